@@ -11,11 +11,14 @@ from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from numpy import linspace, array, where, max, ndarray, sqrt, arctan2
 from Modularize.support import QDmanager, Data_manager, init_meas, shut_down, init_system_atte,coupler_zctrl
-from Modularize.support.Pulse_schedule_library import ROF_Cali_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array
+from Modularize.support.Pulse_schedule_library import ROF_Cali_sche, ROF_Cali_interleaved_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array, split_multiplexed_dataset, interleaved_states
 
 
-def rofCali(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_span_Hz:float=3e6,IF:int=150e6,n_avg:int=500,f_points:int=101,run:bool=True,q='q1',Experi_info:dict={},data_folder:str=''):
-    
+def rofCali(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_span_Hz:float=3e6,IF:int=150e6,n_avg:int=500,f_points:int=101,run:bool=True,q='q1',Experi_info:dict={},data_folder:str='',interleave:bool=True):
+    """
+    Sweep the readout frequency with the qubit in |g> and |e>, return the frequency where they are most separated.\n
+    * interleave: prepare |g> and |e> one after another in one schedule, so both states see the same drift and the sweep runs once. False for the former 2 runs.
+    """
     analysis_result = {}
     qubit = QD_agent.quantum_device.get_element(q)
 
@@ -81,10 +84,61 @@ def rofCali(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_span_Hz:float=3e6
         
         return array(I), array(Q)
     
-    slightly_print("Running |1>")
-    I_e, Q_e = array(state_dep_sched('e'))
-    slightly_print("Running |0>")
-    I_g, Q_g = array(state_dep_sched('g'))
+    def interleaved_sched():
+        sched_kwargs = dict(
+            q=q,
+            ro_freq=option_rof,
+            pi_amp={str(q):qubit.rxy.amp180()},
+            pi_dura={str(q):qubit.rxy.duration()},
+            R_amp={str(q):qubit.measure.pulse_amp()},
+            R_duration={str(q):qubit.measure.pulse_duration()},
+            R_integration={str(q):qubit.measure.integration_time()},
+            R_inte_delay=qubit.measure.acq_delay(),
+            )
+        exp_kwargs= dict(sweep_ROF=['start '+'%E' %ro_f_samples[0],'end '+'%E' %ro_f_samples[-1]])
+        if run:
+            gettable = ScheduleGettable(
+                QD_agent.quantum_device,
+                schedule_function=ROF_Cali_interleaved_sche,
+                schedule_kwargs=sched_kwargs,
+                real_imag=True,
+                batched=True,
+            )
+            
+            QD_agent.quantum_device.cfg_sched_repetitions(n_avg)
+            meas_ctrl.gettables(gettable)
+            meas_ctrl.settables(option_rof)
+            meas_ctrl.setpoints(ro_f_samples)
+            
+            rfs_ds = meas_ctrl.run("Rof-Calibrate")
+            # Save the raw data of each state into netCDF like the former separated runs
+            IQ = {}
+            for ini_state, state_ds in split_multiplexed_dataset(rfs_ds,interleaved_states).items():
+                Data_manager().save_raw_data(QD_agent=QD_agent,ds=state_ds,qb=q,label=ini_state,exp_type='RofCali',specific_dataFolder=data_folder)
+                IQ[ini_state] = dataset_to_array(dataset=state_ds,dims=1)
+            
+            show_args(exp_kwargs, title="RofCali_kwargs: Meas.qubit="+q)
+            return array(IQ['g'][0]), array(IQ['g'][1]), array(IQ['e'][0]), array(IQ['e'][1])
+
+        else:
+            n_s = 2
+            sweep_para= array(ro_f_samples[:n_s])
+            sched_kwargs['ro_freq']= sweep_para.reshape(sweep_para.shape or (1,))
+            pulse_preview(QD_agent.quantum_device,ROF_Cali_interleaved_sche,sched_kwargs)
+
+            show_args(exp_kwargs, title="RofCali_kwargs: Meas.qubit="+q)
+            if Experi_info != {}:
+                show_args(Experi_info(q))
+            return array([]), array([]), array([]), array([])
+
+    if interleave:
+        slightly_print("Running |0> and |1> interleaved")
+        I_g, Q_g, I_e, Q_e = interleaved_sched()
+    else:
+        slightly_print("Running |1>")
+        I_e, Q_e = array(state_dep_sched('e'))
+        slightly_print("Running |0>")
+        I_g, Q_g = array(state_dep_sched('g'))
     I_diff = I_e-I_g
     Q_diff = Q_e-Q_g
     dis_diff = sqrt((I_diff)**2+(Q_diff)**2)
@@ -0,0 +1,158 @@
+"""
+Vectorized peak extraction for the flux vs. XYF (z-gate two tone) magnitude maps.\n
+Only numpy is required, so the QM side script `aux_measurement/get_bias_byEqn_QM.py` shares it with `support/QuFluxFit.py`.
+"""
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from numpy import ndarray, array, asarray, arange, argmax, unique, lexsort, r_, sort, empty, abs, column_stack
+
+
+def column_peaks(raw_mag:ndarray):
+    """
+    For a magnitude map in shape (XYF, z), return the XYF index of the maximum in every z column and that maximum.
+    """
+    f_idx = argmax(raw_mag, axis=0)
+    return f_idx, raw_mag[f_idx, arange(raw_mag.shape[1])]
+
+def filter_2D(raw_mag:ndarray,threshold:float=3.0):
+    """
+    In every z column pick the maximum which is larger than `mean + threshold*std` of the whole map.\n
+    Return the XYF indice, z indice and the picked magnitudes.
+    """
+    raw_mag = asarray(raw_mag)
+    f_idx, peak_mag = column_peaks(raw_mag)
+    passed = peak_mag > raw_mag.mean() + threshold*raw_mag.std()
+    return f_idx[passed], arange(raw_mag.shape[1])[passed], peak_mag[passed]
+
+def relaxed_filter_2D(raw_mag:ndarray,threshold:float=3.0,relax_step:float=0.5,min_threshold:float=0.0):
+    """
+    Same as `filter_2D`, but lower the threshold by `relax_step` until some peaks pass or the threshold goes under `min_threshold`.\n
+    Return the XYF indice, z indice, the picked magnitudes and the threshold finally used.
+    """
+    raw_mag = asarray(raw_mag)
+    f_idx, peak_mag = column_peaks(raw_mag)
+    mu, sigma = raw_mag.mean(), raw_mag.std()
+    z_idx = arange(raw_mag.shape[1])
+    while threshold >= min_threshold:
+        passed = peak_mag > mu + threshold*sigma
+        if passed.any():
+            return f_idx[passed], z_idx[passed], peak_mag[passed], threshold
+        threshold -= relax_step
+    return f_idx[:0], z_idx[:0], peak_mag[:0], threshold
+
+def keep_strongest_per_bias(z:ndarray,xyf:ndarray,mag:ndarray)->ndarray:
+    """
+    If several points share the same bias, only the strongest one is kept. The points stay in the column order.\n
+    Return an array in shape (points, 3), every row is [z, xyf, mag].
+    """
+    _, group = unique(z, return_inverse=True)
+    order = lexsort((mag, group)) # by group, then by mag
+    group_sorted = group[order]
+    strongest = sort(order[r_[group_sorted[1:] != group_sorted[:-1], True]])
+    return column_stack((z[strongest], xyf[strongest], mag[strongest]))
+
+def sortAndDecora(raw_z:ndarray,raw_XYF:ndarray,raw_mag:ndarray,threshold:float=3):
+    """
+    Extract the XYF peaks along the flux axis. Return an array in shape (points, 3), every row is [z, xyf, mag].\n
+    The threshold is relaxed down to 0 if no peak can be found, then an empty array is returned.
+    """
+    raw_z, raw_XYF = asarray(raw_z), asarray(raw_XYF)
+    f_idx, z_idx, XL_mag, _ = relaxed_filter_2D(raw_mag,threshold)
+    if f_idx.shape[0] == 0:
+        print(f"This interval can't find the trend : XYF={raw_XYF[0]}~{raw_XYF[-1]}")
+        return empty((0,3))
+    return keep_strongest_per_bias(raw_z[z_idx],raw_XYF[f_idx],XL_mag)
+
+def mag_static_filter(x_array:ndarray,y_array:ndarray,mag_array:ndarray,threshold:float=3.0):
+    """
+    Keep the points with magnitude > `mean - threshold*std`, the threshold is relaxed down to 0 if nothing is kept.
+    """
+    x_array, y_array, mag_array = asarray(x_array), asarray(y_array), asarray(mag_array)
+    while threshold >= 0:
+        passed = mag_array > mag_array.mean() - threshold*mag_array.std()
+        if passed.any():
+            return x_array[passed].tolist(), y_array[passed].tolist()
+        threshold -= 0.5
+    print(f"No peaks are found in this Z interval: {x_array[0]}~{x_array[-1]} V")
+    return [], []
+
+def FitErrorFilter(eqn,eqn_paras:list,exp_x_ary:ndarray,exp_y_ary:ndarray,threshold:float=1.5):
+    """
+    Statics for the distances along the same x axis between exp_y_data and fitting curve. Throw away the larger deviation.
+    """
+    exp_x_ary, exp_y_ary = asarray(exp_x_ary), asarray(exp_y_ary)
+    distances = abs(eqn(exp_x_ary,*eqn_paras)-exp_y_ary)
+    passed = distances < distances.mean() + threshold*distances.std()
+    return exp_x_ary[passed], exp_y_ary[passed], int((~passed).sum())
+
+
+def _loop_sortAndDecora(raw_z:ndarray,raw_XYF:ndarray,raw_mag:ndarray,threshold:float=3):
+    """ The former nested-loop implementation, only kept for `benchmark_peak_extraction` to compare with. """
+    def loop_filter_2D(raw_mag,threshold):
+        filtered_f_idx, filtered_z_idx, filtered_mag = [], [], []
+        mu, sigma = raw_mag.reshape(-1).mean(), raw_mag.reshape(-1).std()
+        for i_z in range(raw_mag.shape[1]):
+            sofar_max = min(raw_mag.reshape(-1))
+            z_idx_champion, f_idx_champion = 0, 0
+            for i_f in range(raw_mag.shape[0]):
+                if raw_mag[i_f][i_z] > mu + threshold*sigma and raw_mag[i_f][i_z] > sofar_max:
+                    f_idx_champion, z_idx_champion, sofar_max = i_f, i_z, raw_mag[i_f][i_z]
+            if z_idx_champion != 0 or f_idx_champion != 0:
+                filtered_z_idx.append(z_idx_champion)
+                filtered_f_idx.append(f_idx_champion)
+                filtered_mag.append(sofar_max)
+        return filtered_f_idx, filtered_z_idx, filtered_mag
+
+    while True:
+        f_idx, z_idx, XL_mag = loop_filter_2D(raw_mag,threshold)
+        if len(f_idx) != 0 or threshold <= 0:
+            break
+        threshold -= 0.5
+    extracted = [[raw_z[z_idx[i]],raw_XYF[f_idx[i]],XL_mag[i]] for i in range(len(f_idx))]
+    filtered = []
+    for point_i in range(len(extracted)):
+        same_bias = [extracted[point_i]] + [extracted[j] for j in range(point_i,len(extracted)) if extracted[j][0] == extracted[point_i][0]]
+        same_bias.sort(key=lambda elem:elem[-1])
+        if filtered == [] or filtered[-1][0] != same_bias[-1][0]:
+            filtered.append(same_bias[-1])
+    return array(filtered)
+
+
+def benchmark_peak_extraction(maps:list,threshold:float=1.0)->list:
+    """
+    Compare the loop and the vectorized `sortAndDecora` on the given maps, every map is a tuple (z, xyf, mag) with mag in shape (xyf, z).\n
+    Return a list of dict with the costs and whether the outputs are identical.
+    """
+    from numpy import array_equal
+    reports = []
+    for z, xyf, mag in maps:
+        start = time.time()
+        old = _loop_sortAndDecora(z,xyf,mag,threshold)
+        loop_cost = time.time()-start
+        start = time.time()
+        new = sortAndDecora(z,xyf,mag,threshold)
+        vec_cost = time.time()-start
+        same = array_equal(old.reshape(-1,3),new)
+        reports.append({"shape":mag.shape,"loop":loop_cost,"vectorized":vec_cost,"identical":same})
+        print(f"map {mag.shape}: loop {round(loop_cost,3)} s, vectorized {round(vec_cost*1e3,3)} ms, speedup x{round(loop_cost/vec_cost)}, identical={same}")
+    return reports
+
+
+if __name__ == "__main__":
+    # python FluxPeakAna.py [Flux2tone .nc files ...]
+    import sys
+    from numpy import linspace, exp, cos
+    from numpy.random import default_rng
+    # 400x400 simulated flux-qubit map
+    rng = default_rng(0)
+    z, xyf = linspace(-0.2,0.2,400), linspace(4e9,4.5e9,400)
+    fq = 4.05e9 + 0.4e9*abs(cos(3*z))
+    mag = exp(-((xyf[:,None]-fq[None,:])/3e6)**2) + 0.1*rng.standard_normal((400,400))
+    maps = [(z,xyf,mag)]
+    # saved Flux2tone files given on the command line
+    if len(sys.argv) > 1:
+        from Modularize.support.QuFluxFit import convert_netCDF_2_arrays, mag_repalce_origin
+        for nc in sys.argv[1:]:
+            f, flux, i, q = convert_netCDF_2_arrays(nc)
+            maps.append((flux,f,mag_repalce_origin(i,q,[0,0],qblox_rotation=True)))
+    benchmark_peak_extraction(maps)
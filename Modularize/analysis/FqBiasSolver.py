@@ -0,0 +1,133 @@
+"""
+Closed-form inverse of the transmon `FqEqn`, get the biases for the given transition frequencies without SymPy.\n
+fq = sqrt(8*Ej_sum*Ec*sqrt(cos(a(z-b))**2+d**2*sin(a(z-b))**2)) - Ec (GHz), so sin(a(z-b))**2 = (1-((fq+Ec)**2/(8*Ej_sum*Ec))**2)/(1-d**2).\n
+Like `sp.solvers.solve`, the candidates are the 4 solutions with a(z-b) in [-pi, pi]. Only numpy and scipy are required, `aux_measurement/get_bias_byEqn_QM.py` shares it with `support/FluxBiasDict.py`.
+"""
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from numpy import ndarray, array, asarray, atleast_1d, sqrt, sin, cos, pi, arcsin, linspace, sign, nan, full, isnan, where, nanargmin, abs, sort, clip, errstate
+from scipy.optimize import brentq
+
+
+def FqEqn(x,a,b,Ec,coefA,d):
+    """
+    a ~ period, b ~ offset,
+    """
+    return sqrt(8*coefA*Ec*sqrt(cos(a*(x-b))**2+d**2*sin(a*(x-b))**2))-Ec
+
+def closed_form_candidates(target_fq_Hz:ndarray,fitting_popts:list)->ndarray:
+    """
+    Return the bias candidates in shape (targets, 4) sorted in every row, NaN if the target fq can't be reached.\n
+    ### The given `fitting_popts` should follow the order: [a, b, Ec, Ej_sum, d]
+    """
+    a, b, Ec, Ej_sum, d = [float(para) for para in fitting_popts]
+    fq = atleast_1d(asarray(target_fq_Hz,dtype=float))*1e-9
+    g = ((fq+Ec)**2/(8*Ej_sum*Ec))**2           # cos**2 + d**2*sin**2
+    with errstate(divide='ignore', invalid='ignore'):
+        sin_sq = (1-g)/(1-d**2)
+    reachable = (fq+Ec >= 0) & (sin_sq >= -1e-12) & (sin_sq <= 1+1e-12)
+    theta = arcsin(sqrt(clip(where(reachable,sin_sq,0),0,1)))
+    candidates = b + array([-pi+theta, -theta, theta, pi-theta]).T/a
+    candidates[~reachable] = nan
+    return sort(candidates,axis=1)
+
+def bracketed_candidates(target_fq_Hz:ndarray,fitting_popts:list,grid_points:int=2001)->ndarray:
+    """
+    Same as `closed_form_candidates` but by brentq in the brackets of a(z-b) grid in [-pi, pi] where the fq crosses the target.\n
+    It's the fallback when d ~ 1 makes the closed form ill-conditioned.
+    """
+    a, b, Ec, Ej_sum, d = [float(para) for para in fitting_popts]
+    fq = atleast_1d(asarray(target_fq_Hz,dtype=float))*1e-9
+    z_grid = b + linspace(-pi,pi,grid_points)/a
+    fq_grid = FqEqn(z_grid,a,b,Ec,Ej_sum,d)
+    candidates = full((fq.shape[0],4),nan)
+    for idx, target in enumerate(fq):
+        diff = fq_grid - target
+        roots = list(z_grid[diff == 0])
+        for i in (sign(diff[:-1])*sign(diff[1:]) < 0).nonzero()[0]:
+            roots.append(brentq(lambda z: FqEqn(z,a,b,Ec,Ej_sum,d)-target, z_grid[i], z_grid[i+1]))
+        roots = sort(array(roots))[:4]
+        candidates[idx,:roots.shape[0]] = roots
+    return sort(candidates,axis=1)
+
+def bias_candidates(target_fq_Hz:ndarray,fitting_popts:list,tolerance_Hz:float=1e3)->ndarray:
+    """
+    Closed-form candidates in shape (targets, 4), the targets whose solutions are off by more than `tolerance_Hz` are solved again by `bracketed_candidates`.
+    """
+    a, b, Ec, Ej_sum, d = [float(para) for para in fitting_popts]
+    target_fq_Hz = atleast_1d(asarray(target_fq_Hz,dtype=float))
+    candidates = closed_form_candidates(target_fq_Hz,fitting_popts)
+    residual = abs(FqEqn(candidates,a,b,Ec,Ej_sum,d)*1e9 - target_fq_Hz[:,None])
+    solved = isnan(candidates).all(axis=1) | (residual <= tolerance_Hz).all(axis=1, where=~isnan(candidates))
+    if abs(1-d**2) < 1e-9:
+        solved[:] = False
+    if not solved.all():
+        candidates[~solved] = bracketed_candidates(target_fq_Hz[~solved],fitting_popts)
+    return candidates
+
+def biases_for_fq(target_fq_Hz:ndarray,fitting_popts:list,flux_guard:float=0.4)->ndarray:
+    """
+    For every target fq (Hz) pick the candidate closest to 0 V, it's replaced by `flux_guard` if its magnitude isn't smaller than `flux_guard`.\n
+    Return the biases (V) in the same shape as the given targets, NaN if the target fq can't be reached.
+    """
+    shape = asarray(target_fq_Hz).shape
+    candidates = bias_candidates(target_fq_Hz,fitting_popts)
+    answers = full(candidates.shape[0],nan)
+    found = ~isnan(candidates).all(axis=1)
+    if found.any():
+        nearest = candidates[found][range(int(found.sum())),nanargmin(abs(candidates[found]),axis=1)]
+        answers[found] = where(abs(nearest) < flux_guard, nearest, flux_guard)
+    return answers.reshape(shape)
+
+
+def sympy_candidates(target_fq_Hz:float,fitting_popts:list)->ndarray:
+    """ The former SymPy way, only kept for `compare_with_sympy` and the benchmark. """
+    import sympy as sp
+    z = sp.Symbol('z',real=True)
+    a,b,Ec,Ej_sum,d = fitting_popts[0], fitting_popts[1], fitting_popts[2], fitting_popts[3], fitting_popts[4]
+    to_solve = sp.sqrt(8*Ej_sum*Ec*sp.sqrt(sp.cos(a*(z-b))**2+d**2*sp.sin(a*(z-b))**2))-Ec - target_fq_Hz*1e-9
+    return sort(array([float(sol) for sol in sp.solvers.solve(to_solve, z)]))
+
+def compare_with_sympy(target_fq_Hz:list,fitting_popts:list)->float:
+    """
+    Solve the targets by SymPy and by `bias_candidates`, return the max difference (V) between the solutions.\n
+    Raise ValueError if they find different numbers of solutions.
+    """
+    closed_form = bias_candidates(target_fq_Hz,fitting_popts)
+    max_diff = 0.0
+    for idx, target in enumerate(target_fq_Hz):
+        by_sympy = sympy_candidates(target,fitting_popts)
+        ours = closed_form[idx][~isnan(closed_form[idx])]
+        if by_sympy.shape[0] != ours.shape[0]:
+            raise ValueError(f"fq = {target*1e-9} GHz: SymPy found {by_sympy.shape[0]} solutions but closed form found {ours.shape[0]}")
+        if ours.shape[0] != 0:
+            max_diff = max(max_diff, float(abs(by_sympy-ours).max()))
+    return max_diff
+
+def benchmark_fq_inverse(fitting_popts:list,target_number:int=10000,sympy_number:int=3)->dict:
+    """
+    Solve `target_number` targets inside the min and max fq by `biases_for_fq` and `sympy_number` of them by SymPy, the SymPy cost is extrapolated.
+    """
+    a, b, Ec, Ej_sum, d = [float(para) for para in fitting_popts]
+    fq_max, fq_min = FqEqn(b,a,b,Ec,Ej_sum,d), FqEqn(b+pi/2/a,a,b,Ec,Ej_sum,d)
+    targets = linspace(min(fq_min,fq_max),max(fq_min,fq_max),target_number+2)[1:-1]*1e9 # SymPy fails right on the extrema
+
+    start = time.time()
+    biases_for_fq(targets,fitting_popts)
+    closed_cost = time.time()-start
+
+    start = time.time()
+    for target in targets[linspace(0,target_number-1,sympy_number).astype(int)]:
+        sympy_candidates(target,fitting_popts)
+    sympy_cost = (time.time()-start)/sympy_number*target_number
+
+    print(f"{target_number} targets: closed form {round(closed_cost*1e3,2)} ms, SymPy ~ {round(sympy_cost)} s (extrapolated from {sympy_number}), speedup x{round(sympy_cost/closed_cost)}")
+    return {"closed_form":closed_cost,"sympy":sympy_cost}
+
+
+if __name__ == "__main__":
+    # [a, b, Ec, Ej_sum, d], put the qubFitParas of your qubit here
+    fitting_popts = [pi/0.5, 0.02, 0.2, 30, 0.3]
+    check_fq = [6.7e9, 6.5e9, 6e9, 5e9, 4.5e9, 4e9, 3.6e9, 3e9, 8e9]
+    print(f"max |closed form - SymPy| = {compare_with_sympy(check_fq,fitting_popts)} V")
+    benchmark_fq_inverse(fitting_popts)
@@ -2,17 +2,23 @@ import os, sys
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
 from qcat.analysis.state_discrimination.readout_fidelity import GMMROFidelity
 from qcat.visualization.readout_fidelity import plot_readout_fidelity
-from xarray import Dataset, open_dataset
 from Modularize.analysis.Radiator.RadiatorSetAna import OSdata_arranger
 from Modularize.support.UserFriend import *
 from Modularize.support.QDmanager import QDmanager
+from Modularize.support.DiscriminatorCache import QD_registry, readout_config, load_OS_shots, OS_populations
 from numpy import array, moveaxis, mean, std, median, arange
 import matplotlib.pyplot as plt
 from Modularize.analysis.Radiator.RadiatorSetAna import sort_files
 from qcat.analysis.state_discrimination import p01_to_Teff
 
 
-def a_OSdata_analPlot(QD_agent:QDmanager, target_q:str, nc_path:str, plot:bool=True, pic_path:str='', save_pic:bool=False): # 
+def a_OSdata_analPlot(QD_agent:QDmanager, target_q:str, nc_path:str, plot:bool=True, pic_path:str='', save_pic:bool=False, cache_discriminator:bool=False): # 
+    """
+    Return p01, effT_mK and RO_fidelity_percentage of a single-shot nc.\n
+    * cache_discriminator: without the plot, the populations are predicted by the discriminator kept next to the QD file (see `DiscriminatorCache`) instead of training a GMM for every file, it's trained once if the readout config changed.
+    """
+    if cache_discriminator and not plot:
+        return cached_OSdata_anal(QD_agent, target_q, [nc_path])[0]
     folder = os.path.join(os.path.split(nc_path)[0],'OS_pic')
     if not os.path.exists(folder):
         os.mkdir(folder)
@@ -20,17 +26,7 @@ def a_OSdata_analPlot(QD_agent:QDmanager, target_q:str, nc_path:str, plot:bool=T
         pic_save_path = os.path.join(folder,os.path.split(nc_path)[1].split(".")[0]) if pic_path == '' else pic_path
     else:
         pic_save_path = None
-    SS_ds = open_dataset(nc_path)
-    ss_dict = Dataset.to_dict(SS_ds)
-    # print(ss_dict)
-    pe_I, pe_Q = ss_dict['data_vars']['e']['data']
-    pg_I, pg_Q = ss_dict['data_vars']['g']['data']
-    pgI_collection = [pg_I]
-    pgQ_collection = [pg_Q]
-    peI_collection = [pe_I]
-    peQ_collection = [pe_Q]
-
-    OS_data = 1000*array([[pgI_collection,peI_collection],[pgQ_collection,peQ_collection]]) # can train or predict 2*2*histo_counts*shot
+    OS_data = load_OS_shots([nc_path], scale=1000) # can train or predict 2*2*histo_counts*shot
     tarin_data, fit_arrays = OSdata_arranger(OS_data)
     # train GMM
     gmm2d_fidelity = GMMROFidelity()
@@ -50,40 +46,27 @@ def a_OSdata_analPlot(QD_agent:QDmanager, target_q:str, nc_path:str, plot:bool=T
 
     return p01, effT_mK, RO_fidelity_percentage
 
-def share_model_OSana(QD_agent:QDmanager,target_q:str,folder_path:str,pic_save:bool=True):
+def cached_OSdata_anal(QD_agent:QDmanager, target_q:str, nc_paths:list)->list:
+    """
+    Predict the single-shot ncs (with the same shots) at once by the cached discriminator of the target qubit, it's trained on the first nc if there isn't one for the current readout config.\n
+    Return [(p01, effT_mK, RO_fidelity_percentage), ...] for the ncs in order.
+    """
+    OS_data = load_OS_shots(nc_paths) # (IQ, state, files, shots)
+    model = QD_registry(QD_agent).get_or_train(target_q, readout_config(QD_agent,target_q), OS_data[:,0,0], OS_data[:,1,0])
+    pops = OS_populations(model, OS_data) # (files, prepared state, [p0, p1])
     transi_freq = QD_agent.quantum_device.get_element(target_q).clock_freqs.f01()
+    results = []
+    for file_pops in pops:
+        p01 = file_pops[0][1]
+        results.append((p01, p01_to_Teff(p01, transi_freq)*1000, (file_pops[0][0]+file_pops[1][1])*100/2))
+    return results
+
+def share_model_OSana(QD_agent:QDmanager,target_q:str,folder_path:str,pic_save:bool=True):
+    """ The thermal populations and effective temperatures (mK) of the first 21 SingleShot ncs in the folder by one cached discriminator, see `cached_OSdata_anal`. """
     files = [name for name in os.listdir(folder_path) if (os.path.isfile(os.path.join(folder_path,name)) and name.split("_")[1].split("(")[0]=="SingleShot")]
     files = [os.path.join(folder_path,name) for name in sort_files(files)][:21]
-    pop_rec, efft_rec = [], []
-    if pic_save:
-        pic_folder = os.path.join(folder_path,"OS_detail_pic")
-        if not os.path.exists(pic_folder):
-            os.mkdir(pic_folder)
-    else:
-        pic_folder = None
-
-    for idx, file in enumerate(files):
-        SS_ds = open_dataset(file)
-        ss_dict = Dataset.to_dict(SS_ds)
-        # print(ss_dict)
-        pe_I, pe_Q = ss_dict['data_vars']['e']['data']
-        pg_I, pg_Q = ss_dict['data_vars']['g']['data']
-        pgI_collection = [pg_I]
-        pgQ_collection = [pg_Q]
-        peI_collection = [pe_I]
-        peQ_collection = [pe_Q]
-
-        OS_data = 1000*array([[pgI_collection,peI_collection],[pgQ_collection,peQ_collection]]) # can train or predict 2*2*histo_counts*shot
-        tarin_data, fit_arrays = OSdata_arranger(OS_data)
-        # train GMM
-        if idx == 0:
-            gmm2d_fidelity = GMMROFidelity()
-            gmm2d_fidelity._import_data(tarin_data[0])
-            gmm2d_fidelity._start_analysis()
-
-        gmm2d_fidelity.discriminator._import_data( fit_arrays[0] )
-        gmm2d_fidelity.discriminator._start_analysis()
-
+    results = cached_OSdata_anal(QD_agent, target_q, files)
+    pop_rec, efft_rec = [result[0] for result in results], [result[1] for result in results]
 
     return pop_rec, efft_rec
 
@@ -4,7 +4,7 @@ This program is only for analyzing a series of radiation tests like 0K, 20K 40K
 import os, sys, time, json, pickle
 from pandas import DataFrame as DF
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "..", ".."))
-from Modularize.support.Pulse_schedule_library import IQ_data_dis, dataset_to_array, T1_fit_analysis, T2_fit_analysis, plot_textbox, Fit_analysis_plot
+from Modularize.support.Pulse_schedule_library import IQ_data_dis, dataset_to_array, T1_fit_analysis, T2_fit_analysis, plot_textbox, Fit_analysis_plot, as_fit_dataset
 from xarray import Dataset, open_dataset # Dataset.to_dict(SS_ds)
 from numpy import array, ndarray, mean, std, round, arange, moveaxis, any, zeros, delete, average, sqrt
 # from Modularize.support.Pulse_schedule_library import hist_plot
@@ -12,7 +12,10 @@ import matplotlib.pyplot as plt
 from xarray import DataArray
 from Modularize.support.Path_Book import meas_raw_dir
 from Modularize.analysis.DRtemp import Kelvin_collector
+from Modularize.support.FitPool import fit_jobs, para_column
 from qcat.analysis.state_discrimination.discriminator import train_GMModel  # type: ignore
+from qcat.analysis.state_discrimination import p01_to_Teff
+from Modularize.support.DiscriminatorCache import DiscriminatorRegistry, OS_populations, load_OS_shots
 from qcat.visualization.readout_fidelity import plot_readout_fidelity
 
 exp_items = {"1":"T1","2":"T2","3":"effT","4":"gamma1","5":"gamma2","6":"thermalPop","7":"gammaPhi"}
@@ -277,6 +280,7 @@ def create_json_folder(results_folder):
 
 def save_weired_data_pic(x_s:ndarray,y:ndarray,exp_type:str,exp_idx:str,set_idx:str,T_folder_path:str, fit_res:dict={}):
     save_folder = creat_weired_pic_folder(T_folder_path)
+    fit_res = as_fit_dataset(fit_res)
     if fit_res == {}:
         plt.plot(round(x_s*1e6,1),y)
         plt.ylabel("Contrast (V)")
@@ -339,25 +343,14 @@ def sort_files(file_name_list:list):
     
     return T1_file+T2_file+SS_file
 
-def OSdata_arranger(total_array:ndarray, want_IQset_num:int=1)->tuple[list, list]:
+def OSdata_arranger(total_array:ndarray, want_IQset_num:int=1)->tuple[list, DataArray]:
     """
     total_array shape: (2,2,M,N) which is (IQ, state, histos, shots)\n
-    return traning and predict list
+    return traning list and the predict DataArray in shape (histo, mixer, prepared_state, index), `all_datasets[histo]` is the (2,2,N) view of a histo without copying.
     """
     from numpy.random import randint
-    all_datasets = []
     train_dataset  = []
-    
-    for histo in range(total_array.shape[2]):
-        IQ_folder = []
-        for iq in range(total_array.shape[0]):
-            state_folder = []
-            for state in range(total_array.shape[1]):
-                state_folder.append(total_array[iq][state][histo])
-            IQ_folder.append(state_folder)
-        ds = DataArray(array(IQ_folder), coords= [("mixer",["I","Q"]), ("prepared_state",[0,1]), ("index",arange(array(IQ_folder).shape[2]))] )
-        all_datasets.append(ds)
-    # total_sets.shape shape = (histo, IQ, State, shots)
+    all_datasets = DataArray(moveaxis(total_array,2,0), dims=["histo","mixer","prepared_state","index"], coords={"mixer":["I","Q"],"prepared_state":[0,1],"index":arange(total_array.shape[3])})
 
     for pick_number in range(want_IQset_num):
         rand_pick_set_idx = randint(0 ,len(all_datasets))
@@ -365,6 +358,15 @@ def OSdata_arranger(total_array:ndarray, want_IQset_num:int=1)->tuple[list, list
     
     return train_dataset, all_datasets
 
+def cached_OS_populations(registry:DiscriminatorRegistry, target_q:str, OS_data:ndarray, ref_iq:list, transi_freq:float)->ndarray:
+    """
+    OS_data in mV with shape (IQ, state, histos, shots), return the populations in shape (histos, prepared state, [p0, p1]).\n
+    The discriminator is looked up by refIQ and f01 of the run (the readout is fixed in a radiator test), it's trained on the first histo if there isn't one.
+    """
+    config = {"refIQ":ref_iq,"f01":transi_freq}
+    model = registry.get_or_train(target_q, config, OS_data[:,0,0]/1000, OS_data[:,1,0]/1000)
+    return OS_populations(model.scaled(1000), OS_data)
+
 def collect_allSets_inTempera(temperature_folder_path:str, refresh:bool=False)->dict:
     """ 
     ## Return \n
@@ -476,8 +478,11 @@ def get_references_from_ResultJson(temperature_folder_path:str,minute_from_the_e
     
     return ref_dict
 
-def a_set_analysis(set_folder_path:str, old_monitor_dict:dict, ref_iq:list, transi_freq:float)->dict:
-    """ old_monitor_dict = {"x_minutes":[],"T1":[],"T1_sd":[],"T2":[],"T2_sd":[],"effT":[],"effT_sd":[],"thermalPop":[],"thermalPop_sd":[]} """
+def a_set_analysis(set_folder_path:str, old_monitor_dict:dict, ref_iq:list, transi_freq:float, registry:DiscriminatorRegistry=None, target_q:str='q0')->dict:
+    """ 
+    old_monitor_dict = {"x_minutes":[],"T1":[],"T1_sd":[],"T2":[],"T2_sd":[],"effT":[],"effT_sd":[],"thermalPop":[],"thermalPop_sd":[]}\n
+    With a `registry` the SingleShots are predicted at once by the discriminator of target_q kept in it instead of a GMM trained for every set, see `cached_OS_populations`.
+    """
     if old_monitor_dict == {}:
         old_monitor_dict = {"x_minutes":[],"T1":[],"T1_sd":[],"T2":[],"T2_sd":[],"effT":[],"effT_sd":[],"thermalPop":[],"thermalPop_sd":[]}
     folder_name = os.path.split(set_folder_path)[-1]
@@ -490,11 +495,10 @@ def a_set_analysis(set_folder_path:str, old_monitor_dict:dict, ref_iq:list, tran
     T2_us = []
     effT_mK = []
     thermal_pop = []
+    T1_jobs = []
+    T2_jobs = []
 
-    pgI_collection = []
-    pgQ_collection = []
-    peI_collection = []
-    peQ_collection = []
+    SS_paths = []
     for file_name in files: # in a single set
         exp_idx = file_name.split("(")[-1].split(")")[0]  # histo_counts
         exp_type = file_name.split("(")[0].split("_")[-1] # T1/ T2/ SingleShot
@@ -502,37 +506,21 @@ def a_set_analysis(set_folder_path:str, old_monitor_dict:dict, ref_iq:list, tran
         print(f"{exp_type}-{exp_idx}")
         if exp_type == "T1":
             T1_ds = open_dataset(file_path)
-            times = array(Dataset.to_dict(T1_ds)["coords"]['x0']['data']) # s
+            times = T1_ds['x0'].values # s
             I,Q= dataset_to_array(dataset=T1_ds,dims=1)
             data= array(IQ_data_dis(I,Q,ref_I=ref_iq[0],ref_Q=ref_iq[-1]))
-            try:
-                data_fit= T1_fit_analysis(data=data,freeDu=times,T1_guess=8e-6)
-                T1_us.append(data_fit.attrs['T1_fit']*1e6) 
-            except:
-                T1_us.append(0)
+            T1_jobs.append((data,times,'T1',8e-6))
         elif exp_type == "T2":
             T2_ds = open_dataset(file_path)
-            times = array(Dataset.to_dict(T2_ds)["coords"]['x0']['data']) # s
+            times = T2_ds['x0'].values # s
             I,Q= dataset_to_array(dataset=T2_ds,dims=1)
             data= (IQ_data_dis(I,Q,ref_I=ref_iq[0],ref_Q=ref_iq[1]))
-            try:
-                data_fit= T2_fit_analysis(data=data,freeDu=times,T2_guess=8e-6)
-                T2_us.append(data_fit.attrs['T2_fit']*1e6)
-            except:
-                T2_us.append(0)
+            T2_jobs.append((data,times,'T2',8e-6))
             
             
         elif exp_type == "SingleShot":
             # collect data to choose training and predict
-            SS_ds = open_dataset(file_path)
-            ss_dict = Dataset.to_dict(SS_ds)
-            # print(ss_dict)
-            pe_I, pe_Q = ss_dict['data_vars']['e']['data']
-            pg_I, pg_Q = ss_dict['data_vars']['g']['data']
-            pgI_collection.append(pg_I)
-            pgQ_collection.append(pg_Q)
-            peI_collection.append(pe_I)
-            peQ_collection.append(pe_Q)
+            SS_paths.append(file_path)
 
             
         else:
@@ -540,26 +528,41 @@ def a_set_analysis(set_folder_path:str, old_monitor_dict:dict, ref_iq:list, tran
         
     
     # reshape data to (I,Q)*(g,e)*shots       
-    OS_data = 1000*array([[pgI_collection,peI_collection],[pgQ_collection,peQ_collection]]) # can train or predict 2*2*histo_counts*shot
-    tarin_data, fit_arrays = OSdata_arranger(OS_data)
-    # train GMM
-    dist_model = train_GMModel (tarin_data[0])
-    dist_model.relabel_model(array([ref_iq]).transpose())
-    # predict all collection to calculate eff_T for every exp_idx
-    for histo_i in range(fit_arrays.shape[0]):
-        analysis_data = fit_arrays[histo_i] #your (2,2,N) data to analysis
-
-        new_data = moveaxis( analysis_data ,1,0)
-        p0_pop = dist_model.get_state_population(new_data[0].transpose()) # [p0in0, p0in1]
-        p1_pop = dist_model.get_state_population(new_data[1].transpose()) # [p1in0, p1in1]
-        if transi_freq != 0 and transi_freq is not None:
-            fig , eff_t, snr = plot_readout_fidelity(analysis_data, transi_freq, None, False)
-            effT_mK.append(eff_t)
-        else:
-            thermal_pop.append(p0_pop[1])
-        
-        plt.close()
+    OS_data = load_OS_shots(SS_paths, scale=1000) # can train or predict 2*2*histo_counts*shot
+    if registry is not None:
+        for p0_pop, p1_pop in cached_OS_populations(registry, target_q, OS_data, ref_iq, transi_freq):
+            if transi_freq != 0 and transi_freq is not None:
+                effT_mK.append(p01_to_Teff(p0_pop[1], transi_freq)*1000)
+            else:
+                thermal_pop.append(p0_pop[1])
+    else:
+        tarin_data, fit_arrays = OSdata_arranger(OS_data)
+        # train GMM
+        dist_model = train_GMModel (tarin_data[0])
+        dist_model.relabel_model(array([ref_iq]).transpose())
+        # predict all collection to calculate eff_T for every exp_idx
+        for histo_i in range(fit_arrays.shape[0]):
+            analysis_data = fit_arrays[histo_i] #your (2,2,N) data to analysis
+
+            new_data = moveaxis( analysis_data ,1,0)
+            p0_pop = dist_model.get_state_population(new_data[0].transpose()) # [p0in0, p0in1]
+            p1_pop = dist_model.get_state_population(new_data[1].transpose()) # [p1in0, p1in1]
+            if transi_freq != 0 and transi_freq is not None:
+                fig , eff_t, snr = plot_readout_fidelity(analysis_data, transi_freq, None, False)
+                effT_mK.append(eff_t)
+            else:
+                thermal_pop.append(p0_pop[1])
+            
+            plt.close()
     
+    # fit T1 and T2 across the cores, the failed ones are 0
+    T1_paras, _, T1_success = fit_jobs(T1_jobs)
+    T1_us = T1_paras[:,para_column('T1','T1')]*1e6
+    T1_us[~T1_success] = 0
+    T2_paras, _, T2_success = fit_jobs(T2_jobs)
+    T2_us = T2_paras[:,para_column('T2','T2')]*1e6
+    T2_us[~T2_success] = 0
+
     # calc T1
     T1_us = array(T1_us)
     old_monitor_dict["T1"].append(round(mean(T1_us[T1_us != 0]),1))
@@ -582,151 +585,105 @@ def a_set_analysis(set_folder_path:str, old_monitor_dict:dict, ref_iq:list, tran
 
     return old_monitor_dict
     
-def main_analysis(target_q:str, temperature_folder_path:str, mode:str='all' ):
+def a_set_raw_values(set_folder_path:str, temperature_folder_path:str, ref_iq:list, transi_freq:float, registry:DiscriminatorRegistry=None, target_q:str='q0')->dict:
     """
-    target_q: 'q0'\n
-    temperature: '10K'\n
-    mode: 'all' or 'jump', 'all' for analyze all set again. 'jump' analyze those haven't been analyzed set.\n
+    Fit every T1/T2 nc and predict every SingleShot nc in a set folder `Radiator(idx)`, the weired data pics are saved into the temperature folder.\n
+    With a `registry` the SingleShots are predicted by the discriminator of target_q kept in it, see `cached_OS_populations`.\n
+    Return the values for each histo before the error-bound filter:\n
+    {"T1s":[],"T1ers":[],"gamma1s":[],"T2s":[],"T2ers":[],"gamma2s":[],"effTs":[],"thermalPops":[]}
     """
-    other_info_dict = {}
-    temperature = os.path.split(temperature_folder_path)[-1]
-    parent_path = temperature_folder_path
-
-    sub_folders = delet_incomplete_set(temperature_folder_path)
-    print(sub_folders)
-    other_info_ = [name for name in os.listdir(temperature_folder_path) if (os.path.isfile(os.path.join(temperature_folder_path,name)) and name.split(".")[0]=='otherInfo')]
-    with open(os.path.join(temperature_folder_path,other_info_[0])) as JJ:
-        other_info_dict = json.load(JJ)
-
-    sort_set(sub_folders,0) # sort sets start from 0 
-    ref_iq = other_info_dict[target_q]["refIQ"]
-    transi_freq = other_info_dict[target_q]["f01"] # Hz
-    result_folder = create_result_folder(temperature_folder_path)
-    json_folder = create_json_folder(result_folder)
-    SS_folder = creat_oneshot_folder(result_folder)
-    T1_pic_folder = create_T1T2_folder(result_folder,"t1")
-    T2_pic_folder = create_T1T2_folder(result_folder,"t2")
-    start = time.time()
-    T1s = {}
-    T1ers = {}
-    gamma1s = {}
-    gamma1ers = {}
-    T2s = {}
-    T2ers = {}
-    gamma2ers = {}
-    gamma2s = {}
-    effTs = {}
-    thermalpops = {}
-    gammaphis = {}
-    gammaphiers = {}
-
-    if mode.lower() == 'jump':
-        set_idx_done = [int(name.split("(")[-1].split(")")[0]) for name in os.listdir(json_folder) if (os.path.isfile(os.path.join(json_folder,name)) and name.split(".")[0].split("(")[0]=='setInfo')]
-        final_complete_setidx = max(set_idx_done)
-        print(f"start set-idx = {final_complete_setidx+1}")
-        sub_folders = sub_folders[final_complete_setidx+1:]
+    folder_path = set_folder_path
+    set_idx = os.path.split(set_folder_path)[-1].split("(")[-1].split(")")[0]
+    print(f"==================================================== Set-{set_idx} start")
+    files = [name for name in os.listdir(folder_path) if (os.path.isfile(os.path.join(folder_path,name)) and name.split(".")[-1] == "nc")] # DR1q0_{T1/T2/SingleShot}(exp_idx)_H17M23S19.nc
+    files = sort_files(files) # sort files start from 0 
+    T1_us = []
+    T1_err = []
+    gamma1_MHz = []
+    T2_us = []
+    T2_err = []
+    gamma2_MHz = []
+    effT_mK = []
+    therm_pop = []
 
-    for folder_name in sub_folders:
-        set_idx = folder_name.split("(")[-1].split(")")[0]
-        folder_path = os.path.join(temperature_folder_path,folder_name)
-        print(f"==================================================== Set-{set_idx} start")
-        files = [name for name in os.listdir(folder_path) if (os.path.isfile(os.path.join(folder_path,name)) and name.split(".")[-1] == "nc")] # DR1q0_{T1/T2/SingleShot}(exp_idx)_H17M23S19.nc
-        files = sort_files(files) # sort files start from 0 
-        T1_us = []
-        T1_err = []
-        gamma1_MHz = []
-        gamm1_err = []
-        T2_us = []
-        T2_err = []
-        gamma2_MHz = []
-        gamma2_err = []
-        effT_mK = []
-        therm_pop = []
-
-        pgI_collection = []
-        pgQ_collection = []
-        peI_collection = []
-        peQ_collection = []
-        for file_name in files: # in a single set
-            exp_idx = file_name.split("(")[-1].split(")")[0]  # histo_counts
-            exp_type = file_name.split("(")[0].split("_")[-1] # T1/ T2/ SingleShot
-            file_path = os.path.join(folder_path,file_name)
-            print(f"{exp_type}-{exp_idx}")
-            if exp_type == "T1":
-                T1_ds = open_dataset(file_path)
-                
-                times = array(Dataset.to_dict(T1_ds)["coords"]['x0']['data']) # s
-                I,Q= dataset_to_array(dataset=T1_ds,dims=1)
-                data= array(IQ_data_dis(I,Q,ref_I=ref_iq[0],ref_Q=ref_iq[-1]))
-                try:
-                    data_fit, fit_error = T1_fit_analysis(data=data,freeDu=times,T1_guess=8e-6, return_error=True)
-                    t1 = data_fit.attrs['T1_fit']*1e6
-                    print(f"T1={t1}, error={fit_error}, ~ {round(fit_error*100/t1,1)} %")
-                    if t1 < 50 and t1 > 0: 
-                        T1_us.append(t1)
-                        T1_err.append(fit_error)
-                        gamma1_MHz.append(1/t1)
-                        if fit_error*100/t1 > 50:
-                            save_weired_data_pic(times, data, "T1", exp_idx, set_idx, temperature_folder_path,data_fit) 
-                    else: 
-                        T1_us.append(0)
-                        gamma1_MHz.append(0)
-                        T1_err.append(0)
-                        save_weired_data_pic(times, data, "T1", exp_idx, set_idx, temperature_folder_path,data_fit)   
-                except:
-                    save_weired_data_pic(times, data, "T1", exp_idx, set_idx, temperature_folder_path)
+    SS_paths = []
+    for file_name in files: # in a single set
+        exp_idx = file_name.split("(")[-1].split(")")[0]  # histo_counts
+        exp_type = file_name.split("(")[0].split("_")[-1] # T1/ T2/ SingleShot
+        file_path = os.path.join(folder_path,file_name)
+        print(f"{exp_type}-{exp_idx}")
+        if exp_type == "T1":
+            T1_ds = open_dataset(file_path)
+            
+            times = T1_ds['x0'].values # s
+            I,Q= dataset_to_array(dataset=T1_ds,dims=1)
+            data= array(IQ_data_dis(I,Q,ref_I=ref_iq[0],ref_Q=ref_iq[-1]))
+            try:
+                data_fit, fit_error = T1_fit_analysis(data=data,freeDu=times,T1_guess=8e-6, return_error=True, params_only=True)
+                t1 = data_fit.attrs['T1_fit']*1e6
+                print(f"T1={t1}, error={fit_error}, ~ {round(fit_error*100/t1,1)} %")
+                if t1 < 50 and t1 > 0: 
+                    T1_us.append(t1)
+                    T1_err.append(fit_error)
+                    gamma1_MHz.append(1/t1)
+                    if fit_error*100/t1 > 50:
+                        save_weired_data_pic(times, data, "T1", exp_idx, set_idx, temperature_folder_path,data_fit) 
+                else: 
                     T1_us.append(0)
                     gamma1_MHz.append(0)
                     T1_err.append(0)
-            elif exp_type == "T2":
-                T2_ds = open_dataset(file_path)
-                times = array(Dataset.to_dict(T2_ds)["coords"]['x0']['data']) # s
-                I,Q= dataset_to_array(dataset=T2_ds,dims=1)
-                data= (IQ_data_dis(I,Q,ref_I=ref_iq[0],ref_Q=ref_iq[1]))
-                try:
-                    data_fit, fit_error = T2_fit_analysis(data=data,freeDu=times,T2_guess=8e-6, return_error=True)
-                    t2 = data_fit.attrs['T2_fit']*1e6
-                    print(f"T2={t2}, error={fit_error}, ~ {round(fit_error*100/t2,1)} %")
-                    if t2 < 50 and t2 > 0: 
-                        T2_us.append(t2)
-                        gamma2_MHz.append(1/t2)
-                        T2_err.append(fit_error)
-                        if fit_error*100/t2 > 50 :
-                            save_weired_data_pic(times, data, "T2", exp_idx, set_idx, temperature_folder_path, data_fit)
-                    else:
-                        T2_us.append(0)
-                        gamma2_MHz.append(0)
-                        T2_err.append(0)
+                    save_weired_data_pic(times, data, "T1", exp_idx, set_idx, temperature_folder_path,data_fit)   
+            except:
+                save_weired_data_pic(times, data, "T1", exp_idx, set_idx, temperature_folder_path)
+                T1_us.append(0)
+                gamma1_MHz.append(0)
+                T1_err.append(0)
+        elif exp_type == "T2":
+            T2_ds = open_dataset(file_path)
+            times = T2_ds['x0'].values # s
+            I,Q= dataset_to_array(dataset=T2_ds,dims=1)
+            data= (IQ_data_dis(I,Q,ref_I=ref_iq[0],ref_Q=ref_iq[1]))
+            try:
+                data_fit, fit_error = T2_fit_analysis(data=data,freeDu=times,T2_guess=8e-6, return_error=True, params_only=True)
+                t2 = data_fit.attrs['T2_fit']*1e6
+                print(f"T2={t2}, error={fit_error}, ~ {round(fit_error*100/t2,1)} %")
+                if t2 < 50 and t2 > 0: 
+                    T2_us.append(t2)
+                    gamma2_MHz.append(1/t2)
+                    T2_err.append(fit_error)
+                    if fit_error*100/t2 > 50 :
                         save_weired_data_pic(times, data, "T2", exp_idx, set_idx, temperature_folder_path, data_fit)
-                except:
-                    save_weired_data_pic(times, data, "T2", exp_idx, set_idx, temperature_folder_path)
+                else:
                     T2_us.append(0)
                     gamma2_MHz.append(0)
                     T2_err.append(0)
-                
-                
-            elif exp_type == "SingleShot":
-                # collect data to choose training and predict
-                SS_ds = open_dataset(file_path)
-                ss_dict = Dataset.to_dict(SS_ds)
-                # print(ss_dict)
-                pe_I, pe_Q = ss_dict['data_vars']['e']['data']
-                pg_I, pg_Q = ss_dict['data_vars']['g']['data']
-                pgI_collection.append(pg_I)
-                pgQ_collection.append(pg_Q)
-                peI_collection.append(pe_I)
-                peQ_collection.append(pe_Q)
-
-                
-            else:
-                pass
+                    save_weired_data_pic(times, data, "T2", exp_idx, set_idx, temperature_folder_path, data_fit)
+            except:
+                save_weired_data_pic(times, data, "T2", exp_idx, set_idx, temperature_folder_path)
+                T2_us.append(0)
+                gamma2_MHz.append(0)
+                T2_err.append(0)
             
             
-        print(f"First stage analysis complete for set-{set_idx}!")
+        elif exp_type == "SingleShot":
+            # collect data to choose training and predict
+            SS_paths.append(file_path)
+
             
+        else:
+            pass
+        
+        
+    print(f"First stage analysis complete for set-{set_idx}!")
         
-        # reshape data to (I,Q)*(g,e)*shots       
-        OS_data = 1000*array([[pgI_collection,peI_collection],[pgQ_collection,peQ_collection]]) # can train or predict 2*2*histo_counts*shot
+    
+    # reshape data to (I,Q)*(g,e)*shots       
+    OS_data = load_OS_shots(SS_paths, scale=1000) # can train or predict 2*2*histo_counts*shot
+    if registry is not None:
+        for p0_pop, p1_pop in cached_OS_populations(registry, target_q, OS_data, ref_iq, transi_freq):
+            therm_pop.append(p0_pop[1]*100)
+            effT_mK.append(p01_to_Teff(p0_pop[1], transi_freq)*1000)
+    else:
         tarin_data, fit_arrays = OSdata_arranger(OS_data)
         # train GMM
         dist_model = train_GMModel (tarin_data[0])
@@ -738,143 +695,347 @@ def main_analysis(target_q:str, temperature_folder_path:str, mode:str='all' ):
             new_data = moveaxis( analysis_data ,1,0)
             p0_pop = dist_model.get_state_population(new_data[0].transpose()) # [p0in0, p0in1]
             p1_pop = dist_model.get_state_population(new_data[1].transpose()) # [p1in0, p1in1]
-            OneShot_pic_path = os.path.join(SS_folder,f"SingleShot-S{set_idx}-{histo_i}")
             fig , eff_t, snr = plot_readout_fidelity(analysis_data, transi_freq, None, False)
             therm_pop.append(100-(p0_pop[0]*100/(p0_pop[0]+p0_pop[1])))
             effT_mK.append(eff_t)
             plt.close()
-        
-        # T1
-        T1s[set_idx] = T1_us
-        T1ers[set_idx] = T1_err 
-        gamma1s[set_idx] = gamma1_MHz
-    
-        # T2
-        T2s[set_idx] = T2_us
-        T2ers[set_idx] = T2_err 
-        gamma2s[set_idx] = gamma2_MHz
-
-        # calc OnsShot
-        effTs[set_idx] = effT_mK
-        thermalpops[set_idx] = therm_pop
 
-    T1_err_up_lim, T1_err_bt_lim = ret_error_bound([ T1ers[set_id] for set_id in T1ers],2)
-    T2_err_up_lim, T2_err_bt_lim = ret_error_bound([ T2ers[set_id] for set_id in T2ers],2)
+    return {"T1s":T1_us,"T1ers":T1_err,"gamma1s":gamma1_MHz,"T2s":T2_us,"T2ers":T2_err,"gamma2s":gamma2_MHz,"effTs":effT_mK,"thermalPops":therm_pop}
 
-    # # Filter outlier
-    for set_idx in T1s:
-        info_dict = create_results_dict()
-        # # cala T1
-        gamma1ers[set_idx] = []
-        for histo_idx in range(len(T1ers[set_idx])):
-            error_value = T1ers[set_idx][histo_idx]
-            if T1s[set_idx][histo_idx] != 0:
-                if error_value > T1_err_up_lim or error_value < T1_err_bt_lim:
-                    T1s[set_idx][histo_idx] = 0
-                    T1ers[set_idx][histo_idx] = 0
-                    gamma1s[set_idx][histo_idx] = 0
-                    gamma1ers[set_idx].append(0)
-                else:
-                    err_ratio = T1ers[set_idx][histo_idx]/T1s[set_idx][histo_idx]
-                    gamma1ers[set_idx].append(gamma1s[set_idx][histo_idx]*err_ratio)
+def a_set_statistics(raw_values:dict, T1_err_bounds:tuple, T2_err_bounds:tuple)->tuple[dict, dict]:
+    """
+    Filter the outliers in a set by the error bounds from `ret_error_bound`, then calculate the averages and stds.\n
+    raw_values is the dict from `a_set_raw_values`, it won't be modified.\n
+    ## Return \n
+    info_dict for `setInfo(idx).json`, and the filtered values of this set with the keys in `every_values.json`.
+    """
+    T1_err_up_lim, T1_err_bt_lim = T1_err_bounds
+    T2_err_up_lim, T2_err_bt_lim = T2_err_bounds
+    T1s, T1ers, gamma1s = list(raw_values["T1s"]), list(raw_values["T1ers"]), list(raw_values["gamma1s"])
+    T2s, T2ers, gamma2s = list(raw_values["T2s"]), list(raw_values["T2ers"]), list(raw_values["gamma2s"])
+    info_dict = create_results_dict()
+    # # cala T1
+    gamma1ers = []
+    for histo_idx in range(len(T1ers)):
+        error_value = T1ers[histo_idx]
+        if T1s[histo_idx] != 0:
+            if error_value > T1_err_up_lim or error_value < T1_err_bt_lim:
+                T1s[histo_idx] = 0
+                T1ers[histo_idx] = 0
+                gamma1s[histo_idx] = 0
+                gamma1ers.append(0)
             else:
-                gamma1ers[set_idx].append(0)
-        
-        t1_aray, t1_err_aray, g1_aray, g1_err_aray = array(T1s[set_idx]), array(T1ers[set_idx]), array(gamma1s[set_idx]), array(gamma1ers[set_idx])
-        if sum(t1_err_aray) == 0:
-            mean_T1_us = 0
-            sd_T1_us = 0
+                err_ratio = T1ers[histo_idx]/T1s[histo_idx]
+                gamma1ers.append(gamma1s[histo_idx]*err_ratio)
         else:
-            mean_T1_us = round(average(t1_aray[t1_aray != 0],weights=1/(t1_err_aray[t1_err_aray != 0])),1)
-            sd_T1_us = round(std(t1_aray[t1_aray != 0]),1)
-        if sum(g1_err_aray[g1_err_aray != 0]) != 0:
-            mean_gamma1_MHz = round(average(g1_aray[g1_aray != 0],weights=1/(g1_err_aray[g1_err_aray != 0])),2)
-        else:
-            mean_gamma1_MHz = round(mean(g1_aray[g1_aray != 0]),2)
-        sd_gamma1_MHz = round(std(g1_aray[g1_aray != 0]),2)
-        info_dict["T1"]["avg"], info_dict["T1"]["std"] = mean_T1_us, sd_T1_us
-        info_dict["gamma1"]["avg"], info_dict["gamma1"]["std"] = mean_gamma1_MHz, sd_gamma1_MHz
-        # histo_path = os.path.join(result_folder,f"T1-histo-S{set_idx}.png")
-        # hist_plot("nobu",{"nobu":t1_aray},f"S{set_idx}, T1={mean_T1_us}+/-{sd_T1_us} us",histo_path, False)
-
-        # # cala T2
-        gamma2ers[set_idx] = []
-        for histo_idx in range(len(T2ers[set_idx])):
-            error_value = T2ers[set_idx][histo_idx]
-            if T2s[set_idx][histo_idx] != 0:
-                if error_value > T2_err_up_lim or error_value < T2_err_bt_lim:
-                    T2s[set_idx][histo_idx] = 0
-                    T2ers[set_idx][histo_idx] = 0
-                    gamma2s[set_idx][histo_idx] = 0
-                    gamma2ers[set_idx].append(0)
-                else:
-                    err_ratio = T2ers[set_idx][histo_idx]/T2s[set_idx][histo_idx]
-                    gamma2ers[set_idx].append(gamma2s[set_idx][histo_idx]*err_ratio)
+            gamma1ers.append(0)
+    
+    t1_aray, t1_err_aray, g1_aray, g1_err_aray = array(T1s), array(T1ers), array(gamma1s), array(gamma1ers)
+    if sum(t1_err_aray) == 0:
+        mean_T1_us = 0
+        sd_T1_us = 0
+    else:
+        mean_T1_us = round(average(t1_aray[t1_aray != 0],weights=1/(t1_err_aray[t1_err_aray != 0])),1)
+        sd_T1_us = round(std(t1_aray[t1_aray != 0]),1)
+    if sum(g1_err_aray[g1_err_aray != 0]) != 0:
+        mean_gamma1_MHz = round(average(g1_aray[g1_aray != 0],weights=1/(g1_err_aray[g1_err_aray != 0])),2)
+    else:
+        mean_gamma1_MHz = round(mean(g1_aray[g1_aray != 0]),2)
+    sd_gamma1_MHz = round(std(g1_aray[g1_aray != 0]),2)
+    info_dict["T1"]["avg"], info_dict["T1"]["std"] = mean_T1_us, sd_T1_us
+    info_dict["gamma1"]["avg"], info_dict["gamma1"]["std"] = mean_gamma1_MHz, sd_gamma1_MHz
+
+    # # cala T2
+    gamma2ers = []
+    for histo_idx in range(len(T2ers)):
+        error_value = T2ers[histo_idx]
+        if T2s[histo_idx] != 0:
+            if error_value > T2_err_up_lim or error_value < T2_err_bt_lim:
+                T2s[histo_idx] = 0
+                T2ers[histo_idx] = 0
+                gamma2s[histo_idx] = 0
+                gamma2ers.append(0)
             else:
-                gamma2ers[set_idx].append(0)
-        
-        t2_aray, t2_err_aray, g2_aray, g2_err_aray = array(T2s[set_idx]), array(T2ers[set_idx]), array(gamma2s[set_idx]), array(gamma2ers[set_idx])
-        if sum(t2_err_aray) == 0:
-            mean_T2_us = 0
-            sd_T2_us = 0
+                err_ratio = T2ers[histo_idx]/T2s[histo_idx]
+                gamma2ers.append(gamma2s[histo_idx]*err_ratio)
         else:
-            mean_T2_us = round(average(t2_aray[t2_aray != 0],weights=1/(t2_err_aray[t2_err_aray != 0])),1)
-            sd_T2_us = round(std(t2_aray[t2_aray != 0]),1)
-        if sum(g2_err_aray) != 0:
-            mean_gamma2_MHz = round(average(g2_aray[g2_aray != 0],weights=1/(g2_err_aray[g2_err_aray != 0])),2)
+            gamma2ers.append(0)
+    
+    t2_aray, t2_err_aray, g2_aray, g2_err_aray = array(T2s), array(T2ers), array(gamma2s), array(gamma2ers)
+    if sum(t2_err_aray) == 0:
+        mean_T2_us = 0
+        sd_T2_us = 0
+    else:
+        mean_T2_us = round(average(t2_aray[t2_aray != 0],weights=1/(t2_err_aray[t2_err_aray != 0])),1)
+        sd_T2_us = round(std(t2_aray[t2_aray != 0]),1)
+    if sum(g2_err_aray) != 0:
+        mean_gamma2_MHz = round(average(g2_aray[g2_aray != 0],weights=1/(g2_err_aray[g2_err_aray != 0])),2)
+    else:
+        mean_gamma2_MHz = round(mean(g2_aray[g2_aray != 0]),2)
+    sd_gamma2_MHz = round(std(g2_aray[g2_aray != 0]),2)
+    info_dict["T2"]["avg"], info_dict["T2"]["std"] = mean_T2_us, sd_T2_us
+    info_dict["gamma2"]["avg"], info_dict["gamma2"]["std"] = mean_gamma2_MHz, sd_gamma2_MHz
+
+    # # calc T-phi
+    gammaphis = []
+    gammaphiers = []
+    for histo_idx in range(len(T1s)):
+        if gamma1s[histo_idx] != 0 and gamma2s[histo_idx] != 0:
+            gammaphis.append(gamma2s[histo_idx] - 0.5*(gamma1s[histo_idx]))
+            error_gamma_phi = sqrt((gamma2ers[histo_idx])**2 + (0.5*(gamma1ers[histo_idx]))**2)
+            gammaphiers.append(error_gamma_phi)
         else:
-            mean_gamma2_MHz = round(mean(g2_aray[g2_aray != 0]),2)
-        sd_gamma2_MHz = round(std(g2_aray[g2_aray != 0]),2)
-        info_dict["T2"]["avg"], info_dict["T2"]["std"] = mean_T2_us, sd_T2_us
-        info_dict["gamma2"]["avg"], info_dict["gamma2"]["std"] = mean_gamma2_MHz, sd_gamma2_MHz
-        # histo_path = os.path.join(result_folder,f"T2-histo-S{set_idx}.png")
-        # hist_plot("nobu",{"nobu":t2_aray},f"S{set_idx}, T2={mean_T2_us}+/-{sd_T2_us} us",histo_path, False)
-
-        # # calc T-phi
-        gammaphis[set_idx] = []
-        gammaphiers[set_idx] = []
-        for histo_idx in range(len(T1s[set_idx])):
-            if gamma1s[set_idx][histo_idx] != 0 and gamma2s[set_idx][histo_idx] != 0:
-                gammaphis[set_idx].append(gamma2s[set_idx][histo_idx] - 0.5*(gamma1s[set_idx][histo_idx]))
-                error_gamma_phi = sqrt((gamma2ers[set_idx][histo_idx])**2 + (0.5*(gamma1ers[set_idx][histo_idx]))**2)
-                gammaphiers[set_idx].append(error_gamma_phi)
-            else:
-                gammaphis[set_idx].append(0)
-                gammaphiers[set_idx].append(0)
+            gammaphis.append(0)
+            gammaphiers.append(0)
 
-        gphi_aray, aphi_err_aray = array(gammaphis[set_idx]), array(gammaphiers[set_idx])
-        if sum(aphi_err_aray) == 0 :
-            mean_gammaphi_MHz = 0
-            sd_gammaphi_MHz = 0
+    gphi_aray, aphi_err_aray = array(gammaphis), array(gammaphiers)
+    if sum(aphi_err_aray) == 0 :
+        mean_gammaphi_MHz = 0
+        sd_gammaphi_MHz = 0
+    else:
+        mean_gammaphi_MHz = round(average(gphi_aray[gphi_aray != 0],weights=1/(aphi_err_aray[aphi_err_aray != 0])),2)
+        sd_gammaphi_MHz = round(std(gphi_aray[gphi_aray != 0]),2)
+    info_dict["gammaPhi"]["avg"], info_dict["gammaPhi"]["std"] = mean_gammaphi_MHz, sd_gammaphi_MHz
+
+    # # calc effT (no filters now)
+    effT_mK = array(raw_values["effTs"])
+    therm_pop = array(raw_values["thermalPops"])
+    mean_effT_mK = round(mean(effT_mK),1)
+    sd_effT_mK = round(std(effT_mK),1)
+    info_dict["effT"]["avg"], info_dict["effT"]["std"] = mean_effT_mK, sd_effT_mK
+    info_dict["thermalPop"]["avg"], info_dict["thermalPop"]["std"] = round(mean(therm_pop),2), round(std(therm_pop),2)
+
+    set_values = {"T1s":T1s,"T1ers":T1ers,"gamma1s":gamma1s,"gamma1ers":gamma1ers,"T2s":T2s,"T2ers":T2ers,"gamma2ers":gamma2ers,"gamma2s":gamma2s,"effTs":list(raw_values["effTs"]),"thermalPops":list(raw_values["thermalPops"]),"gammaPhis":gammaphis,"gammaPhiers":gammaphiers}
+    return info_dict, set_values
+
+# ============================================ Incremental index ================================================================================
+def file_signature(file_path:str, old_signature:dict={})->dict:
+    """
+    Return {"mtime","size","sha1"} of a file. If mtime and size are the same as `old_signature`, the old sha1 is kept without reading the file again.
+    """
+    import hashlib
+    stat = os.stat(file_path)
+    signature = {"mtime":stat.st_mtime,"size":stat.st_size}
+    if old_signature != {} and old_signature["mtime"] == signature["mtime"] and old_signature["size"] == signature["size"]:
+        signature["sha1"] = old_signature["sha1"]
+    else:
+        sha1 = hashlib.sha1()
+        with open(file_path,'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha1.update(chunk)
+        signature["sha1"] = sha1.hexdigest()
+    return signature
+
+def set_signatures(set_folder_path:str, old_signatures:dict={})->dict:
+    """ {nc file name: file_signature} for a set folder. """
+    signatures = {}
+    for name in os.listdir(set_folder_path):
+        if os.path.isfile(os.path.join(set_folder_path,name)) and name.split(".")[-1] == "nc":
+            signatures[name] = file_signature(os.path.join(set_folder_path,name),old_signatures[name] if name in old_signatures else {})
+    return signatures
+
+def is_same_set(old_signatures:dict, new_signatures:dict)->bool:
+    if sorted(old_signatures.keys()) != sorted(new_signatures.keys()):
+        return False
+    return all([old_signatures[name]["sha1"] == new_signatures[name]["sha1"] for name in new_signatures])
+
+def load_analyzed_index(json_folder:str)->dict:
+    """
+    The index of analyzed sets in `results/jsons/analyzedIndex.json`:\n
+    {"sets":{"Radiator(0)":{nc name:{"mtime","size","sha1"}}, ...}, "errors":{"T1ers":[counts, sum, square sum], "T2ers":[...]}}\n
+    The errors part keeps the running statistics for `ret_error_bound`.
+    """
+    index_path = os.path.join(json_folder,"analyzedIndex.json")
+    if os.path.exists(index_path):
+        with open(index_path) as J:
+            return json.load(J)
+    return {"sets":{},"errors":{"T1ers":[0,0,0],"T2ers":[0,0,0]}}
+
+def save_analyzed_index(json_folder:str, index:dict):
+    index_path = os.path.join(json_folder,"analyzedIndex.json")
+    with open(index_path+".tmp", "w") as record_file:
+        json.dump(index,record_file)
+    os.replace(index_path+".tmp",index_path)
+
+def accumulate_errors(running_stats:list, errors:list)->list:
+    """ Add the errors into [counts, sum, square sum]. """
+    errors = array(errors,dtype=float).reshape(-1)
+    return [running_stats[0]+int(errors.shape[0]), running_stats[1]+float(errors.sum()), running_stats[2]+float((errors**2).sum())]
+
+def running_error_bound(running_stats:list, threshold:float=1)->tuple[float, float]:
+    """ The same bounds as `ret_error_bound` but from [counts, sum, square sum]. """
+    counts, err_sum, err_sq_sum = running_stats
+    if counts == 0:
+        return 0, 0
+    err_mean = err_sum/counts
+    err_std = sqrt(max(err_sq_sum/counts - err_mean**2, 0))
+    return err_mean + threshold*err_std, err_mean - threshold*err_std
+
+def append_histo_values(json_folder:str, set_idx:str, set_values:dict):
+    """ Append the filtered values of a set into the columnar store `results/jsons/histoValues.csv`, one row for a histo. """
+    csv_path = os.path.join(json_folder,"histoValues.csv")
+    columns = {"set_idx":[int(set_idx)]*max([len(set_values[part]) for part in set_values])}
+    columns["histo_idx"] = list(range(len(columns["set_idx"])))
+    for part in set_values:
+        columns[part] = set_values[part]
+    df = DF.from_dict(columns, orient='index').transpose()
+    df["set_idx"], df["histo_idx"] = df["set_idx"].astype(int), df["histo_idx"].astype(int)
+    df.to_csv(csv_path, mode='a', header=not os.path.exists(csv_path), index=False)
+
+def read_histo_values(temperature_folder_path:str)->DF:
+    """ Read the columnar store written by the incremental analysis. """
+    from pandas import read_csv
+    return read_csv(os.path.join(temperature_folder_path,"results","jsons","histoValues.csv"))
+
+def incremental_analysis(target_q:str, temperature_folder_path:str):
+    """
+    Only analyze the complete sets which are not in `analyzedIndex.json`, then append their results to `histoValues.csv`, `every_values.json` and `temperatureInfo.json`.\n
+    The error bounds for the outlier filter are from all the sets analyzed so far, the setInfo of the old sets are kept.\n
+    If any analyzed set was changed on disk, everything is analyzed again with mode='all'.
+    """
+    other_info_dict = {}
+    other_info_ = [name for name in os.listdir(temperature_folder_path) if (os.path.isfile(os.path.join(temperature_folder_path,name)) and name.split(".")[0]=='otherInfo')]
+    with open(os.path.join(temperature_folder_path,other_info_[0])) as JJ:
+        other_info_dict = json.load(JJ)
+    ref_iq = other_info_dict[target_q]["refIQ"]
+    transi_freq = other_info_dict[target_q]["f01"] # Hz
+    result_folder = create_result_folder(temperature_folder_path)
+    json_folder = create_json_folder(result_folder)
+    creat_oneshot_folder(result_folder)
+    create_T1T2_folder(result_folder,"t1")
+    create_T1T2_folder(result_folder,"t2")
+    index = load_analyzed_index(json_folder)
+
+    sub_folders = delet_incomplete_set(temperature_folder_path)
+    sort_set(sub_folders,0)
+    new_sets = {}
+    for folder_name in sub_folders:
+        folder_path = os.path.join(temperature_folder_path,folder_name)
+        if folder_name in index["sets"]:
+            signatures = set_signatures(folder_path,index["sets"][folder_name])
+            if not is_same_set(index["sets"][folder_name],signatures):
+                print(f"{folder_name} was changed after analyzed, analyze all sets again!")
+                return main_analysis(target_q, temperature_folder_path, mode='all')
+            index["sets"][folder_name] = signatures # mtime may be renewed
+        else:
+            new_sets[folder_name] = set_signatures(folder_path)
+    
+    start = time.time()
+    print(f"{len(new_sets)} new sets to analyze: {list(new_sets.keys())}")
+    if len(new_sets) == 0:
+        save_analyzed_index(json_folder,index)
+        return
+    
+    every_value_path = os.path.join(json_folder,"every_values.json")
+    every_value = {}
+    if os.path.exists(every_value_path):
+        with open(every_value_path) as J:
+            every_value = json.load(J)
+    tempera_info_path = os.path.join(json_folder,"temperatureInfo.json")
+    for folder_name in new_sets:
+        set_idx = folder_name.split("(")[-1].split(")")[0]
+        raw_values = a_set_raw_values(os.path.join(temperature_folder_path,folder_name), temperature_folder_path, ref_iq, transi_freq)
+        index["errors"]["T1ers"] = accumulate_errors(index["errors"]["T1ers"],raw_values["T1ers"])
+        index["errors"]["T2ers"] = accumulate_errors(index["errors"]["T2ers"],raw_values["T2ers"])
+        info_dict, set_values = a_set_statistics(raw_values, running_error_bound(index["errors"]["T1ers"],2), running_error_bound(index["errors"]["T2ers"],2))
+        
+        with open(f"{json_folder}/setInfo({set_idx}).json", "w") as record_file: 
+            json.dump(info_dict,record_file)
+        append_histo_values(json_folder, set_idx, set_values)
+        for part in set_values:
+            every_value[part] = every_value.get(part,[]) + array(set_values[part]).reshape(-1).tolist()
+        if os.path.exists(tempera_info_path):
+            tempera_info = collect_allSets_inTempera(temperature_folder_path)
+            for exp in tempera_info:
+                tempera_info[exp]["avg"].append(float(info_dict[exp]["avg"]))
+                tempera_info[exp]["std"].append(float(info_dict[exp]["std"]))
+            with open(tempera_info_path, "w") as record_file:
+                json.dump(tempera_info,record_file)
         else:
-            mean_gammaphi_MHz = round(average(gphi_aray[gphi_aray != 0],weights=1/(aphi_err_aray[aphi_err_aray != 0])),2)
-            sd_gammaphi_MHz = round(std(gphi_aray[gphi_aray != 0]),2)
-        info_dict["gammaPhi"]["avg"], info_dict["gammaPhi"]["std"] = mean_gammaphi_MHz, sd_gammaphi_MHz
-
-        # # calc effT (no filters now)
-        effT_mK = array(effTs[set_idx])
-        therm_pop = array(thermalpops[set_idx])
-        mean_effT_mK = round(mean(effT_mK),1)
-        sd_effT_mK = round(std(effT_mK),1)
-        info_dict["effT"]["avg"], info_dict["effT"]["std"] = mean_effT_mK, sd_effT_mK
-        info_dict["thermalPop"]["avg"], info_dict["thermalPop"]["std"] = round(mean(therm_pop),2), round(std(therm_pop),2)
+            collect_allSets_inTempera(temperature_folder_path)
+        
+        index["sets"][folder_name] = new_sets[folder_name]
+        # keep the index after every set, an interrupted analysis goes on from here
+        with open(every_value_path, "w") as record_file:   
+            json.dump(every_value,record_file)
+        save_analyzed_index(json_folder,index)
+
+    end = time.time()
+    print(f"Analysis time cost: {round((end-start)/60,1)} mins")
+
+def main_analysis(target_q:str, temperature_folder_path:str, mode:str='all' ):
+    """
+    target_q: 'q0'\n
+    temperature: '10K'\n
+    mode: 'all', 'jump' or 'incremental'. 'all' for analyze all set again. 'jump' analyze those haven't been analyzed set.\n
+    'incremental' only analyzes the sets not in `analyzedIndex.json` and appends the results, see `incremental_analysis()`.
+    """
+    if mode.lower() == 'incremental':
+        return incremental_analysis(target_q, temperature_folder_path)
+    other_info_dict = {}
+    temperature = os.path.split(temperature_folder_path)[-1]
+    parent_path = temperature_folder_path
+
+    sub_folders = delet_incomplete_set(temperature_folder_path)
+    print(sub_folders)
+    other_info_ = [name for name in os.listdir(temperature_folder_path) if (os.path.isfile(os.path.join(temperature_folder_path,name)) and name.split(".")[0]=='otherInfo')]
+    with open(os.path.join(temperature_folder_path,other_info_[0])) as JJ:
+        other_info_dict = json.load(JJ)
 
+    sort_set(sub_folders,0) # sort sets start from 0 
+    ref_iq = other_info_dict[target_q]["refIQ"]
+    transi_freq = other_info_dict[target_q]["f01"] # Hz
+    result_folder = create_result_folder(temperature_folder_path)
+    json_folder = create_json_folder(result_folder)
+    SS_folder = creat_oneshot_folder(result_folder)
+    T1_pic_folder = create_T1T2_folder(result_folder,"t1")
+    T2_pic_folder = create_T1T2_folder(result_folder,"t2")
+    start = time.time()
+    index = load_analyzed_index(json_folder) if mode.lower() == 'jump' else {"sets":{},"errors":{"T1ers":[0,0,0],"T2ers":[0,0,0]}}
+
+    if mode.lower() == 'jump':
+        set_idx_done = [int(name.split("(")[-1].split(")")[0]) for name in os.listdir(json_folder) if (os.path.isfile(os.path.join(json_folder,name)) and name.split(".")[0].split("(")[0]=='setInfo')]
+        final_complete_setidx = max(set_idx_done)
+        print(f"start set-idx = {final_complete_setidx+1}")
+        sub_folders = sub_folders[final_complete_setidx+1:]
+
+    raw_values = {}
+    for folder_name in sub_folders:
+        set_idx = folder_name.split("(")[-1].split(")")[0]
+        folder_path = os.path.join(temperature_folder_path,folder_name)
+        raw_values[set_idx] = a_set_raw_values(folder_path, temperature_folder_path, ref_iq, transi_freq)
+        index["sets"][folder_name] = set_signatures(folder_path)
+        index["errors"]["T1ers"] = accumulate_errors(index["errors"]["T1ers"],raw_values[set_idx]["T1ers"])
+        index["errors"]["T2ers"] = accumulate_errors(index["errors"]["T2ers"],raw_values[set_idx]["T2ers"])
+
+    T1_err_bounds = ret_error_bound([ raw_values[set_id]["T1ers"] for set_id in raw_values],2)
+    T2_err_bounds = ret_error_bound([ raw_values[set_id]["T2ers"] for set_id in raw_values],2)
+
+    # # Filter outlier
+    set_values = {}
+    for set_idx in raw_values:
+        info_dict, set_values[set_idx] = a_set_statistics(raw_values[set_idx], T1_err_bounds, T2_err_bounds)
         # save the info to plt scatter
         with open(f"{json_folder}/setInfo({set_idx}).json", "w") as record_file: 
             json.dump(info_dict,record_file)
     
     every_value = {}
-    parts = {"T1s":T1s,"T1ers":T1ers,"gamma1s":gamma1s,"gamma1ers":gamma1ers,"T2s":T2s,"T2ers":T2ers,"gamma2ers":gamma2ers,"gamma2s":gamma2s,"effTs":effTs,"thermalPops":thermalpops,"gammaPhis":gammaphis,"gammaPhiers":gammaphiers}
+    parts = ["T1s","T1ers","gamma1s","gamma1ers","T2s","T2ers","gamma2ers","gamma2s","effTs","thermalPops","gammaPhis","gammaPhiers"]
+    myKeys = list(set_values.keys())
+    myKeys.sort()
     for part in parts:
-        infos = parts[part]
-        myKeys = list(infos.keys())
-        myKeys.sort()
-        sorted_infos = {i: infos[i] for i in myKeys}
-        every_value[part] = array([sorted_infos[set_idx] for set_idx in sorted_infos]).reshape(-1).tolist()
+        every_value[part] = array([set_values[set_idx][part] for set_idx in myKeys]).reshape(-1).tolist()
     
 
     with open(f"{json_folder}/every_values.json", "w") as record_file:   
         json.dump(every_value,record_file)
+    
+    # rebuild the columnar store and the index for the incremental analysis
+    if mode.lower() != 'jump' and os.path.exists(os.path.join(json_folder,"histoValues.csv")):
+        os.remove(os.path.join(json_folder,"histoValues.csv"))
+    for set_idx in sorted(set_values, key=int):
+        append_histo_values(json_folder, set_idx, set_values[set_idx])
+    save_analyzed_index(json_folder,index)
 
     end = time.time()
     print(f"Analysis time cost: {round((end-start)/60,1)} mins")
@@ -1253,6 +1414,7 @@ if __name__ == '__main__':
     # // If you wanna plot DR temperature, "start_date" and "start_time" in log_info_dict and also log_folder ALL should be given !
     # *********** Manully settings ***********
     analysis:bool = 1   # analysis or not. Once u had analyzed, u won't need it again
+    analysis_mode:str = 'incremental'   # 'all' analyzes every set again, 'incremental' only analyzes the new sets
     plot_time_trend:bool = 1   # If there is only one element in `log_info_dict`, polt the time monitoring, which is time as the x-axis.
     always_plot_timeTrend:bool = 1  # if there are more than one element in `log_info_dict`, turn on this will plot time monitoring for all elements. 
     plot_temp_dependence: bool = 0 # if there are more than one element in `log_info_dict`, plot the radiator-temp dependence, radiator_temp as x-asix. 
@@ -1281,11 +1443,11 @@ if __name__ == '__main__':
             tempera_folder = os.path.join(meas_raw_dir,sample_folder,conditional_folder,tempera)
             if analysis:
                 print("y")
-                main_analysis(target_q, tempera_folder)
+                main_analysis(target_q, tempera_folder, analysis_mode)
             time_past_sec_array = get_time_axis(target_q,tempera_folder)
             # plot time trend with a given temperature (time as x-axis, in min)
             if plot_time_trend:
-                time_trend_artist(tempera_folder, target_q, exp_catas, time_past_sec_array, ref_before, ref_recove, log_info_dict[tempera], log_folder, DRtemp_che=6,refresh_tempera_info=True)
+                time_trend_artist(tempera_folder, target_q, exp_catas, time_past_sec_array, ref_before, ref_recove, log_info_dict[tempera], log_folder, DRtemp_che=6,refresh_tempera_info=analysis_mode!='incremental')
     else:
         if plot_temp_dependence:
             temp_depen_artist(temperature_list, target_q, sample_folder, conditional_folder, log_info_dict, exp_catas, ref_before, ref_recove, log_folder, tempera_che=6)
@@ -3,11 +3,12 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "
 from xarray import Dataset, open_dataset
 from Modularize.support import QDmanager,Data_manager
 import matplotlib.pyplot as plt
-from numpy import ndarray, array, median, std, mean
+from numpy import ndarray, array, median, std, mean, allclose, argsort, interp, linspace
 from Modularize.support.Pulse_schedule_library import IQ_data_dis, dataset_to_array, T2_fit_analysis, T1_fit_analysis
 from datetime import datetime 
 from matplotlib.gridspec import GridSpec as GS
 from Modularize.analysis.Radiator.RadiatorSetAna import sort_set
+from Modularize.support.FitPool import fit_jobs, para_column
 
 def time_label_sort(nc_file_name:str):
     return datetime.strptime(nc_file_name.split("_")[-1].split(".")[0],"H%HM%MS%S")
@@ -68,6 +69,20 @@ def plot_coherence_timetrace(raw_data:ndarray, time_samples:ndarray, ans:ndarray
     plt.savefig(os.path.join(raw_data_folder,f"{exp.upper()}_{q}_timeDep.png"))
     plt.close()
 
+def common_delay_grid(sample_sets:list, traces:list, points:int=100)->tuple[ndarray, ndarray]:
+    """
+    Put the traces on one delay grid for `colormap`. If the runs took different delays (the adaptive T1/T2 of TimeDepMonitor),
+    every trace is interpolated onto `points` uniform delays in the span which all the runs cover.
+    """
+    if all(samples.shape == sample_sets[0].shape and allclose(samples, sample_sets[0]) for samples in sample_sets):
+        return sample_sets[0], array(traces)
+    grid = linspace(max(samples.min() for samples in sample_sets), min(samples.max() for samples in sample_sets), points)
+    on_grid = []
+    for samples, trace in zip(sample_sets, traces):
+        order = argsort(samples)
+        on_grid.append(interp(grid, samples[order], array(trace)[order]))
+    return grid, array(on_grid)
+
 def colormap(x:ndarray, y:ndarray, z:ndarray, fit_values:ndarray, ax:plt.Axes=None, fig_path:str=None):
     if ax is None:
         fig, ax = plt.subplots()
@@ -152,8 +167,10 @@ if __name__ == "__main__":
             else:
                 raise KeyError(f"Unsupported sort mode was given = '{sort_mode}'")
             raw_data = []
+            sample_sets = []
             ans = []
             detu = []
+            fit_todo = []
             for idx, file in enumerate(files) :
                 path = os.path.join(folder,file)
                 nc = open_dataset(path)
@@ -162,23 +179,30 @@ if __name__ == "__main__":
                     I,Q= dataset_to_array(dataset=nc,dims=1)
                     data = IQ_data_dis(I,Q,ref_I=QD_agent.refIQ[qs][0],ref_Q=QD_agent.refIQ[qs][-1])
                     raw_data.append(data)
+                    sample_sets.append(samples)
                     if folder_name.split("_")[0] == "T1":   
-                        data_fit= T1_fit_analysis(data=data,freeDu=samples,T1_guess=25e-6)
-                        ans.append(data_fit.attrs['T1_fit']*1e6)
+                        fit_todo.append((data,samples,'T1',25e-6))
                     else:
-                        data_fit= T2_fit_analysis(data=data,freeDu=samples,T2_guess=10e-6)
-                        ans.append(data_fit.attrs['T2_fit']*1e6)
-                        detu.append(data_fit.attrs['f']*1e-6)
+                        fit_todo.append((data,samples,'T2',10e-6))
                 else:
                     #　OS to build
                     pass
             
+            # fit all the traces across the cores
+            if len(fit_todo) != 0:
+                exp = folder_name.split("_")[0]
+                params, _, _ = fit_jobs(fit_todo)
+                ans = (params[:,para_column(exp,exp)]*1e6).tolist()
+                if exp == "T2":
+                    detu = (params[:,para_column(exp,'f')]*1e-6).tolist()
+            
             time_json_path = [os.path.join(folder,name) for name in os.listdir(folder) if (os.path.isfile(os.path.join(folder,name)) and name.split(".")[-1] == "json")][0]
             with open(time_json_path) as time_record_file:
                 time_past_dict:dict = json.load(time_record_file)
             time_array = array(list(time_past_dict.values())[0])
             if folder_name.split("_")[0].lower() in ['t1','t2']:
-                colormap(time_array,samples*1e6,array(raw_data),array(ans),fig_path=os.path.join(folder,f"{qs}_{folder_name.split('_')[0]}_timeDep_colormap.png"))
+                delays, traces = common_delay_grid(sample_sets, raw_data)
+                colormap(time_array,delays*1e6,traces,array(ans),fig_path=os.path.join(folder,f"{qs}_{folder_name.split('_')[0]}_timeDep_colormap.png"))
 
             if folder_name.split("_")[0].lower() == 't1':
                 plot_timeDepCohe(time_array, array(ans), folder_name.split("_")[0], units={"x":"min","y":"µs"}, fig_path=os.path.join(folder,f"{qs}_T1_timeDep.png"))
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 from Modularize.support.QDmanager import QDmanager
 from Modularize.support.Pulse_schedule_library import IQ_data_dis, T1_fit_analysis, Fit_analysis_plot
+from Modularize.support.FitPool import fit_jobs, para_column
 from numpy import array, std, average, round, max, min, transpose, abs, sqrt, cos, sin, pi, linspace, arange,ndarray, log10, ndarray, asarray
 
 #//================= Fill in here ========================
@@ -71,13 +72,13 @@ def zgate_T1_fitting(dataset:xr.Dataset, ref_IQ:list, fit:bool=True):
         for z_idx in range(array(data.values[0]).shape[0]):
             data = IQ_data_dis(I[z_idx],Q[z_idx],ref_I=ref_IQ[0],ref_Q=ref_IQ[-1])
             signals.append(data)
-            if fit:
-                try:
-                    data_fit = T1_fit_analysis(data=data,freeDu=array(time),T1_guess=14e-6)
-                    # Fit_analysis_plot(data_fit,P_rescale=False,Dis=None)
-                    T1s.append(data_fit.attrs['T1_fit']*1e6)
-                except:
-                    T1s.append(0e-6)
+    
+    if fit:
+        # all the z points are fitted across the cores, the failed ones are 0
+        paras, _, success = fit_jobs([(data,array(time),'T1',14e-6) for data in signals])
+        T1_fit = paras[:,para_column('T1','T1')]*1e6
+        T1_fit[~success] = 0e-6
+        T1s = T1_fit.tolist()
 
     return time*1e6, flux, T1s, signals
 
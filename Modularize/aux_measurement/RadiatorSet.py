@@ -5,7 +5,7 @@ from Modularize.support.Path_Book import meas_raw_dir
 from Modularize.m13_T1  import T1_executor
 from Modularize.m12_T2  import ramsey_executor
 from Modularize.m14_SingleShot import SS_executor
-from Modularize.support import init_meas, shut_down, init_system_atte, coupler_zctrl
+from Modularize.support.MeasSession import MeasurementSession
 
 def create_set_folder(parent_dir:str,folder_idx:int):
     folder_name = f"Radiator({folder_idx})"
@@ -27,7 +27,9 @@ def create_temperature_folder(temperature:str,within_specific_path:str="")->str:
 
 def time_monitor(monitoring_info:dict, other_info:dict, qubit:str, data_parent_dir:str, start_time):
     from Modularize.analysis.Radiator.RadiatorSetAna import a_set_analysis,live_time_monitoring_plot
-    monitoring_info = a_set_analysis(set_folder,monitoring_info,other_info[qubit]["refIQ"],other_info[qubit]["f01"])
+    from Modularize.support.DiscriminatorCache import DiscriminatorRegistry, registry_folder_name
+    registry = DiscriminatorRegistry(os.path.join(data_parent_dir,registry_folder_name))
+    monitoring_info = a_set_analysis(set_folder,monitoring_info,other_info[qubit]["refIQ"],other_info[qubit]["f01"],registry=registry,target_q=qubit)
     monitoring_info["x_minutes"].append(round((time.time()-start_time)/60,1))
     live_time_monitoring_plot(monitoring_info,data_parent_dir)
     return monitoring_info
@@ -61,15 +63,15 @@ if __name__ == "__main__":
     if str(tracking_time_min).lower() == 'free':
         tracking_time_min = 500 * 24 * 60 # keep running for 500 days, waiting interupted manually
   
+    session = MeasurementSession(QD_path,couplers=couplers,cp_bias_where='i').open()
+    QD_agent, cluster, meas_ctrl, Fctrl = session.QD_agent, session.cluster, session.meas_ctrl, session.Fctrl
     for qubit in ro_elements:
         set_idx = 0
         while (cut_time-start)/60 < tracking_time_min:
             set_folder = create_set_folder(parent_dir=data_parent_dir,folder_idx=set_idx)
             for exp_idx, exp in enumerate(doing_exp):
                 for ith_histo in range(ro_elements[qubit]["histo_counts"]):
-                    QD_agent, cluster, meas_ctrl, ic, Fctrl = init_meas(QuantumDevice_path=QD_path,mode='l')
-                    init_system_atte(QD_agent.quantum_device,list(Fctrl.keys()),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'))
-                    Cctrl = coupler_zctrl(dr,cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
+                    session.prepare_for(qubit)
                     if set_idx == 0 and exp_idx == 0 and ith_histo == 0:
                         other_info[qubit]={"start_time":exp_start_time,"refIQ":QD_agent.refIQ[qubit],"time_past":[],"f01":QD_agent.quantum_device.get_element(qubit).clock_freqs.f01()}
                     
@@ -78,12 +80,12 @@ if __name__ == "__main__":
                     elif exp == "T2":
                         _ = ramsey_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,artificial_detune=ro_elements[qubit]["T2detune"],freeDura=ro_elements[qubit]["freeTime"]["T2"],ith=ith_histo,run=True,specific_folder=set_folder)
                     elif exp == "OS":
-                        SS_executor(QD_agent,cluster,Fctrl,qubit,execution=True,data_folder=set_folder,exp_label=ith_histo,plot=False)
+                        SS_executor(QD_agent,cluster,Fctrl,qubit,execution=True,data_folder=set_folder,exp_label=ith_histo,plot=False,cache_discriminator=True)
                     else:
                         print(f"*** Can't support this exp called '{exp}' in Radiator test set !")
                     
-                    """ Close """
-                    shut_down(cluster,Fctrl,Cctrl)
+                    """ Reset """
+                    session.soft_reset()
             
             
             cut_time = time.time()
@@ -94,6 +96,8 @@ if __name__ == "__main__":
             with open(os.path.join(data_parent_dir,"otherInfo.json"),"w") as record_file:
                 json.dump(other_info,record_file)
 
+    """ Close """
+    session.close()
     end = time.time()
     print(f"{set_idx}*{ro_elements['q0']['histo_counts']} Cost time: {round((end-start)/60,1)} mins")
 
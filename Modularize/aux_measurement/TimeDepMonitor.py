@@ -5,7 +5,7 @@ from Modularize.support.Path_Book import meas_raw_dir
 from Modularize.m13_T1  import T1_executor
 from Modularize.m12_T2  import ramsey_executor
 from Modularize.m14_SingleShot import SS_executor
-from Modularize.support import init_meas, shut_down, init_system_atte, coupler_zctrl
+from Modularize.support.MeasSession import MeasurementSession
 
 
 if __name__ == "__main__":
@@ -27,6 +27,8 @@ if __name__ == "__main__":
     XY_IF:float = 250e6
     n_avg:int = 300
     shots = 5e3
+    adaptive:dict = {} # like {"rel_err":0.05}, T1 and T2 pick their delays adaptively and stop at rel_err, {} for the linear grids
+    OS_thresholded:bool = False # the OS keeps only the |1> populations by the thresholded acquisition, it needs a discriminator from an IQ single shot
 
 
     """ Preparations """
@@ -43,6 +45,9 @@ if __name__ == "__main__":
 
     time_recs = {'T1_times_rec':[],'T2_times_rec':[],'OS_times_rec':[]}
     paths = [T1_folder_path, T2_folder_path, OS_folder_path]
+    session = MeasurementSession(QD_path,couplers=couplers,cp_bias_where='i').open()
+    session.bias_coupler('c3',0.13)
+    QD_agent, cluster, meas_ctrl, Fctrl = session.QD_agent, session.cluster, session.meas_ctrl, session.Fctrl
     for qubit in ro_elements:
         set_idx = 0
         while (cut_time-start)/60 < tracking_time_min:
@@ -60,19 +65,16 @@ if __name__ == "__main__":
                         with open(os.path.join(paths[idx],"timeInfo.json")) as recorded_file:
                             time_recs[list(time_recs.keys())[idx]] = json.load(recorded_file)[list(time_recs.keys())[idx]]
 
-                    QD_agent, cluster, meas_ctrl, ic, Fctrl = init_meas(QuantumDevice_path=QD_path,mode='l')
-                    init_system_atte(QD_agent.quantum_device,list(Fctrl.keys()),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'))
-                    Cctrl = coupler_zctrl(dr,cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
-                    Cctrl['c3'](0.13)
+                    session.prepare_for(qubit)
 
                     if exp == "T1" and T1_folder_path != '' and doing_exp[exp]:
-                        _ = T1_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,freeDura=ro_elements[qubit]["freeTime"]["T1"],ith=set_idx,run=True,specific_folder=T1_folder_path,avg_times=n_avg,IF=XY_IF)
+                        _ = T1_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,freeDura=ro_elements[qubit]["freeTime"]["T1"],ith=set_idx,run=True,specific_folder=T1_folder_path,avg_times=n_avg,IF=XY_IF,adaptive=adaptive)
                         
                     elif exp == "T2" and T2_folder_path != '' and doing_exp[exp]:
-                        _ = ramsey_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,artificial_detune=ro_elements[qubit]["T2detune"],freeDura=ro_elements[qubit]["freeTime"]["T2"],ith=set_idx,run=True,specific_folder=T2_folder_path,avg_n=int(1.5*n_avg),second_phase='y',IF=XY_IF)
+                        _ = ramsey_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,artificial_detune=ro_elements[qubit]["T2detune"],freeDura=ro_elements[qubit]["freeTime"]["T2"],ith=set_idx,run=True,specific_folder=T2_folder_path,avg_n=int(1.5*n_avg),second_phase='y',IF=XY_IF,adaptive=adaptive)
                         
                     elif exp == "OS" and OS_folder_path != '' and doing_exp[exp]:
-                        SS_executor(QD_agent,cluster,Fctrl,qubit,execution=True,data_folder=OS_folder_path,exp_label=set_idx,plot=False,IF=XY_IF,shots=shots)
+                        SS_executor(QD_agent,cluster,Fctrl,qubit,execution=True,data_folder=OS_folder_path,exp_label=set_idx,plot=False,IF=XY_IF,shots=shots,cache_discriminator=True,thresholded=OS_thresholded)
                         
                     else:
                         print(f"*** Can't support this exp called '{exp}' in Radiator test set !")
@@ -82,8 +84,8 @@ if __name__ == "__main__":
                     if paths[idx] != '':
                         with open(os.path.join(paths[idx],"timeInfo.json"),"w") as recorded_file:
                                 json.dump({list(time_recs.keys())[idx]:time_recs[list(time_recs.keys())[idx]]},recorded_file)
-                    """ Close """
-                    shut_down(cluster,Fctrl,Cctrl)
+                    """ Reset """
+                    session.soft_reset()
             set_idx += 1
             
             
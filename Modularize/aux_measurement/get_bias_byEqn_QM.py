@@ -1,9 +1,11 @@
-from numpy import asarray, ndarray, array, sqrt, sort, mean, std, pi, cos, sin, diag, linspace
-import sympy as sp
+from numpy import asarray, ndarray, array, sqrt, sort, mean, std, pi, cos, sin, diag, linspace, isnan
 from scipy.optimize import curve_fit
-import json, os
+import json, os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 from typing import Callable
 import matplotlib.pyplot as plt
+from Modularize.analysis.FluxPeakAna import sortAndDecora, filter_2D, mag_static_filter, FitErrorFilter
+from Modularize.analysis.FqBiasSolver import biases_for_fq
 
 
 def find_nearest(ary:ndarray, near_target:float):
@@ -66,44 +68,6 @@ def mag_repalce_origin(I_ary:ndarray,Q_ary:ndarray,ref_IQ,qblox_rotation:bool=Fa
 
     return displaced_magnitude
 
-def sortAndDecora(raw_z:ndarray,raw_XYF:ndarray,raw_mag:ndarray,threshold:float=3):
-    def takeLast(elem):
-        return elem[-1]
-
-    while True:
-        f_idx, z_idx, XL_mag = filter_2D(raw_mag,threshold)
-        if len(f_idx)==0 and len(z_idx)==0:
-            if threshold != 0:
-                threshold-=0.5
-            else:
-                print(f"This interval can't find the trend : XYF={raw_XYF[0]}~{raw_XYF[-1]}")
-        else:
-            break
-
-    extracted = []
-    for i in range(len(f_idx)):
-        extracted.append([raw_z[z_idx[i]],raw_XYF[f_idx[i]],XL_mag[i]])
-    # filter out the freq when it's under the same bias
-    filtered = []
-    for point_i in range(len(extracted)):
-        same_bias = []
-        picked_z = extracted[point_i][0]
-        same_bias.append(extracted[point_i])
-        for point_j in range(point_i,len(extracted)):
-            if extracted[point_j][0] == picked_z:
-                same_bias.append(extracted[point_j])
-        same_bias.sort(key=takeLast)
-        if filtered != []:
-            if filtered[-1][0] != same_bias[-1][0]:
-                filtered.append(same_bias[-1])
-        else:
-            filtered.append(same_bias[-1])
-
-    sort(array(filtered),axis=0)
-
-    return array(filtered)
-
-
 def data2plot(XYF_array:ndarray,z_array:ndarray,I_array:ndarray,Q_array:ndarray,specified_refIQ:list,filter2D_threshold:float=1.0,qblox:bool=False,plot_scatter:bool=False):
     
     mag = mag_repalce_origin(I_array,Q_array,ref_IQ=specified_refIQ,qblox_rotation=qblox)
@@ -168,74 +132,6 @@ def plot_fq_fit(flux_array:ndarray,f01_array:ndarray,target_q:str,popt:dict,plot
 
 ### filters
 
-def filter_2D(raw_mag:ndarray,threshold:float=3.0):
-    filtered_f_idx = []
-    filtered_z_idx = []
-    filtered_mag   = []
-    mu = mean(raw_mag.reshape(-1))
-    sigma = std(raw_mag.reshape(-1))
-    for i_z in range(raw_mag.shape[1]):
-        sofar_max = min(raw_mag.reshape(-1))# the maximum signal in the same bias
-        z_idx_champion = 0
-        f_idx_champion = 0
-        for i_f in range(raw_mag.shape[0]):
-            if raw_mag[i_f][i_z] > mu + threshold*sigma:
-                if raw_mag[i_f][i_z] > sofar_max:
-                    f_idx_champion = i_f
-                    z_idx_champion = i_z 
-                    sofar_max = raw_mag[i_f][i_z]
-        if z_idx_champion != 0 or f_idx_champion != 0:
-            filtered_z_idx.append(z_idx_champion)
-            filtered_f_idx.append(f_idx_champion)
-            filtered_mag.append(sofar_max)
-    
-    return filtered_f_idx, filtered_z_idx, filtered_mag
-
-def mag_static_filter(x_array:ndarray,y_array:ndarray,mag_array:ndarray,threshold:float=3.0):
-    x_choosen = []
-    y_choosen = []
-    while True:
-        bottom_line = mean(mag_array) - threshold*std(mag_array)
-        for idx in range(x_array.shape[0]):
-            if mag_array[idx] > bottom_line:
-                x_choosen.append(x_array[idx])
-                y_choosen.append(y_array[idx])
-        if len(x_choosen) > 0 :
-            break
-        else:
-            if threshold != 0.5:
-                threshold -= 0.5
-            else:
-                print(f"No peaks are found in this Z interval: {x_array[0]}~{x_array[-1]} V")
-    
-    return x_choosen, y_choosen
-
-def FitErrorFilter(eqn:Callable,eqn_paras:dict,exp_x_ary:ndarray,exp_y_ary:ndarray,threshold:float=1.5):
-    """
-    Statics for the distances along the same x axis between exp_y_data and fitting curve. Throw away the larger deviation. 
-    """
-    fit_y_ary:ndarray = eqn(exp_x_ary,*eqn_paras)
-    distances  = []
-    # compute distances along a same x axis between fit curve and exp data
-    for idx in range(fit_y_ary.shape[0]):
-        distances.append(abs(fit_y_ary[idx]-exp_y_ary[idx]))
-    away_bound = mean(array(distances)) + threshold*std(array(distances))
-    
-    throwAwayCounts = 0
-    pass_exp_x = []
-    pass_exp_y = []
-    for idx in range(exp_y_ary.shape[0]):
-        if distances[idx] < away_bound:
-            pass_exp_y.append(exp_y_ary[idx])
-            pass_exp_x.append(exp_x_ary[idx])
-        else:
-            throwAwayCounts += 1
-
-    return array(pass_exp_x), array(pass_exp_y), throwAwayCounts
-
-
-
-### fitting flux vs collected xyf
 def fq_fit(period:float,offset:float,data2fit_path:str,target_q:str,plot:bool=True,savefig_path:str='', FitFilter_threshold:float=1.0):
 
     flux, f01 = read_fq_data(data2fit_path)
@@ -283,22 +179,18 @@ def fq_fit(period:float,offset:float,data2fit_path:str,target_q:str,plot:bool=Tr
 def get_biasWithFq_from(fitting_popts:list,target_fq_Hz:float, flux_guard:float=0.4):
     """
     After we fit the tarnsition freq vs bias, we can get the bias according to the given `target_fq_Hz` for the `target_q`.\n
-    ### The given `target_fq_Hz` should unit in Hz.\n
+    ### The given `target_fq_Hz` should unit in Hz, it can be an array.\n
     ### The given `fitting_popts` should follow the order: [a, b, Ec, Ej_sum, d]
-    Return the bias unit in V.
+    Return the bias unit in V. For an array it returns an array with NaN where the fq can't be reached, for a float it returns 'n'.
     """
+    answer = biases_for_fq(target_fq_Hz,fitting_popts,flux_guard)
     
-    z = sp.Symbol('z',real=True)
-    
-    a,b,Ec,Ej_sum,d = fitting_popts[0], fitting_popts[1], fitting_popts[2], fitting_popts[3], fitting_popts[4]
-    to_solve = sp.sqrt(8*Ej_sum*Ec*sp.sqrt(sp.cos(a*(z-b))**2+d**2*sp.sin(a*(z-b))**2))-Ec - target_fq_Hz*1e-9
-    candidators = array(sp.solvers.solve(to_solve, z))
-    
-    if candidators.shape[0] == 0:
-        answer = 'n'
-        print(f"Can NOT find a bias makes the fq @ {target_fq_Hz*1e-9} GHz !")
-    else:
-        answer = find_nearest(candidators, 0) if find_nearest(candidators, 0) < flux_guard else flux_guard
+    if answer.ndim == 0:
+        if isnan(answer):
+            answer = 'n'
+            print(f"Can NOT find a bias makes the fq @ {target_fq_Hz*1e-9} GHz !")
+        else:
+            answer = float(answer)
 
     return answer
 
@@ -1,15 +1,17 @@
 import datetime, json
 import os, sys
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) 
-from numpy import array, ndarray, mean, std, where, sort
+from numpy import array, ndarray, mean, std, where, sort, linspace
 from Modularize.m7_RefIQ import Single_shot_ref_spec
 from Modularize.support.UserFriend import *
-from Modularize.m9_FluxQubit import Zgate_two_tone_spec
+from Modularize.m9_FluxQubit import Zgate_two_tone_spec, Zgate_track_spec
+from Modularize.support.FluxTracking import initial_fq_paras
 from qblox_instruments import Cluster
 from Modularize.support import QDmanager, Data_manager, init_system_atte, reset_offset, shut_down, init_meas, coupler_zctrl
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support.QuFluxFit import calc_fq_g_excluded, convert_netCDF_2_arrays, data2plot, fq_fit
+from Modularize.analysis.FluxPeakAna import mag_static_filter
 
 def sweepZ_arranger(QD_agent:QDmanager,qb:str,Z_guard:float=0.4):
     """
@@ -107,28 +109,42 @@ def Fq_z_coordinator(QD_agent:QDmanager,qb:str,IF:float,span:float,Z_guard:float
     eyeson_print(f"Total {len(meas_var)} pics for Flux vs. Fq exp.")
     return meas_var, z_pts
 
-    
-def mag_static_filter(x_array:ndarray,y_array:ndarray,mag_array:ndarray,threshold:float=3.0):
-    x_choosen = []
-    y_choosen = []
-    while True:
-        bottom_line = mean(mag_array) - threshold*std(mag_array)
-        for idx in range(x_array.shape[0]):
-            if mag_array[idx] > bottom_line:
-                x_choosen.append(x_array[idx])
-                y_choosen.append(y_array[idx])
-        if len(x_choosen) > 0 :
-            break
-        else:
-            if threshold != 0.5:
-                threshold -= 0.5
-            else:
-                print(f"No peaks are found in this Z interval: {x_array[0]}~{x_array[-1]} V")
-    
-    return x_choosen, y_choosen
 
+def FluxFqTrack_execution(QD_agent:QDmanager, meas_ctrl:MeasurementControl, Fctrl:dict, cluster:Cluster,target_q:str, re_n:int=500, z_pts:int=40, xy_if:float=100e6, Z_guard:float=0.4, **track):
+    """
+    The tracking mode of `FluxFqFit_execution`: the same Z range as the windows of `sweepZ_arranger` in `z_pts` biases, but only a narrow frequency window around
+    the prediction is measured at every bias by `Zgate_track_spec`. The first model is the qubFitParas if it was fitted, otherwise it's from the period and f01 at the sweet spot.\n
+    The found points go through `fq_fit` like the maps do, return True if the fitting failed.
+    """
+    ref_z = QD_agent.Fluxmanager.get_sweetBiasFor(target_q)
+    original_rof = QD_agent.quantum_device.get_element(target_q).clock_freqs.readout()
+    windows = sweepZ_arranger(QD_agent,target_q,Z_guard)
+    biases = ref_z + linspace(min([window[0] for window in windows]),max([window[-1] for window in windows]),z_pts)
+    fitting_popts = QD_agent.Fluxmanager.get_bias_dict()[target_q]["qubFitParas"]
+    if len(fitting_popts) == 0:
+        fitting_popts = initial_fq_paras(QD_agent.Fluxmanager.get_PeriodFor(target_q),ref_z,QD_agent.quantum_device.get_element(target_q).clock_freqs.f01())
+
+    cluster.reset()
+    Fctrl[target_q](ref_z)
+    result = Zgate_track_spec(QD_agent,meas_ctrl,target_q,biases,ref_z,fitting_popts,IF=xy_if,n_avg=re_n,**track)
+    reset_offset(Fctrl)
+    QD_agent.quantum_device.get_element(target_q).clock_freqs.readout(original_rof)
+
+    json_path = Data_manager().save_dict2json(QD_agent,{"x":result["bias"].tolist(),"y":result["fq"].tolist()},target_q,True)
+    try:
+        fq_fit(QD_agent,json_path,target_q,savefig_path=Data_manager().get_today_picFolder(),saveParas=True,plot=False,FitFilter_threshold=2.5)
+    except:
+        return True
+    return False
+
+    
 # main execute program
-def FluxFqFit_execution(QD_agent:QDmanager, meas_ctrl:MeasurementControl, Fctrl:dict, cluster:Cluster,target_q:str, run:bool=True, f_pts:int=30, re_n:int=500, peak_threshold:float=3):
+def FluxFqFit_execution(QD_agent:QDmanager, meas_ctrl:MeasurementControl, Fctrl:dict, cluster:Cluster,target_q:str, run:bool=True, f_pts:int=30, re_n:int=500, peak_threshold:float=3, track:dict={}):
+    """
+    * track: like {"z_pts":40,"window_Hz":30e6}, follow f01 by `FluxFqTrack_execution` instead of the full frequency x flux maps, {} for the maps.
+    """
+    if run and track != {}:
+        return FluxFqTrack_execution(QD_agent,meas_ctrl,Fctrl,cluster,target_q,re_n=re_n,**track)
     f_span = 500e6
     xy_if = 100e6
     failed = False
@@ -184,6 +200,7 @@ if __name__ == "__main__":
     DRandIP = {"dr":"dr3","last_ip":"13"}
     ro_elements = ['q0']
     couplers = ["c0"]
+    track:dict = {} # like {"z_pts":40,"window_Hz":30e6}, measure only around the predicted f01 at every bias instead of the full maps
 
 
     """ Preparations"""
@@ -200,7 +217,7 @@ if __name__ == "__main__":
         if QD_agent.Fluxmanager.get_offsweetspot_button(qubit): raise ValueError("m10 should be performed at sweet spot, now is deteced in off-sweetspot mode!")
         init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
     
-        error = FluxFqFit_execution(QD_agent, meas_ctrl, Fctrl, cluster, target_q=qubit, run=execution,peak_threshold=2)
+        error = FluxFqFit_execution(QD_agent, meas_ctrl, Fctrl, cluster, target_q=qubit, run=execution,peak_threshold=2,track=track)
         if error:
             fit_error.append(qubit)
 
@@ -8,12 +8,16 @@ from qcodes.parameters import ManualParameter
 from numpy import linspace, array, arange, NaN
 from Modularize.support import QDmanager, Data_manager, cds
 from quantify_scheduler.gettables import ScheduleGettable
+from Modularize.support.Q1ASMLoops import LoopedQ1ASMGettable
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr, meas_raw_dir
 from Modularize.support import init_meas, init_system_atte, shut_down, coupler_zctrl
 from Modularize.support.Pulse_schedule_library import Rabi_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array, Rabi_fit_analysis, Fit_analysis_plot
 from Modularize.analysis.RabiChevAna import plot_chevron
-def Rabi(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XY_amp:float=0.5, XY_duration:float=20e-9, IF:int=250e6,n_avg:int=300,points:int=100,run:bool=True,XY_theta:str='X_theta',Rabi_type:str='PowerRabi',q:str='q1',Experi_info:dict={},ref_IQ:list=[0,0],specific_data_folder:str=''):
+def Rabi(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XY_amp:float=0.5, XY_duration:float=20e-9, IF:int=250e6,n_avg:int=300,points:int=100,run:bool=True,XY_theta:str='X_theta',Rabi_type:str='PowerRabi',q:str='q1',Experi_info:dict={},ref_IQ:list=[0,0],specific_data_folder:str='',q1asm:bool=False):
+    """
+    * q1asm: run the sweep as register-looped Q1ASM (power Rabi only) by `LoopedQ1ASMGettable`, it falls back to quantify if the sweep can't be looped.
+    """
     analysis_result = {}
     sche_func= Rabi_sche
     qubit_info = QD_agent.quantum_device.get_element(q)
@@ -75,7 +79,7 @@ def Rabi(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XY_amp:float=0.5, XY_du
     
     
     if run:
-        gettable = ScheduleGettable(
+        gettable = (LoopedQ1ASMGettable if q1asm else ScheduleGettable)(
         QD_agent.quantum_device,
         schedule_function=sche_func,
         schedule_kwargs=sched_kwargs,
@@ -116,7 +120,7 @@ def Rabi(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XY_amp:float=0.5, XY_du
     return analysis_result
     
 
-def rabi_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,specific_qubits:str,XYamp_max:float=0.5,XYdura_max:float=20e-9,which_rabi:str='power',run:bool=True,pts:int=100,avg_times:int=500,data_folder:str=''):
+def rabi_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,specific_qubits:str,XYamp_max:float=0.5,XYdura_max:float=20e-9,which_rabi:str='power',run:bool=True,pts:int=100,avg_times:int=500,data_folder:str='',q1asm:bool=False):
     if which_rabi.lower() in ['p','power']:
         exp_type = 'powerRabi'
     elif which_rabi.lower() in ['t','time']:
@@ -129,7 +133,7 @@ def rabi_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementContro
     if run:
         
         Fctrl[specific_qubits](float(QD_agent.Fluxmanager.get_proper_zbiasFor(specific_qubits)))
-        Rabi_results = Rabi(QD_agent,meas_ctrl,Rabi_type=exp_type,q=specific_qubits,ref_IQ=QD_agent.refIQ[specific_qubits],run=True,XY_amp=XYamp_max,XY_duration=XYdura_max,points=pts,n_avg=avg_times,specific_data_folder=data_folder)
+        Rabi_results = Rabi(QD_agent,meas_ctrl,Rabi_type=exp_type,q=specific_qubits,ref_IQ=QD_agent.refIQ[specific_qubits],run=True,XY_amp=XYamp_max,XY_duration=XYdura_max,points=pts,n_avg=avg_times,specific_data_folder=data_folder,q1asm=q1asm)
         Fctrl[specific_qubits](0.0)
         
         cluster.reset()
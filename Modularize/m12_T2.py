@@ -5,17 +5,24 @@ from utils.tutorial_utils import show_args
 from qcodes.parameters import ManualParameter
 import matplotlib.pyplot as plt
 from Modularize.support.UserFriend import *
-from Modularize.support import QDmanager, Data_manager, cds
-from quantify_scheduler.gettables import ScheduleGettable
+from Modularize.support import QDmanager, Data_manager, cds, compose_para_for_multiplexing
+from Modularize.support.ScheduleCache import CachedScheduleGettable
+from Modularize.support.Q1ASMLoops import LoopedQ1ASMGettable
+from Modularize.support.AdaptiveDecay import AdaptiveDecayEstimator, run_adaptive
 from numpy import std, arange, array, average, mean, ndarray, pi
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support import init_meas, init_system_atte, shut_down, coupler_zctrl
-from Modularize.support.Pulse_schedule_library import Ramsey_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array, T2_fit_analysis, Fit_analysis_plot, Fit_T2_cali_analysis_plot, T1_fit_analysis
+from Modularize.support.Pulse_schedule_library import electrical_delay, point_cycles, sweep_wall_time, Ramsey_sche, multi_Ramsey_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array, split_multiplexed_dataset, T2_fit_analysis, Fit_analysis_plot, Fit_T2_cali_analysis_plot, T1_fit_analysis
 
 
-def Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,arti_detune:int=0,IF:int=250e6,n_avg:int=1000,points:int=101,run:bool=True,q='q1', ref_IQ:list=[0,0],Experi_info:dict={},exp_idx:int=0,data_folder:str='',spin:int=0, second_phase:str='x'):
-    
+def Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,arti_detune:int=0,IF:int=250e6,n_avg:int=1000,points:int=101,run:bool=True,q='q1', ref_IQ:list=[0,0],Experi_info:dict={},exp_idx:int=0,data_folder:str='',spin:int=0, second_phase:str='x',q1asm:bool=False,active_reset:dict={},fixed_relax:bool=False):
+    """
+    * fixed_relax: every point relaxes for reset + buffer before the first pi/2 pulse (see `Ramsey_sche`), so the reset doesn't need the padding by the free time.\n
+    * q1asm: run the sweep as register-looped Q1ASM by `LoopedQ1ASMGettable`, it falls back to quantify if the sweep can't be looped.
+    A Q1ASM wait can't be 0 ns, so the looped free times are 4 ns (8 ns with the echo) longer than `samples` which start from 0, see `lift_swept_waits`.\n
+    * active_reset: {"rounds":1,"relax":2e-6,"check":True} to replace the passive reset by the active reset in the looped Q1ASM (q1asm is turned on), {} for the passive reset.
+    """
     T2_us = {}
     analysis_result = {}
     Real_detune= {}
@@ -59,13 +66,19 @@ def Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,ar
         R_integration={str(q):qubit_info.measure.integration_time()},
         R_inte_delay=qubit_info.measure.acq_delay(),
         echo_pi_num=spin,
-        second_pulse_phase=second_phase
+        second_pulse_phase=second_phase,
+        fixed_relax=fixed_relax,
         )
     exp_kwargs= dict(sweep_freeDu=['start '+'%E' %samples[0],'end '+'%E' %samples[-1]],
                      f_xy='%E' %sched_kwargs['New_fxy'],
                      )
+    cycles = point_cycles(qubit_info.reset.duration(),samples,(2+spin)*qubit_info.rxy.duration()+electrical_delay,max(qubit_info.measure.pulse_duration(),qubit_info.measure.acq_delay()+qubit_info.measure.integration_time()),fixed_relax)
+    eyeson_print(f"Expected Ramsey time on the instruments: {round(sweep_wall_time(cycles,n_avg),2)} s ({round(cycles.mean()*1e6,1)} µs per shot)")
     if run:
-        gettable = ScheduleGettable(
+        if active_reset != {}:
+            q1asm = True
+            sched_kwargs["active_reset"] = active_reset
+        gettable = (LoopedQ1ASMGettable if q1asm else CachedScheduleGettable)(
             QD_agent.quantum_device,
             schedule_function=sche_func,
             schedule_kwargs=sched_kwargs,
@@ -80,6 +93,8 @@ def Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,ar
         
         
         ramsey_ds = meas_ctrl.run('Ramsey')
+        if active_reset != {}:
+            exp_kwargs["active_reset"] = gettable.reset_report
 
         # Save the raw data into netCDF
         Data_manager().save_raw_data(QD_agent=QD_agent,ds=ramsey_ds,label=exp_idx,qb=q,exp_type='T2',specific_dataFolder=data_folder)
@@ -90,12 +105,12 @@ def Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,ar
         
         try:
             if spin == 0:
-                data_fit= T2_fit_analysis(data=data,freeDu=samples,T2_guess=20e-6)
+                data_fit= T2_fit_analysis(data=data,freeDu=samples,T2_guess=20e-6,params_only=True)
                 phase = round(data_fit.attrs['phase']*180/pi,1)
                 T2_us[q] = data_fit.attrs['T2_fit']*1e6
                 Real_detune[q] = data_fit.attrs['f']
             else:
-                data_fit= T1_fit_analysis(data=data,freeDu=samples,T1_guess=40e-6)
+                data_fit= T1_fit_analysis(data=data,freeDu=samples,T1_guess=40e-6,params_only=True)
                 T2_us[q] = data_fit.attrs['T1_fit']*1e6
                 Real_detune[q] = 0
         except:
@@ -124,6 +139,138 @@ def Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,ar
     return analysis_result, T2_us, Real_detune
 
 
+def Ramsey_adaptive(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float,arti_detune:int=0,q='q1',rel_err:float=0.05,batch:int=10,max_points:int=200,n_avg:int=1000,IF:int=250e6,ref_IQ:list=[0,0],exp_idx:int=0,data_folder:str='',spin:int=0,second_phase:str='x',fixed_relax:bool=True):
+    """
+    Ramsey (spin echo when `spin` > 0) with the adaptive delays of `AdaptiveDecayEstimator`, the rounds go on until T2 is known within `rel_err` or `max_points` are visited.\n
+    The Ramsey starts from a uniform round to resolve the detuning, the spin echo is fitted as a decay like `Ramsey()` does.
+    The visited points are saved like a T2 dataset (x0, y0, y1) with the estimate in attrs. Return analysis_result, T2_us and Real_detune like `Ramsey()`.
+    """
+    qubit_info = QD_agent.quantum_device.get_element(q)
+    New_fxy= qubit_info.clock_freqs.f01()+arti_detune
+    set_LO_frequency(QD_agent.quantum_device,q=q,module_type='drive',LO_frequency=New_fxy+IF)
+    Para_free_Du = ManualParameter(name="free_Duration", unit="s", label="Time")
+    Para_free_Du.batched = True
+    sched_kwargs = dict(
+        q=q,
+        pi_amp={str(q):qubit_info.rxy.amp180()},
+        New_fxy=New_fxy,
+        freeduration=Para_free_Du,
+        pi_dura=qubit_info.rxy.duration(),
+        R_amp={str(q):qubit_info.measure.pulse_amp()},
+        R_duration={str(q):qubit_info.measure.pulse_duration()},
+        R_integration={str(q):qubit_info.measure.integration_time()},
+        R_inte_delay=qubit_info.measure.acq_delay(),
+        echo_pi_num=spin,
+        second_pulse_phase=second_phase,
+        fixed_relax=fixed_relax,
+        )
+    gettable = CachedScheduleGettable(
+        QD_agent.quantum_device,
+        schedule_function=Ramsey_sche,
+        schedule_kwargs=sched_kwargs,
+        real_imag=True,
+        batched=True,
+    )
+    QD_agent.quantum_device.cfg_sched_repetitions(n_avg)
+    meas_ctrl.gettables(gettable)
+    meas_ctrl.settables(Para_free_Du)
+
+    def measure(delays):
+        meas_ctrl.setpoints(delays)
+        I,Q= dataset_to_array(dataset=meas_ctrl.run('Ramsey adaptive'),dims=1)
+        return IQ_data_dis(I,Q,ref_I=ref_IQ[0],ref_Q=ref_IQ[-1]), array([I,Q])
+
+    # the echo splits the free time by 2*spin, so keep it on the 8 ns grid like `modify_time_point`
+    estimator = AdaptiveDecayEstimator('T2' if spin == 0 else 'T1',freeduration,rel_err=rel_err,batch=batch,max_points=max_points,guess=20e-6 if spin == 0 else 40e-6,resolution=4e-9 if spin == 0 else spin*8e-9)
+    result = run_adaptive(estimator,measure)
+    Data_manager().save_raw_data(QD_agent=QD_agent,ds=estimator.to_dataset(),label=exp_idx,qb=q,exp_type='T2',specific_dataFolder=data_folder)
+    T2 = result[estimator.model]
+    slightly_print(f"T2 = {round(T2*1e6,2)} µs +/- {round(result['rel_err']*100,1)} % by {result['delays'].shape[0]} points ({result['delays'].shape[0]*n_avg} shots)")
+    return {q:estimator.fit_record()}, {q:T2*1e6}, {q:result["params"].get("f",0)}
+
+
+def multi_Ramsey(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,IF:int=250e6,n_avg:int=1000,points:int=101,run:bool=True,exp_idx:int=0,data_folder:str='',spin:int=0,second_phase:str='x'):
+    """
+    Ramsey (spin echo when `spin` > 0) for all the qubits in `ro_elements` on the same feedline with one multiplexed schedule.\n
+    ### Args:\n
+    * ro_elements: {'q0':{"detune":0e6,"evoT":5e-6}, ...}, every qubit sweeps `points` free times up to its own evoT.\n
+    ### Returns:\n
+    analysis_result, T2_us and Real_detune, all are dicts keyed by the qubit names like `Ramsey()`.
+    """
+    T2_us = {}
+    analysis_result = {}
+    Real_detune= {}
+    qubits = list(ro_elements.keys())
+    sche_func= multi_Ramsey_sche
+    
+    samples, New_fxy = {}, {}
+    for q in qubits:
+        qubit_info = QD_agent.quantum_device.get_element(q)
+        New_fxy[q] = qubit_info.clock_freqs.f01()+ro_elements[q]["detune"]
+        set_LO_frequency(QD_agent.quantum_device,q=q,module_type='drive',LO_frequency=New_fxy[q]+IF)
+        gap = (ro_elements[q]["evoT"])*1e9 // points + (((ro_elements[q]["evoT"])*1e9 // points) %(4*(spin+1)))
+        samples[q] = modify_time_point(arange(points)*gap*1e-9, spin*8e-9 if spin >= 1 else 4e-9)
+    
+    Para_free_Du_idx = ManualParameter(name="free_Duration_idx", unit="", label="Index")
+    Para_free_Du_idx.batched = True
+    
+    sched_kwargs = dict(
+        freeduration=samples,
+        pi_amp={q:QD_agent.quantum_device.get_element(q).rxy.amp180() for q in qubits},
+        New_fxy=New_fxy,
+        pi_dura={q:QD_agent.quantum_device.get_element(q).rxy.duration() for q in qubits},
+        R_amp=compose_para_for_multiplexing(QD_agent,ro_elements,1),
+        R_duration=compose_para_for_multiplexing(QD_agent,ro_elements,3),
+        R_integration=compose_para_for_multiplexing(QD_agent,ro_elements,4),
+        R_inte_delay=compose_para_for_multiplexing(QD_agent,ro_elements,2),
+        echo_pi_num=spin,
+        second_pulse_phase=second_phase
+        )
+    
+    if run:
+        gettable = CachedScheduleGettable(
+            QD_agent.quantum_device,
+            schedule_function=sche_func,
+            schedule_kwargs=sched_kwargs,
+            real_imag=True,
+            batched=True,
+            num_channels=len(qubits),
+        )
+        QD_agent.quantum_device.cfg_sched_repetitions(n_avg)
+        meas_ctrl.gettables(gettable)
+        meas_ctrl.settables(Para_free_Du_idx)
+        meas_ctrl.setpoints(arange(points))
+        
+        ramsey_ds = meas_ctrl.run('multiplexing Ramsey')
+        
+        for q, q_ds in split_multiplexed_dataset(ramsey_ds,qubits,x0=samples).items():
+            # Save the raw data into netCDF for each qubit
+            Data_manager().save_raw_data(QD_agent=QD_agent,ds=q_ds,label=exp_idx,qb=q,exp_type='T2',specific_dataFolder=data_folder)
+            I,Q= dataset_to_array(dataset=q_ds,dims=1)
+            data= IQ_data_dis(I,Q,ref_I=QD_agent.refIQ[q][0],ref_Q=QD_agent.refIQ[q][-1])
+            try:
+                if spin == 0:
+                    data_fit= T2_fit_analysis(data=data,freeDu=samples[q],T2_guess=20e-6,params_only=True)
+                    T2_us[q] = data_fit.attrs['T2_fit']*1e6
+                    Real_detune[q] = data_fit.attrs['f']
+                else:
+                    data_fit= T1_fit_analysis(data=data,freeDu=samples[q],T1_guess=40e-6,params_only=True)
+                    T2_us[q] = data_fit.attrs['T1_fit']*1e6
+                    Real_detune[q] = 0
+            except:
+                warning_print(f"{q} T2 fitting error")
+                data_fit=[]
+                T2_us[q] = 0
+                Real_detune[q] = 0
+            analysis_result[q] = data_fit
+            show_args(dict(sweep_freeDu=['start '+'%E' %samples[q][0],'end '+'%E' %samples[q][-1]],f_xy='%E' %New_fxy[q]), title="Ramsey_kwargs: Meas.qubit="+q)
+    else:
+        sched_kwargs['freeduration']= {q:array([samples[q][0],samples[q][-1]]) for q in qubits}
+        pulse_preview(QD_agent.quantum_device,sche_func,sched_kwargs)
+    
+    return analysis_result, T2_us, Real_detune
+
+
 def modify_time_point(ary:ndarray,factor1:int, factor2:int=0):
     x = []
     for i in ary:
@@ -156,16 +303,24 @@ def modify_time_point(ary:ndarray,factor1:int, factor2:int=0):
     return array(x)
 
 
-def ramsey_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,specific_qubits:str,artificial_detune:float=0e6,freeDura:float=30e-6,ith:int=1,run:bool=True,specific_folder:str='',pts:int=100, avg_n:int=800, spin_echo:int=0, IF:float=250e6, second_phase:str='x'):
+def ramsey_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,specific_qubits:str,artificial_detune:float=0e6,freeDura:float=30e-6,ith:int=1,run:bool=True,specific_folder:str='',pts:int=100, avg_n:int=800, spin_echo:int=0, IF:float=250e6, second_phase:str='x',q1asm:bool=False,active_reset:dict={},fixed_relax:bool=True,adaptive:dict={}):
+    """
+    * fixed_relax: True keeps the reset and every point relaxes for reset + buffer, False pads the reset by `freeDura` for all the points like before.\n
+    * adaptive: {"rel_err":0.05,"batch":10,"max_points":200} to estimate T2 by `Ramsey_adaptive` instead of the `pts` linear grid, {} for the grid.
+    """
     if run:
         qubit_info = QD_agent.quantum_device.get_element(specific_qubits)
         ori_reset = qubit_info.reset.duration()
-        qubit_info.reset.duration(qubit_info.reset.duration()+freeDura)
+        if active_reset == {} and not fixed_relax:
+            qubit_info.reset.duration(qubit_info.reset.duration()+freeDura)
     
         slightly_print(f"The {ith}-th T2:")
         Fctrl[specific_qubits](float(QD_agent.Fluxmanager.get_proper_zbiasFor(specific_qubits)))
         
-        Ramsey_results, T2_us, average_actual_detune = Ramsey(QD_agent,meas_ctrl,arti_detune=artificial_detune,freeduration=freeDura,n_avg=avg_n,q=specific_qubits,ref_IQ=QD_agent.refIQ[specific_qubits],points=pts,run=True,exp_idx=ith,data_folder=specific_folder,spin=spin_echo,IF=IF,second_phase=second_phase)
+        if adaptive != {}:
+            Ramsey_results, T2_us, average_actual_detune = Ramsey_adaptive(QD_agent,meas_ctrl,freeDura,arti_detune=artificial_detune,q=specific_qubits,n_avg=avg_n,IF=IF,ref_IQ=QD_agent.refIQ[specific_qubits],exp_idx=ith,data_folder=specific_folder,spin=spin_echo,second_phase=second_phase,fixed_relax=fixed_relax,**adaptive)
+        else:
+            Ramsey_results, T2_us, average_actual_detune = Ramsey(QD_agent,meas_ctrl,arti_detune=artificial_detune,freeduration=freeDura,n_avg=avg_n,q=specific_qubits,ref_IQ=QD_agent.refIQ[specific_qubits],points=pts,run=True,exp_idx=ith,data_folder=specific_folder,spin=spin_echo,IF=IF,second_phase=second_phase,q1asm=q1asm,active_reset=active_reset,fixed_relax=fixed_relax)
         Fctrl[specific_qubits](0.0)
         
         cluster.reset()
@@ -178,6 +333,30 @@ def ramsey_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementCont
 
     return Ramsey_results, this_t2_us, average_actual_detune
 
+def multi_ramsey_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,ro_elements:dict,ith:int=1,run:bool=True,specific_folder:str='',pts:int=100, avg_n:int=800, spin_echo:int=0, IF:float=250e6, second_phase:str='x'):
+    """
+    Like `ramsey_executor` but for all the qubits in `ro_elements` at once, see `multi_Ramsey()`. Return Ramsey_results, a dict with the T2 in µs and a dict with the detunings.
+    """
+    if run:
+        ori_reset = {}
+        for q in ro_elements:
+            qubit_info = QD_agent.quantum_device.get_element(q)
+            ori_reset[q] = qubit_info.reset.duration()
+            qubit_info.reset.duration(qubit_info.reset.duration()+max([ro_elements[qb]["evoT"] for qb in ro_elements]))
+            Fctrl[q](float(QD_agent.Fluxmanager.get_proper_zbiasFor(q)))
+        
+        slightly_print(f"The {ith}-th multiplexing T2 for {list(ro_elements.keys())}:")
+        Ramsey_results, T2_us, average_actual_detune = multi_Ramsey(QD_agent,meas_ctrl,ro_elements,n_avg=avg_n,points=pts,run=True,exp_idx=ith,data_folder=specific_folder,spin=spin_echo,IF=IF,second_phase=second_phase)
+        for q in ro_elements:
+            Fctrl[q](0.0)
+            QD_agent.quantum_device.get_element(q).reset.duration(ori_reset[q])
+        cluster.reset()
+        
+    else:
+        Ramsey_results, _, average_actual_detune = multi_Ramsey(QD_agent,meas_ctrl,ro_elements,n_avg=1000,points=100,run=False,spin=spin_echo)
+        T2_us = {q:0 for q in ro_elements}
+
+    return Ramsey_results, T2_us, average_actual_detune
 
 
 
@@ -197,10 +376,30 @@ if __name__ == "__main__":
     time_data_points = 100
     avg_n = 1000
     xy_IF = 250e6
+    multiplexing:bool = 0 # 1 for all the qubits in ro_elements (on the same feedline) at once
+    active_reset:dict = {} # like {"rounds":1,"relax":2e-6}, it needs the calibrated acq_threshold and acq_rotation
+    adaptive:dict = {} # like {"rel_err":0.05}, pick the delays adaptively until T2 is known within rel_err
+
+
+    """ Multiplexing iteration """
+    for ith_histo in range(max([ro_elements[q]["histo_counts"] for q in ro_elements]) if multiplexing else 0):
+        start_time = time.time()
+        QD_path = find_latest_QD_pkl_for_dr(which_dr=DRandIP["dr"],ip_label=DRandIP["last_ip"])
+        QD_agent, cluster, meas_ctrl, ic, Fctrl = init_meas(QuantumDevice_path=QD_path,mode='l')
+        Cctrl = coupler_zctrl(DRandIP["dr"],cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
+        for qubit in ro_elements:
+            init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
+        ramsey_results, T2_us, average_actual_detune = multi_ramsey_executor(QD_agent,cluster,meas_ctrl,Fctrl,ro_elements,ith=ith_histo,run=execution,pts=time_data_points,spin_echo=spin_echo_pi_num,avg_n=avg_n,IF=xy_IF)
+        highlight_print(f"T2: {T2_us} µs")
+        if execution and max([ro_elements[q]["histo_counts"] for q in ro_elements]) == 1:
+            for qubit in ramsey_results:
+                Fit_analysis_plot(ramsey_results[qubit],P_rescale=False,Dis=None,spin_echo=True if spin_echo_pi_num ==1 else False)
+        shut_down(cluster,Fctrl,Cctrl)
+        slightly_print(f"time cost: {round(time.time()-start_time,1)} secs")
 
 
     """ Iteration """
-    for qubit in ro_elements:
+    for qubit in (ro_elements if not multiplexing else []):
         t2_us_rec = []
         for ith_histo in range(ro_elements[qubit]["histo_counts"]):
             start_time = time.time()
@@ -213,7 +412,7 @@ if __name__ == "__main__":
             Cctrl = coupler_zctrl(DRandIP["dr"],cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
             init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
             slightly_print(f"Ramsey with detuning = {round(ro_elements[qubit]['detune']*1e-6,2)} MHz")
-            ramsey_results, this_t2_us, average_actual_detune = ramsey_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,artificial_detune=ro_elements[qubit]["detune"],freeDura=ro_elements[qubit]["evoT"],ith=ith_histo,run=execution,pts=time_data_points,spin_echo=spin_echo_pi_num,avg_n=avg_n,IF=xy_IF)
+            ramsey_results, this_t2_us, average_actual_detune = ramsey_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,artificial_detune=ro_elements[qubit]["detune"],freeDura=ro_elements[qubit]["evoT"],ith=ith_histo,run=execution,pts=time_data_points,spin_echo=spin_echo_pi_num,avg_n=avg_n,IF=xy_IF,active_reset=active_reset,adaptive=adaptive)
             highlight_print(f"{qubit} XYF = {round(QD_agent.quantum_device.get_element(qubit).clock_freqs.f01()*1e-9,5)} GHz")
             if this_t2_us > 0:
                 t2_us_rec.append(this_t2_us)
@@ -5,15 +5,21 @@ from numpy import mean, array, arange, std
 from utils.tutorial_utils import show_args
 from Modularize.support.UserFriend import *
 from qcodes.parameters import ManualParameter
-from Modularize.support import QDmanager, Data_manager, multiples_of_x, cds
-from quantify_scheduler.gettables import ScheduleGettable
+from Modularize.support import QDmanager, Data_manager, multiples_of_x, cds, compose_para_for_multiplexing
+from Modularize.support.ScheduleCache import CachedScheduleGettable
+from Modularize.support.Q1ASMLoops import LoopedQ1ASMGettable
+from Modularize.support.AdaptiveDecay import AdaptiveDecayEstimator, run_adaptive
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support import init_meas, init_system_atte, shut_down, coupler_zctrl
-from Modularize.support.Pulse_schedule_library import mix_T1_sche, T1_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array, T1_fit_analysis, Fit_analysis_plot
-
-def T1(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float=80e-6,IF:int=150e6,n_avg:int=300,points:int=100,run:bool=True,q='q1',exp_idx:int=0, Experi_info:dict={},ref_IQ:list=[0,0],data_folder:str=''):
+from Modularize.support.Pulse_schedule_library import electrical_delay, point_cycles, sweep_wall_time, mix_T1_sche, T1_sche, multi_T1_sche, set_LO_frequency, pulse_preview, IQ_data_dis, dataset_to_array, split_multiplexed_dataset, T1_fit_analysis, Fit_analysis_plot
 
+def T1(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float=80e-6,IF:int=150e6,n_avg:int=300,points:int=100,run:bool=True,q='q1',exp_idx:int=0, Experi_info:dict={},ref_IQ:list=[0,0],data_folder:str='',q1asm:bool=False,active_reset:dict={},fixed_relax:bool=False):
+    """
+    * fixed_relax: every point relaxes for reset + buffer before the pi pulse (see `T1_sche`), so the reset doesn't need the padding by the free time.\n
+    * q1asm: run the sweep as register-looped Q1ASM by `LoopedQ1ASMGettable`, it falls back to quantify if the sweep can't be looped.\n
+    * active_reset: {"rounds":1,"relax":2e-6,"check":True} to replace the passive reset by the active reset in the looped Q1ASM (q1asm is turned on), {} for the passive reset.
+    """
     T1_us = {}
     analysis_result = {}
   
@@ -38,11 +44,17 @@ def T1(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float=80e-6,
         R_duration={str(q):qubit_info.measure.pulse_duration()},
         R_integration={str(q):qubit_info.measure.integration_time()},
         R_inte_delay=qubit_info.measure.acq_delay(),
+        fixed_relax=fixed_relax,
         )
     exp_kwargs= dict(sweep_freeDu=['start '+'%E' %samples[0],'end '+'%E' %samples[-1]],
                      )
+    cycles = point_cycles(qubit_info.reset.duration(),samples,qubit_info.rxy.duration()+electrical_delay,max(qubit_info.measure.pulse_duration(),qubit_info.measure.acq_delay()+qubit_info.measure.integration_time()),fixed_relax)
+    eyeson_print(f"Expected T1 time on the instruments: {round(sweep_wall_time(cycles,n_avg),2)} s ({round(cycles.mean()*1e6,1)} µs per shot)")
     if run:
-        gettable = ScheduleGettable(
+        if active_reset != {}:
+            q1asm = True
+            sched_kwargs["active_reset"] = active_reset
+        gettable = (LoopedQ1ASMGettable if q1asm else CachedScheduleGettable)(
             QD_agent.quantum_device,
             schedule_function=sche_func,
             schedule_kwargs=sched_kwargs,
@@ -55,13 +67,15 @@ def T1(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float=80e-6,
         meas_ctrl.setpoints(samples)
         
         T1_ds = meas_ctrl.run('T1')
+        if active_reset != {}:
+            exp_kwargs["active_reset"] = gettable.reset_report
         # Save the raw data into netCDF
         Data_manager().save_raw_data(QD_agent=QD_agent,ds=T1_ds,label=exp_idx,qb=q,exp_type='T1',specific_dataFolder=data_folder)
         
         I,Q= dataset_to_array(dataset=T1_ds,dims=1)
         data= IQ_data_dis(I,Q,ref_I=ref_IQ[0],ref_Q=ref_IQ[-1])
         if data_folder == '':
-            data_fit= T1_fit_analysis(data=data,freeDu=samples,T1_guess=1e-6)
+            data_fit= T1_fit_analysis(data=data,freeDu=samples,T1_guess=1e-6,params_only=True)
             T1_us[q] = data_fit.attrs['T1_fit']*1e6
         else:
             data_fit=[]
@@ -92,15 +106,67 @@ def T1(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float=80e-6,
     return analysis_result, T1_us
 
 
-def T1_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,specific_qubits:str,freeDura:float=30e-6,run:bool=True,specific_folder:str='',pts:int=100,ith:int=0,avg_times:int=500,IF:float=250e6):
+def T1_adaptive(QD_agent:QDmanager,meas_ctrl:MeasurementControl,freeduration:float=80e-6,q='q1',rel_err:float=0.05,batch:int=10,max_points:int=200,n_avg:int=300,IF:int=150e6,ref_IQ:list=[0,0],exp_idx:int=0,data_folder:str='',fixed_relax:bool=True):
+    """
+    T1 with the adaptive delays of `AdaptiveDecayEstimator`, the rounds go on until T1 is known within `rel_err` or `max_points` are visited.\n
+    The visited points are saved like a T1 dataset (x0, y0, y1) with the estimate in attrs. Return {q: FitRecord of the visited points}, {q: T1 in µs} and the estimator result.
+    """
+    qubit_info = QD_agent.quantum_device.get_element(q)
+    LO= qubit_info.clock_freqs.f01()+IF
+    set_LO_frequency(QD_agent.quantum_device,q=q,module_type='drive',LO_frequency=LO)
+    Para_free_Du = ManualParameter(name="free_Duration", unit="s", label="Time")
+    Para_free_Du.batched = True
+    sched_kwargs = dict(
+        q=q,
+        pi_amp={str(q):qubit_info.rxy.amp180()},
+        pi_dura=qubit_info.rxy.duration(),
+        freeduration=Para_free_Du,
+        R_amp={str(q):qubit_info.measure.pulse_amp()},
+        R_duration={str(q):qubit_info.measure.pulse_duration()},
+        R_integration={str(q):qubit_info.measure.integration_time()},
+        R_inte_delay=qubit_info.measure.acq_delay(),
+        fixed_relax=fixed_relax,
+        )
+    gettable = CachedScheduleGettable(
+        QD_agent.quantum_device,
+        schedule_function=T1_sche,
+        schedule_kwargs=sched_kwargs,
+        real_imag=True,
+        batched=True,
+        )
+    QD_agent.quantum_device.cfg_sched_repetitions(n_avg)
+    meas_ctrl.gettables(gettable)
+    meas_ctrl.settables(Para_free_Du)
+
+    def measure(delays):
+        meas_ctrl.setpoints(delays)
+        I,Q= dataset_to_array(dataset=meas_ctrl.run('T1 adaptive'),dims=1)
+        return IQ_data_dis(I,Q,ref_I=ref_IQ[0],ref_Q=ref_IQ[-1]), array([I,Q])
+
+    estimator = AdaptiveDecayEstimator('T1',freeduration,rel_err=rel_err,batch=batch,max_points=max_points)
+    result = run_adaptive(estimator,measure)
+    Data_manager().save_raw_data(QD_agent=QD_agent,ds=estimator.to_dataset(),label=exp_idx,qb=q,exp_type='T1',specific_dataFolder=data_folder)
+    slightly_print(f"T1 = {round(result['T1']*1e6,2)} µs +/- {round(result['rel_err']*100,1)} % by {result['delays'].shape[0]} points ({result['delays'].shape[0]*n_avg} shots)")
+    return {q:estimator.fit_record()}, {q:result['T1']*1e6}, result
+
+
+def T1_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,specific_qubits:str,freeDura:float=30e-6,run:bool=True,specific_folder:str='',pts:int=100,ith:int=0,avg_times:int=500,IF:float=250e6,q1asm:bool=False,active_reset:dict={},fixed_relax:bool=True,adaptive:dict={}):
+    """
+    * fixed_relax: True keeps the reset and every point relaxes for reset + buffer, False pads the reset by `freeDura` for all the points like before.\n
+    * adaptive: {"rel_err":0.05,"batch":10,"max_points":200} to estimate T1 by `T1_adaptive` instead of the `pts` linear grid, {} for the grid.
+    """
     if run:
         qubit_info = QD_agent.quantum_device.get_element(specific_qubits)
         ori_reset = qubit_info.reset.duration()
-        qubit_info.reset.duration(qubit_info.reset.duration()+freeDura)
+        if active_reset == {} and not fixed_relax:
+            qubit_info.reset.duration(qubit_info.reset.duration()+freeDura)
         
         slightly_print(f"The {ith}-th T1:")
         Fctrl[specific_qubits](float(QD_agent.Fluxmanager.get_proper_zbiasFor(specific_qubits)))
-        T1_results, T1_hist = T1(QD_agent,meas_ctrl,q=specific_qubits,freeduration=freeDura,ref_IQ=QD_agent.refIQ[specific_qubits],run=True,exp_idx=ith,data_folder=specific_folder,points=pts,n_avg=avg_times,IF=IF)
+        if adaptive != {}:
+            T1_results, T1_hist, _ = T1_adaptive(QD_agent,meas_ctrl,freeduration=freeDura,q=specific_qubits,n_avg=avg_times,IF=IF,ref_IQ=QD_agent.refIQ[specific_qubits],exp_idx=ith,data_folder=specific_folder,fixed_relax=fixed_relax,**adaptive)
+        else:
+            T1_results, T1_hist = T1(QD_agent,meas_ctrl,q=specific_qubits,freeduration=freeDura,ref_IQ=QD_agent.refIQ[specific_qubits],run=True,exp_idx=ith,data_folder=specific_folder,points=pts,n_avg=avg_times,IF=IF,q1asm=q1asm,active_reset=active_reset,fixed_relax=fixed_relax)
         Fctrl[specific_qubits](0.0)
         cluster.reset()
         this_t1_us = T1_hist[specific_qubits]
@@ -115,6 +181,103 @@ def T1_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,
     
     return T1_results, this_t1_us
 
+def multi_T1(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,IF:int=150e6,n_avg:int=300,points:int=100,run:bool=True,exp_idx:int=0,data_folder:str=''):
+    """
+    T1 for all the qubits in `ro_elements` on the same feedline with one multiplexed schedule.\n
+    ### Args:\n
+    * ro_elements: {'q0':{"evoT":5e-6}, 'q1':{"evoT":30e-6}, ...}, every qubit sweeps `points` free times up to its own evoT.\n
+    ### Returns:\n
+    analysis_result and T1_us, both are dicts keyed by the qubit names like `T1()`.
+    """
+    T1_us = {}
+    analysis_result = {}
+    qubits = list(ro_elements.keys())
+    sche_func= multi_T1_sche
+    
+    samples = {}
+    for q in qubits:
+        qubit_info = QD_agent.quantum_device.get_element(q)
+        LO= qubit_info.clock_freqs.f01()+IF
+        set_LO_frequency(QD_agent.quantum_device,q=q,module_type='drive',LO_frequency=LO)
+        gap = (ro_elements[q]["evoT"]*1e9 // points) + ((ro_elements[q]["evoT"]*1e9 // points)%4)
+        samples[q] = arange(points)*gap*1e-9
+    
+    Para_free_Du_idx = ManualParameter(name="free_Duration_idx", unit="", label="Index")
+    Para_free_Du_idx.batched = True
+
+    sched_kwargs = dict(
+        freeduration=samples,
+        pi_amp={q:QD_agent.quantum_device.get_element(q).rxy.amp180() for q in qubits},
+        pi_dura={q:QD_agent.quantum_device.get_element(q).rxy.duration() for q in qubits},
+        R_amp=compose_para_for_multiplexing(QD_agent,ro_elements,1),
+        R_duration=compose_para_for_multiplexing(QD_agent,ro_elements,3),
+        R_integration=compose_para_for_multiplexing(QD_agent,ro_elements,4),
+        R_inte_delay=compose_para_for_multiplexing(QD_agent,ro_elements,2),
+        )
+    
+    if run:
+        gettable = CachedScheduleGettable(
+            QD_agent.quantum_device,
+            schedule_function=sche_func,
+            schedule_kwargs=sched_kwargs,
+            real_imag=True,
+            batched=True,
+            num_channels=len(qubits),
+            )
+        QD_agent.quantum_device.cfg_sched_repetitions(n_avg)
+        meas_ctrl.gettables(gettable)
+        meas_ctrl.settables(Para_free_Du_idx)
+        meas_ctrl.setpoints(arange(points))
+        
+        T1_ds = meas_ctrl.run('multiplexing T1')
+        
+        for q, q_ds in split_multiplexed_dataset(T1_ds,qubits,x0=samples).items():
+            # Save the raw data into netCDF for each qubit
+            Data_manager().save_raw_data(QD_agent=QD_agent,ds=q_ds,label=exp_idx,qb=q,exp_type='T1',specific_dataFolder=data_folder)
+            I,Q= dataset_to_array(dataset=q_ds,dims=1)
+            data= IQ_data_dis(I,Q,ref_I=QD_agent.refIQ[q][0],ref_Q=QD_agent.refIQ[q][-1])
+            if data_folder == '':
+                data_fit= T1_fit_analysis(data=data,freeDu=samples[q],T1_guess=1e-6,params_only=True)
+                T1_us[q] = data_fit.attrs['T1_fit']*1e6
+            else:
+                data_fit=[]
+                T1_us[q] = 0
+            analysis_result[q] = data_fit
+            show_args(dict(sweep_freeDu=['start '+'%E' %samples[q][0],'end '+'%E' %samples[q][-1]]), title="T1_kwargs: Meas.qubit="+q)
+    else:
+        n_s = 2
+        sched_kwargs['freeduration']= {q:samples[q][:n_s] for q in qubits}
+        pulse_preview(QD_agent.quantum_device,sche_func,sched_kwargs)
+    
+    return analysis_result, T1_us
+
+
+def multi_T1_executor(QD_agent:QDmanager,cluster:Cluster,meas_ctrl:MeasurementControl,Fctrl:dict,ro_elements:dict,run:bool=True,specific_folder:str='',pts:int=100,ith:int=0,avg_times:int=500,IF:float=250e6):
+    """
+    Like `T1_executor` but for all the qubits in `ro_elements` at once, see `multi_T1()`. Return T1_results and a dict with the T1 in µs for each qubit.
+    """
+    if run:
+        ori_reset = {}
+        for q in ro_elements:
+            qubit_info = QD_agent.quantum_device.get_element(q)
+            ori_reset[q] = qubit_info.reset.duration()
+            qubit_info.reset.duration(qubit_info.reset.duration()+max([ro_elements[qb]["evoT"] for qb in ro_elements]))
+            Fctrl[q](float(QD_agent.Fluxmanager.get_proper_zbiasFor(q)))
+        
+        slightly_print(f"The {ith}-th multiplexing T1 for {list(ro_elements.keys())}:")
+        T1_results, T1_hist = multi_T1(QD_agent,meas_ctrl,ro_elements,run=True,exp_idx=ith,data_folder=specific_folder,points=pts,n_avg=avg_times,IF=IF)
+        for q in ro_elements:
+            Fctrl[q](0.0)
+            QD_agent.quantum_device.get_element(q).reset.duration(ori_reset[q])
+        cluster.reset()
+        slightly_print(f"T1: {T1_hist} µs")
+        
+    else:
+        T1_results, T1_hist = multi_T1(QD_agent,meas_ctrl,ro_elements,run=False,exp_idx=ith,data_folder=specific_folder,points=pts)
+        T1_hist = {q:0 for q in ro_elements}
+
+    return T1_results, T1_hist
+
 if __name__ == "__main__":
     
 
@@ -131,10 +294,29 @@ if __name__ == "__main__":
     time_data_points = 100
     avg_n = 1000
     xy_IF = 250e6
+    multiplexing:bool = 0 # 1 for all the qubits in ro_elements (on the same feedline) at once
+    active_reset:dict = {} # like {"rounds":1,"relax":2e-6}, it needs the calibrated acq_threshold and acq_rotation
+    adaptive:dict = {} # like {"rel_err":0.05}, pick the delays adaptively until T1 is known within rel_err
   
 
+    """ Multiplexing iterations """
+    for ith_histo in range(max([ro_elements[q]["histo_counts"] for q in ro_elements]) if multiplexing else 0):
+        every_start = time.time()
+        QD_path = find_latest_QD_pkl_for_dr(which_dr=DRandIP["dr"],ip_label=DRandIP["last_ip"])
+        QD_agent, cluster, meas_ctrl, ic, Fctrl = init_meas(QuantumDevice_path=QD_path,mode='l')
+        Cctrl = coupler_zctrl(DRandIP["dr"],cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
+        for qubit in ro_elements:
+            init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
+        T1_results, T1_hist = multi_T1_executor(QD_agent,cluster,meas_ctrl,Fctrl,ro_elements,run=execution,ith=ith_histo,avg_times=avg_n,pts=time_data_points,IF=xy_IF)
+        if execution and ith_histo == 0 and max([ro_elements[q]["histo_counts"] for q in ro_elements]) == 1:
+            for qubit in T1_results:
+                Fit_analysis_plot(T1_results[qubit],P_rescale=False,Dis=None)
+        shut_down(cluster,Fctrl,Cctrl)
+        slightly_print(f"time cost: {round(time.time()-every_start,1)} secs")
+
+
     """ Iterations """
-    for qubit in ro_elements:
+    for qubit in (ro_elements if not multiplexing else []):
 
         t1_us_rec = []
         for ith_histo in range(ro_elements[qubit]["histo_counts"]):
@@ -149,7 +331,7 @@ if __name__ == "__main__":
             init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
             evoT = ro_elements[qubit]["evoT"]
 
-            T1_results, this_t1_us = T1_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,freeDura=evoT,run=execution,ith=ith_histo,avg_times=avg_n,pts=time_data_points,IF=xy_IF)
+            T1_results, this_t1_us = T1_executor(QD_agent,cluster,meas_ctrl,Fctrl,qubit,freeDura=evoT,run=execution,ith=ith_histo,avg_times=avg_n,pts=time_data_points,IF=xy_IF,active_reset=active_reset,adaptive=adaptive)
             t1_us_rec.append(this_t1_us)
 
 
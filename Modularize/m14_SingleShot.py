@@ -6,12 +6,15 @@ from utils.tutorial_utils import show_args
 from Modularize.support.UserFriend import *
 from qcodes.parameters import ManualParameter
 from numpy import array, linspace, median, std
-from quantify_scheduler.gettables import ScheduleGettable
+from Modularize.support.ScheduleCache import CachedScheduleGettable
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support.Pulse_schedule_library import Qubit_state_single_shot_plot
-from Modularize.support import QDmanager, Data_manager,init_system_atte, init_meas, shut_down, coupler_zctrl
-from Modularize.support.Pulse_schedule_library import Qubit_SS_sche, set_LO_frequency, pulse_preview, Qubit_state_single_shot_fit_analysis
+from Modularize.support import QDmanager, Data_manager,init_system_atte, init_meas, shut_down, coupler_zctrl, compose_para_for_multiplexing
+from Modularize.support.Pulse_schedule_library import Qubit_SS_sche, multi_Qubit_SS_sche, Qubit_SS_interleaved_sche, interleaved_states, active_reset_summary, set_LO_frequency, pulse_preview, Qubit_state_single_shot_fit_analysis
+from Modularize.support.Pulse_schedule_library import split_thresholded, ThresholdedAcquisition
+from Modularize.support.DiscriminatorCache import thresholded_acq_settings, effective_temperature_mK, QD_registry, readout_config
+from Modularize.support.StreamingShots import stream_single_shots
 
 
 try:
@@ -23,8 +26,27 @@ except:
     mode = "WeiEn"
 
 
-def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:str='q1',IF:float=250e6,Experi_info:dict={},ro_amp_factor:float=1,T1:float=15e-6,exp_idx:int=0,parent_datafolder:str='',plot:bool=False):
+def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:str='q1',IF:float=250e6,Experi_info:dict={},ro_amp_factor:float=1,T1:float=15e-6,exp_idx:int=0,parent_datafolder:str='',plot:bool=False,interleave:bool=True,active_reset:dict={},thresholded:bool=False,stream_batch:int=0):
+    """
+    * interleave: every repetition prepares |g> then |e> in one schedule, so both states are shot in one run with the same drift. False for the former 2 runs.\n
+    * active_reset: {"rounds":1,"relax":2e-6} to replace the passive reset by ConditionalReset (see `Qubit_reset`), it needs the calibrated acq_threshold and acq_rotation. {} for the passive reset.
+    Its thresholded readouts can't be in one schedule with the IQ shots, so it only works with `thresholded` and the passive reset is used for the IQ shots.\n
+    * thresholded: the instrument discriminates the shots by the rotation and threshold of the discriminator kept for the current readout (see `DiscriminatorCache`),
+    the instrument returns the state bit of every shot, they are averaged into the |1> populations of |g> and |e> which are saved instead of the IQ of every shot. It takes the IQ shots and trains the discriminator with them if there isn't one yet.\n
+    * stream_batch: if 0 < stream_batch < shots, the IQ shots are taken in batches of it and appended to the nc file batch by batch (see `StreamingShots`),
+    the discriminator kept for the current readout (or trained on the first batch) gives the running populations instead of the built-in analysis.
+    """
     qubit_info = QD_agent.quantum_device.get_element(q)
+    thresholded_settings = {}
+    if thresholded:
+        if ThresholdedAcquisition is None:
+            warning_print("ThresholdedAcquisition isn't available in this quantify-scheduler, take the IQ shots.")
+        else:
+            thresholded_settings = thresholded_acq_settings(QD_agent,q)
+    if active_reset != {} and thresholded_settings == {}:
+        warning_print("The active reset works with the thresholded shots only, take the IQ shots with the passive reset.")
+        active_reset = {}
+    reset_rounds = int(active_reset.get("rounds",1))
     print("Integration time ",qubit_info.measure.integration_time()*1e6, "µs")
     print("Reset time ", qubit_info.reset.duration()*1e6, "µs")
     
@@ -42,7 +64,7 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
     exp_kwargs= dict(shots=shots,
                      )
     print(qubit_info.rxy.amp180())
-    def state_dep_sched(ini_state:str):
+    def state_dep_sched(ini_state:str,reps:int=shots):
         slightly_print(f"Shotting for |{ini_state}>")
         sched_kwargs = dict(   
             q=q,
@@ -53,18 +75,22 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
             R_duration={str(q):qubit_info.measure.pulse_duration()},
             R_integration={str(q):qubit_info.measure.integration_time()},
             R_inte_delay=qubit_info.measure.acq_delay(),
+            active_reset=active_reset,
+            thresholded=thresholded_settings,
         )
         
         if run:
-            gettable = ScheduleGettable(
+            gettable = CachedScheduleGettable(
                 QD_agent.quantum_device,
                 schedule_function=sche_func, 
                 schedule_kwargs=sched_kwargs,
                 real_imag=True,
                 batched=True,
             )
-            QD_agent.quantum_device.cfg_sched_repetitions(shots)
-            ss_ds= gettable.get()
+            QD_agent.quantum_device.cfg_sched_repetitions(reps)
+            ss_ds, reset_IQ = split_thresholded(gettable.get(),1,reset_rounds) if thresholded_settings != {} else (list(gettable.get()), [])
+            if active_reset != {}:
+                exp_kwargs[f"active_reset_{ini_state}"] = active_reset_summary(qubit_info,active_reset,reset_IQ)
             
             data[ini_state] = ss_ds
             show_args(exp_kwargs, title="Single_shot_kwargs: Meas.qubit="+q)
@@ -78,17 +104,88 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
             if Experi_info != {}:
                 show_args(Experi_info(q))
             
+    def interleaved_sched(reps:int=shots):
+        slightly_print(f"Shotting for |g> and |e> interleaved")
+        sched_kwargs = dict(   
+            q=q,
+            pi_amp={str(q):qubit_info.rxy.amp180()*1},
+            pi_dura={str(q):qubit_info.rxy.duration()},
+            R_amp={str(q):qubit_info.measure.pulse_amp()},
+            R_duration={str(q):qubit_info.measure.pulse_duration()},
+            R_integration={str(q):qubit_info.measure.integration_time()},
+            R_inte_delay=qubit_info.measure.acq_delay(),
+            active_reset=active_reset,
+            thresholded=thresholded_settings,
+        )
+        
+        if run:
+            gettable = CachedScheduleGettable(
+                QD_agent.quantum_device,
+                schedule_function=Qubit_SS_interleaved_sche, 
+                schedule_kwargs=sched_kwargs,
+                real_imag=True,
+                batched=True,
+            )
+            QD_agent.quantum_device.cfg_sched_repetitions(reps)
+            if thresholded_settings != {}:
+                ss_ds, reset_IQ = split_thresholded(gettable.get(),len(interleaved_states),reset_rounds)
+            else:
+                ss_ds, reset_IQ = list(gettable.get()), []
+            if active_reset != {}:
+                exp_kwargs["active_reset"] = active_reset_summary(qubit_info,active_reset,reset_IQ)
+            # [I_g, Q_g, I_e, Q_e] in the acq_channel order, or [p1_g, p1_e] thresholded
+            for idx, ini_state in enumerate(interleaved_states):
+                data[ini_state] = ss_ds[idx:idx+1] if thresholded_settings != {} else ss_ds[2*idx:2*idx+2]
+            show_args(exp_kwargs, title="Single_shot_kwargs: Meas.qubit="+q)
+            if Experi_info != {}:
+                show_args(Experi_info(q))
+    
+        else:
+            pulse_preview(QD_agent.quantum_device,Qubit_SS_interleaved_sche,sched_kwargs)
+            
+            show_args(exp_kwargs, title="Single_shot_kwargs: Meas.qubit="+q)
+            if Experi_info != {}:
+                show_args(Experi_info(q))
+
     tau= qubit_info.measure.integration_time()        
-    state_dep_sched('g')
-    state_dep_sched('e')
-    SS_dict = {
-        "e":{"dims":("I","Q"),"data":array(data['e'])},
-        "g":{"dims":("I","Q"),"data":array(data['g'])},
-    }
+    if run and 0 < stream_batch < shots and thresholded_settings == {}:
+        def acquire(reps:int)->dict:
+            if interleave:
+                interleaved_sched(reps)
+            else:
+                state_dep_sched('g',reps)
+                state_dep_sched('e',reps)
+            return {"g":data.pop('g'),"e":data.pop('e')}
+        registry = QD_registry(QD_agent)
+        nc_path, summary = stream_single_shots(acquire, shots, stream_batch,
+                                               save=lambda SS_ds: Data_manager().save_raw_data(QD_agent=QD_agent,ds=SS_ds,qb=q,exp_type='ss',label=exp_idx,specific_dataFolder=parent_datafolder,get_data_loc=True),
+                                               train=lambda g_IQ, e_IQ: registry.get_or_train(q,readout_config(QD_agent,q),g_IQ,e_IQ))
+        analysis_result[q] = {"streamed":summary}
+        return analysis_result, nc_path
+    if interleave:
+        interleaved_sched()
+    else:
+        state_dep_sched('g')
+        state_dep_sched('e')
+    if thresholded_settings != {}:
+        SS_dict = {
+            "coords":{},
+            "data_vars":{"e":{"dims":("excited_pop",),"data":array(data['e'])},"g":{"dims":("excited_pop",),"data":array(data['g'])}},
+            "attrs":{"thresholded":1,"shots":int(shots),"acq_rotation":thresholded_settings["rotation"],"acq_threshold":thresholded_settings["threshold"]},
+        }
+    else:
+        SS_dict = {
+            "e":{"dims":("I","Q"),"data":array(data['e'])},
+            "g":{"dims":("I","Q"),"data":array(data['g'])},
+        }
     
     SS_ds = Dataset.from_dict(SS_dict)
     nc_path = Data_manager().save_raw_data(QD_agent=QD_agent,ds=SS_ds,qb=q,exp_type='ss',label=exp_idx,specific_dataFolder=parent_datafolder,get_data_loc=True)
-    if mode == "WeiEn" and plot: 
+    if thresholded and thresholded_settings == {} and run:
+        QD_registry(QD_agent).get_or_train(q,readout_config(QD_agent,q),data['g'],data['e'])
+    if thresholded_settings != {}:
+        analysis_result[q] = {"thresholded":{"g":data['g'][0],"e":data['e'][0]}}
+    elif mode == "WeiEn" and plot: 
         slightly_print("under built-in analysis...")
         analysis_result[q] = Qubit_state_single_shot_fit_analysis(data,T1=T1,tau=tau) 
     else:
@@ -96,7 +193,73 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
     return analysis_result, nc_path
 
 
-def SS_executor(QD_agent:QDmanager,cluster:Cluster,Fctrl:dict,target_q:str,shots:int=10000,execution:bool=True,data_folder='',plot:bool=True,roAmp_modifier:float=1,exp_label:int=0,save_every_pic:bool=False,IF:float=250e6):
+def multi_Qubit_state_single_shot(QD_agent:QDmanager,ro_elements:dict,shots:int=1000,run:bool=True,IF:float=250e6,T1:dict={},exp_idx:int=0,parent_datafolder:str='',plot:bool=False):
+    """
+    Single shot for all the qubits in `ro_elements` on the same feedline, |g> and |e> are both shot with one multiplexed schedule.\n
+    The data of each qubit is saved into its own nc file like `Qubit_state_single_shot()` does.\n
+    ### Returns:\n
+    analysis_result and nc_paths, both are dicts keyed by the qubit names.
+    """
+    qubits = list(ro_elements.keys())
+    sche_func = multi_Qubit_SS_sche
+    for q in qubits:
+        qubit_info = QD_agent.quantum_device.get_element(q)
+        set_LO_frequency(QD_agent.quantum_device,q=q,module_type='drive',LO_frequency=qubit_info.clock_freqs.f01()+IF)
+    data = {}
+    analysis_result, nc_paths = {}, {}
+
+    def state_dep_sched(ini_state:str):
+        slightly_print(f"Shotting for |{ini_state}> on {qubits}")
+        sched_kwargs = dict(
+            ini_state=ini_state,
+            pi_amp={q:QD_agent.quantum_device.get_element(q).rxy.amp180() for q in qubits},
+            pi_dura={q:QD_agent.quantum_device.get_element(q).rxy.duration() for q in qubits},
+            R_amp=compose_para_for_multiplexing(QD_agent,ro_elements,1),
+            R_duration=compose_para_for_multiplexing(QD_agent,ro_elements,3),
+            R_integration=compose_para_for_multiplexing(QD_agent,ro_elements,4),
+            R_inte_delay=compose_para_for_multiplexing(QD_agent,ro_elements,2),
+        )
+        if run:
+            gettable = CachedScheduleGettable(
+                QD_agent.quantum_device,
+                schedule_function=sche_func,
+                schedule_kwargs=sched_kwargs,
+                real_imag=True,
+                batched=True,
+                num_channels=len(qubits),
+            )
+            QD_agent.quantum_device.cfg_sched_repetitions(shots)
+            # [I_q0, Q_q0, I_q1, Q_q1, ...]
+            data[ini_state] = array(gettable.get())
+        else:
+            pulse_preview(QD_agent.quantum_device,sche_func,sched_kwargs)
+
+    state_dep_sched('g')
+    state_dep_sched('e')
+    if not run:
+        return analysis_result, nc_paths
+    
+    for idx, q in enumerate(qubits):
+        q_data = {"e":data['e'][2*idx:2*idx+2],"g":data['g'][2*idx:2*idx+2]}
+        SS_ds = Dataset.from_dict({
+            "e":{"dims":("I","Q"),"data":q_data['e']},
+            "g":{"dims":("I","Q"),"data":q_data['g']},
+        })
+        nc_paths[q] = Data_manager().save_raw_data(QD_agent=QD_agent,ds=SS_ds,qb=q,exp_type='ss',label=exp_idx,specific_dataFolder=parent_datafolder,get_data_loc=True)
+        if mode == "WeiEn" and plot:
+            slightly_print(f"{q} under built-in analysis...")
+            analysis_result[q] = Qubit_state_single_shot_fit_analysis(q_data,T1=T1[q] if q in T1 else 15e-6,tau=QD_agent.quantum_device.get_element(q).measure.integration_time())
+        else:
+            analysis_result[q] = []
+    return analysis_result, nc_paths
+
+
+def SS_executor(QD_agent:QDmanager,cluster:Cluster,Fctrl:dict,target_q:str,shots:int=10000,execution:bool=True,data_folder='',plot:bool=True,roAmp_modifier:float=1,exp_label:int=0,save_every_pic:bool=False,IF:float=250e6,active_reset:dict={},cache_discriminator:bool=False,thresholded:bool=False,stream_batch:int=0):
+    """
+    Return (thermal_p, effT_mk, ro_fidelity).\n
+    * thresholded: take the |1> populations by the instrument's thresholded acquisition, see `Qubit_state_single_shot`.\n
+    * stream_batch: stream the shots over it in batches of it, see `Qubit_state_single_shot`.
+    """
 
     Fctrl[target_q](float(QD_agent.Fluxmanager.get_proper_zbiasFor(target_q)))
 
@@ -108,23 +271,53 @@ def SS_executor(QD_agent:QDmanager,cluster:Cluster,Fctrl:dict,target_q:str,shots
                 ro_amp_factor=roAmp_modifier,
                 exp_idx=exp_label,
                 plot=plot,
-                IF=IF)
+                IF=IF,
+                active_reset=active_reset,
+                thresholded=thresholded,
+                stream_batch=stream_batch)
     Fctrl[target_q](0.0)
     cluster.reset()
     
     
-    if mode == "WeiEn":
+    if isinstance(SS_result[target_q], dict) and ("thresholded" in SS_result[target_q] or "streamed" in SS_result[target_q]):
+        pops = SS_result[target_q]["thresholded"] if "thresholded" in SS_result[target_q] else SS_result[target_q]["streamed"]["p1"]
+        thermal_p, ro_fidelity = pops['g'], (1-pops['g']+pops['e'])*100/2
+        effT_mk = effective_temperature_mK(thermal_p, QD_agent.quantum_device.get_element(target_q).clock_freqs.f01())
+    elif mode == "WeiEn":
         if plot:
             Qubit_state_single_shot_plot(SS_result[target_q],Plot_type='both',y_scale='log')
             effT_mk, ro_fidelity, thermal_p = 0, 0, 0
         else:
             effT_mk, ro_fidelity, thermal_p = 0, 0, 0
     else:
-        thermal_p, effT_mk, ro_fidelity = a_OSdata_analPlot(QD_agent,target_q,nc,plot,save_pic=save_every_pic)
+        thermal_p, effT_mk, ro_fidelity = a_OSdata_analPlot(QD_agent,target_q,nc,plot,save_pic=save_every_pic,cache_discriminator=cache_discriminator)
 
 
     return thermal_p, effT_mk, ro_fidelity
 
+def multi_SS_executor(QD_agent:QDmanager,cluster:Cluster,Fctrl:dict,ro_elements:dict,shots:int=10000,execution:bool=True,data_folder='',plot:bool=True,exp_label:int=0,save_every_pic:bool=False,IF:float=250e6,cache_discriminator:bool=False)->dict:
+    """
+    Like `SS_executor` but for all the qubits in `ro_elements` at once, see `multi_Qubit_state_single_shot()`.\n
+    Return a dict like {'q0':(thermal_p, effT_mk, ro_fidelity), ...}.
+    """
+    for q in ro_elements:
+        Fctrl[q](float(QD_agent.Fluxmanager.get_proper_zbiasFor(q)))
+    SS_result, ncs = multi_Qubit_state_single_shot(QD_agent,ro_elements,shots=shots,run=execution,parent_datafolder=data_folder,exp_idx=exp_label,plot=plot,IF=IF)
+    for q in ro_elements:
+        Fctrl[q](0.0)
+    cluster.reset()
+
+    infos = {}
+    for q in ncs:
+        if mode == "WeiEn":
+            if plot:
+                Qubit_state_single_shot_plot(SS_result[q],Plot_type='both',y_scale='log')
+            infos[q] = (0, 0, 0)
+        else:
+            infos[q] = a_OSdata_analPlot(QD_agent,q,ncs[q],plot,save_pic=save_every_pic,cache_discriminator=cache_discriminator)
+
+    return infos
+
 if __name__ == '__main__':
     
 
@@ -140,12 +333,32 @@ if __name__ == '__main__':
     ro_atte_degrade_dB:int = 0 # multiple of 2 
     shot_num:int = 10000
     xy_IF = 250e6
-
+    multiplexing:bool = 0 # 1 for all the qubits in ro_elements (on the same feedline) at once
+    active_reset:dict = {} # like {"rounds":1,"relax":2e-6}, it needs the calibrated acq_threshold and acq_rotation
+    thresholded:bool = False # only the |1> populations by the thresholded acquisition, the discriminator of the last IQ single shot is used
+    stream_batch:int = 0 # like 50000 for 1e6+ shots, the shots are appended to the nc file batch by batch
 
 
     """ Iteration """
     snr_rec, effT_rec, thermal_pop = {}, {}, {}
-    for qubit in ro_elements:
+    for i in range(repeat if multiplexing else 0):
+        start_time = time.time()
+        QD_path = find_latest_QD_pkl_for_dr(which_dr=DRandIP["dr"],ip_label=DRandIP["last_ip"])
+        QD_agent, cluster, meas_ctrl, ic, Fctrl = init_meas(QuantumDevice_path=QD_path,mode='l')
+        Cctrl = coupler_zctrl(DRandIP["dr"],cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
+        for qubit in ro_elements:
+            init_system_atte(QD_agent.quantum_device,list([qubit]),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'))
+        infos = multi_SS_executor(QD_agent,cluster,Fctrl,ro_elements,execution=execute,shots=shot_num,plot=True if repeat ==1 else False,exp_label=i,IF=xy_IF,cache_discriminator=repeat > 1)
+        for qubit in infos:
+            if i == 0:
+                snr_rec[qubit], effT_rec[qubit], thermal_pop[qubit] = [], [], []
+            snr_rec[qubit].append(infos[qubit][2])
+            effT_rec[qubit].append(infos[qubit][1])
+            thermal_pop[qubit].append(infos[qubit][0]*100)
+        shut_down(cluster,Fctrl,Cctrl)
+        slightly_print(f"time cose: {round(time.time()-start_time,1)} secs")
+
+    for qubit in (ro_elements if not multiplexing else []):
         for i in range(repeat):
             start_time = time.time()
 
@@ -163,7 +376,7 @@ if __name__ == '__main__':
             init_system_atte(QD_agent.quantum_device,list([qubit]),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'))
             ro_amp_scaling = ro_elements[qubit]["roAmp_factor"]
             if ro_amp_scaling != 1 and repeat > 1 : raise ValueError("Check the RO_amp_factor should be 1 when you want to repeat it!")
-            info = SS_executor(QD_agent,cluster,Fctrl,qubit,execution=execute,shots=shot_num,roAmp_modifier=ro_amp_scaling,plot=True if repeat ==1 else False,exp_label=i,IF=xy_IF)
+            info = SS_executor(QD_agent,cluster,Fctrl,qubit,execution=execute,shots=shot_num,roAmp_modifier=ro_amp_scaling,plot=True if repeat ==1 else False,exp_label=i,IF=xy_IF,active_reset=active_reset,cache_discriminator=repeat > 1,thresholded=thresholded,stream_batch=stream_batch)
             snr_rec[qubit].append(info[2])
             effT_rec[qubit].append(info[1])
             thermal_pop[qubit].append(info[0]*100)
@@ -1,4 +1,4 @@
-import os, sys, json
+import os, sys
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 import numpy as np
@@ -32,19 +32,16 @@ def wideCS(readout_module:Cluster, lo_start_freq:int, lo_stop_freq:int, num_data
         stop                               # Stop the sequencer
         """
 
-    # Add sequence to single dictionary and write to JSON file.
+    # Add sequence to single dictionary and upload it from memory.
     sequence = {
         "waveforms": {},
         "weights": {},
         "acquisitions": acquisitions,
         "program": seq_prog,
     }
-    with open("sequence.json", "w", encoding="utf-8") as file:
-        json.dump(sequence, file, indent=4)
-        file.close()
 
     # Upload sequence
-    readout_module.sequencer0.sequence("sequence.json")
+    readout_module.sequencer0.sequence(sequence)
     readout_module.disconnect_outputs()
     readout_module.disconnect_inputs()
 
@@ -107,6 +104,11 @@ def wideCS(readout_module:Cluster, lo_start_freq:int, lo_stop_freq:int, num_data
     I_data = np.asarray(I_data)
     Q_data = np.asarray(Q_data)
 
+    plot_wideCS(lo_sweep_range + nco_freq, I_data, Q_data)
+
+
+def plot_wideCS(freqs:np.ndarray, I_data:np.ndarray, Q_data:np.ndarray):
+    num_data = freqs.shape[0]
     amplitude = np.sqrt(I_data**2 + Q_data**2)
     phase = np.arctan2(Q_data, I_data) * 180 / np.pi
 
@@ -125,17 +127,112 @@ def wideCS(readout_module:Cluster, lo_start_freq:int, lo_stop_freq:int, num_data
         if amplitude[i] > mean_amp*2/3:        # Discard the local minimum which is caused by noise
             cav_freq = np.delete(cav_freq, np.where(cav_freq == i))
 
-    ax1.plot((lo_sweep_range + nco_freq) / 1e9, amplitude, color="#00839F", linewidth=2)
-    ax1.plot(((cav_freq / num_data)*(lo_stop_freq - lo_start_freq) + lo_start_freq + nco_freq) /1e9, amplitude[cav_freq], "x")
-    print(((cav_freq / num_data)*(lo_stop_freq - lo_start_freq) + lo_start_freq + nco_freq) /1e9)
+    ax1.plot(freqs / 1e9, amplitude, color="#00839F", linewidth=2)
+    ax1.plot(freqs[cav_freq] /1e9, amplitude[cav_freq], "x")
+    print(freqs[cav_freq] /1e9)
     ax1.set_ylabel("Amplitude (V)")
 
-    ax2.plot((lo_sweep_range + nco_freq) / 1e9, np.diff(np.unwrap(phase,180,period=360),append=np.unwrap(phase,180,period=360)[-1]), color="#00839F", linewidth=2)
+    ax2.plot(freqs / 1e9, np.diff(np.unwrap(phase,180,period=360),append=np.unwrap(phase,180,period=360)[-1]), color="#00839F", linewidth=2)
     ax2.set_ylabel("Phase ($\circ$)")
     ax2.set_xlabel("Frequency (GHz)")
     fig.tight_layout()
     plt.show()
 
+
+def wideCS_nco(readout_module:Cluster, start_freq:float, stop_freq:float, num_data:int, nco_window:tuple=(20e6, 220e6), num_averages:int=10, plot:bool=True):
+    """
+    Wide cavity scan with the NCO swept inside one Q1ASM program, the LO only steps once per `nco_window`.\n
+    Every LO step is one arm with a bin for every frequency in the window, so there are about (stop-start)/window arms instead of `num_data`.\n
+    ### Args:\n
+    * start_freq, stop_freq: the RF frequencies (Hz) to scan.\n
+    * nco_window: (lowest, highest) NCO frequency (Hz) used, keep it away from 0 Hz and inside the IF bandwidth.\n
+    ### Returns:\n
+    freqs, I, Q
+    """
+    integration_length = 1024
+    holdoff_length = 200
+    set_freq_steps = 4                 # set_freq takes the frequency in steps of 0.25 Hz
+
+    freqs = np.linspace(start_freq, stop_freq, num_data)
+    df = freqs[1] - freqs[0] if num_data > 1 else 0
+    points_per_lo = num_data if df == 0 else max(1, min(num_data, int((nco_window[1] - nco_window[0]) // df) + 1))
+    lo_steps = int(np.ceil(num_data / points_per_lo))
+
+    # Sequence program, the NCO goes through `points_per_lo` frequencies and every one has its own bin.
+    seq_prog = f"""
+        move    {num_averages},R0           # Average iterator.
+        nop
+        reset_ph
+        set_awg_offs 10000, 10000          # set amplitude of signal
+        nop
+    avg:
+        move    0,R1                       # Bin of the first frequency.
+        move    {int(round(nco_window[0]*set_freq_steps))},R2   # NCO of the first frequency.
+        move    {points_per_lo},R3          # Frequency iterator.
+    point:
+        set_freq R2                        # Next NCO frequency.
+        upd_param {holdoff_length}         # Wait time of flight
+        acquire  0,R1,{integration_length} # Acquire data and store them in the bin of this frequency.
+        add      R1,1,R1
+        add      R2,{int(round(df*set_freq_steps))},R2
+        loop     R3,@point                 # Run until all the frequencies in this LO step are done.
+        loop     R0,@avg                   # Run until number of average iterations is done.
+        stop                               # Stop the sequencer
+        """
+
+    sequence = {
+        "waveforms": {},
+        "weights": {},
+        "acquisitions": {"acq": {"num_bins": points_per_lo, "index": 0}},
+        "program": seq_prog,
+    }
+    readout_module.sequencer0.sequence(sequence)
+    readout_module.disconnect_outputs()
+    readout_module.disconnect_inputs()
+    readout_module.sequencer0.connect_sequencer("io0")
+    readout_module.sequencer0.marker_ovr_en(True)
+    readout_module.sequencer0.marker_ovr_value(3)  # Enables output on QRM-RF
+    readout_module.out0_offset_path0(5.5)
+    readout_module.out0_offset_path1(5.5)
+    readout_module.sequencer0.mod_en_awg(True)
+    readout_module.sequencer0.demod_en_acq(True)
+    readout_module.sequencer0.nco_freq(nco_window[0])
+    readout_module.sequencer0.integration_length_acq(integration_length)
+    readout_module.sequencer0.sync_en(True)
+    readout_module.sequencer0.nco_prop_delay_comp_en(True)
+
+    I_data, Q_data = [], []
+    for lo_idx in range(lo_steps):
+        readout_module.out0_in0_lo_freq(freqs[0] + lo_idx*points_per_lo*df - nco_window[0])
+        readout_module.sequencer0.delete_acquisition_data("acq")
+        readout_module.arm_sequencer(0)
+        readout_module.start_sequencer()
+        readout_module.get_acquisition_state(0, timeout=1)
+        # all the frequencies of this LO step in one fetch
+        bins = readout_module.get_acquisitions(0)["acq"]["acquisition"]["bins"]["integration"]
+        I_data += list(np.asarray(bins["path0"]) / integration_length)
+        Q_data += list(np.asarray(bins["path1"]) / integration_length)
+
+    # the last LO step may go beyond stop_freq
+    I_data = np.asarray(I_data)[:num_data]
+    Q_data = np.asarray(Q_data)[:num_data]
+    if plot:
+        plot_wideCS(freqs, I_data, Q_data)
+    return freqs, I_data, Q_data
+
+
+def benchmark_wideCS(readout_module:Cluster, lo_start_freq:float, lo_stop_freq:float, num_data:int):
+    """ Time the LO-stepped `wideCS` and the NCO-swept `wideCS_nco` over the same range. """
+    import time
+    start = time.time()
+    wideCS(readout_module=readout_module, lo_start_freq=lo_start_freq, lo_stop_freq=lo_stop_freq, num_data=num_data)
+    lo_cost = time.time() - start
+    start = time.time()
+    wideCS_nco(readout_module, lo_start_freq+1e6, lo_stop_freq+1e6, num_data)
+    nco_cost = time.time() - start
+    print(f"{num_data} points: LO stepped {round(lo_cost,1)} s, NCO swept {round(nco_cost,1)} s, speedup x{round(lo_cost/nco_cost,1)}")
+    return {"lo_stepped":lo_cost, "nco_swept":nco_cost}
+
 if __name__ == "__main__":
     from Modularize.support import init_meas, init_system_atte, shut_down, QRM_nco_init
     from Modularize.support.UI_Window import init_meas_window
@@ -146,6 +243,7 @@ if __name__ == "__main__":
     lo_start_freq:float = 4.5  * 1e9
     lo_stop_freq:float = 5 * 1e9
     num_data:int =5000
+    nco_sweep:bool = True # sweep the NCO in the program and step the LO only every 200 MHz
 
 
     """ Preparations """
@@ -160,7 +258,10 @@ if __name__ == "__main__":
 
 
     """ Running """
-    wideCS(readout_module=readout_module, lo_start_freq=lo_start_freq, lo_stop_freq=lo_stop_freq, num_data=num_data)
+    if nco_sweep:
+        wideCS_nco(readout_module, start_freq=lo_start_freq+1e6, stop_freq=lo_stop_freq+1e6, num_data=num_data)
+    else:
+        wideCS(readout_module=readout_module, lo_start_freq=lo_start_freq, lo_stop_freq=lo_stop_freq, num_data=num_data)
 
 
     """ Close """
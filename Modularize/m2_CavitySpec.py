@@ -10,7 +10,10 @@ from Modularize.support import cds
 from utils.tutorial_utils import show_args
 from qcodes.parameters import ManualParameter
 from quantify_scheduler.gettables import ScheduleGettable
-from numpy import array, linspace, arange, cos, sin, deg2rad, real, imag, sqrt
+from Modularize.support.ScheduleCache import CachedScheduleGettable
+from Modularize.support.AdaptiveAveraging import adaptive_average_run
+from Modularize.support.ZoomSpectroscopy import zoom_spectroscopy
+from numpy import array, linspace, arange, cos, sin, deg2rad, real, imag, sqrt, exp
 from quantify_core.measurement.control import MeasurementControl
 from qcat.analysis.resonator.photon_dep.res_data import ResonatorData
 from Modularize.support import init_meas, init_system_atte, shut_down
@@ -18,13 +21,14 @@ from Modularize.support import Data_manager, QDmanager, compose_para_for_multipl
 from Modularize.support.Pulse_schedule_library import One_tone_multi_sche, pulse_preview
 
 
-def Cavity_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,n_avg:int=10,run:bool=True,Experi_info:dict={},particular_folder:str="",ro_amps:dict={})->Dataset:
+def Cavity_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,n_avg:int=10,run:bool=True,Experi_info:dict={},particular_folder:str="",ro_amps:dict={},adaptive_avg:dict={})->Dataset:
     """
         Doing the multiplexing cavity search according to the arg `ro_elements`\n
         Please fill up the initial value about measure for qubit in QuantumDevice first, like: amp, duration, integration_time and acqusition_delay!\n
         ----
         ### Args:\n
         * ro_elements: {'q0': data point array, 'q1':[], ...}\n
+        * adaptive_avg: like {"chunk":100,"snr":10} or {"chunk":100,"fr_err_Hz":20e3}, average in chunks until the target of `adaptive_average_run`, then `n_avg` is the maximum. {} for a single run with `n_avg`.\n
         ----
         ## Warning:\n
         The sweep frequency data-point for each cavity in ro_elements is better to set equally.
@@ -62,7 +66,7 @@ def Cavity_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict
     )
     
     if run:
-        gettable = ScheduleGettable(
+        gettable = (CachedScheduleGettable if adaptive_avg != {} else ScheduleGettable)(
             quantum_device,
             schedule_function=sche_func, 
             schedule_kwargs=spec_sched_kwargs,
@@ -75,7 +79,10 @@ def Cavity_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict
         meas_ctrl.settables(freq)
         meas_ctrl.setpoints(datapoint_idx)
         
-        rs_ds = meas_ctrl.run("One-tone")
+        if adaptive_avg != {}:
+            rs_ds = adaptive_average_run(quantum_device,meas_ctrl,"One-tone",n_avg,polar=True,freqs=array([ro_elements[q] for q in ro_elements]),**adaptive_avg)
+        else:
+            rs_ds = meas_ctrl.run("One-tone")
         Data_manager().save_raw_data(QD_agent=QD_agent,ds=rs_ds,qb=q,exp_type='CS',specific_dataFolder=particular_folder)
         
         print(f"{q} Cavity:")
@@ -144,16 +151,42 @@ def multiplexing_CS_ana(QD_agent:QDmanager, ds:Dataset, ro_elements:dict, save_p
 
     return fit_results
 
+def zoom_cavity_search(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_bare_guess:dict,ro_span_Hz:float=10e6,dense:tuple=(),**zoom)->dict:
+    """
+    Search every cavity in ro_bare_guess +/- ro_span_Hz by `zoom_spectroscopy` on the amplitude dip, one cavity after another.\n
+    Every sweep is a `Cavity_spec` run (and saved), the window of the best candidate is fitted by `multiplexing_CS_ana` at last.\n
+    ### Args:\n
+    * dense: (points, n_avg) of the dense sweep to compare with.\n
+    * zoom: the kwargs of `zoom_spectroscopy`, like coarse_points=100, coarse_avg=10, fine_points=41, fine_avg=100, stages=2, shot_budget=0.
+    """
+    CS_results = {}
+    for q in ro_bare_guess:
+        datasets = []
+        def measure(freqs, n_avg):
+            datasets.append(Cavity_spec(QD_agent,meas_ctrl,{q:freqs},n_avg=n_avg))
+            amp = abs(array(datasets[-1]["y0"]*exp(1j*deg2rad(datasets[-1]["y1"]))))
+            return amp.max()-amp
+        zoomed = zoom_spectroscopy(measure,ro_bare_guess[q]-ro_span_Hz,ro_bare_guess[q]+ro_span_Hz,dense=dense,**zoom)
+        best_sweep = zoomed["sweeps"][zoomed["best_sweep"]]
+        CS_results[q] = multiplexing_CS_ana(QD_agent,datasets[zoomed["best_sweep"]],{q:best_sweep["freqs"]})[q]
+    return CS_results
+
 # execution pack
-def cavitySpectro_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_bare_guess:dict,ro_span_Hz:float=10e6,run:bool=True,fpts:int=101,avg_times:int=10)->dict:
+def cavitySpectro_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_bare_guess:dict,ro_span_Hz:float=10e6,run:bool=True,fpts:int=101,avg_times:int=10,adaptive_avg:dict={},zoom:dict={})->dict:
+    """
+    * zoom: like {"coarse_avg":10,"fine_avg":100}, search coarse-to-fine by `zoom_cavity_search` instead of `fpts` points with `avg_times`, {} for the dense sweep.
+    """
     ro_elements = {}
     Quality_values = ["Qi_dia_corr", "Qc_dia_corr", "Ql"]
     Quality_errors = ["Qi_dia_corr_err", "absQc_err", "Ql_err"]
     for qb in list(ro_bare_guess.keys()):
         ro_elements[qb] = linspace(ro_bare_guess[qb]-ro_span_Hz, ro_bare_guess[qb]+ro_span_Hz, fpts)
     if run:
-        cs_ds = Cavity_spec(QD_agent,meas_ctrl,ro_elements,n_avg=avg_times)
-        CS_results = multiplexing_CS_ana(QD_agent, cs_ds, ro_elements)
+        if zoom != {}:
+            CS_results = zoom_cavity_search(QD_agent,meas_ctrl,ro_bare_guess,ro_span_Hz,dense=(fpts,avg_times),**zoom)
+        else:
+            cs_ds = Cavity_spec(QD_agent,meas_ctrl,ro_elements,n_avg=avg_times,adaptive_avg=adaptive_avg)
+            CS_results = multiplexing_CS_ana(QD_agent, cs_ds, ro_elements)
         for qubit in CS_results:
             qu = QD_agent.quantum_device.get_element(qubit)
             qu.clock_freqs.readout(float(CS_results[qubit]['fr']))
@@ -198,6 +231,8 @@ if __name__ == "__main__":
     freq_data_points = 201
     half_freq_window_Hz = 10e6
     n_avg: int = 100
+    adaptive_avg:dict = {} # like {"chunk":20,"snr":10}, stop averaging at this peak/noise, then n_avg is the maximum
+    zoom:dict = {} # like {"coarse_avg":10,"fine_avg":100}, coarse-to-fine search instead of freq_data_points with n_avg
 
 
 
@@ -217,7 +252,7 @@ if __name__ == "__main__":
     init_system_atte(QD_agent.quantum_device,list(ro_bare.keys()),ro_out_att=init_RO_DigiAtte)
     
     """ Measurements """
-    CS_results = cavitySpectro_executor(QD_agent=QD_agent,meas_ctrl=meas_ctrl,ro_bare_guess=ro_bare,run = execution,ro_span_Hz=half_freq_window_Hz,fpts=freq_data_points,avg_times=n_avg)
+    CS_results = cavitySpectro_executor(QD_agent=QD_agent,meas_ctrl=meas_ctrl,ro_bare_guess=ro_bare,run = execution,ro_span_Hz=half_freq_window_Hz,fpts=freq_data_points,avg_times=n_avg,adaptive_avg=adaptive_avg,zoom=zoom)
     
     
     """ Storing """
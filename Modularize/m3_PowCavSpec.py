@@ -14,10 +14,12 @@ from quantify_core.analysis.base_analysis import Basic2DAnalysis
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support import init_meas, init_system_atte, shut_down
 from Modularize.support.QuFluxFit import convert_netCDF_2_arrays
-from Modularize.support.Pulse_schedule_library import One_tone_multi_sche, pulse_preview
-
-def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,ro_p_min:float=0.01,ro_p_max:float=0.5,p_points:int=20,n_avg:int=100,run:bool=True,Experi_info:dict={}, rof_marks:dict={})->Dataset:
+from Modularize.support.Pulse_schedule_library import One_tone_multi_sche, pulse_preview, batched_chunk_size
 
+def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,ro_p_min:float=0.01,ro_p_max:float=0.5,p_points:int=20,n_avg:int=100,run:bool=True,Experi_info:dict={}, rof_marks:dict={},batch_power:bool=True)->Dataset:
+    """
+    * batch_power: the RO amplitude is batched together with the frequency index, the grid runs as few programs as the sequencer memory allows instead of compiling one schedule for every amplitude.
+    """
     sche_func = One_tone_multi_sche
     freq_datapoint_idx = arange(0,len(list(list(ro_elements.values())[0])))
     original_rof = {}
@@ -34,12 +36,16 @@ def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:di
     freq.batched = True
     
     ro_pulse_amp = ManualParameter(name="ro_amp", unit="", label="Readout pulse amplitude")
-    ro_pulse_amp.batched = False
+    ro_pulse_amp.batched = batch_power
+    if batch_power:
+        # every point reads all the qubits
+        freq.batch_size = ro_pulse_amp.batch_size = batched_chunk_size(freq_datapoint_idx.shape[0]*p_points,instructions_per_point=12*len(ro_elements),inner_points=freq_datapoint_idx.shape[0])
     
     
     spec_sched_kwargs = dict(   
         frequencies=ro_elements,
         R_amp=ro_pulse_amp,
+        freq_idx=freq if batch_power else None,
         R_duration=compose_para_for_multiplexing(QD_agent,ro_elements,3),
         R_integration=compose_para_for_multiplexing(QD_agent,ro_elements,4),
         R_inte_delay=compose_para_for_multiplexing(QD_agent,ro_elements,2),
@@ -85,7 +91,8 @@ def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:di
             preview_para[q] = ro_elements[q][:n_s]
         sweep_para2 = array(ro_p_samples[:2])
         spec_sched_kwargs['frequencies']= preview_para
-        spec_sched_kwargs['R_amp']= {q:sweep_para2.reshape(sweep_para2.shape or (1,))[0]}
+        spec_sched_kwargs['R_amp']= sweep_para2.reshape(sweep_para2.shape or (1,))[0]
+        spec_sched_kwargs['freq_idx']= None
         pulse_preview(QD_agent.quantum_device,sche_func,spec_sched_kwargs)
 
         # show_args(exp_kwargs, title="One_tone_powerDep_kwargs: Meas.qubit="+q)
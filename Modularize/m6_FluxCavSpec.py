@@ -6,6 +6,8 @@ from qcodes.parameters import ManualParameter
 from Modularize.support.UserFriend import *
 from Modularize.support import QDmanager, Data_manager, cds
 from quantify_scheduler.gettables import ScheduleGettable
+from Modularize.support.ScheduleCache import CachedScheduleGettable
+from Modularize.support.AdaptiveAveraging import adaptive_average_run
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support import init_meas, init_system_atte, shut_down, coupler_zctrl
@@ -15,8 +17,12 @@ from Modularize.support.Pulse_schedule_library import One_tone_sche, pulse_previ
 
 
 
-def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,ro_span_Hz:int=3e6,flux_span:float=0.3,n_avg:int=300,f_points:int=20,flux_points:int=20,run:bool=True,q:str='q1',Experi_info:dict={}):
-
+def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,ro_span_Hz:int=3e6,flux_span:float=0.3,n_avg:int=300,f_points:int=20,flux_points:int=20,run:bool=True,q:str='q1',Experi_info:dict={},adaptive_avg:dict={}):
+    """
+    Cavity spectroscopy versus flux bias.\n
+    ### Args:\n
+    * adaptive_avg: like {"chunk":50,"snr":10}, average in chunks until the median peak/noise along the frequency sweeps reaches it, then `n_avg` is the maximum. {} for a single run with `n_avg`.
+    """
     sche_func = One_tone_sche
         
     analysis_result = {}
@@ -48,7 +54,7 @@ def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,
                      Flux=['start '+'%E' %flux_samples[0],'end '+'%E' %flux_samples[-1]])
     
     if run:
-        gettable = ScheduleGettable(
+        gettable = (CachedScheduleGettable if adaptive_avg != {} else ScheduleGettable)(
             QD_agent.quantum_device,
             schedule_function=sche_func, 
             schedule_kwargs=spec_sched_kwargs,
@@ -62,7 +68,11 @@ def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,
         
         
         
-        rfs_ds = meas_ctrl.run("One-tone-Flux")
+        if adaptive_avg != {}:
+            rfs_ds = adaptive_average_run(QD_agent.quantum_device,meas_ctrl,"One-tone-Flux",n_avg,polar=True,grid_shape=(flux_points,f_points),**adaptive_avg)
+            exp_kwargs["n_avg"] = rfs_ds.attrs["n_avg"]
+        else:
+            rfs_ds = meas_ctrl.run("One-tone-Flux")
         # Save the raw data into netCDF
         Data_manager().save_raw_data(QD_agent=QD_agent,ds=rfs_ds,qb=q,exp_type='FD')
         analysis_result[q] = ResonatorFluxSpectroscopyAnalysis(tuid=rfs_ds.attrs["tuid"], dataset=rfs_ds).run(sweetspot_index=0)
@@ -109,11 +119,11 @@ def update_coupler_bias(QD_agent:QDmanager,cp_elements:dict):
         QD_agent.Fluxmanager.save_idleBias_for(cp, cp_elements[cp])
 
 
-def fluxCavity_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,specific_qubits:str,run:bool=True,flux_span:float=0.4,ro_span_Hz=3e6,zpts=20,fpts=30,avg_n=20):
+def fluxCavity_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,specific_qubits:str,run:bool=True,flux_span:float=0.4,ro_span_Hz=3e6,zpts=20,fpts=30,avg_n=20,adaptive_avg:dict={}):
     
     if run:
         print(f"{specific_qubits} are under the measurement ...")
-        FD_results = FluxCav_spec(QD_agent,meas_ctrl,Fctrl,ro_span_Hz=ro_span_Hz,q=specific_qubits,flux_span=flux_span,flux_points=zpts,f_points=fpts,n_avg=avg_n)[specific_qubits]
+        FD_results = FluxCav_spec(QD_agent,meas_ctrl,Fctrl,ro_span_Hz=ro_span_Hz,q=specific_qubits,flux_span=flux_span,flux_points=zpts,f_points=fpts,n_avg=avg_n,adaptive_avg=adaptive_avg)[specific_qubits]
         if FD_results == {}:
             print(f"Flux dependence error qubit: {specific_qubits}")
         
@@ -139,6 +149,8 @@ if __name__ == "__main__":
     freq_data_points = 40
     flux_data_points = 40
     freq_center_shift = 0e6 # freq axis shift
+    avg_n = 20
+    adaptive_avg:dict = {} # like {"chunk":10,"snr":10}, stop averaging at this peak/noise, then avg_n is the maximum
 
     for qubit in ro_elements:
         """ Preparations """
@@ -158,7 +170,7 @@ if __name__ == "__main__":
         init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'))
         qu = QD_agent.quantum_device.get_element(qubit)
         qu.clock_freqs.readout(qu.clock_freqs.readout()+freq_center_shift)
-        FD_results[qubit] = fluxCavity_executor(QD_agent,meas_ctrl,qubit,run=execution,flux_span=flux_half_window_V,ro_span_Hz=freq_half_window_Hz, zpts=flux_data_points,fpts=freq_data_points)
+        FD_results[qubit] = fluxCavity_executor(QD_agent,meas_ctrl,qubit,run=execution,flux_span=flux_half_window_V,ro_span_Hz=freq_half_window_Hz, zpts=flux_data_points,fpts=freq_data_points,avg_n=avg_n,adaptive_avg=adaptive_avg)
         cluster.reset()
         if execution:
             permission = mark_input("Update the QD with this result ? [y/n]") 
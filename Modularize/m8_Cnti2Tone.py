@@ -8,13 +8,21 @@ from qcodes.parameters import ManualParameter
 from Modularize.support.UserFriend import *
 from Modularize.support import QDmanager, Data_manager, cds
 from quantify_scheduler.gettables import ScheduleGettable
+from Modularize.support.ScheduleCache import CachedScheduleGettable
+from Modularize.support.AdaptiveAveraging import adaptive_average_run
+from Modularize.support.ZoomSpectroscopy import zoom_spectroscopy, lorentzian_location
 from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from Modularize.support.QuFluxFit import calc_Gcoef_inFbFqFd, calc_g
 from Modularize.support import init_meas, shut_down,  advise_where_fq, init_system_atte, coupler_zctrl
 from Modularize.support.Pulse_schedule_library import Two_tone_sche, set_LO_frequency, pulse_preview, IQ_data_dis, QS_fit_analysis, dataset_to_array, twotone_comp_plot
 
-def Two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,IF:float=100e6,f01_guess:int=0,xyf_span_Hz:int=400e6,xyamp:float=0.02,n_avg:int=500,points:int=200,run:bool=True,q:str='q1',Experi_info:dict={},ref_IQ:list=[0,0],drive_read_overlap:bool=False):
+def Two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,IF:float=100e6,f01_guess:int=0,xyf_span_Hz:int=400e6,xyamp:float=0.02,n_avg:int=500,points:int=200,run:bool=True,q:str='q1',Experi_info:dict={},ref_IQ:list=[0,0],drive_read_overlap:bool=False,adaptive_avg:dict={}):
+    """
+    Continuous-wave two-tone spectroscopy.\n
+    ### Args:\n
+    * adaptive_avg: like {"chunk":100,"snr":10} or {"chunk":100,"fr_err_Hz":1e6}, average in chunks until the target of `adaptive_average_run`, then `n_avg` is the maximum. {} for a single run with `n_avg`.
+    """
     sche_func = Two_tone_sche   
     analysis_result = {}
     qubit_info = QD_agent.quantum_device.get_element(q)
@@ -64,7 +72,7 @@ def Two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,IF:float=100e6
                      spec_Du='%E' %spec_sched_kwargs['spec_Du'])
     highlight_print(f"Now spec_amp = {xyamp}")
     if run:
-        gettable = ScheduleGettable(
+        gettable = (CachedScheduleGettable if adaptive_avg != {} else ScheduleGettable)(
             QD_agent.quantum_device,
             schedule_function=sche_func, 
             schedule_kwargs=spec_sched_kwargs,
@@ -76,7 +84,11 @@ def Two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,IF:float=100e6
         meas_ctrl.settables(freq)
         meas_ctrl.setpoints(f01_samples)
         
-        qs_ds = meas_ctrl.run("Two-tone")
+        if adaptive_avg != {}:
+            qs_ds = adaptive_average_run(QD_agent.quantum_device,meas_ctrl,"Two-tone",n_avg,freqs=f01_samples,**adaptive_avg)
+            exp_kwargs["n_avg"] = qs_ds.attrs["n_avg"]
+        else:
+            qs_ds = meas_ctrl.run("Two-tone")
         # Save the raw data into netCDF
         Data_manager().save_raw_data(QD_agent=QD_agent,ds=qs_ds,qb=q,exp_type='2tone')
         I,Q= dataset_to_array(dataset=qs_ds,dims=1)
@@ -106,6 +118,28 @@ def Two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,IF:float=100e6
 
     return analysis_result
 
+def Zoom_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,IF:float=100e6,f01_guess:int=0,xyf_span_Hz:int=400e6,xyamp:float=0.02,q:str='q1',ref_IQ:list=[0,0],drive_read_overlap:bool=False,dense:tuple=(),**zoom):
+    """
+    The same window as `Two_tone_spec` by `zoom_spectroscopy`: a coarse sweep with few averages, then the narrow windows around the candidate peaks with more averages.\n
+    Every sweep is a `Two_tone_spec` run (and saved), the returned result is the fit of the best window with the shots report in its attrs.\n
+    ### Args:\n
+    * dense: (points, n_avg) of the dense sweep to compare with.\n
+    * zoom: the kwargs of `zoom_spectroscopy`, like coarse_points=100, coarse_avg=100, fine_points=41, fine_avg=500, stages=2, shot_budget=0.
+    """
+    f01_high = (f01_guess if f01_guess != 0 else QD_agent.quantum_device.get_element(q).clock_freqs.f01())+IF
+    def measure(freqs, n_avg):
+        result = Two_tone_spec(QD_agent,meas_ctrl,IF=IF,f01_guess=freqs[-1]-IF,xyf_span_Hz=freqs[-1]-freqs[0],xyamp=xyamp,n_avg=n_avg,points=freqs.shape[0],q=q,ref_IQ=ref_IQ,drive_read_overlap=drive_read_overlap)
+        return array(result[q].data_vars['data'])
+    def locate(freqs, data):
+        f01 = QS_fit_analysis(data,f=freqs,params_only=True).attrs['f01_fit']
+        return f01 if freqs[0] <= f01 <= freqs[-1] else lorentzian_location(freqs, data)
+
+    zoomed = zoom_spectroscopy(measure,f01_high-xyf_span_Hz,f01_high,dense=dense,locate=locate,**zoom)
+    best_sweep = zoomed["sweeps"][zoomed["best_sweep"]]
+    analysis_result = QS_fit_analysis(best_sweep["data"],f=best_sweep["freqs"])
+    analysis_result.attrs.update({"zoom_shots":zoomed["report"]["shots"],"zoom_candidates":[c["freq"] for c in zoomed["candidates"]]})
+    return {q:analysis_result}
+
 def paras_guess_determinator(QD_path:str, specific_qubits:str, execution:bool=True, xyf_guess:list=[], guess_g:float=48e6, xyAmp_guess:list=[])->tuple[list, list]:
     QD_agent = QDmanager(QD_path)
     QD_agent.QD_loader()
@@ -142,7 +176,10 @@ def update_2toneResults_for(QD_agent:QDmanager,qb:str,QS_results:dict,XYL:float)
 
 
 
-def conti2tone_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,cluster:Cluster,specific_qubits:str,XYF:float,XYL:float,xyf_span:float=500e6,xy_if:float=100e6,run:bool=True,V_away_from:float=0,drive_read_overlap:bool=False,avg_times:int=500,fpts:int=100):
+def conti2tone_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,cluster:Cluster,specific_qubits:str,XYF:float,XYL:float,xyf_span:float=500e6,xy_if:float=100e6,run:bool=True,V_away_from:float=0,drive_read_overlap:bool=False,avg_times:int=500,fpts:int=100,adaptive_avg:dict={},zoom:dict={}):
+    """
+    * zoom: like {"coarse_avg":100,"fine_avg":500}, search the window coarse-to-fine by `Zoom_two_tone_spec` instead of `fpts` points with `avg_times`, {} for the dense sweep.
+    """
     
     if run:
         ori_data = []
@@ -155,7 +192,14 @@ def conti2tone_executor(QD_agent:QDmanager,meas_ctrl:MeasurementControl,cluster:
             warning_print(f"meas under flux = {round(offset,3)}+{round(V_away_from,3)} V")
         Fctrl[specific_qubits](want_bias) 
         
-        QS_results = Two_tone_spec(QD_agent,meas_ctrl,xyamp=XYL,IF=xy_if,f01_guess=XYF,q=specific_qubits,xyf_span_Hz=xyf_span,points=fpts,n_avg=avg_times,run=True,ref_IQ=QD_agent.refIQ[specific_qubits],drive_read_overlap=drive_read_overlap) # 
+        if zoom != {}:
+            if XYL == 0:
+                Fctrl[specific_qubits](0.0)
+                warning_print("The background (XYL = 0) is skipped in the zoom search, its sweeps are different.")
+                return []
+            QS_results = Zoom_two_tone_spec(QD_agent,meas_ctrl,IF=xy_if,f01_guess=XYF,xyf_span_Hz=xyf_span,xyamp=XYL,q=specific_qubits,ref_IQ=QD_agent.refIQ[specific_qubits],drive_read_overlap=drive_read_overlap,dense=(fpts,avg_times),**zoom)
+        else:
+            QS_results = Two_tone_spec(QD_agent,meas_ctrl,xyamp=XYL,IF=xy_if,f01_guess=XYF,q=specific_qubits,xyf_span_Hz=xyf_span,points=fpts,n_avg=avg_times,run=True,ref_IQ=QD_agent.refIQ[specific_qubits],drive_read_overlap=drive_read_overlap,adaptive_avg=adaptive_avg if XYL != 0 else {}) # the background has no peak to stop at
         Fctrl[specific_qubits](0.0)
         
         cluster.reset() # *** important
@@ -197,6 +241,8 @@ if __name__ == "__main__":
     xyf_range = 500e6
     fpts:int = 100
     avg_n:int = 1000
+    adaptive_avg:dict = {} # like {"chunk":100,"snr":10}, stop averaging at this peak/noise, then avg_n is the maximum. The background (xyl = 0) always uses avg_n
+    zoom:dict = {} # like {"coarse_avg":100,"fine_avg":1000}, coarse-to-fine search instead of fpts points with avg_n, the background (xyl = 0) is skipped
 
 
     """ Running """
@@ -219,7 +265,7 @@ if __name__ == "__main__":
                 init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
                 tune_bias = ro_elements[qubit]["tune_bias"]
                 print(xyf)
-                tt_results = conti2tone_executor(QD_agent,meas_ctrl,cluster,specific_qubits=qubit,XYF=xyf,XYL=xyl,run=execution,xy_if=xy_IF,xyf_span=xyf_range,V_away_from=tune_bias,drive_read_overlap=drive_read_overlap,avg_times=avg_n,fpts=fpts)
+                tt_results = conti2tone_executor(QD_agent,meas_ctrl,cluster,specific_qubits=qubit,XYF=xyf,XYL=xyl,run=execution,xy_if=xy_IF,xyf_span=xyf_range,V_away_from=tune_bias,drive_read_overlap=drive_read_overlap,avg_times=avg_n,fpts=fpts,adaptive_avg=adaptive_avg,zoom=zoom)
 
                 if xyl == 0: 
                     background = tt_results
@@ -1,7 +1,7 @@
-import os, sys
+import os, sys, time
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from numpy import NaN
-from numpy import array, linspace
+from numpy import array, linspace, ndarray
 from utils.tutorial_utils import show_args
 from qcodes.parameters import ManualParameter
 from Modularize.support.UserFriend import *
@@ -11,13 +11,17 @@ from quantify_core.measurement.control import MeasurementControl
 from Modularize.support.Path_Book import find_latest_QD_pkl_for_dr
 from utils.tutorial_analysis_classes import QubitFluxSpectroscopyAnalysis
 from Modularize.support import init_meas, init_system_atte, shut_down, reset_offset, coupler_zctrl
-from Modularize.support.QuFluxFit import plot_QbFlux
-from Modularize.support.Pulse_schedule_library import Z_gate_two_tone_sche, set_LO_frequency, pulse_preview
+from Modularize.support.QuFluxFit import plot_QbFlux, convert_netCDF_2_arrays
+from Modularize.support.FluxTracking import FluxFqTracker
+from Modularize.support.Pulse_schedule_library import Z_gate_two_tone_sche, set_LO_frequency, pulse_preview, batched_chunk_size, IQ_data_dis
 
 
 
 
-def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,Z_amp_start:float,Z_amp_end:float,IF:int=200e6,xyf:float=0e9,xyf_span_Hz:float=400e6,n_avg:int=1000,RO_z_amp:float=0,Z_points:int=40,f_points:int=60,run:bool=True,q:str='q1',Experi_info={},get_data_path:bool=False,analysis:bool=True):
+def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,Z_amp_start:float,Z_amp_end:float,IF:int=200e6,xyf:float=0e9,xyf_span_Hz:float=400e6,n_avg:int=1000,RO_z_amp:float=0,Z_points:int=40,f_points:int=60,run:bool=True,q:str='q1',Experi_info={},get_data_path:bool=False,analysis:bool=True,batch_Z:bool=True):
+    """
+    * batch_Z: Z bias is batched together with the frequency, the (frequency, Z) grid runs as few programs as the sequencer memory allows instead of compiling one schedule for every Z.
+    """
     print("Zgate 2tone start")
     trustable = True
     sche_func = Z_gate_two_tone_sche
@@ -39,7 +43,9 @@ def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,Z_amp_st
     freq.batched = True
     
     Z_bias = ManualParameter(name="Z", unit="V", label="Z bias")
-    Z_bias.batched = False
+    Z_bias.batched = batch_Z
+    if batch_Z:
+        freq.batch_size = Z_bias.batch_size = batched_chunk_size(f_points*Z_points,inner_points=f_points)
     
     # temperature quard
     if Z_amp_end > 0.4:
@@ -127,6 +133,39 @@ def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,Z_amp_st
     return analysis_result, path, trustable
 
 
+def Zgate_track_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,q:str,biases:ndarray,ref_z:float,fitting_popts:list,IF:int=200e6,n_avg:int=500,**track)->dict:
+    """
+    Track f01 along the `biases` (V) by `FluxFqTracker`, every bias only measures a narrow window around the `FqEqn` prediction by `Zgate_two_tone_spec`.\n
+    The Z line should be at `ref_z` already, the Z pulse is bias - ref_z. `fitting_popts` is the first model [a, b, Ec, Ej_sum, d], like the qubFitParas in Fluxmanager.\n
+    ### Args:\n
+    * track: the kwargs of `FluxFqTracker`, like window_Hz=30e6, points=21, widen=3, max_window_Hz=500e6, min_snr=4.\n
+    ----
+    Return the `FluxFqTracker.result()`, the found bias and fq (Hz) and the refitted paras.
+    """
+    ref_IQ = QD_agent.refIQ[q]
+    def measure(bias, freqs):
+        _, path, _ = Zgate_two_tone_spec(QD_agent,meas_ctrl,Z_amp_start=bias-ref_z,Z_amp_end=bias-ref_z,IF=IF,xyf=freqs[-1]-IF,xyf_span_Hz=freqs[-1]-freqs[0],n_avg=n_avg,Z_points=1,f_points=freqs.shape[0],q=q,get_data_path=True,analysis=False)
+        _, _, I, Q = convert_netCDF_2_arrays(path)
+        return array(IQ_data_dis(I.reshape(-1),Q.reshape(-1),ref_I=ref_IQ[0],ref_Q=ref_IQ[-1]))
+    tracker = FluxFqTracker(fitting_popts,biases,**track)
+    result = tracker.run(measure)
+    slightly_print(f"{q} tracked {result['bias'].shape[0]}/{len(biases)} biases with {result['points']} frequency points.")
+    return result
+
+
+def benchmark_batched_Zgate(QD_agent:QDmanager,meas_ctrl:MeasurementControl,q:str,Z_amp_start:float=-0.05,Z_amp_end:float=0.05,Z_points:int=40,f_points:int=60,n_avg:int=100)->dict:
+    """
+    Run the same flux-qubit map with the Z bias un-batched (one schedule per Z) and batched, return the wall times in seconds.
+    """
+    costs = {}
+    for label, batch_Z in {"unbatched":False,"batched":True}.items():
+        start = time.time()
+        Zgate_two_tone_spec(QD_agent,meas_ctrl,Z_amp_start=Z_amp_start,Z_amp_end=Z_amp_end,Z_points=Z_points,f_points=f_points,n_avg=n_avg,q=q,analysis=False,batch_Z=batch_Z)
+        costs[label] = time.time()-start
+    slightly_print(f"{Z_points}x{f_points} flux-qubit map: unbatched {round(costs['unbatched'],1)} s, batched {round(costs['batched'],1)} s, speedup x{round(costs['unbatched']/costs['batched'],1)}")
+    return costs
+
+
 def update_by_fluxQubit(QD_agent:QDmanager,correct_results:dict,target_q:str):
     """
     correct_results dict in the form: {"xyf":float,"sweet_bias":float}
@@ -183,6 +222,7 @@ if __name__ == "__main__":
     sweet_flux_shifter:float = 0
     xy_IF = 100e6
     avg_n:int = 500
+    benchmark:bool = False # compare a 40x60 map with Z un-batched and batched before running
 
 
 
@@ -198,6 +238,12 @@ if __name__ == "__main__":
     FQ_results = {}
     check_again =[]
     Cctrl = coupler_zctrl(DRandIP["dr"],cluster,QD_agent.Fluxmanager.build_Cctrl_instructions(couplers,'i'))
+    if benchmark and execution:
+        init_system_atte(QD_agent.quantum_device,list([ro_elements[0]]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(ro_elements[0],'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(ro_elements[0],'xy'))
+        Fctrl[ro_elements[0]](QD_agent.Fluxmanager.get_proper_zbiasFor(target_q=ro_elements[0]))
+        benchmark_batched_Zgate(QD_agent,meas_ctrl,ro_elements[0],Z_points=40,f_points=60,n_avg=avg_n)
+        reset_offset(Fctrl)
+        cluster.reset()
     for qubit in ro_elements:
         if not QD_agent.Fluxmanager.get_offsweetspot_button(qubit):
             init_system_atte(QD_agent.quantum_device,list([qubit]),ro_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'ro'),xy_out_att=QD_agent.Notewriter.get_DigiAtteFor(qubit,'xy'))
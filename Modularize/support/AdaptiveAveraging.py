@@ -0,0 +1,173 @@
+"""
+SNR-driven averaging for the spectroscopies.\n
+Instead of one run with a fixed `n_avg`, the same schedule is run in chunks of `chunk` repetitions.
+The chunk means of every point are merged into a running mean and variance, and it stops as soon as
+the peak-to-noise ratio (or the fit uncertainty of the resonance frequency) reaches the target, or `n_avg` repetitions are used anyway.\n
+The returned dataset is the last run with its y-values replaced by the running means, the attrs record the effective averages.
+"""
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from xarray import Dataset
+from scipy.optimize import curve_fit
+from Modularize.support.UserFriend import *
+
+
+def dataset_signals(ds:Dataset, polar:bool=False)->np.ndarray:
+    """
+    The complex signals of the channels in shape (channels, points), the channels are the (y0, y1), (y2, y3) ... pairs.\n
+    `polar` for the datasets by `real_imag=False`, the pairs are amplitude and phase (deg), otherwise they are I and Q.
+    """
+    signals = []
+    for idx in range(len([var for var in ds.data_vars if str(var).startswith("y")])//2):
+        first, second = np.asarray(ds[f"y{2*idx}"]).reshape(-1), np.asarray(ds[f"y{2*idx+1}"]).reshape(-1)
+        signals.append(first*np.exp(1j*np.deg2rad(second)) if polar else first+1j*second)
+    return np.array(signals)
+
+def signals_to_dataset(ds:Dataset, signals:np.ndarray, polar:bool=False)->Dataset:
+    """ Put the complex signals from `dataset_signals` back into a copy of the dataset. """
+    new_ds = ds.copy(deep=True)
+    for idx, signal in enumerate(signals):
+        first, second = (np.abs(signal), np.rad2deg(np.angle(signal))) if polar else (signal.real, signal.imag)
+        new_ds[f"y{2*idx}"].values = first.reshape(new_ds[f"y{2*idx}"].shape)
+        new_ds[f"y{2*idx+1}"].values = second.reshape(new_ds[f"y{2*idx+1}"].shape)
+    return new_ds
+
+
+class RunningSignal():
+    """
+    Running mean and variance of the complex signals, merged chunk by chunk (weighted Welford), so the raw chunks are never kept.\n
+    The variance is the one of a single repetition estimated from the scatter of the chunk means, `sem` is the standard error of the running mean.
+    """
+    def __init__(self):
+        self.chunks:int = 0
+        self.repetitions:int = 0
+        self.mean = None
+        self.__scatter = None
+
+    def add(self, signals:np.ndarray, repetitions:int):
+        signals = np.asarray(signals, dtype=complex)
+        if self.mean is None:
+            self.mean = np.zeros_like(signals)
+            self.__scatter = np.zeros(signals.shape)
+        total = self.repetitions + repetitions
+        delta = signals - self.mean
+        self.mean = self.mean + delta*repetitions/total
+        self.__scatter = self.__scatter + np.abs(delta)**2*repetitions*self.repetitions/total
+        self.repetitions = total
+        self.chunks += 1
+
+    @property
+    def variance(self)->np.ndarray:
+        if self.chunks < 2:
+            return np.full(self.mean.shape, np.inf)
+        return self.__scatter/(self.chunks-1)
+
+    @property
+    def sem(self)->np.ndarray:
+        return np.sqrt(self.variance/self.repetitions)
+
+    @property
+    def pooled_sem(self)->np.ndarray:
+        """ The standard error of every channel pooled over its points, the noise is white along a sweep and a few chunks can't tell it point by point. """
+        return np.sqrt(np.mean(self.variance,axis=-1)/self.repetitions)
+
+
+def peak_to_noise(signal:np.ndarray, sem:float, grid_shape:tuple=None)->float:
+    """
+    The largest distance of the signal from its median over the standard error `sem`.\n
+    For a 2D sweep give the `grid_shape` (slow points, fast points), the ratio is taken along every fast (frequency) sweep and the median of them is returned.
+    """
+    signal = np.asarray(signal).reshape(grid_shape if grid_shape is not None else (1,-1))
+    peaks = np.max(np.abs(signal-np.median(signal.real,axis=1,keepdims=True)-1j*np.median(signal.imag,axis=1,keepdims=True)),axis=1)
+    return float(np.median(peaks)/sem)
+
+def lorentzian(f, f0, width, height, offset):
+    return offset + height/(1+((f-f0)/(width/2))**2)
+
+def resonance_uncertainty(freqs:np.ndarray, signal:np.ndarray, sem:float)->float:
+    """
+    Std (Hz) of the resonance frequency by a Lorentzian fit on the distance of the signal from its median with the standard error `sem`, inf if the fit fails.\n
+    The distance makes a cavity dip and a qubit peak both a peak, in any IQ direction.
+    """
+    freqs = np.asarray(freqs, dtype=float).reshape(-1)
+    distance = np.abs(signal-np.median(signal.real)-1j*np.median(signal.imag))
+    if not np.isfinite(sem):
+        return np.inf
+    guess = [freqs[np.argmax(distance)], (freqs[-1]-freqs[0])/10, np.ptp(distance), np.min(distance)]
+    try:
+        popt, pcov = curve_fit(lorentzian, freqs, distance, p0=guess, sigma=np.full(freqs.shape[0], max(sem, 1e-12*np.max(distance))), absolute_sigma=True, maxfev=2000)
+    except (RuntimeError, ValueError):
+        return np.inf
+    std = float(np.sqrt(pcov[0,0]))
+    return std if np.isfinite(std) and freqs[0] <= popt[0] <= freqs[-1] else np.inf
+
+
+def adaptive_average_run(quantum_device, meas_ctrl, exp_name:str, n_avg:int, chunk:int=100, snr:float=10, fr_err_Hz:float=0, polar:bool=False, freqs:np.ndarray=None, grid_shape:tuple=None, min_chunks:int=2)->Dataset:
+    """
+    Run the experiment prepared in `meas_ctrl` chunk by chunk with `chunk` repetitions each, until the target is reached or `n_avg` repetitions are used.\n
+    ### Args:\n
+    * snr: the target of `peak_to_noise` for every channel.\n
+    * fr_err_Hz: if > 0, the target is the std of the resonance frequency by `resonance_uncertainty` instead, `freqs` are needed then, in shape (channels, points) if the channels sweep different frequencies.\n
+    * polar: the gettable is `real_imag=False`.\n
+    * grid_shape: (slow points, fast points) for a 2D sweep, only the snr target works for it.\n
+    * min_chunks: the noise is estimated from the chunks, so don't stop before this many of them.\n
+    ----
+    The returned dataset has the attrs "n_avg" (effective repetitions), "avg_chunks" and "avg_metric" (the final snr or Hz).
+    """
+    if fr_err_Hz > 0 and (freqs is None or grid_shape is not None):
+        raise ValueError("The resonance uncertainty target needs the 1D `freqs`, use the snr target for a 2D sweep.")
+    min_chunks = max(int(min_chunks), 2)
+    chunk = max(int(min(chunk, n_avg//min_chunks)), 1)
+    freqs = None if freqs is None else np.atleast_2d(freqs)
+    quantum_device.cfg_sched_repetitions(chunk)
+    stats = RunningSignal()
+    metric = np.inf if fr_err_Hz > 0 else 0.0
+    while stats.repetitions + chunk <= n_avg or stats.chunks < min_chunks:
+        start = time.time()
+        ds = meas_ctrl.run(exp_name)
+        stats.add(dataset_signals(ds, polar), chunk)
+        if stats.chunks < min_chunks:
+            continue
+        sem = stats.pooled_sem
+        if fr_err_Hz > 0:
+            metric = max(resonance_uncertainty(freqs[min(idx,freqs.shape[0]-1)], stats.mean[idx], sem[idx]) for idx in range(stats.mean.shape[0]))
+            reached = metric <= fr_err_Hz
+            slightly_print(f"{stats.repetitions} averages: fr std = {round(metric*1e-3,1)} kHz ({round(time.time()-start,1)} s/chunk)")
+        else:
+            metric = min(peak_to_noise(stats.mean[idx], sem[idx], grid_shape) for idx in range(stats.mean.shape[0]))
+            reached = metric >= snr
+            slightly_print(f"{stats.repetitions} averages: peak/noise = {round(metric,1)} ({round(time.time()-start,1)} s/chunk)")
+        if reached:
+            break
+    else:
+        warning_print(f"The averaging target isn't reached with n_avg = {stats.repetitions}")
+    averaged_ds = signals_to_dataset(ds, stats.mean, polar)
+    averaged_ds.attrs.update({"n_avg":stats.repetitions, "avg_chunks":stats.chunks, "avg_metric":float(metric)})
+    return averaged_ds
+
+
+def benchmark_adaptive_average(points:int=200, contrast:float=1.0, shot_noise:float=4, snr:float=10, chunk:int=100, n_avg:int=5000, repeat:int=20)->dict:
+    """
+    A Lorentzian dip with white shot noise instead of the instruments, the repetitions `adaptive_average_run` uses against the fixed `n_avg`.
+    """
+    freqs = np.linspace(-5e6, 5e6, points)
+    used = []
+    for seed in range(repeat):
+        rng = np.random.default_rng(seed)
+        class _Device():
+            def cfg_sched_repetitions(self, reps):
+                self.reps = reps
+        class _MeasCtrl():
+            def run(self, name):
+                noise = shot_noise/np.sqrt(device.reps)*(rng.standard_normal(points)+1j*rng.standard_normal(points))/np.sqrt(2)
+                signal = 1 - contrast*lorentzian(freqs, 0.3e6, 1e6, 1, 0) + noise
+                return Dataset(data_vars=dict(y0=(["dim_0"],signal.real), y1=(["dim_0"],signal.imag)), coords=dict(x0=(["dim_0"],freqs)))
+        device = _Device()
+        used.append(adaptive_average_run(device, _MeasCtrl(), "benchmark", n_avg, chunk=chunk, snr=snr).attrs["n_avg"])
+    slightly_print(f"peak/noise >= {snr}: {round(np.mean(used))} averages on average (max {max(used)}) against the fixed n_avg = {n_avg}, x{round(n_avg/np.mean(used),1)} less time")
+    return {"adaptive":float(np.mean(used)), "fixed":n_avg}
+
+
+if __name__ == "__main__":
+    benchmark_adaptive_average()
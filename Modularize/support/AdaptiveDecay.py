@@ -0,0 +1,198 @@
+"""
+Adaptive delay sampling for the T1 and T2 (Ramsey) estimations.\n
+A few delays are measured first, then every round fits all the visited points and picks the next batch of delays where they shrink the variance of T1 (T2) most,
+by the Fisher information of the fitted model. It stops when the relative uncertainty of T1 (T2) from the fit covariance reaches the target.\n
+`AdaptiveDecayEstimator` only does the bookkeeping, the measurement of a batch is done by the caller, like `m13_T1.T1_adaptive` and `m12_T2.Ramsey_adaptive`.
+"""
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+import xarray as xr
+from Modularize.support.Pulse_schedule_library import T1_func, Ramsey_func, Ramsey_func_model, FitRecord, T1_fit_analysis
+from Modularize.support.FitPool import fit_a_job, fit_para_names, para_column
+from Modularize.support.UserFriend import *
+
+model_funcs = {"T1":T1_func, "T2":Ramsey_func}
+# the Ramsey needs a uniform start to resolve the oscillation, the T1 only needs the decay shape
+initial_points:dict = {"T1":8, "T2":30}
+# the delays are on the 4 ns grid of the sequencers
+delay_resolution:float = 4e-9
+
+
+def model_jacobian(model:str, params:np.ndarray, delays:np.ndarray)->np.ndarray:
+    """ d(model)/d(para) on the delays in shape (delays, paras), by the central difference with a relative step. """
+    delays = np.asarray(delays, dtype=float)
+    params = np.asarray(params, dtype=float)
+    jac = np.empty((delays.shape[0], params.shape[0]))
+    for idx in range(params.shape[0]):
+        step = 1e-6*max(abs(params[idx]), 1e-12)
+        upper, lower = params.copy(), params.copy()
+        upper[idx] += step
+        lower[idx] -= step
+        jac[:,idx] = (model_funcs[model](delays,*upper)-model_funcs[model](delays,*lower))/(2*step)
+    return jac
+
+def greedy_delays(model:str, params:np.ndarray, sigma:float, visited:np.ndarray, candidates:np.ndarray, batch:int)->np.ndarray:
+    """
+    Pick `batch` delays from the candidates one by one, every pick shrinks the variance of T1 (T2) most with the visited ones (a candidate can be picked again).\n
+    The covariance is updated by Sherman-Morrison after every pick, so it's one Jacobian of the candidates for the whole batch.
+    """
+    target = para_column(model, model)
+    fisher = model_jacobian(model, params, visited)
+    fisher = fisher.T @ fisher / sigma**2
+    covar = np.linalg.pinv(fisher + 1e-12*np.trace(fisher)*np.eye(fisher.shape[0]))
+    jac = model_jacobian(model, params, candidates)
+    picked = []
+    for _ in range(int(batch)):
+        u = jac @ covar
+        denom = sigma**2 + np.sum(u*jac, axis=1)
+        best = int(np.argmax(u[:,target]**2/denom))
+        picked.append(candidates[best])
+        covar = covar - np.outer(u[best], u[best])/denom[best]
+    return np.array(picked)
+
+
+class AdaptiveDecayEstimator():
+    """
+    Keep the visited delays and data of an adaptive T1 ('T1') or Ramsey ('T2') estimation.\n
+    ### Args:\n
+    * max_delay: the longest delay (sec), the candidates are on the 4 ns grid in [0, max_delay].\n
+    * rel_err: stop when the std of T1 (T2) over its value is below it.\n
+    * batch: delays measured in a round after the first one.\n
+    * max_points: stop when this many points are visited anyway.\n
+    * guess: T1 (T2) guess for the fit, 0 for max_delay/3.\n
+    * resolution: the candidates are on this grid, like 8 ns times the echo pi number for the spin echo.
+    """
+    def __init__(self, model:str, max_delay:float, rel_err:float=0.05, batch:int=10, max_points:int=200, candidates:int=400, guess:float=0, resolution:float=delay_resolution):
+        if model not in model_funcs:
+            raise KeyError(f"Unsupported model = '{model}', it should be in {list(model_funcs.keys())}")
+        self.model = model
+        self.rel_err = rel_err
+        self.batch = int(batch)
+        self.max_points = int(max_points)
+        self.guess = guess if guess > 0 else max_delay/3
+        grid = np.linspace(0, max_delay, int(candidates))
+        self.candidates = np.unique(np.round(grid/resolution)*resolution)
+        self.delays = np.array([])
+        self.data = np.array([])
+        self.IQ = np.empty((2,0))
+        self.params = np.full(len(fit_para_names[model]), np.nan)
+        self.uncertainty = np.inf
+        self.rounds = []
+
+    @property
+    def estimate(self)->float:
+        return float(self.params[para_column(self.model, self.model)])
+
+    @property
+    def done(self)->bool:
+        return self.uncertainty <= self.rel_err or self.delays.shape[0] >= self.max_points
+
+    def next_delays(self)->np.ndarray:
+        """ The delays to measure in the next round, the first round is uniform. """
+        if self.delays.shape[0] == 0:
+            idx = np.linspace(0, self.candidates.shape[0]-1, initial_points[self.model]).astype(int)
+            return self.candidates[idx]
+        batch = min(self.batch, self.max_points-self.delays.shape[0])
+        if not np.isfinite(self.params).all():
+            # no usable fit yet, fill the candidates between the visited ones
+            offset = (len(self.rounds)*7) % self.candidates.shape[0]
+            return self.candidates[(offset+np.linspace(0, self.candidates.shape[0]-1, batch).astype(int)) % self.candidates.shape[0]]
+        residual = self.data - model_funcs[self.model](self.delays, *self.params)
+        sigma = max(float(np.std(residual)), 1e-9*max(np.abs(self.data).max(), 1e-12))
+        return greedy_delays(self.model, self.params, sigma, self.delays, self.candidates, batch)
+
+    def _fit(self)->tuple:
+        """ Like `fit_a_job`. After the first round the Ramsey starts from the last fit, it's closer than the periodogram guess of `T2_fit_analysis` for the non-uniform delays. """
+        if self.model == "T2" and np.isfinite(self.params).all():
+            names = fit_para_names["T2"]
+            try:
+                result = Ramsey_func_model.fit(self.data, D=self.delays, **dict(zip(names, self.params)))
+            except Exception:
+                return np.full(len(names),np.nan), np.full((len(names),len(names)),np.nan), False
+            covar = result.covar if result.covar is not None else np.full((len(names),len(names)),np.nan)
+            return np.array([result.best_values[name] for name in names]), covar, True
+        return fit_a_job((self.data, self.delays, self.model, self.guess))
+
+    def update(self, delays:np.ndarray, data:np.ndarray, IQ:np.ndarray=None)->float:
+        """ Add the measured points (and their raw [I, Q] for `to_dataset`), fit all the visited points and return the relative uncertainty of T1 (T2). """
+        delays = np.asarray(delays, dtype=float).reshape(-1)
+        IQ = np.full((2,delays.shape[0]),np.nan) if IQ is None else np.asarray(IQ, dtype=float).reshape(2,-1)
+        self.delays = np.hstack([self.delays, delays])
+        self.data = np.hstack([self.data, np.asarray(data, dtype=float).reshape(-1)])
+        self.IQ = np.hstack([self.IQ, IQ])
+        order = np.argsort(self.delays, kind="stable")
+        self.delays, self.data, self.IQ = self.delays[order], self.data[order], self.IQ[:,order]
+        values, covar, ok = self._fit()
+        target = para_column(self.model, self.model)
+        if ok and np.isfinite(covar[target,target]) and values[target] > 0:
+            self.params = values
+            self.uncertainty = float(np.sqrt(covar[target,target])/values[target])
+        else:
+            self.params[:] = np.nan
+            self.uncertainty = np.inf
+        self.rounds.append({"points":int(self.delays.shape[0]), self.model:self.estimate, "rel_err":self.uncertainty})
+        return self.uncertainty
+
+    def result(self)->dict:
+        """ {model: estimate (sec), "rel_err", "params", "delays", "data", "rounds"}, the delays and data are all the visited points in order. """
+        return {self.model:self.estimate, "rel_err":self.uncertainty, "params":dict(zip(fit_para_names[self.model], self.params.tolist())),
+                "delays":self.delays, "data":self.data, "rounds":self.rounds}
+
+    def fit_record(self):
+        """ The `FitRecord` of the visited points for `Fit_analysis_plot`, like the params_only results of `T1_fit_analysis` and `T2_fit_analysis`. """
+        if self.model == "T1":
+            return T1_fit_analysis(data=self.data,freeDu=self.delays,T1_guess=self.guess if np.isnan(self.estimate) else self.estimate,params_only=True)
+        start = self.params if np.isfinite(self.params).all() else [np.ptp(self.data)/2, self.guess, 0, 0, np.mean(self.data)]
+        result = Ramsey_func_model.fit(self.data, D=self.delays, **dict(zip(fit_para_names["T2"], start)))
+        return FitRecord.from_result("T2","freeDu",self.delays,self.data,result,T2_fit=result.best_values['T2'],f=result.best_values['f'],phase=result.best_values['phase'])
+
+    def to_dataset(self)->xr.Dataset:
+        """ The visited points in the MeasurementControl layout (x0, y0, y1) with the estimate in attrs, so the T1/T2 analyses read it like the fixed-grid ones. """
+        return xr.Dataset(
+            data_vars=dict(y0=(["dim_0"],self.IQ[0]), y1=(["dim_0"],self.IQ[1])),
+            coords=dict(x0=(["dim_0"],self.delays)),
+            attrs={f"{self.model}_fit":self.estimate, "rel_err":self.uncertainty, "rounds":len(self.rounds), "adaptive":1},
+        )
+
+
+def run_adaptive(estimator:AdaptiveDecayEstimator, measure)->dict:
+    """
+    Measure round by round until the estimator is done. `measure(delays)` returns the data (same length as the delays) of the given delays, or (data, [I, Q]).
+    """
+    while not estimator.done:
+        delays = estimator.next_delays()
+        if delays.shape[0] == 0:
+            break
+        measured = measure(delays)
+        estimator.update(delays, *(measured if isinstance(measured, tuple) else (measured,)))
+        slightly_print(f"{estimator.rounds[-1]['points']} points: {estimator.model} = {round(estimator.estimate*1e6,2)} µs +/- {round(estimator.uncertainty*100,1)} %")
+    return estimator.result()
+
+
+def simulated_measure(model:str, true_params:list, noise:float, seed:int=0):
+    """ A `measure` for `run_adaptive` without the instruments, the model with white noise of std `noise`. """
+    rng = np.random.default_rng(seed)
+    return lambda delays: model_funcs[model](np.asarray(delays),*true_params) + noise*rng.standard_normal(np.asarray(delays).shape[0])
+
+def benchmark_adaptive(model:str='T1', true_params:list=[1e-3,20e-6,0.5e-3], max_delay:float=120e-6, noise:float=0.05e-3, rel_err:float=0.05, repeat:int=20)->dict:
+    """
+    Points (= shots / n_avg) the adaptive estimation needs to reach `rel_err` against the fixed 100-point linear grid, and the relative uncertainties they end with.
+    """
+    fixed_points = 100
+    adaptive_points, adaptive_err, fixed_err = [], [], []
+    for seed in range(repeat):
+        measure = simulated_measure(model, true_params, noise, seed)
+        result = run_adaptive(AdaptiveDecayEstimator(model, max_delay, rel_err=rel_err), measure)
+        adaptive_points.append(result["delays"].shape[0])
+        adaptive_err.append(abs(result[model]/true_params[1]-1))
+        grid = np.linspace(0, max_delay, fixed_points)
+        values, _, ok = fit_a_job((measure(grid), grid, model, max_delay/3))
+        fixed_err.append(abs(values[para_column(model, model)]/true_params[1]-1) if ok else np.nan)
+    slightly_print(f"{model}: adaptive {round(np.mean(adaptive_points),1)} points (|error| {round(np.mean(adaptive_err)*100,2)} %), fixed grid {fixed_points} points (|error| {round(np.nanmean(fixed_err)*100,2)} %), shots x{round(fixed_points/np.mean(adaptive_points),1)} fewer")
+    return {"adaptive_points":float(np.mean(adaptive_points)), "adaptive_error":float(np.mean(adaptive_err)), "fixed_error":float(np.nanmean(fixed_err))}
+
+
+if __name__ == "__main__":
+    benchmark_adaptive('T1')
+    benchmark_adaptive('T2', true_params=[1e-3,15e-6,0.3e6,0,0.5e-3], max_delay=40e-6)
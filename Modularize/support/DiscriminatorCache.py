@@ -0,0 +1,276 @@
+"""
+Per-qubit discriminator registry for the repeated single-shot analyses.\n
+A discriminator is trained once by `single_shot_EM` and kept as a json file in the folder `Discriminators` next to the QD file,
+keyed on the readout configuration of the qubit (rof, rop, RO duration, integration time, ro_atte and refIQ).
+Any change of them misses the key and the discriminator is trained again, `QDmanager.write_with_meas_option` forgets it explicitly.\n
+With the shared-sigma blobs the discrimination is a threshold on the projection along the g-e axis, so thousands of single-shot files are predicted at once,
+and the same rotation and threshold run on the instrument by the thresholded acquisition, see `thresholded_acq_settings`.
+"""
+import os, sys, json, time, hashlib, tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from xarray import Dataset, open_dataset
+from Modularize.support.Pulse_schedule_library import single_shot_EM, simulated_single_shots
+from Modularize.support.UserFriend import *
+try:
+    from netCDF4 import Dataset as NCfile
+except ImportError:
+    NCfile = None
+
+registry_folder_name = "Discriminators"
+# the shots loaded over it are kept in a memory-mapped temporary file
+OS_memmap_bytes:int = 2**30
+# h/k_B in K/Hz
+h_over_kB:float = 4.799243073e-11
+
+
+def readout_config(QD_agent, target_q:str)->dict:
+    """ The readout settings of the qubit which the discriminator depends on. """
+    qubit = QD_agent.quantum_device.get_element(target_q)
+    return {"rof":qubit.clock_freqs.readout(),"rop":qubit.measure.pulse_amp(),"ro_dura":qubit.measure.pulse_duration(),
+            "integration_time":qubit.measure.integration_time(),"ro_atte":QD_agent.Notewriter.get_DigiAtteFor(target_q,'ro'),"refIQ":QD_agent.refIQ[target_q]}
+
+def config_key(config:dict)->str:
+    """ sha256 of the readout config, numpy values count as their python ones. """
+    content = json.dumps(config, sort_keys=True, default=lambda obj: obj.tolist() if hasattr(obj,'tolist') else str(obj))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class GaussianDiscriminator():
+    """
+    Two isotropic Gaussian blobs with a shared sigma, `cg` and `ce` are the complex centers of |0> and |1> in the units of the trained shots.
+    """
+    def __init__(self, cg:complex, ce:complex, sigma:float):
+        self.cg = complex(cg)
+        self.ce = complex(ce)
+        self.sigma = float(sigma)
+
+    @classmethod
+    def train(cls, g_IQ:np.ndarray, e_IQ:np.ndarray, ref_IQ:list=None):
+        """ Fit the blobs on the |g> and |e> preparations, the blob closer to `ref_IQ` (the |g> reference point) is |0>. """
+        blobs = single_shot_EM(g_IQ, e_IQ)
+        model = cls(blobs['cg'], blobs['ce'], blobs['sigma'])
+        if ref_IQ is not None:
+            ref = complex(ref_IQ[0], ref_IQ[-1])
+            if abs(model.ce-ref) < abs(model.cg-ref):
+                model.cg, model.ce = model.ce, model.cg
+        return model
+
+    def projection(self, I:np.ndarray, Q:np.ndarray)->np.ndarray:
+        """ The shots projected on the g-e axis in units of sigma, 0 at the threshold and positive for |1>. """
+        axis = (self.ce-self.cg)/abs(self.ce-self.cg)
+        center = (self.cg+self.ce)/2
+        return ((np.asarray(I)-center.real)*axis.real+(np.asarray(Q)-center.imag)*axis.imag)/self.sigma
+
+    def predict(self, I:np.ndarray, Q:np.ndarray)->np.ndarray:
+        """ The states (0 or 1) of the shots, any shape. """
+        return (self.projection(I,Q) > 0).astype(int)
+
+    def populations(self, I:np.ndarray, Q:np.ndarray)->np.ndarray:
+        """ [p0, p1] along the last axis (shots), so `I` in shape (files, shots) gives (files, 2) at once. """
+        p1 = np.mean(self.projection(I,Q) > 0, axis=-1)
+        return np.stack([1-p1, p1], axis=-1)
+
+    def thresholded_acq_settings(self)->dict:
+        """
+        {"rotation":deg,"threshold":V} of the instrument's thresholded acquisition, the rotation turns the g-e axis onto +I and the threshold is the middle of the centers on it.
+        """
+        rotation = np.mod(-np.angle(self.ce-self.cg), 2*np.pi)
+        threshold = (np.exp(1j*rotation)*(self.cg+self.ce)).real/2
+        return {"rotation":float(np.rad2deg(rotation)),"threshold":float(threshold)}
+
+    def scaled(self, factor:float):
+        """ The same discriminator for the shots in other units, like 1000 for the ones trained in V predicting the shots in mV. """
+        return GaussianDiscriminator(self.cg*factor, self.ce*factor, self.sigma*abs(factor))
+
+    def to_dict(self)->dict:
+        return {"cg":[self.cg.real,self.cg.imag],"ce":[self.ce.real,self.ce.imag],"sigma":self.sigma}
+
+    @classmethod
+    def from_dict(cls, content:dict):
+        return cls(complex(*content["cg"]), complex(*content["ce"]), content["sigma"])
+
+
+class DiscriminatorRegistry():
+    """
+    The discriminators of the qubits in `folder`, one json file `{q}.json` per qubit with the key of the readout config it was trained with.\n
+    Use `QD_registry(QD_agent)` for the one next to the QD file.
+    """
+    def __init__(self, folder:str):
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+
+    def __path(self, target_q:str)->str:
+        return os.path.join(self.folder, f"{target_q}.json")
+
+    def get(self, target_q:str, config:dict):
+        """ The discriminator trained with the same readout config, or None. """
+        if os.path.exists(self.__path(target_q)):
+            try:
+                with open(self.__path(target_q)) as json_file:
+                    content = json.load(json_file)
+            except Exception as err:
+                warning_print(f"Broken discriminator file is ignored: {err}")
+            else:
+                if content.get("key") == config_key(config):
+                    self.hits += 1
+                    return GaussianDiscriminator.from_dict(content["model"])
+        self.misses += 1
+        return None
+
+    def put(self, target_q:str, config:dict, model:GaussianDiscriminator, shots:int=0):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        content = {"key":config_key(config),"config":json.loads(json.dumps(config, default=lambda obj: obj.tolist() if hasattr(obj,'tolist') else str(obj))),
+                   "model":model.to_dict(),"shots":int(shots),"trained":time.strftime("%Y-%m-%d %H:%M:%S")}
+        tmp_path = self.__path(target_q)+".tmp"
+        with open(tmp_path,'w') as json_file:
+            json.dump(content,json_file,indent=1)
+        os.replace(tmp_path,self.__path(target_q))
+
+    def forget(self, target_q:str):
+        if os.path.exists(self.__path(target_q)):
+            os.remove(self.__path(target_q))
+
+    def get_or_train(self, target_q:str, config:dict, g_IQ:np.ndarray, e_IQ:np.ndarray)->GaussianDiscriminator:
+        """ The cached discriminator, or train one on the given |g> and |e> shots ([I, Q] each) and keep it. """
+        model = self.get(target_q, config)
+        if model is None:
+            model = GaussianDiscriminator.train(g_IQ, e_IQ, config.get("refIQ"))
+            self.put(target_q, config, model, shots=np.asarray(g_IQ).shape[-1])
+            slightly_print(f"Discriminator for {target_q} is trained and kept in {self.folder}")
+        return model
+
+    def get_stats(self)->dict:
+        return {"hits":self.hits,"misses":self.misses}
+
+
+def QD_registry(QD_agent)->DiscriminatorRegistry:
+    """ The registry in the folder `Discriminators` next to the QD file. """
+    return DiscriminatorRegistry(os.path.join(os.path.dirname(os.path.abspath(QD_agent.path.rstrip("/\\"))), registry_folder_name))
+
+def forget_discriminator(QD_path:str, target_q:str):
+    """ Drop the discriminator of the qubit kept next to the QD file. """
+    DiscriminatorRegistry(os.path.join(os.path.dirname(os.path.abspath(QD_path.rstrip("/\\"))), registry_folder_name)).forget(target_q)
+
+def thresholded_acq_settings(QD_agent, target_q:str)->dict:
+    """
+    {"rotation":deg,"threshold":V} from the discriminator kept for the current readout config of the qubit, they are also set into `measure.acq_rotation` and `measure.acq_threshold`.\n
+    {} if there isn't one, a single shot in the IQ mode trains it.
+    """
+    model = QD_registry(QD_agent).get(target_q, readout_config(QD_agent,target_q))
+    if model is None:
+        warning_print(f"No discriminator for the current readout of {target_q}, take the single shots in IQ once to train it.")
+        return {}
+    settings = model.thresholded_acq_settings()
+    qubit = QD_agent.quantum_device.get_element(target_q)
+    qubit.measure.acq_rotation(settings["rotation"])
+    qubit.measure.acq_threshold(settings["threshold"])
+    return settings
+
+def effective_temperature_mK(p01:float, transi_freq:float)->float:
+    """ The effective temperature (mK) of the thermal population p01 at f01 = transi_freq (Hz) by the Boltzmann ratio. """
+    if p01 <= 0 or p01 >= 0.5:
+        return 0.0 if p01 <= 0 else float('inf')
+    return float(h_over_kB*transi_freq/np.log((1-p01)/p01)*1000)
+
+def read_SS_shots(nc_path:str)->tuple[np.ndarray, np.ndarray]:
+    """ ([I, Q] of |g>, [I, Q] of |e>) of a single-shot nc, by netCDF4 directly if it's there, it skips the decoding of xarray. """
+    if NCfile is not None:
+        with NCfile(nc_path) as nc:
+            nc.set_auto_mask(False)
+            return nc['g'][:], nc['e'][:]
+    with open_dataset(nc_path) as SS_ds:
+        return SS_ds['g'].values, SS_ds['e'].values
+
+def load_OS_shots(nc_paths:list, dtype=np.float32, scale:float=1)->np.ndarray:
+    """
+    The shots of the single-shot nc files in shape (IQ, state, files, shots) like the `OS_data` of the analyses, in V times `scale` (1000 for mV).\n
+    The `g` and `e` of every file are read straight into one preallocated array, it's memory-mapped to a temporary file if it's over `OS_memmap_bytes`.
+    `OS_data[:,:,idx]` is the view of the idx-th file. The files must have the same shots.
+    """
+    if len(nc_paths) == 0:
+        return np.empty((2, 2, 0, 0), dtype=dtype)
+    shots = read_SS_shots(nc_paths[0])[0].shape[-1]
+    shape = (2, 2, len(nc_paths), shots)
+    if np.prod(shape)*np.dtype(dtype).itemsize > OS_memmap_bytes:
+        OS_data = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+    else:
+        OS_data = np.empty(shape, dtype=dtype)
+    for idx, path in enumerate(nc_paths):
+        g_IQ, e_IQ = read_SS_shots(path)
+        if g_IQ.shape[-1] != shots or e_IQ.shape[-1] != shots:
+            raise ValueError(f"{os.path.split(path)[-1]} has {g_IQ.shape[-1]} shots but {shots} are expected.")
+        OS_data[:,0,idx] = g_IQ
+        OS_data[:,1,idx] = e_IQ
+    if scale != 1:
+        OS_data *= scale
+    return OS_data
+
+def OS_populations(model:GaussianDiscriminator, OS_data:np.ndarray)->np.ndarray:
+    """ OS_data in shape (IQ, state, files, shots), return the populations in shape (files, prepared state, [p0, p1]). """
+    return np.moveaxis(model.populations(OS_data[0], OS_data[1]), 0, 1)
+
+
+def benchmark_discriminator_cache(files:int=1000, shots:int=10000, folder:str='')->dict:
+    """
+    Simulated single-shot files instead of the instruments, training a discriminator for every file against one cached discriminator predicting all of them at once.
+    """
+    import tempfile
+    datas = [simulated_single_shots(shots, seed=seed) for seed in range(files)]
+    OS_data = np.moveaxis(np.array([[data['g'], data['e']] for data in datas]), [0,1,2], [2,1,0])
+    config = {"rof":5.9e9,"rop":0.2,"ro_dura":1e-6,"integration_time":1e-6,"ro_atte":20,"refIQ":[1,1]}
+    start = time.time()
+    retrained = np.array([GaussianDiscriminator.train(data['g'], data['e'], config["refIQ"]).populations(np.array([data['g'][0],data['e'][0]]), np.array([data['g'][1],data['e'][1]])) for data in datas])
+    retrain_cost = time.time()-start
+    registry = DiscriminatorRegistry(folder if folder != '' else tempfile.mkdtemp())
+    start = time.time()
+    registry.get_or_train('q0', config, OS_data[:,0,0], OS_data[:,1,0])
+    train_cost = time.time()-start
+    start = time.time()
+    cached = OS_populations(registry.get_or_train('q0', config, OS_data[:,0,0], OS_data[:,1,0]), OS_data)
+    cached_cost = time.time()-start
+    diff = float(np.max(np.abs(cached-retrained)))
+    # the rotation and threshold of the thresholded acquisition give the same states
+    settings = registry.get('q0', config).thresholded_acq_settings()
+    rotated = np.exp(1j*np.deg2rad(settings["rotation"]))*(OS_data[0]+1j*OS_data[1])
+    bits_diff = float(np.max(np.abs(np.moveaxis(np.mean(rotated.real > settings["threshold"], axis=-1)[...,np.newaxis], 0, 1)[...,0]-cached[...,1])))
+    slightly_print(f"thresholded acquisition: max |population diff| {round(bits_diff,6)}, {OS_data[...,0].size*8*shots} bytes of IQ against {cached[...,1].size*8} bytes of populations")
+    slightly_print(f"{files} files x {shots} shots: retrain every file {round(retrain_cost,2)} s, cached {round(cached_cost,3)} s (+{round(train_cost,3)} s to train once), x{round(retrain_cost/(cached_cost+train_cost),1)}; max |population diff| {round(diff,4)}")
+    return {"retrain":retrain_cost,"cached":cached_cost,"train":train_cost,"max_diff":diff,"thresholded_diff":bits_diff}
+
+def benchmark_OS_loading(files:int=300, shots:int=10000, folder:str='')->dict:
+    """
+    Simulated single-shot nc files, loading them by `Dataset.to_dict` into the nested lists (the former loaders) against `load_OS_shots`.
+    """
+    folder = folder if folder != '' else tempfile.mkdtemp()
+    nc_paths = []
+    for seed in range(files):
+        data = simulated_single_shots(shots, seed=seed)
+        nc_paths.append(os.path.join(folder, f"DR0q0_SingleShot({seed})_H0M0S0.nc"))
+        Dataset.from_dict({"e":{"dims":("I","Q"),"data":data['e']},"g":{"dims":("I","Q"),"data":data['g']}}).to_netcdf(nc_paths[-1])
+    start = time.time()
+    pgI_collection, pgQ_collection, peI_collection, peQ_collection = [], [], [], []
+    for path in nc_paths:
+        with open_dataset(path) as SS_ds:
+            ss_dict = Dataset.to_dict(SS_ds)
+        pe_I, pe_Q = ss_dict['data_vars']['e']['data']
+        pg_I, pg_Q = ss_dict['data_vars']['g']['data']
+        pgI_collection.append(pg_I)
+        pgQ_collection.append(pg_Q)
+        peI_collection.append(pe_I)
+        peQ_collection.append(pe_Q)
+    listed = 1000*np.array([[pgI_collection,peI_collection],[pgQ_collection,peQ_collection]])
+    list_cost = time.time()-start
+    start = time.time()
+    loaded = load_OS_shots(nc_paths, scale=1000)
+    load_cost = time.time()-start
+    diff = float(np.max(np.abs(loaded-listed)))
+    slightly_print(f"{files} files x {shots} shots: to_dict lists {round(list_cost,2)} s ({round(listed.nbytes/1e6,1)} MB), load_OS_shots {round(load_cost,2)} s ({round(loaded.nbytes/1e6,1)} MB), x{round(list_cost/load_cost,1)}; max |diff| {diff:.2e} mV")
+    return {"to_dict":list_cost,"load":load_cost,"max_diff":diff}
+
+
+if __name__ == "__main__":
+    benchmark_discriminator_cache()
+    benchmark_OS_loading()
@@ -0,0 +1,149 @@
+"""
+Process pool for fitting many T1/T2 traces at once.\n
+A job is a tuple (data, freeDu, model, guess) with model in 'T1' or 'T2', every job is fitted by `T1_fit_analysis` or `T2_fit_analysis` with `params_only=True`.
+The results come back in compact arrays instead of one xr.Dataset per trace.
+"""
+import os, sys, time, atexit
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from Modularize.support.Pulse_schedule_library import T1_fit_analysis, T2_fit_analysis
+from Modularize.support.UserFriend import *
+
+# parameter order in the returned arrays
+fit_para_names = {"T1":["A","T1","offset"],"T2":["A","T2","f","phase","offset"]}
+
+_fit_pool = None
+_fit_pool_size = 0
+
+
+def fit_a_job(job:tuple)->tuple:
+    """
+    Fit one (data, freeDu, model, guess) job. Return (best values, covariance, success), covariance is filled by NaN if lmfit can't estimate it.\n
+    Only the failures of the fit itself (like NaN from the model or no convergence) count as unsuccessful, the others are raised.
+    """
+    data, freeDu, model, guess = job
+    data, freeDu = np.asarray(data), np.asarray(freeDu)
+    if model not in fit_para_names:
+        raise KeyError(f"Unsupported fitting model = '{model}'")
+    n = len(fit_para_names[model])
+    try:
+        if model == 'T1':
+            record = T1_fit_analysis(data,freeDu,T1_guess=guess,params_only=True)
+        else:
+            record = T2_fit_analysis(data,freeDu,T2_guess=guess,params_only=True)
+    except (ValueError, RuntimeError, FloatingPointError, np.linalg.LinAlgError):
+        return np.full(n,np.nan), np.full((n,n),np.nan), False
+    values = np.array([record.best_values[name] for name in fit_para_names[model]])
+    covar = record.covar if record.covar is not None else np.full((n,n),np.nan)
+    return values, covar, True
+
+def get_fit_pool(processes:int=0):
+    """ The pool shared by all the analyses in a python process, it's created at the first call. processes=0 for all the cores. """
+    global _fit_pool, _fit_pool_size
+    processes = cpu_count() if processes <= 0 else processes
+    if _fit_pool is None or _fit_pool_size != processes:
+        close_fit_pool()
+        _fit_pool = Pool(processes)
+        _fit_pool_size = processes
+    return _fit_pool
+
+def close_fit_pool():
+    global _fit_pool, _fit_pool_size
+    if _fit_pool is not None:
+        _fit_pool.close()
+        _fit_pool.join()
+    _fit_pool, _fit_pool_size = None, 0
+
+atexit.register(close_fit_pool)
+
+def fit_jobs(jobs:list, processes:int=0, chunksize:int=0, serial_below:int=16)->tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fit all the jobs across the cores.\n
+    ### Args:\n
+    * jobs: [(data, freeDu, 'T1' or 'T2', T1/T2 guess), ...]\n
+    * processes: pool size, 0 for all the cores.\n
+    * chunksize: jobs sent to a worker at once, 0 for about 4 chunks per worker.\n
+    * serial_below: less jobs than this are fitted in this process, it's faster than sending them.\n
+    ### Returns:\n
+    params in shape (jobs, paras), covars in shape (jobs, paras, paras) and success in shape (jobs,).\n
+    paras is the longest one in `fit_para_names` for the given models, the unused columns are NaN. The failed jobs are NaN too.
+    """
+    width = max([len(fit_para_names[job[2]]) for job in jobs]) if len(jobs) != 0 else max([len(names) for names in fit_para_names.values()])
+    params = np.full((len(jobs),width),np.nan)
+    covars = np.full((len(jobs),width,width),np.nan)
+    success = np.zeros(len(jobs),dtype=bool)
+    if len(jobs) == 0:
+        return params, covars, success
+
+    if len(jobs) < serial_below:
+        results = [fit_a_job(job) for job in jobs]
+    else:
+        pool = get_fit_pool(processes)
+        if chunksize <= 0:
+            chunksize = max(1, len(jobs)//(4*_fit_pool_size))
+        results = pool.map(fit_a_job, jobs, chunksize=chunksize)
+
+    for idx, (values, covar, ok) in enumerate(results):
+        n = values.shape[0]
+        params[idx,:n] = values
+        covars[idx,:n,:n] = covar
+        success[idx] = ok
+    return params, covars, success
+
+def para_column(model:str, para_name:str)->int:
+    """ The column index of `para_name` in the params from `fit_jobs`, like para_column('T1','T1') = 1. """
+    return fit_para_names[model].index(para_name)
+
+
+def simulated_T1_traces(trace_number:int, points:int=100, seed:int=0):
+    """ Noisy T1 decays with T1 in 5~30 µs over 60 µs. Return freeDu, traces in shape (trace_number, points) and the true T1s. """
+    rng = np.random.default_rng(seed)
+    freeDu = np.linspace(0,60e-6,points)
+    T1_true = rng.uniform(5e-6,30e-6,trace_number)
+    traces = 1e-3*np.exp(-freeDu[None,:]/T1_true[:,None]) + 0.5e-3 + 0.02e-3*rng.standard_normal((trace_number,points))
+    return freeDu, traces, T1_true
+
+def benchmark_fit_latency(trace_number:int=500, points:int=100)->dict:
+    """
+    Per-fit latency of `T1_fit_analysis` with the former setup (xr.Dataset with the fitting curve, data[-1] guesses) and with `params_only=True` and the log-linear guess.\n
+    Also report the mean function evaluations lmfit needs in both cases.
+    """
+    freeDu, traces, _ = simulated_T1_traces(trace_number, points)
+    costs, nfevs = {}, {}
+    for label, kwargs in {"dataset":dict(linear_guess=False),"params_only":dict(params_only=True)}.items():
+        start = time.time()
+        for trace in traces:
+            T1_fit_analysis(trace,freeDu,T1_guess=10e-6,**kwargs)
+        costs[label] = (time.time()-start)/trace_number
+        nfevs[label] = np.mean([T1_fit_analysis(trace,freeDu,T1_guess=10e-6,params_only=True,linear_guess=kwargs.get("linear_guess",True)).nfev for trace in traces])
+    slightly_print(f"T1 fit latency: dataset {round(costs['dataset']*1e3,2)} ms ({round(nfevs['dataset'],1)} nfev), params_only {round(costs['params_only']*1e3,2)} ms ({round(nfevs['params_only'],1)} nfev)")
+    return {"latency":costs,"nfev":nfevs}
+
+def benchmark_fit_pool(trace_number:int=5000, points:int=100, processes:int=0)->dict:
+    """
+    Fit `trace_number` simulated T1 traces by `T1_fit_analysis` one after another and by `fit_jobs`, compare the costs and the fitted T1.
+    """
+    freeDu, traces, _ = simulated_T1_traces(trace_number, points)
+    jobs = [(traces[i],freeDu,'T1',10e-6) for i in range(trace_number)]
+
+    start = time.time()
+    serial_T1 = []
+    for i in range(trace_number):
+        serial_T1.append(T1_fit_analysis(traces[i],freeDu,T1_guess=10e-6).attrs['T1_fit'])
+    serial_cost = time.time()-start
+
+    start = time.time()
+    params, covars, success = fit_jobs(jobs, processes)
+    pool_cost = time.time()-start
+    pool_T1 = params[:,para_column('T1','T1')]
+
+    max_diff = float(np.nanmax(np.abs(pool_T1-np.array(serial_T1))))
+    slightly_print(f"{trace_number} T1 traces: serial {round(serial_cost,1)} s, pool({_fit_pool_size} processes) {round(pool_cost,1)} s, speedup x{round(serial_cost/pool_cost,1)}")
+    slightly_print(f"failed fits = {int((~success).sum())}, max |T1 difference| = {max_diff} s")
+    return {"serial":serial_cost,"pool":pool_cost,"max_T1_diff":max_diff}
+
+
+if __name__ == "__main__":
+    benchmark_fit_latency(500)
+    benchmark_fit_pool(5000)
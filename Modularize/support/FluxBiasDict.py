@@ -1,4 +1,4 @@
-from numpy import array, ndarray, sin, sqrt, cos, pi, real
+from numpy import array, ndarray, sin, sqrt, cos, pi, real, isnan
 from Modularize.support.UserFriend import *
 
 # TODO: Test this class to store the bias info
@@ -185,27 +185,23 @@ class FluxBiasDict():
     def get_biasWithFq_from(self,target_q:str,target_fq_Hz:float, flux_guard:float=0.4):
         """
         After we fit the tarnsition freq vs bias, we can get the bias according to the given `target_fq_Hz` for the `target_q`.\n
-        ### The given `target_fq_Hz` should unit in Hz.\n
-        Return the bias unit in V.
+        ### The given `target_fq_Hz` should unit in Hz, it can be an array.\n
+        Return the bias unit in V. For an array it returns an array with NaN where the fq can't be reached, for a float it returns 'n'.
         """
-        import sympy as sp
-        from Modularize.support import find_nearest
-        z = sp.Symbol('z',real=True)
+        from Modularize.analysis.FqBiasSolver import biases_for_fq
         if self.__bias_dict[target_q]["qubFitParas"] == []:
             raise ValueError("You have NOT fit the transition frequency with bias!")
 
-        a,b,Ec,Ej_sum,d = self.__bias_dict[target_q]["qubFitParas"][0], self.__bias_dict[target_q]["qubFitParas"][1], self.__bias_dict[target_q]["qubFitParas"][2], self.__bias_dict[target_q]["qubFitParas"][3], self.__bias_dict[target_q]["qubFitParas"][4]
-        to_solve = sp.sqrt(8*Ej_sum*Ec*sp.sqrt(sp.cos(a*(z-b))**2+d**2*sp.sin(a*(z-b))**2))-Ec - target_fq_Hz*1e-9
-
-        candidators = array(sp.solvers.solve(to_solve, z))
+        answer = biases_for_fq(target_fq_Hz,self.__bias_dict[target_q]["qubFitParas"],flux_guard)
         
-        if candidators.shape[0] == 0:
-            answer = 'n'
-            fq_max = self.fqEqn_for_qub(target_q,array([self.get_sweetBiasFor(target_q)]))[0]
-            warning_print(f"Can NOT find a bias makes the fq @ {target_fq_Hz*1e-9} GHz !")
-            warning_print(f"The max fq about this qubit = {fq_max} GHz")
-        else:
-            answer = find_nearest(candidators, 0) if abs(find_nearest(candidators, 0)) < flux_guard else flux_guard
+        if answer.ndim == 0:
+            if isnan(answer):
+                answer = 'n'
+                fq_max = self.fqEqn_for_qub(target_q,array([self.get_sweetBiasFor(target_q)]))[0]
+                warning_print(f"Can NOT find a bias makes the fq @ {target_fq_Hz*1e-9} GHz !")
+                warning_print(f"The max fq about this qubit = {fq_max} GHz")
+            else:
+                answer = float(answer)
 
         return answer
 
@@ -0,0 +1,142 @@
+"""
+Model-guided flux-qubit tracking, instead of the full frequency x flux maps.\n
+The biases are visited from the sweet spot outwards. At every bias only a narrow window centered on the `FqEqn` prediction is measured,
+the found f01 refits the model right away, so the next prediction follows the measured curve.
+The window is widened only when the peak is lost, and narrowed back when it's found again.\n
+`FluxFqTracker` only does the bookkeeping, the measurement of a window is `measure(bias, freqs)` given by the caller, like `m9_FluxQubit.Zgate_track_spec`.
+"""
+import os, sys, warnings
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from scipy.optimize import curve_fit, OptimizeWarning
+from Modularize.analysis.FqBiasSolver import FqEqn
+from Modularize.support.ZoomSpectroscopy import lorentzian_location, peak_snr
+from Modularize.support.UserFriend import *
+
+# the fitting paras are [a, b, Ec, Ej_sum, d], the fewer points the fewer of them are refitted.
+# Ec is kept, f01 alone hardly tells it from Ej_sum and the fit wanders between them.
+refit_paras = {1:[3], 2:[1,3], 3:[1,3], 4:[1,3,4]}
+full_refit_paras = [0,1,3,4]
+
+
+def initial_fq_paras(period:float, sweet_bias:float, f01_sweet_Hz:float, Ec_guess_GHz:float=0.21, squid_ratio_guess:float=0.5)->list:
+    """ [a, b, Ec, Ej_sum, d] from the flux period and the f01 at the sweet spot, like `set_fitting_paras` with Ej_sum solved from FqEqn(b) = f01. """
+    Ej_sum = (f01_sweet_Hz*1e-9+Ec_guess_GHz)**2/(8*Ec_guess_GHz)
+    return [np.pi/period, sweet_bias, Ec_guess_GHz, Ej_sum, squid_ratio_guess]
+
+def fq_paras_bounds(fitting_popts:list)->tuple:
+    """ (lower, upper) of [a, b, Ec, Ej_sum, d], a in 30 % and b in a quarter period around the given ones. """
+    a, b = fitting_popts[0], fitting_popts[1]
+    quarter = np.pi/abs(a)/4
+    lower = [min(0.7*a,1.3*a), b-quarter, 0.05, 1, 0]
+    upper = [max(0.7*a,1.3*a), b+quarter, 0.6, 200, 1]
+    return lower, upper
+
+
+class FluxFqTracker():
+    """
+    Track f01 over the `biases` (V) with the `FqEqn` paras [a, b, Ec, Ej_sum, d] as the first model.\n
+    ### Args:\n
+    * window_Hz, points: the window around the prediction and its frequency points.\n
+    * widen: the window (and its points) is multiplied by it every time the peak is lost at a bias, the bias is given up over `max_window_Hz`.\n
+    * min_snr: a window shows the peak if it stands out by this times the point-to-point noise and isn't on the window edge.
+    """
+    def __init__(self, fitting_popts:list, biases:np.ndarray, window_Hz:float=30e6, points:int=21, widen:float=3, max_window_Hz:float=500e6, min_snr:float=4):
+        self.popts = [float(para) for para in fitting_popts]
+        self.bounds = fq_paras_bounds(self.popts)
+        biases = np.asarray(biases, dtype=float)
+        self.biases = biases[np.argsort(np.abs(biases-self.popts[1]), kind="stable")]
+        self.window_Hz = window_Hz
+        self.points = int(points)
+        self.widen = widen
+        self.max_window_Hz = max_window_Hz
+        self.min_snr = min_snr
+        self.__width = window_Hz
+        self.found = []
+        self.lost = []
+        self.shots_points = 0
+
+    def predict(self, bias)->np.ndarray:
+        """ f01 (Hz) by the current model. """
+        return FqEqn(np.asarray(bias, dtype=float),*self.popts)*1e9
+
+    def window(self, bias:float)->np.ndarray:
+        """ The window around the prediction, a widened one has more points to keep the frequency step. """
+        center = float(self.predict(bias))
+        return np.linspace(center-self.__width/2, center+self.__width/2, int(round((self.points-1)*self.__width/self.window_Hz))+1)
+
+    def refit(self):
+        """ Refit the model with all the found points, only some paras when there are few points, the model is kept if the fit fails. """
+        bias, fq = np.array(self.found).T
+        free = refit_paras.get(bias.shape[0], full_refit_paras)
+        def partial_eqn(x, *values):
+            paras = list(self.popts)
+            for idx, value in zip(free, values):
+                paras[idx] = value
+            return FqEqn(x,*paras)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", OptimizeWarning) # no covariance with a single point
+                popt, _ = curve_fit(partial_eqn, bias, fq*1e-9, p0=[self.popts[i] for i in free], bounds=([self.bounds[0][i] for i in free],[self.bounds[1][i] for i in free]), x_scale='jac')
+        except (RuntimeError, ValueError):
+            return
+        if np.isfinite(popt).all():
+            for idx, value in zip(free, popt):
+                self.popts[idx] = float(value)
+
+    def update(self, bias:float, freqs:np.ndarray, data:np.ndarray)->bool:
+        """ Give the measured window at the bias, return True if this bias is done (found or given up), False to measure the wider window again. """
+        freqs, data = np.asarray(freqs, dtype=float), np.asarray(data, dtype=float)
+        self.shots_points += freqs.shape[0]
+        edge = int(np.argmax(data)) in [0, data.shape[0]-1]
+        if peak_snr(data) >= self.min_snr and not edge:
+            self.found.append((float(bias), lorentzian_location(freqs, data)))
+            self.refit()
+            self.__width = self.window_Hz
+            return True
+        self.__width *= self.widen
+        if self.__width > self.max_window_Hz:
+            self.lost.append(float(bias))
+            self.__width = self.window_Hz
+            warning_print(f"f01 is lost at {round(bias,4)} V, skip it.")
+            return True
+        return False
+
+    def run(self, measure)->dict:
+        """ Visit all the biases, `measure(bias, freqs)` returns the data (f01 as a peak) on the freqs at the bias. """
+        for bias in self.biases:
+            done = False
+            while not done:
+                freqs = self.window(bias)
+                done = self.update(bias, freqs, measure(bias, freqs))
+        return self.result()
+
+    def result(self)->dict:
+        """ {"fitting_popts", "bias", "fq" (Hz) of the found points sorted by bias, "lost", "points" measured} """
+        found = sorted(self.found)
+        return {"fitting_popts":list(self.popts), "bias":np.array([p[0] for p in found]), "fq":np.array([p[1] for p in found]), "lost":self.lost, "points":self.shots_points}
+
+
+def benchmark_tracking(true_popts:list=[np.pi/0.6, 0.02, 0.21, 35, 0.4], bias_span:float=0.2, bias_points:int=40, map_span_Hz:float=500e6, linewidth:float=3e6, noise:float=0.1, repeat:int=10)->dict:
+    """
+    A Lorentzian f01 peak on `FqEqn` with white noise instead of the instruments. The tracker starts from a model off by 2 % in a and 20 MHz at the sweet spot,
+    its measured points and max fq error against the full maps over `map_span_Hz` with the same biases and frequency step.
+    """
+    points, errors = [], []
+    for seed in range(repeat):
+        rng = np.random.default_rng(seed)
+        measure = lambda bias, freqs: 1/(1+((freqs-FqEqn(bias,*true_popts)*1e9)/(linewidth/2))**2) + noise*rng.standard_normal(freqs.shape[0])
+        guess = initial_fq_paras(0.98*np.pi/true_popts[0], true_popts[1], FqEqn(true_popts[1],*true_popts)*1e9+20e6, squid_ratio_guess=0.5)
+        tracker = FluxFqTracker(guess, true_popts[1]+np.linspace(-bias_span,bias_span,bias_points))
+        step = tracker.window_Hz/(tracker.points-1)
+        result = tracker.run(measure)
+        points.append(result["points"])
+        curve = np.linspace(true_popts[1]-bias_span, true_popts[1]+bias_span, 200)
+        errors.append(np.max(np.abs(FqEqn(curve,*result["fitting_popts"])-FqEqn(curve,*true_popts)))*1e9)
+    map_points = bias_points*int(map_span_Hz/step+1)
+    slightly_print(f"tracking: {round(np.mean(points))} points, max |fq error| {round(np.median(errors)*1e-6,2)} MHz; full maps: {map_points} points, x{round(map_points/np.mean(points),1)} fewer")
+    return {"track_points":float(np.mean(points)), "map_points":map_points, "fq_error_Hz":float(np.median(errors))}
+
+
+if __name__ == "__main__":
+    benchmark_tracking()
@@ -0,0 +1,156 @@
+"""
+MeasurementSession keeps one cluster connection, QDmanager and MeasurementControl alive for a long monitor.\n
+Instead of calling `init_meas()` and `shut_down()` around every histogram, open a session once and call `soft_reset()` between runs.
+"""
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from qblox_instruments import Cluster
+from quantify_core.measurement.control import MeasurementControl
+from quantify_scheduler.instrument_coordinator import InstrumentCoordinator
+from Modularize.support.QDmanager import QDmanager
+from Modularize.support.UserFriend import *
+from Modularize.support import init_meas, shut_down, reset_offset, init_system_atte, coupler_zctrl, get_dr_loca, QRM_nco_init
+
+
+class MeasurementSession():
+    """
+    Wrap the `QDmanager`, `Cluster`, `MeasurementControl`, `InstrumentCoordinator` and the `Fctrl`/`Cctrl` maps into a long-lived object.\n
+    ### Args:\n
+    * QD_path: the QD pkl file to load.\n
+    * couplers: coupler names to bias, like ['c0','c1'].\n
+    * cp_bias_where: 'idle', 'operation' or 'max', see `FluxBiasDict.build_Cctrl_instructions`.\n
+    * full_reset_every: do a complete `cluster.reset()` every N soft resets, 0 for never.\n
+    ### Example:\n
+    with MeasurementSession(QD_path, couplers=['c0']) as session:\n
+        for ith in range(100):\n
+            session.prepare_for('q0')\n
+            T1_executor(session.QD_agent,session.cluster,session.meas_ctrl,session.Fctrl,'q0',ith=ith)\n
+            session.soft_reset()
+    """
+    def __init__(self,QD_path:str,couplers:list=[],cp_bias_where:str='i',full_reset_every:int=0):
+        self.QD_path = QD_path
+        self.dr = get_dr_loca(QD_path).lower()
+        self.couplers = couplers
+        self.cp_bias_where = cp_bias_where
+        self.full_reset_every = full_reset_every
+
+        self.QD_agent:QDmanager = None
+        self.cluster:Cluster = None
+        self.meas_ctrl:MeasurementControl = None
+        self.ic:InstrumentCoordinator = None
+        self.Fctrl:dict = {}
+        self.Cctrl:dict = {}
+        self.Cctrl_bias:dict = {}
+        self.soft_reset_counts:int = 0
+
+    def is_open(self)->bool:
+        return self.cluster is not None
+
+    def open(self):
+        """
+        Connect to the cluster and load the QD file, only done once for the whole session.
+        """
+        if self.is_open():
+            return self
+        self.QD_agent, self.cluster, self.meas_ctrl, self.ic, self.Fctrl = init_meas(QuantumDevice_path=self.QD_path,mode='l')
+        self.Cctrl_bias = self.QD_agent.Fluxmanager.build_Cctrl_instructions(self.couplers,self.cp_bias_where)
+        self.Cctrl = coupler_zctrl(self.dr,self.cluster,self.Cctrl_bias)
+        self.soft_reset_counts = 0
+        return self
+
+    def prepare_for(self,target_q:str):
+        """
+        Set the attenuations of all the qubits in `Fctrl` to the ones of the target qubit in its Notebook, call it before each executor.
+        """
+        init_system_atte(self.QD_agent.quantum_device,list(self.Fctrl.keys()),xy_out_att=self.QD_agent.Notewriter.get_DigiAtteFor(target_q,'xy'),ro_out_att=self.QD_agent.Notewriter.get_DigiAtteFor(target_q,'ro'))
+
+    def bias_coupler(self,cp:str,bias:float):
+        """
+        Bias a coupler and remember it, so `hard_reset()` can apply it back.
+        """
+        self.Cctrl[cp](bias)
+        self.Cctrl_bias[cp] = bias
+
+    def soft_reset(self):
+        """
+        Cheap reset between 2 runs: stop the sequencers, zero all the qubit flux bias, init the QRM NCO delay compensation
+        and apply the coupler bias again (executors call `cluster.reset()` which zeros them).\n
+        Every `full_reset_every` times it does a `hard_reset()`.
+        """
+        self.ic.stop()
+        QRM_nco_init(self.cluster)
+        reset_offset(self.Fctrl)
+        for cp in self.Cctrl_bias:
+            self.Cctrl[cp](self.Cctrl_bias[cp])
+        self.soft_reset_counts += 1
+        if self.full_reset_every > 0 and self.soft_reset_counts % self.full_reset_every == 0:
+            self.hard_reset()
+
+    def hard_reset(self):
+        """
+        Complete cluster reset without reconnecting, NCO delay compensation and coupler bias are applied again.
+        """
+        self.cluster.reset()
+        QRM_nco_init(self.cluster)
+        reset_offset(self.Fctrl)
+        for cp in self.Cctrl_bias:
+            self.Cctrl[cp](self.Cctrl_bias[cp])
+
+    def reconnect(self):
+        """
+        Close everything and open the session again, for the case that the connection is broken.
+        """
+        warning_print("Session reconnecting...")
+        cp_bias = dict(self.Cctrl_bias)
+        self.close()
+        self.open()
+        for cp in cp_bias:
+            self.bias_coupler(cp,cp_bias[cp])
+
+    def close(self):
+        if self.is_open():
+            shut_down(self.cluster,self.Fctrl,self.Cctrl)
+        self.QD_agent, self.cluster, self.meas_ctrl, self.ic = None, None, None, None
+        self.Fctrl, self.Cctrl = {}, {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def benchmark_session_overhead(QD_path:str,iterations:int=20):
+    """
+    Compare the per-iteration overhead between `init_meas()`+`shut_down()` and `MeasurementSession.soft_reset()` with a mocked cluster.\n
+    Only the connection is mocked, QD_loader still unpickles the given QD file. Return the mean secs per iteration in a dict.
+    """
+    from unittest import mock
+    import Modularize.support as support
+
+    def fake_ctrl_loop(device,cluster,live_plotting:bool=False):
+        return mock.MagicMock(), mock.MagicMock()
+
+    with mock.patch.object(support,"Cluster",mock.MagicMock()), mock.patch.object(support,"configure_measurement_control_loop",fake_ctrl_loop):
+        start = time.time()
+        for _ in range(iterations):
+            QD_agent, cluster, meas_ctrl, ic, Fctrl = init_meas(QuantumDevice_path=QD_path,mode='l')
+            shut_down(cluster,Fctrl)
+        reconnect_cost = (time.time()-start)/iterations
+
+        session = MeasurementSession(QD_path).open()
+        start = time.time()
+        for _ in range(iterations):
+            session.soft_reset()
+        session_cost = (time.time()-start)/iterations
+        session.close()
+
+    slightly_print(f"init_meas + shut_down: {round(reconnect_cost*1e3,2)} ms/iteration")
+    slightly_print(f"session soft_reset: {round(session_cost*1e3,2)} ms/iteration")
+    return {"reconnect":reconnect_cost,"session":session_cost}
+
+
+if __name__ == "__main__":
+    QD_path = 'Modularize/QD_backup/2024_9_23/DR4#81_SumInfo.pkl'
+    benchmark_session_overhead(QD_path,iterations=20)
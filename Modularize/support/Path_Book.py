@@ -1,15 +1,19 @@
 """
     Path_book keeps the path indecated to the directories, and the object will be saved in the folder named by date.
 """
-import os, datetime, sys
+import os, datetime, sys, json
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
-from Modularize.support.UserFriend import eyeson_print
+from Modularize.support.UserFriend import eyeson_print, warning_print
 
 root = os.getcwd()
 # The directory for measurement raw data
 meas_raw_dir = os.path.join(root,'Modularize/Meas_raw')
 # The directory for qauntum device
 qdevice_backup_dir = os.path.join(root,'Modularize/QD_backup')
+# The directory for the compiled schedules cache
+sche_cache_dir = os.path.join(qdevice_backup_dir,'ScheduleCache')
+# The index of the QD pkl files in qdevice_backup_dir, it's in a sub-folder to keep the mtime of qdevice_backup_dir for the staleness check
+qd_index_path = os.path.join(qdevice_backup_dir,'QD_index','QD_index.json')
 
 
 def decode_datetime_2_foldername(date:datetime):
@@ -20,54 +24,119 @@ def decode_datetime_2_foldername(date:datetime):
     folder_name =  y+"_"+m+"_"+d
     return folder_name
 
+def foldername_2_date(folder_name:str):
+    """ '2024_5_31' -> datetime.date(2024,5,31), None if it's not a date folder like ScheduleCache. """
+    if len(folder_name.split("_")) != 3 or not folder_name.replace("_","").isdigit():
+        return None
+    try:
+        return datetime.date(*[int(i) for i in folder_name.split("_")])
+    except ValueError:
+        return None
+
+def decode_QD_filename(file_name:str):
+    """ 'DR2#171_SumInfo.pkl' or the state store 'DR2#171_SumInfo.qds' -> ('dr2','171'), None if it's not a QD file. """
+    if file_name.split(".")[-1] not in ['pkl','qds'] or "#" not in file_name:
+        return None
+    return file_name.split("#")[0].lower(), file_name.split("#")[-1].split("_")[0]
+
+def _QD_file_mtime(QD_path:str)->float:
+    """ For a state store folder it's the mtime of its meta.json, which is written at last. """
+    if os.path.isdir(QD_path):
+        QD_path = os.path.join(QD_path,"meta.json")
+    return os.path.getmtime(QD_path)
+
+def _QD_index_entry(date_folder:str,file_name:str)->dict:
+    dr, ip = decode_QD_filename(file_name)
+    return {"dr":dr,"ip":ip,"date":foldername_2_date(date_folder).isoformat(),"path":os.path.join(date_folder,file_name),"mtime":_QD_file_mtime(os.path.join(qdevice_backup_dir,date_folder,file_name))}
+
+def _newer_QD(entry:dict,than:dict)->bool:
+    return than is None or (entry["date"],entry["mtime"]) > (than["date"],than["mtime"])
+
+def _put_QD_entry(index:dict,entry:dict):
+    """ Record the entry and refresh the latest one for its dr and for its dr#ip. """
+    index["files"][entry["path"]] = entry
+    for key in [entry["dr"], f"{entry['dr']}#{entry['ip']}"]:
+        if _newer_QD(entry,index["latest"].get(key)):
+            index["latest"][key] = entry
+
+def _save_QD_index(index:dict):
+    os.makedirs(os.path.dirname(qd_index_path),exist_ok=True)
+    index["dir_mtime"] = os.path.getmtime(qdevice_backup_dir)
+    tmp_path = qd_index_path+".tmp"
+    with open(tmp_path,'w') as json_file:
+        json.dump(index,json_file,indent=1)
+    os.replace(tmp_path,qd_index_path)
+
+def build_QD_index()->dict:
+    """
+    Scan all the date folders in qdevice_backup_dir and rebuild the QD index file.\n
+    index = {"dir_mtime":float, "folders":{date_folder:mtime}, "files":{path:entry}, "latest":{"dr2":entry, "dr2#171":entry}}, entry = {"dr","ip","date","path","mtime"}.
+    """
+    index = {"dir_mtime":0,"folders":{},"files":{},"latest":{}}
+    for date_folder in os.listdir(qdevice_backup_dir):
+        folder_path = os.path.join(qdevice_backup_dir,date_folder)
+        if not os.path.isdir(folder_path) or foldername_2_date(date_folder) is None:
+            continue
+        index["folders"][date_folder] = os.path.getmtime(folder_path)
+        for name in os.listdir(folder_path):
+            is_QD_file = os.path.isfile(os.path.join(folder_path,name)) or os.path.isfile(os.path.join(folder_path,name,"meta.json"))
+            if is_QD_file and decode_QD_filename(name) is not None:
+                _put_QD_entry(index,_QD_index_entry(date_folder,name))
+    _save_QD_index(index)
+    return index
+
+def QD_index_is_stale(index:dict)->bool:
+    """
+    The index is stale if a folder is added or removed in qdevice_backup_dir, a file is added or removed in the newest date folder or a latest file is gone.
+    """
+    if abs(os.path.getmtime(qdevice_backup_dir)-index.get("dir_mtime",0)) > 1e-6:
+        return True
+    if index["folders"] != {}:
+        newest = max(index["folders"], key=foldername_2_date)
+        newest_path = os.path.join(qdevice_backup_dir,newest)
+        if not os.path.isdir(newest_path) or abs(os.path.getmtime(newest_path)-index["folders"][newest]) > 1e-6:
+            return True
+    return any([not os.path.exists(os.path.join(qdevice_backup_dir,entry["path"])) for entry in index["latest"].values()])
+
+def load_QD_index()->dict:
+    """ Load the QD index file, it's rebuilt if it doesn't exist, can't be read or is stale. """
+    try:
+        with open(qd_index_path) as json_file:
+            index = json.load(json_file)
+        if not QD_index_is_stale(index):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    eyeson_print("Rebuilding the QD index...")
+    return build_QD_index()
+
+def update_QD_index(QD_pkl_path:str):
+    """ Add the QD pkl just saved into the index, `QDmanager.QD_keeper` calls it. The files outside the date folders in qdevice_backup_dir are ignored. """
+    date_folder_path, file_name = os.path.split(os.path.abspath(QD_pkl_path))
+    date_folder = os.path.basename(date_folder_path)
+    if os.path.abspath(os.path.dirname(date_folder_path)) != os.path.abspath(qdevice_backup_dir) or foldername_2_date(date_folder) is None or decode_QD_filename(file_name) is None:
+        return
+    index = load_QD_index()
+    index["folders"][date_folder] = os.path.getmtime(date_folder_path)
+    _put_QD_entry(index,_QD_index_entry(date_folder,file_name))
+    _save_QD_index(index)
+
 def find_latest_QD_pkl_for_dr(which_dr:str,ip_label:str=''):
-    folders = [name for name in os.listdir(qdevice_backup_dir) if os.path.isdir(os.path.join(qdevice_backup_dir,name))]
-    date = []
-    for name in folders:
-        year_str = name.split("_")[0]
-        mon_str  = "0"+name.split("_")[1] if len(name.split("_")[1])==1 else name.split("_")[1]
-        day_str  = "0"+name.split("_")[2] if len(name.split("_")[2])==1 else name.split("_")[2]
-        date.append(datetime.datetime.strptime(day_str+mon_str+year_str, "%d%m%Y").date())
-    date.sort(reverse=True)
-    for date_obj_idx in range(len(date)):
-        date_folder = decode_datetime_2_foldername(date[date_obj_idx])
-        date_folder_path = os.path.join(qdevice_backup_dir,date_folder)
-        target_file_list = [name for name in os.listdir(date_folder_path) if (os.path.isfile(os.path.join(date_folder_path,name)) and (name.split(".")[-1]=='pkl' and name.split("#")[0].lower()==which_dr.lower()))]
-
-        if len(target_file_list) > 1:
-            if ip_label == '' :
-                for idx, name in enumerate(target_file_list):
-                    print(f"index={idx}: {name}")
-                idx = int(input("Found many files, which index is your wanted file?"))
-                wanted_QD_pkl_path = os.path.join(date_folder_path,target_file_list[idx])
-            else:
-                button = 1
-                for name in target_file_list:
-                    if name.split("#")[-1].split("_")[0] == ip_label and name.split("_")[-1].split(".")[0]=="SumInfo":
-                        wanted_QD_pkl_path = os.path.join(date_folder_path,name)
-                        eyeson_print(f"now use QD_file in {date_folder_path.split('/')[-1]}")
-                        button = 0
-                        break
-                if button:
-                    raise ValueError(f"Can't find a suitable QD file for {which_dr}#{ip_label}")
-        elif len(target_file_list) == 1:
-            if ip_label == '' :
-                wanted_QD_pkl_path = os.path.join(date_folder_path,target_file_list[0])
-                eyeson_print(f"now use QD_file in {date_folder_path.split('/')[-1]}")
-                break
-            else:
-                if target_file_list[0].split("#")[-1].split("_")[0] == ip_label:
-                    eyeson_print(f"now use QD_file in {date_folder_path.split('/')[-1]}")
-                    wanted_QD_pkl_path = os.path.join(date_folder_path,target_file_list[0])
-                    break
-                else:
-                    raise ValueError(f"Can't find a suitable QD file for {which_dr}#{ip_label}")
-        else:
-            pass
-        if date_obj_idx == len(date) - 1:
-            raise ValueError(f"No QD.pkl for the target_dr={which_dr}")
-    
-    return wanted_QD_pkl_path
+    """
+    Return the path of the latest QD pkl or state store for the given dr (and the cluster ip label if given) by the QD index.\n
+    The latest one is in the newest date folder, if there are several (different ip labels in the same day) the last saved one is used.
+    """
+    index = load_QD_index()
+    key = which_dr.lower() if ip_label == '' else f"{which_dr.lower()}#{ip_label}"
+    if key not in index["latest"]:
+        raise ValueError(f"Can't find a suitable QD file for {which_dr}#{ip_label}" if ip_label != '' else f"No QD.pkl for the target_dr={which_dr}")
+    entry = index["latest"][key]
+    if ip_label == '':
+        same_day = [other["path"] for other in index["files"].values() if other["dr"] == entry["dr"] and other["date"] == entry["date"] and other["ip"] != entry["ip"]]
+        if same_day != []:
+            warning_print(f"Found many files, use the last saved {entry['path']} among {same_day}")
+    eyeson_print(f"now use QD_file in {os.path.dirname(entry['path'])}")
+    return os.path.join(qdevice_backup_dir,entry["path"])
 
 
 
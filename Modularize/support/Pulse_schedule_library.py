@@ -5,9 +5,11 @@ import matplotlib.colors as colors
 from matplotlib.patches import Ellipse
 import numpy as np
 import xarray as xr
+from dataclasses import dataclass
+from typing import Optional
 from scipy import special
 from scipy.integrate import quad
-from scipy.signal import butter,sosfiltfilt
+from scipy.signal import butter,sosfiltfilt,lombscargle
 from lmfit import Model,Parameter 
 from quantify_scheduler.enums import BinMode
 from quantify_scheduler.backends.graph_compilation import SerialCompiler
@@ -18,10 +20,114 @@ from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
 from quantify_scheduler.operations.gate_library import Reset, Measure
 from quantify_scheduler.resources import ClockResource, BasebandClockResource
 from quantify_scheduler.helpers.collections import find_port_clock_path
+try:
+    from quantify_scheduler.backends.qblox.operations.gate_library import ConditionalReset
+except ImportError: # quantify-scheduler without the Qblox conditional playback
+    ConditionalReset = None
+try:
+    from quantify_scheduler.operations.acquisition_library import ThresholdedAcquisition
+except ImportError: # quantify-scheduler without the thresholded acquisition
+    ThresholdedAcquisition = None
+try:
+    from quantify_scheduler.backends.qblox.constants import TRIGGER_DELAY
+except ImportError: # quantify-scheduler without the trigger network
+    TRIGGER_DELAY = 364e-9
 from Modularize.support.WaveformCtrl import XY_waveform, s_factor, half_pi_ratio
 
 """ Global pulse settings """
 electrical_delay:float = 280e-9
+# state order (acq_channel 0, 1) in the interleaved |g>/|e> schedules
+interleaved_states:list = ['g','e']
+# Q1ASM instructions a sequencer can hold and the acquisition bins of a readout sequencer
+sequencer_instruction_limit:int = 16384
+sequencer_bin_limit:int = 131072
+# acq_channel of the thresholded readouts in the active reset, after the acq_channels of the multiplexed qubits
+active_reset_acq_channel:int = 10
+# from the end of a thresholded acquisition to the conditional pi pulse, the trigger network delay
+feedback_latency:float = TRIGGER_DELAY
+
+
+def Qubit_reset(sche,q:str,active_reset:dict={},acq_index:int=0):
+    """
+    Use it instead of `sche.add(Reset(q))`, it returns the last added operation.\n
+    * active_reset: {} for the passive wait of `reset.duration`. {"rounds":1,"relax":0} for `rounds` of ConditionalReset (thresholded readout + pi pulse conditioned by the trigger network) then `relax` (sec) idle.\n
+    The thresholded readouts need the calibrated `measure.acq_threshold` and `measure.acq_rotation`, the rounds are appended into acq_index `acq_index`, `acq_index`+1, ... of `active_reset_acq_channel`.
+    The backend takes only one acquisition protocol and bin mode in a schedule, so the other acquisitions must be thresholded in APPEND too, see `split_thresholded`.
+    It falls back to the passive wait if the conditional playback isn't available.
+    """
+    if active_reset == {}:
+        return sche.add(Reset(q))
+    if ConditionalReset is None:
+        print("ConditionalReset isn't available in this quantify-scheduler, use the passive reset.")
+        return sche.add(Reset(q))
+    for round_idx in range(int(active_reset.get("rounds",1))):
+        reset = sche.add(ConditionalReset(q,acq_channel=active_reset_acq_channel,acq_index=acq_index+round_idx,bin_mode=BinMode.APPEND))
+    if active_reset.get("relax",0) > 0:
+        reset = sche.add(IdlePulse(duration=active_reset["relax"]))
+    return reset
+
+def split_thresholded(acquired:list, states:int=1, rounds:int=1)->tuple[list, list]:
+    """
+    Split the `gettable.get()` of the single shots by the thresholded acquisition into (the |1> populations of the first `states` acq_channels, [the excited population before the active reset] or []).\n
+    The gettable returns one uint32 array per thresholded acq_channel, the state bits of all the shots (APPEND), not an I, Q pair. The bits are averaged here.
+    The channel of `Qubit_reset` (the last one) has `rounds` bits per preparation in every repetition, only the first round of each preparation is before any conditional pi.
+    """
+    populations = [float(np.mean(np.asarray(bits, dtype=float))) for bits in acquired[:states]]
+    if len(acquired) <= states:
+        return populations, []
+    reset_bits = np.asarray(acquired[states], dtype=float).reshape(-1, states*rounds) # (repetition, acq_index)
+    return populations, [float(np.mean(reset_bits[:, ::rounds]))]
+
+def active_reset_summary(qubit_info, active_reset:dict, reset_IQ:list, buffer:float=5e-6)->dict:
+    """
+    The period of one preparation (reset + `buffer` + readout) with `Qubit_reset` and with the passive reset, and the excited population before the active reset from `split_thresholded`.\n
+    The thresholded readout of ConditionalReset is taken as long as the readout, the compiled schedule may add some ns for the alignment.
+    """
+    readout = float(np.maximum(qubit_info.measure.pulse_duration(), qubit_info.measure.acq_delay()+qubit_info.measure.integration_time())) # max and min of this module are numpy's
+    active = int(active_reset.get("rounds",1))*(readout+feedback_latency+qubit_info.rxy.duration()) + active_reset.get("relax",0)
+    summary = {
+        "period_s":active+buffer+readout, "passive_period_s":qubit_info.reset.duration()+buffer+readout,
+        "excited_before_reset":reset_IQ[0] if len(reset_IQ) != 0 else None,
+    }
+    summary["rep_rate_Hz"], summary["passive_rep_rate_Hz"] = 1/summary["period_s"], 1/summary["passive_period_s"]
+    return summary
+
+def batched_values(value:any, points:int)->np.ndarray:
+    """
+    The value of every point in a batched schedule. A scalar (outer settable not batched) is repeated for all the `points`, an array from a batched settable should have a value for every point.
+    """
+    values = np.asarray(value, dtype=float).reshape(-1)
+    if values.shape[0] == 1:
+        return np.full(points, values[0])
+    if values.shape[0] != points:
+        raise ValueError(f"Got {values.shape[0]} values for a schedule with {points} points!")
+    return values
+
+def batched_chunk_size(total_points:int, instructions_per_point:int=12, inner_points:int=1)->int:
+    """
+    How many setpoints of a 2D grid fit in one program, it's used as the `batch_size` of the batched settables.\n
+    The chunk is limited by the Q1ASM program memory (`instructions_per_point` for a Reset, SetClockFrequency, pulses and an acquisition, 256 kept for the loop overhead) and the acquisition bins,
+    and it's rounded down to whole inner sweeps if a chunk can hold `inner_points`.
+    """
+    chunk = int(np.minimum(sequencer_bin_limit, (sequencer_instruction_limit-256)//instructions_per_point)) # max and min of this module are numpy's
+    if 1 < inner_points <= chunk:
+        chunk -= chunk % inner_points
+    return int(np.clip(chunk, 1, np.maximum(total_points, 1)))
+
+def point_cycles(reset:float, freeduration:any, pulses:float, readout:float, fixed_relax:bool, buffer:float=5e-6)->np.ndarray:
+    """
+    The duration (sec) of every point in `T1_sche` or `Ramsey_sche` with the given (maybe padded) `reset`, the `pulses` are the XY pulses + electrical delay in a point.\n
+    fixed_relax=False: the pulses and the free time sit inside reset + buffer, so every point takes reset + buffer + readout.\n
+    fixed_relax=True: they follow the reset + buffer, so every point takes reset + buffer + pulses + free time + readout.
+    """
+    freeduration = np.asarray(freeduration, dtype=float).reshape(-1)
+    if fixed_relax:
+        return reset+buffer+pulses+freeduration+readout
+    return np.full(freeduration.shape[0], reset+buffer+readout)
+
+def sweep_wall_time(cycles:np.ndarray, repetitions:int, overhead:float=0)->float:
+    """ Expected time (sec) on the instruments for the point `cycles` from `point_cycles` repeated `repetitions` times, plus the `overhead` like the compilation. """
+    return float(np.sum(cycles))*int(repetitions)+overhead
 
 
 def FlatTopGaussianPulse(Du:float,amp:float,s_factor:int=8,sampling_rate:float=4e-9):
@@ -68,6 +174,9 @@ def XY_waveform_controller(pulse_sche:Schedule, amp:float, duration:float, phase
 
 #%% fit function
 def fft_oscillation_guess(data: np.ndarray, t: np.ndarray):
+    """ Frequency and phase guesses of an oscillation, `lombscargle_oscillation_guess` if the points `t` aren't uniform. """
+    if len(t) > 2 and not np.allclose(np.diff(t), t[1]-t[0], rtol=1e-3, atol=0):
+        return lombscargle_oscillation_guess(data, t)
     amp = np.fft.fft(data)[: len(data) // 2] #use positive frequency
     freq = np.fft.fftfreq(len(data), t[1] - t[0])[: len(amp)]
     amp[0] = 0  # Remove DC part 
@@ -75,6 +184,24 @@ def fft_oscillation_guess(data: np.ndarray, t: np.ndarray):
     f_guess = abs(freq[power == max(power)][0])
     phase_guess = 2 * np.pi - (2 * np.pi * t[data == max(data)] * f_guess)[0]
     return f_guess, phase_guess
+def lombscargle_oscillation_guess(data:np.ndarray, t:np.ndarray, oversampling:int=5):
+    """
+    Like `fft_oscillation_guess` for the non-uniform points (like the adaptive delays), the frequency is the peak of the Lomb-Scargle periodogram
+    up to half the rate of the densest points (10th percentile of the spacings), the phase is from the least-squares cos and sin at that frequency.
+    """
+    order = np.argsort(t)
+    t, data = np.asarray(t, dtype=float)[order], np.asarray(data, dtype=float)[order]
+    span, spacing = t[-1]-t[0], np.diff(t)
+    f_max = 0.5/np.percentile(spacing[spacing > 0], 10)
+    n_freqs = int(np.clip(oversampling*f_max*span, oversampling*len(t), 20000))
+    freqs = np.linspace(f_max/n_freqs, f_max, n_freqs)
+    power = lombscargle(t, data-np.mean(data), 2*np.pi*freqs)
+    f_guess = freqs[np.argmax(power)]
+    # data ~ a*cos(2*pi*f*t) + b*sin(2*pi*f*t) + c = A*cos(2*pi*f*t+phase) + c with a = A*cos(phase), b = -A*sin(phase)
+    basis = np.vstack([np.cos(2*np.pi*f_guess*t), np.sin(2*np.pi*f_guess*t), np.ones_like(t)]).transpose()
+    a, b, _ = np.linalg.lstsq(basis, data, rcond=None)[0]
+    return f_guess, float(np.mod(np.arctan2(-b, a), 2*np.pi))
+
 def find_nearest(array, value):
     array = np.asarray(array)
     idx = (np.abs(array - value)).argmin()
@@ -109,42 +236,107 @@ Loren_func_model = Model(Loren_func)
 gauss2d_func_model = Model(gauss2d_func, independent_vars=['I', 'Q'])
 bigauss2d_func_model = Model(bigauss2d_func, independent_vars=['I', 'Q'])
 
-def T1_fit_analysis(data:np.ndarray,freeDu:np.ndarray,T1_guess:float=10*1e-6,return_error:bool=False):
+fit_funcs = {"T1":T1_func,"T2":Ramsey_func,"QS":Loren_func,"Rabi":Rabi_func}
+
+@dataclass(frozen=True, eq=False)
+class FitRecord:
+    """
+    Params-only result from `T1_fit_analysis`, `T2_fit_analysis`, `QS_fit_analysis` and `Rabi_fit_analysis` with `params_only=True`.\n
+    Only the best values, stderr and reduced chi-square are kept, the oversampled fitting curve is evaluated when `curve()` or `to_dataset()` is called.\n
+    `attrs` is the same as the attrs of the xr.Dataset those functions return, so `record.attrs['T1_fit']` works for both.
+    """
+    exper:str
+    x_name:str
+    x:np.ndarray
+    data:np.ndarray
+    best_values:dict
+    stderr:dict
+    redchi:float
+    nfev:int
+    covar:Optional[np.ndarray]
+    attrs:dict
+
+    @classmethod
+    def from_result(cls, exper:str, x_name:str, x:np.ndarray, data:np.ndarray, result, **attrs):
+        """ Build from a lmfit ModelResult, the stderr is NaN if lmfit can't estimate it. """
+        stderr = {name:(para.stderr if para.stderr is not None else np.nan) for name, para in result.params.items()}
+        covar = np.array(result.covar) if result.covar is not None else None
+        return cls(exper,x_name,np.asarray(x),np.asarray(data),dict(result.best_values),stderr,float(result.redchi),int(result.nfev),covar,dict(exper=exper,**attrs))
+
+    def curve(self, oversampling:int=50):
+        """ Return the x points and the fitting curve on them, `oversampling` times denser than the data. """
+        para_fit = np.linspace(self.x.min(),self.x.max(),oversampling*len(self.data))
+        return para_fit, fit_funcs[self.exper](para_fit,**self.best_values)
+
+    def to_dataset(self)->xr.Dataset:
+        """ The same xr.Dataset as the fitting functions return without `params_only`. """
+        para_fit, fitting = self.curve()
+        return xr.Dataset(data_vars=dict(data=([self.x_name],self.data),fitting=(['para_fit'],fitting)),coords={self.x_name:([self.x_name],self.x),"para_fit":(['para_fit'],para_fit)},attrs=self.attrs)
+
+def as_fit_dataset(results):
+    """ Turn a `FitRecord` into the xr.Dataset for plotting, the others are returned as they are. """
+    return results.to_dataset() if isinstance(results, FitRecord) else results
+
+def T1_linear_guess(data:np.ndarray,freeDu:np.ndarray):
+    """
+    Closed-form T1 guess: the offset is the mean of the last 10% points, then a straight line is fitted to log|data-offset| vs freeDu weighted by |data-offset|.\n
+    Only the points above 2 times the tail noise are used. Return (A, T1, offset), T1 is NaN if it can't be estimated.
+    """
+    data, freeDu = np.asarray(data,dtype=float), np.asarray(freeDu,dtype=float)
+    tail = int(np.maximum(3, data.shape[0]//10)) # max and min of this module are numpy's
+    offset = np.mean(data[-tail:])
+    sign = 1 if np.mean(data[:tail]) >= offset else -1
+    y = sign*(data-offset)
+    used = y > 2*np.std(data[-tail:])
+    if np.count_nonzero(used) < 3:
+        return sign*np.max(y), np.nan, offset
+    slope, intercept = np.polyfit(freeDu[used],np.log(y[used]),1,w=y[used])
+    if not slope < 0:
+        return sign*np.max(y), np.nan, offset
+    return sign*np.exp(intercept), -1/slope, offset
+
+def T1_fit_analysis(data:np.ndarray,freeDu:np.ndarray,T1_guess:float=10*1e-6,return_error:bool=False,params_only:bool=False,linear_guess:bool=True):
+    """
+    Fit T1 decay.\n
+    ### Args:\n
+    * params_only: return a `FitRecord` instead of a xr.Dataset, the fitting curve isn't evaluated.\n
+    * linear_guess: start from `T1_linear_guess`, T1_guess is only used when it fails or is out of 100 times the time span.
+    """
     offset_guess= data[-1]
-    a_guess = np.max(data)-offset_guess if data[-1] > offset_guess else np.min(data)-offset_guess
-    result = T1_func_model.fit(data,D=freeDu,A=np.max(data)-offset_guess,T1=T1_guess,offset=offset_guess)
-    
-    A_fit= result.best_values['A']
-    T1_fit= result.best_values['T1']
-    offset_fit= result.best_values['offset']
-    para_fit= np.linspace(freeDu.min(),freeDu.max(),50*len(data))
-    fitting= T1_func(para_fit,A_fit,T1_fit,offset_fit)
+    A_guess, T1_start = np.max(data)-offset_guess, T1_guess
+    if linear_guess:
+        A_lin, T1_lin, offset_lin = T1_linear_guess(data,freeDu)
+        if np.isfinite(T1_lin) and 0 < T1_lin < 100*(freeDu.max()-freeDu.min()):
+            A_guess, T1_start, offset_guess = A_lin, T1_lin, offset_lin
+    result = T1_func_model.fit(data,D=freeDu,A=A_guess,T1=T1_start,offset=offset_guess)
+    
+    record = FitRecord.from_result("T1","freeDu",freeDu,data,result,T1_fit=result.best_values['T1'])
+    data_fit = record if params_only else record.to_dataset()
     if not return_error:
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T1",T1_fit=T1_fit))
+        return data_fit
     else:
         fit_error = float(result.covar[1][1])*1e6
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T1",T1_fit=T1_fit)), fit_error
-def T2_fit_analysis(data:np.ndarray,freeDu:np.ndarray,T2_guess:float=10*1e-6,return_error:bool=False):
-    
+        return data_fit, fit_error
+def T2_fit_analysis(data:np.ndarray,freeDu:np.ndarray,T2_guess:float=10*1e-6,return_error:bool=False,params_only:bool=False):
+    """
+    Fit Ramsey oscillation, the frequency and phase guesses come from `fft_oscillation_guess`.\n
+    ### Args:\n
+    * params_only: return a `FitRecord` instead of a xr.Dataset, the fitting curve isn't evaluated.
+    """
     f_guess,phase_guess= fft_oscillation_guess(data,freeDu)
     T2=Parameter(name='T2', value= T2_guess, min=0.1e-6, max=5*T2_guess) 
     up_lim_f= 5*1e6
     f_guess_=Parameter(name='f', value=f_guess , min=0, max=up_lim_f)
     result = Ramsey_func_model.fit(data,D=freeDu,A=abs(min(data)+max(data))/2,T2=T2,f=f_guess_,phase=phase_guess, offset=np.mean(data))
-    fit_error = float(result.covar[1][1])*1e6
-    A_fit= result.best_values['A']
-    f_fit= result.best_values['f']
-    phase_fit= result.best_values['phase']
-    
-    T2_fit= result.best_values['T2']
-    offset_fit= result.best_values['offset']
-    para_fit= np.linspace(freeDu.min(),freeDu.max(),50*len(data))
-    fitting= Ramsey_func(para_fit,A_fit,T2_fit,f_fit,phase_fit,offset_fit)
+    
+    record = FitRecord.from_result("T2","freeDu",freeDu,data,result,T2_fit=result.best_values['T2'],f=result.best_values['f'],phase=result.best_values['phase'])
+    data_fit = record if params_only else record.to_dataset()
     if not return_error:
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit))
+        return data_fit
     else:
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit)), fit_error
-def QS_fit_analysis(data:np.ndarray,f:np.ndarray):
+        fit_error = float(result.covar[1][1])*1e6
+        return data_fit, fit_error
+def QS_fit_analysis(data:np.ndarray,f:np.ndarray,params_only:bool=False):
     fmin = f.min()
     fmax = f.max()
     width_max = fmax-fmin
@@ -154,24 +346,15 @@ def QS_fit_analysis(data:np.ndarray,f:np.ndarray):
     width_guess = np.sqrt(width_min*width_max) 
     A= np.pi * width_guess * (np.max(data)-np.mean(data))
     result = Loren_func_model.fit(data,x=f,x0= f[np.argmax(data)],gamma=width_guess,A=A,base=np.mean(data))
-    f01_fit= result.best_values['x0']
-    bw= result.best_values['gamma']
-    A_fit= result.best_values['A']
-    base_fit= result.best_values['base']
-    para_fit= np.linspace(fmin,fmax,50*len(data))
-    fitting= Loren_func(para_fit,f01_fit,bw,A_fit,base_fit)
-    return xr.Dataset(data_vars=dict(data=(['f'],data),fitting=(['para_fit'],fitting)),coords=dict(f=(['f'],f),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="QS",f01_fit=f01_fit,bandwidth=bw))
-
-def Rabi_fit_analysis(data:np.ndarray,samples:np.ndarray, Rabi_type:str):
+    record = FitRecord.from_result("QS","f",f,data,result,f01_fit=result.best_values['x0'],bandwidth=result.best_values['gamma'])
+    return record if params_only else record.to_dataset()
+
+def Rabi_fit_analysis(data:np.ndarray,samples:np.ndarray, Rabi_type:str, params_only:bool=False):
     f_guess,phase_guess= fft_oscillation_guess(data,samples)
     result = Rabi_model.fit(data,x=samples,A=abs(min(data)+max(data))/2,f=f_guess, offset=np.mean(data))
-    A_fit= result.best_values['A'] 
-    f_fit= result.best_values['f']
-    offset_fit= result.best_values['offset']
-    pi_2= 1/(2*f_fit)
-    para_fit= np.linspace(samples.min(),samples.max(),50*len(data))
-    fitting= Rabi_func(para_fit,A_fit,f_fit,offset_fit)
-    return xr.Dataset(data_vars=dict(data=(['samples'],data),fitting=(['para_fit'],fitting)),coords=dict(samples=(['samples'],samples),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="Rabi",Rabi_type=Rabi_type,pi_2=pi_2))
+    pi_2= 1/(2*result.best_values['f'])
+    record = FitRecord.from_result("Rabi","samples",samples,data,result,Rabi_type=Rabi_type,pi_2=pi_2)
+    return record if params_only else record.to_dataset()
 
 def Single_shot_ref_fit_analysis(data:tuple):
     I,Q= np.array(data[0]),np.array(data[1]) 
@@ -194,7 +377,152 @@ def Single_shot_ref_fit_analysis(data:tuple):
     #print ('Total prob. =',np.sum(hist)*((max(xedges)-min(xedges))/bins*(max(yedges)-min(yedges))/bins))
     return dict(data=[I,Q],data_hist=hist,coords=[X,Y],fitting=fitting,fit_pack=fit_pack)
 
-def Qubit_state_single_shot_fit_analysis(data:dict, T1:float,tau:float):
+def single_shot_EM(g_IQ:np.ndarray, e_IQ:np.ndarray, iters:int=200, tol:float=0.1, warm_shots:int=100000)->dict:
+    """
+    EM of two isotropic 2D Gaussians with a shared sigma on the raw shots, the |g> and |e> preparations share the blobs but have their own populations.\n
+    With the shared sigma the log-odds of a shot is linear in its projection on the g-e axis, so an iteration is a few dot products over the shots without any histogram.\n
+    It stops when the centers move less than `tol` times their standard error sigma/sqrt(shots).\n
+    Over `warm_shots` shots per preparation, it converges on an evenly strided subset first and only polishes on all the shots.\n
+    Return {"cg","ce" (complex centers),"sigma","pop_g" ([g, e] populations of the |g> preparation),"pop_e","iters"}.
+    """
+    I = np.hstack([np.asarray(g_IQ[0],dtype=float),np.asarray(e_IQ[0],dtype=float)])
+    Q = np.hstack([np.asarray(g_IQ[1],dtype=float),np.asarray(e_IQ[1],dtype=float)])
+    n_g = np.asarray(g_IQ[0]).shape[0]
+    stride = int(np.ceil(np.maximum(n_g,I.shape[0]-n_g)/warm_shots)) # max and min of this module are numpy's
+    if stride > 1:
+        warm = single_shot_EM([I[:n_g:stride],Q[:n_g:stride]],[I[n_g::stride],Q[n_g::stride]],iters,tol,warm_shots)
+        cg, ce, sigma2, pops = warm['cg'], warm['ce'], warm['sigma']**2, [warm['pop_g'][0],warm['pop_e'][1]]
+    else:
+        cg = np.median(I[:n_g])+1j*np.median(Q[:n_g])
+        ce = np.median(I[n_g:])+1j*np.median(Q[n_g:])
+        sigma2 = np.median((I[:n_g]-cg.real)**2+(Q[:n_g]-cg.imag)**2)/(2*np.log(2)) # |z-c|**2/sigma**2 is chi2 of 2 dof
+        pops = [0.9, 0.9] # the population of the prepared state in each preparation
+    power = np.dot(I,I)+np.dot(Q,Q)
+    prior = np.empty(I.shape[0])
+    for it in range(1,int(iters)+1):
+        prior[:n_g], prior[n_g:] = np.log((1-pops[0])/pops[0]), np.log(pops[1]/(1-pops[1]))
+        axis = ce-cg
+        # log P(e)/P(g) of every shot, (|z-cg|**2-|z-ce|**2)/(2 sigma**2)
+        r_e = special.expit(prior+((I*axis.real+Q*axis.imag)-(abs(ce)**2-abs(cg)**2)/2)/sigma2)
+        n_e = [np.sum(r_e[:n_g]), np.sum(r_e[n_g:])]
+        pops = [float(np.clip(1-n_e[0]/n_g,1e-9,1-1e-9)), float(np.clip(n_e[1]/(I.shape[0]-n_g),1e-9,1-1e-9))]
+        w_e = n_e[0]+n_e[1]
+        sum_e = np.dot(r_e,I)+1j*np.dot(r_e,Q)
+        sum_g = I.sum()+1j*Q.sum()-sum_e
+        new_cg, new_ce = sum_g/(I.shape[0]-w_e), sum_e/w_e
+        sigma2 = float((power-abs(sum_g)**2/(I.shape[0]-w_e)-abs(sum_e)**2/w_e)/(2*I.shape[0]))
+        shift = np.maximum(abs(new_cg-cg),abs(new_ce-ce))
+        cg, ce = new_cg, new_ce
+        if shift < tol*np.sqrt(sigma2/I.shape[0]):
+            break
+    return dict(cg=cg,ce=ce,sigma=float(np.sqrt(sigma2)),pop_g=[pops[0],1-pops[0]],pop_e=[1-pops[1],pops[1]],iters=it)
+
+def Qubit_state_single_shot_fit_analysis(data:dict, T1:float,tau:float,method:str='closed_form'):
+    """
+    The readout error budget of the |g> and |e> single shots, `data` is {'g':[I,Q],'e':[I,Q]}.\n
+    * method: 'closed_form' (`single_shot_EM` on the raw shots and the erf integrals), or 'hist_fit' for the former 2D histogram fits by `Qubit_state_single_shot_hist_analysis`.\n
+    Both return the same dict for `Qubit_state_single_shot_plot`, error_pack has the keys D, sigma, SNR, overlap, overlap_predict, Peg, Pge, Thermal, Relax, Relax_predict, Pre_decay, F_s, F_g, F_e, F.
+    """
+    if method == 'hist_fit':
+        return Qubit_state_single_shot_hist_analysis(data,T1,tau)
+    if method != 'closed_form':
+        raise KeyError(f"Unsupported method = '{method}', it should be 'closed_form' or 'hist_fit'")
+    Ig_data,Qg_data,Ie_data,Qe_data= np.array(data['g'][0]), np.array(data['g'][1]) ,np.array(data['e'][0]), np.array(data['e'][1])
+    bins=401
+    blobs= single_shot_EM([Ig_data,Qg_data],[Ie_data,Qe_data])
+    sigma_fit= blobs['sigma']
+    # displace + rotate
+    angle= np.angle(blobs['ce']-blobs['cg'])
+    rot_e_center= rot(blobs['ce'].real-blobs['cg'].real,blobs['ce'].imag-blobs['cg'].imag,angle)
+    rot_g_IQ= rot(Ig_data-blobs['cg'].real,Qg_data-blobs['cg'].imag,angle)
+    rot_e_IQ= rot(Ie_data-blobs['cg'].real,Qe_data-blobs['cg'].imag,angle)
+    # the projections on the rotated I for the plot, the Gaussian heights are the populations over sqrt(2pi)*sigma
+    R= 10*sigma_fit #range_factor
+    xmin, xmax = np.minimum(0,rot_e_center[0])-R,np.maximum(0,rot_e_center[0])+R
+    New_axe_g_hist, edges= np.histogram(rot_g_IQ[0],bins=bins,range=(xmin,xmax),density=True)
+    New_axe_e_hist, _= np.histogram(rot_e_IQ[0],bins=bins,range=(xmin,xmax),density=True)
+    I_ro= (edges[:-1]+edges[1:])/2
+    I_fit= np.linspace(xmin, xmax,bins*5)
+    norm= np.sqrt(2*np.pi)*sigma_fit
+    Agg_fit, Aeg_fit= blobs['pop_g'][0]/norm, blobs['pop_g'][1]/norm
+    Age_fit, Aee_fit= blobs['pop_e'][0]/norm, blobs['pop_e'][1]/norm
+    # closed-form integrals with the threshold in the middle
+    D= rot_e_center[0]
+    SNR= D/sigma_fit
+    overlap= (1/2)*special.erfc(D/2/(np.sqrt(2)*sigma_fit)) # the tail of a blob over the threshold
+    Thermal= blobs['pop_g'][1]
+    Peg= Thermal*(1-overlap)+overlap
+    Pge= blobs['pop_e'][0]*(1-overlap)+overlap
+    Relax= blobs['pop_e'][0]-Thermal
+    Relax_predict= Relax_cal(0,tau,T1)
+    Pre_decay= Relax-Relax_predict
+    overlap_predict= (1/2)*(1-special.erf(np.sqrt(SNR**2/8)))
+    F_s= 1-overlap
+    F_g= 1-Peg
+    F_e= 1-Pge
+    F=1-(1/2)*(Peg+Pge)
+    fit_pack= [rot_e_center,Agg_fit,Aeg_fit,Age_fit,Aee_fit,sigma_fit,New_axe_g_hist,New_axe_e_hist]
+    error_pack= dict(D=D,sigma=sigma_fit,SNR=SNR,overlap=overlap,overlap_predict=overlap_predict,Peg=Peg,Pge=Pge,Thermal=Thermal,Relax=Relax,Relax_predict=Relax_predict,Pre_decay=Pre_decay, F_s=F_s,F_g=F_g,F_e=F_e,F=F)
+    return dict(rot_IQdata=[rot_g_IQ,rot_e_IQ],I_ro=I_ro,I_fit=I_fit,fit_pack=fit_pack,error_pack=error_pack)
+
+def simulated_single_shots(shots:int, D:float=1, sigma:float=0.25, thermal:float=0.05, relax:float=0.08, seed:int=0)->dict:
+    """
+    {'g':[I,Q],'e':[I,Q]} of two Gaussian blobs (in mV) with the |e> population `thermal` in the |g> preparation and the |g> population `thermal`+`relax` in the |e> one.\n
+    The true error_pack values are in "truth".
+    """
+    rng = np.random.default_rng(seed)
+    cg, ce = 1+1j, 1+1j+D*np.exp(0.7j)
+    overlap = (1/2)*special.erfc(D/2/(np.sqrt(2)*sigma))
+    def shoot(pop_e):
+        z = np.where(rng.random(shots) < pop_e, ce, cg) + sigma*(rng.standard_normal(shots)+1j*rng.standard_normal(shots))
+        return [z.real, z.imag]
+    truth = dict(overlap=overlap,Peg=thermal*(1-overlap)+overlap,Pge=(thermal+relax)*(1-overlap)+overlap,Thermal=thermal,Relax=relax)
+    truth["F"] = 1-(truth["Peg"]+truth["Pge"])/2
+    return {'g':shoot(thermal),'e':shoot(1-thermal-relax),'truth':truth}
+
+def benchmark_single_shot_analysis(shots:list=[1000,10000,100000,1000000], T1:float=20e-6, tau:float=1e-6, **blobs)->dict:
+    """ Time both methods of `Qubit_state_single_shot_fit_analysis` on `simulated_single_shots`, and compare their Peg, Pge and Thermal with the true ones. """
+    import time
+    costs = {}
+    for number in shots:
+        data = simulated_single_shots(int(number),**blobs)
+        costs[number] = {}
+        for method in ['hist_fit','closed_form']:
+            start = time.time()
+            result = Qubit_state_single_shot_fit_analysis(data,T1,tau,method=method)
+            costs[number][method] = {"time":time.time()-start,**{key:float(result['error_pack'][key]) for key in ['Peg','Pge','Thermal']}}
+        print(f"{number} shots: hist_fit {round(costs[number]['hist_fit']['time'],2)} s, closed_form {round(costs[number]['closed_form']['time'],3)} s; "+", ".join([f"{key} {round(costs[number]['hist_fit'][key],4)}/{round(costs[number]['closed_form'][key],4)} (true {round(data['truth'][key],4)})" for key in ['Peg','Pge','Thermal']]))
+    return costs
+
+def simulated_thresholded_acquisition(shots:int, states:int=2, seed:int=0, **blobs)->tuple:
+    """
+    What `gettable.get()` returns for `Qubit_SS_interleaved_sche` (states=2) or `Qubit_SS_sche` (states=1) with the thresholded acquisition:
+    one uint32 array of `shots` state bits per acq_channel in the sorted acq_channel order. The |1> probabilities of |g> and |e> are Peg and 1-Pge of `simulated_single_shots`.
+    """
+    rng = np.random.default_rng(seed)
+    truth = simulated_single_shots(1,**blobs)['truth']
+    p1 = [truth['Peg'],1-truth['Pge']][:states]
+    return tuple((rng.random(shots) < p).astype(np.uint32) for p in p1)
+
+def check_thresholded_populations(shots:int=100000, tol:float=0.005, **blobs)->list:
+    """ Split `simulated_thresholded_acquisition` by `split_thresholded` and raise ValueError if the |1> populations are off the true ones by over `tol`. Return them. """
+    truth = simulated_single_shots(1,**blobs)['truth']
+    populations, _ = split_thresholded(simulated_thresholded_acquisition(shots,2,**blobs),2)
+    for state, population, true_p in zip(interleaved_states,populations,[truth['Peg'],1-truth['Pge']]):
+        if abs(population-true_p) > tol:
+            raise ValueError(f"The thresholded |1> population of |{state}> {round(population,4)} is off the true {round(true_p,4)} by over {tol}")
+    return populations
+
+def check_single_shot_fidelity(shots:int=100000, tol:float=0.005, **blobs)->float:
+    """ Run the closed-form analysis on `simulated_single_shots` and raise ValueError if its fidelity F is off the true one by over `tol`. Return the fitted F. """
+    data = simulated_single_shots(int(shots),**blobs)
+    F = float(Qubit_state_single_shot_fit_analysis(data,T1=20e-6,tau=1e-6)['error_pack']['F'])
+    if abs(F-data['truth']['F']) > tol:
+        raise ValueError(f"The single-shot fidelity {round(F,4)} is off the true {round(data['truth']['F'],4)} by over {tol}")
+    return F
+
+def Qubit_state_single_shot_hist_analysis(data:dict, T1:float,tau:float):
+    """ The former analysis: 401x401 histograms, the 2D bimodal fit and the quad integrals. It's kept for `benchmark_single_shot_analysis`. """
     Ig_data,Qg_data,Ie_data,Qe_data= np.array(data['g'][0]), np.array(data['g'][1]) ,np.array(data['e'][0]), np.array(data['e'][1]) 
     bins=401
     g_predict= Single_shot_ref_fit_analysis(data['g'])['fit_pack']
@@ -387,10 +715,29 @@ def Multi_Readout(sche,q,ref_pulse_sche,R_amp,R_duration,powerDep=False,):
     return sche.add(SquarePulse(duration=Du,amp=amp,port="q:res",clock=q+".ro",t0=4e-9),ref_pt="start",ref_op=ref_pulse_sche,)
 
     
-def Integration(sche,q,R_inte_delay:float,R_inte_duration,ref_pulse_sche,acq_index,acq_channel:int=0,single_shot:bool=False,get_trace:bool=False,trace_recordlength:float=5*1e-6):
+def Integration(sche,q,R_inte_delay:float,R_inte_duration,ref_pulse_sche,acq_index,acq_channel:int=0,single_shot:bool=False,get_trace:bool=False,trace_recordlength:float=5*1e-6,thresholded:dict={}):
+    """
+    * thresholded: {"rotation":deg,"threshold":V} for the instrument's thresholded acquisition, the integrated IQ is rotated and compared with the threshold on the sequencer,
+    so only the state bit is returned instead of the complex IQ, one uint32 value per acq_channel in `gettable.get()`. See `DiscriminatorCache.thresholded_acq_settings`.\n
+    Take it with `single_shot=True` (APPEND), the gettable casts an AVERAGE bin to uint32 and the population is truncated to 0.
+    """
     if single_shot== False:     
         bin_mode=BinMode.AVERAGE
     else: bin_mode=BinMode.APPEND
+    if thresholded != {}:
+        if ThresholdedAcquisition is None:
+            raise ImportError("ThresholdedAcquisition isn't available in this quantify-scheduler!")
+        return sche.add(ThresholdedAcquisition(
+            duration=R_inte_duration[q],
+            port="q:res",
+            clock=q+".ro",
+            acq_index=acq_index,
+            acq_channel=acq_channel,
+            bin_mode=bin_mode,
+            acq_rotation=thresholded["rotation"],
+            acq_threshold=thresholded["threshold"],
+            ),rel_time=R_inte_delay
+            ,ref_op=ref_pulse_sche,ref_pt="start")
     # Trace acquisition does not support APPEND bin mode !!!
     if get_trace==False:
         return sche.add(SSBIntegrationComplex(
@@ -435,15 +782,20 @@ def One_tone_sche(
     repetitions:int=1,    
 ) -> Schedule:
     
+    """
+    With `powerDep=True` the R_amp is the readout amplitude, it can be an array with a value for every frequency, so a (frequency, amplitude) grid runs as one batched program.
+    """
     sched = Schedule("One tone spectroscopy (NCO sweep)",repetitions=repetitions)
     sched.add_resource(ClockResource(name=q+ ".ro", freq=frequencies.flat[0]))
+    if powerDep:
+        ro_amps = batched_values(R_amp, np.asarray(frequencies).reshape(-1).shape[0])
     
     for acq_idx, freq in enumerate(frequencies):
         
         sched.add(SetClockFrequency(clock= q+ ".ro", clock_freq_new=freq))
         sched.add(Reset(q))
         
-        spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=powerDep)
+        spec_pulse = Readout(sched,q,ro_amps[acq_idx] if powerDep else R_amp,R_duration,powerDep=powerDep)
         
         Integration(sched,q,R_inte_delay,R_integration,spec_pulse,acq_idx,single_shot=False,get_trace=False,trace_recordlength=0)
      
@@ -459,17 +811,26 @@ def One_tone_multi_sche(
     R_integration:dict,
     R_inte_delay:dict,
     powerDep:bool,
-    repetitions:int=1,    
+    repetitions:int=1,
+    freq_idx:any=None,    
 ) -> Schedule:
-    
+    """
+    * freq_idx: the frequency index of every point, given by a batched settable over the indices of `frequencies`.\n
+    With it and `powerDep=True` the R_amp has a value for every point, so a (frequency, amplitude) grid runs as one batched program. None to sweep all the frequencies once.
+    """
     qubits2read = list(frequencies.keys())
-    sameple_idx = array(frequencies[qubits2read[0]]).shape[0]
+    if freq_idx is None:
+        point_freq_idx = np.arange(array(frequencies[qubits2read[0]]).shape[0])
+    else:
+        point_freq_idx = np.asarray(freq_idx).reshape(-1).astype(int)
+    if powerDep:
+        ro_amps = batched_values(R_amp, point_freq_idx.shape[0])
     sched = Schedule("One tone multi-spectroscopy (NCO sweep)",repetitions=repetitions)
 
-    for acq_idx in range(sameple_idx):    
+    for acq_idx, f_idx in enumerate(point_freq_idx):    
 
         for qubit_idx, q in enumerate(qubits2read):
-            freq = frequencies[q][acq_idx]
+            freq = frequencies[q][f_idx]
             if acq_idx == 0:
                 sched.add_resource(ClockResource(name=q+ ".ro", freq=array(frequencies[q]).flat[0]))
 
@@ -478,10 +839,10 @@ def One_tone_multi_sche(
             sched.add(IdlePulse(duration=5000*1e-9), label=f"buffer {qubit_idx} {acq_idx}")
             
             if qubit_idx == 0:
-                spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=powerDep)
+                spec_pulse = Readout(sched,q,ro_amps[acq_idx] if powerDep else R_amp,R_duration,powerDep=powerDep)
                 # Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
             else:
-                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=powerDep)
+                Multi_Readout(sched,q,spec_pulse,ro_amps[acq_idx] if powerDep else R_amp,R_duration,powerDep=powerDep)
             Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
             
     return sched
@@ -527,15 +888,19 @@ def Z_gate_two_tone_sche(
     repetitions:int=1,   
     Z_ro_amp:float =0 
 ) -> Schedule:
+    """
+    Z_amp can be an array with a value for every frequency, so a (frequency, Z bias) grid runs as one batched program.
+    """
     sched = Schedule("Zgate_two_tone spectroscopy (NCO sweep)",repetitions=repetitions)
     sched.add_resource(ClockResource(name=q+".01", freq=frequencies.flat[0]))
+    Z_amps = batched_values(Z_amp, np.asarray(frequencies).reshape(-1).shape[0])
     for acq_idx, freq in enumerate(frequencies):
         sched.add(SetClockFrequency(clock= q+ ".01", clock_freq_new=freq))
         sched.add(Reset(q))
         sched.add(IdlePulse(duration=5000*1e-9), label=f"buffer {acq_idx}")
         spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
         Spec_pulse(sched,spec_amp,spec_Du,q,spec_pulse,electrical_delay)
-        Z(sched,Z_amp,spec_Du,q,spec_pulse,electrical_delay)
+        Z(sched,Z_amps[acq_idx],spec_Du,q,spec_pulse,electrical_delay)
         if Z_ro_amp != 0:
             Z(sched,Z_ro_amp,R_integration[q],q,spec_pulse,0,'end')
 
@@ -572,6 +937,34 @@ def Qubit_state_heterodyne_spec_sched_nco(
         # Integration must after all the pulses
     return sched
 
+def Qubit_state_heterodyne_spec_interleaved_sched_nco(
+    frequencies: np.ndarray,
+    q:str,
+    pi_amp: dict,
+    pi_dura: dict,
+    R_amp: dict,
+    R_duration: dict,
+    R_integration:dict,
+    R_inte_delay:float,
+    repetitions:int=1,
+) -> Schedule:
+    """
+    Like `Qubit_state_heterodyne_spec_sched_nco` but |g> and |e> are prepared one after another at every frequency in one program.\n
+    The order of the acq_channels follows `interleaved_states`, the dataset has y0, y1 for |g> and y2, y3 for |e>.
+    """
+    sched = Schedule("One tone qubit-state spectroscopy interleaved (NCO sweep)",repetitions=repetitions)
+    sched.add_resource(ClockResource(name=q+ ".ro", freq=frequencies.flat[0]))
+    for acq_idx, freq in enumerate(frequencies):
+        sched.add(SetClockFrequency(clock= q+ ".ro", clock_freq_new=freq))
+        for acq_channel, ini_state in enumerate(interleaved_states):
+            sched.add(Reset(q))
+            sched.add(IdlePulse(duration=5000*1e-9))
+            spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+            if ini_state=='e': 
+                X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+            Integration(sched,q,R_inte_delay,R_integration,spec_pulse,acq_idx,acq_channel=acq_channel,single_shot=False,get_trace=False,trace_recordlength=0)
+    return sched
+
 
 def Rabi_sche(
     q:str,
@@ -691,7 +1084,9 @@ def Zgate_Rabi_sche(
     Rabi_type:str,
     repetitions:int=1,
 ) -> Schedule:
-
+    """
+    Z_amp can be an array with a value for every XY point, so a (XY, Z bias) grid runs as one batched program.
+    """
     sched = Schedule('Zgate_'+Rabi_type,repetitions=repetitions)
     amps = np.asarray(XY_amp)
     amps = amps.reshape(amps.shape or (1,))
@@ -707,7 +1102,7 @@ def Zgate_Rabi_sche(
         Para_XY_Du = XY_duration*np.ones(np.shape(amps))   
     else: raise KeyError ('Typing error: Rabi_type')
     
-    
+    Z_amps = batched_values(Z_amp, np.asarray(Para_XY_amp).shape[0])
     
     for acq_idx, (amp, duration) in enumerate(zip(Para_XY_amp,Para_XY_Du)):
         
@@ -723,7 +1118,7 @@ def Zgate_Rabi_sche(
             Y_theta(sched,amp,duration,q,spec_pulse,freeDu=0)
         else: raise KeyError ('Typing error: XY_theta')
         
-        Z(sched,Z_amp,duration,q,spec_pulse,0)
+        Z(sched,Z_amps[acq_idx],duration,q,spec_pulse,0)
         Integration(sched,q,R_inte_delay,R_integration,spec_pulse,acq_idx,single_shot=False,get_trace=False,trace_recordlength=0)
     
     return sched
@@ -738,7 +1133,12 @@ def T1_sche(
     R_integration:dict,
     R_inte_delay:float,
     repetitions:int=1,
+    fixed_relax:bool=False,
 ) -> Schedule:
+    """
+    * fixed_relax: False puts the pi pulse inside the Reset, so the qubit relaxes for reset - free time (the executors pad the reset by the longest free time).
+    True adds the pi pulse + free time after the Reset, every point relaxes for reset + buffer and no padding is needed.
+    """
 
     sched = Schedule("T1", repetitions=repetitions)
     
@@ -747,6 +1147,9 @@ def T1_sche(
         sched.add(Reset(q))
         
         sched.add(IdlePulse(duration=5000*1e-9), label=f"buffer {acq_idx}")
+        
+        if fixed_relax:
+            sched.add(IdlePulse(duration=pi_dura+freeDu+electrical_delay))
     
         spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
         
@@ -757,6 +1160,44 @@ def T1_sche(
         
     return sched
 
+def multi_T1_sche(
+    freeduration:dict,
+    pi_amp: dict,
+    pi_dura:dict,
+    R_amp: dict,
+    R_duration: dict,
+    R_integration:dict,
+    R_inte_delay:dict,
+    repetitions:int=1,
+) -> Schedule:
+    """
+    T1 for all the qubits in `freeduration` with one multiplexed readout, qubit i is acquired by acq_channel i.\n
+    ### Args:\n
+    * freeduration: {'q0': free time array, 'q1':[], ...}, all the arrays should have the same length.\n
+    * pi_dura, R_inte_delay: dicts keyed by the qubit names, like the other R_xxx.
+    """
+    qubits2read = list(freeduration.keys())
+    sameple_idx = array(freeduration[qubits2read[0]]).shape[0]
+    sched = Schedule("multiplexing T1", repetitions=repetitions)
+    
+    for acq_idx in range(sameple_idx):
+        
+        sched.add(Reset(*qubits2read))
+        
+        sched.add(IdlePulse(duration=5000*1e-9), label=f"buffer {acq_idx}")
+        
+        for qubit_idx, q in enumerate(qubits2read):
+            if qubit_idx == 0:
+                spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+            else:
+                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
+            
+            X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeduration[q][acq_idx]+electrical_delay)
+            
+            Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
+        
+    return sched
+
 def mix_T1_sche(
     q:str,
     pi_amp: dict,
@@ -863,7 +1304,11 @@ def Ramsey_sche(
     repetitions:int=1,
     echo_pi_num:int = 0,
     second_pulse_phase:str='x',
+    fixed_relax:bool=False,
 ) -> Schedule:
+    """
+    * fixed_relax: like `T1_sche`, the pulses + free time follow the Reset so every point relaxes for reset + buffer.
+    """
 
     sched = Schedule("Ramsey", repetitions=repetitions)
     
@@ -878,6 +1323,9 @@ def Ramsey_sche(
         
         sched.add(IdlePulse(duration=5000*1e-9), label=f"buffer {acq_idx}")
         
+        if fixed_relax:
+            sched.add(IdlePulse(duration=(2+echo_pi_num)*pi_Du+freeDu+electrical_delay))
+        
         # we start construction from readout
         spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
         if second_pulse_phase.lower() == 'x':
@@ -900,6 +1348,67 @@ def Ramsey_sche(
         
     return sched
 
+def multi_Ramsey_sche(
+    freeduration:dict,
+    pi_amp: dict,
+    New_fxy:dict,
+    pi_dura:dict,
+    R_amp: dict,
+    R_duration: dict,
+    R_integration:dict,
+    R_inte_delay:dict,
+    repetitions:int=1,
+    echo_pi_num:int = 0,
+    second_pulse_phase:str='x',
+) -> Schedule:
+    """
+    Ramsey (or spin echo with `echo_pi_num` > 0) for all the qubits in `freeduration` with one multiplexed readout, qubit i is acquired by acq_channel i.\n
+    ### Args:\n
+    * freeduration: {'q0': free time array, 'q1':[], ...}, all the arrays should have the same length.\n
+    * New_fxy, pi_dura, R_inte_delay: dicts keyed by the qubit names, like the other R_xxx.
+    """
+    qubits2read = list(freeduration.keys())
+    sameple_idx = array(freeduration[qubits2read[0]]).shape[0]
+    sched = Schedule("multiplexing Ramsey", repetitions=repetitions)
+    
+    for acq_idx in range(sameple_idx):
+        
+        for q in qubits2read:
+            sched.add(SetClockFrequency(clock=q+ ".01", clock_freq_new= New_fxy[q]))
+        
+        sched.add(Reset(*qubits2read))
+        
+        sched.add(IdlePulse(duration=5000*1e-9), label=f"buffer {acq_idx}")
+        
+        for qubit_idx, q in enumerate(qubits2read):
+            freeDu = freeduration[q][acq_idx]
+            pi_Du = pi_dura[q]
+            # we start construction from readout
+            if qubit_idx == 0:
+                spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+            else:
+                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
+            
+            if second_pulse_phase.lower() == 'x':
+                first_half_pi = X_pi_2_p(sched,pi_amp,q,pi_Du,spec_pulse,freeDu=electrical_delay)
+            else:
+                first_half_pi = Y_pi_2_p(sched,pi_amp,q,pi_Du,spec_pulse,freeDu=electrical_delay)
+            
+            if echo_pi_num != 0:
+                a_separate_free_Du = freeDu / echo_pi_num
+                for pi_idx in range(echo_pi_num):
+                    if pi_idx == 0 :
+                        pi = X_pi_p(sched,pi_amp,q,pi_Du,first_half_pi,0.5*a_separate_free_Du)
+                    else:
+                        pi = X_pi_p(sched,pi_amp,q,pi_Du,pi,1*a_separate_free_Du)
+                X_pi_2_p(sched,pi_amp,q,pi_Du,pi,0.5*a_separate_free_Du)
+            else:
+                X_pi_2_p(sched,pi_amp,q,pi_Du,first_half_pi,freeDu)
+            
+            Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
+        
+    return sched
+
 def Ramsey_readOther_sche(
     q:str,
     read_q:str,
@@ -1046,11 +1555,18 @@ def Qubit_SS_sche(
     R_integration:dict,
     R_inte_delay:float,
     repetitions:int=1,
+    active_reset:dict={},
+    thresholded:dict={},
 ) -> Schedule:
-
+    """
+    * thresholded: {"rotation":deg,"threshold":V} to get the state bit of every shot by the thresholded acquisition instead of its IQ, see `Integration` and `split_thresholded`.\n
+    * active_reset: see `Qubit_reset`, it needs `thresholded` because the thresholded readouts of the reset can't share the sequencer with the IQ shots.
+    """
+    if active_reset != {} and thresholded == {}:
+        raise ValueError("The active reset takes thresholded readouts, they can't be in one schedule with the IQ shots. Use it with `thresholded`.")
     sched = Schedule("Single shot", repetitions=repetitions)
     
-    sched.add(Reset(q))
+    Qubit_reset(sched,q,active_reset)
     
     sched.add(IdlePulse(duration=5000*1e-9))
     
@@ -1061,7 +1577,76 @@ def Qubit_SS_sche(
         
     else: None
     
-    Integration(sched,q,R_inte_delay,R_integration,spec_pulse,0,single_shot=True,get_trace=False,trace_recordlength=0)
+    Integration(sched,q,R_inte_delay,R_integration,spec_pulse,0,single_shot=True,get_trace=False,trace_recordlength=0,thresholded=thresholded)
+
+    return sched
+
+def multi_Qubit_SS_sche(
+    ini_state:str,
+    pi_amp: dict,
+    pi_dura:dict,
+    R_amp: dict,
+    R_duration: dict,
+    R_integration:dict,
+    R_inte_delay:dict,
+    repetitions:int=1,
+) -> Schedule:
+    """
+    Single shot for all the qubits in `R_amp` prepared in the same `ini_state`, qubit i is acquired by acq_channel i with one multiplexed readout.
+    """
+    qubits2read = list(R_amp.keys())
+    sched = Schedule("multiplexing Single shot", repetitions=repetitions)
+    
+    sched.add(Reset(*qubits2read))
+    
+    sched.add(IdlePulse(duration=5000*1e-9))
+    
+    for qubit_idx, q in enumerate(qubits2read):
+        if qubit_idx == 0:
+            spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+        else:
+            Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
+        
+        if ini_state=='e': 
+            X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+        
+        Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,0,acq_channel=qubit_idx,single_shot=True,get_trace=False,trace_recordlength=0)
+
+    return sched
+
+def Qubit_SS_interleaved_sche(
+    q:str,
+    pi_amp: dict,
+    pi_dura:dict,
+    R_amp: dict,
+    R_duration: dict,
+    R_integration:dict,
+    R_inte_delay:float,
+    repetitions:int=1,
+    active_reset:dict={},
+    thresholded:dict={},
+) -> Schedule:
+    """
+    Single shot for |g> and |e> in one program, every repetition prepares |g> then |e>.\n
+    The order of the acq_channels follows `interleaved_states`, so `gettable.get()` returns [I_g, Q_g, I_e, Q_e].\n
+    * thresholded: {"rotation":deg,"threshold":V} to get the state bits of |g> and |e> instead of their IQ, `gettable.get()` returns [bits_g, bits_e] (and the bits of the active reset), see `Integration` and `split_thresholded`.\n
+    * active_reset: see `Qubit_reset`, it needs `thresholded` like `Qubit_SS_sche`.
+    """
+    if active_reset != {} and thresholded == {}:
+        raise ValueError("The active reset takes thresholded readouts, they can't be in one schedule with the IQ shots. Use it with `thresholded`.")
+    sched = Schedule("Single shot interleaved", repetitions=repetitions)
+    
+    for acq_channel, ini_state in enumerate(interleaved_states):
+        Qubit_reset(sched,q,active_reset,acq_index=acq_channel*int(active_reset.get("rounds",1)))
+        
+        sched.add(IdlePulse(duration=5000*1e-9))
+        
+        spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+        
+        if ini_state=='e': 
+            X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+        
+        Integration(sched,q,R_inte_delay,R_integration,spec_pulse,0,acq_channel=acq_channel,single_shot=True,get_trace=False,trace_recordlength=0,thresholded=thresholded)
 
     return sched
 
@@ -1093,6 +1678,37 @@ def ROF_Cali_sche(
 
     return sched
 
+def ROF_Cali_interleaved_sche(
+    q:str,
+    ro_freq:np.ndarray,
+    pi_amp: dict,
+    pi_dura:dict,
+    R_amp: dict,
+    R_duration: dict,
+    R_integration:dict,
+    R_inte_delay:float,
+    repetitions:int=1,
+) -> Schedule:
+    """
+    Like `ROF_Cali_sche` but |g> and |e> are prepared one after another at every readout frequency in one program.\n
+    The order of the acq_channels follows `interleaved_states`, the dataset has y0, y1 for |g> and y2, y3 for |e>.
+    """
+    sched = Schedule("ROF calibration interleaved", repetitions=repetitions)
+    sched.add_resource(ClockResource(name=q+ ".ro", freq=ro_freq.flat[0]))
+    for acq_idx, rof in enumerate(ro_freq):
+        sched.add(SetClockFrequency(clock= q+ ".ro", clock_freq_new=rof))
+        for acq_channel, ini_state in enumerate(interleaved_states):
+            sched.add(Reset(q))
+            sched.add(IdlePulse(duration=5000*1e-9))
+            spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+
+            if ini_state=='e': 
+                X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+                
+            Integration(sched,q,R_inte_delay,R_integration,spec_pulse,acq_idx,acq_channel=acq_channel,single_shot=False,get_trace=False,trace_recordlength=0)
+
+    return sched
+
 def PI_amp_cali_sche(
     q:str,
     XY_amp: dict,
@@ -1384,18 +2000,33 @@ def Multi_dataset_to_array(dataset:xr.core.dataset.Dataset,dims:float,Q:list):
     Q_data={}
     if dims==1:
         for i in range(len(Q)):
-            I_data[Q[i]]= dataset['y'+str(i)].data
-            Q_data[Q[i]]= dataset['y'+str(1+i)].data
+            I_data[Q[i]]= dataset['y'+str(2*i)].data
+            Q_data[Q[i]]= dataset['y'+str(2*i+1)].data
     elif dims==2:
         gridded_dataset = dh.to_gridded_dataset(dataset)
         for i in range(len(Q)):
-            I_data[Q[i]]= gridded_dataset['y'+str(i)].data
-            Q_data[Q[i]]= gridded_dataset['y'+str(1+i)].data         
+            I_data[Q[i]]= gridded_dataset['y'+str(2*i)].data
+            Q_data[Q[i]]= gridded_dataset['y'+str(2*i+1)].data         
         
     else: raise KeyError ('dims is not 1 or 2')  
     
     return I_data,Q_data
 
+def split_multiplexed_dataset(dataset:xr.core.dataset.Dataset,Q:list,x0:dict={})->dict:
+    """
+    Split a multiplexing dataset with y0, y1, ..., y(2n-1) into the datasets for each qubit with its own y0 (I) and y1 (Q).\n
+    The order of `Q` should be the same as the acq_channel order in the schedule. Return a dict like {'q0':Dataset, ...}.\n
+    * x0: {'q0': sweep array, ...}, replace the sweep index in x0 by the real sweep values of that qubit.
+    """
+    splited = {}
+    for i in range(len(Q)):
+        q_ds = dataset[['y'+str(2*i),'y'+str(2*i+1)]].rename({'y'+str(2*i):'y0','y'+str(2*i+1):'y1'})
+        q_ds.attrs = dict(dataset.attrs)
+        if Q[i] in x0:
+            q_ds = q_ds.assign_coords(x0=(q_ds.x0.dims,np.asarray(x0[Q[i]]),dict(q_ds.x0.attrs)))
+        splited[Q[i]] = q_ds
+    return splited
+
 def plot_textbox(ax,text, **kw):
     box_props = dict(boxstyle="round", pad=0.4, facecolor="white", alpha=0.5)
     new_kw_with_defaults = dict(
@@ -1559,6 +2190,7 @@ def Qubit_state_Avgtimetrace_plot(results:dict,fc:float,Digital_downconvert:bool
     return dict(Ig=Ig,Qg=Qg,Ie=Ie,Qe=Qe)
     
 def Fit_analysis_plot(results:xr.core.dataset.Dataset, P_rescale:bool, Dis:any, save_path:str='', spin_echo=False):
+    results = as_fit_dataset(results)
     if P_rescale is not True:
         Nor_f=1/1000
         y_label= 'Contrast'+' [mV]'
@@ -0,0 +1,570 @@
+"""
+Register-looped Q1ASM for the standard 1D sweeps, T1 (`T1_sche`), Ramsey (`Ramsey_sche`) and power Rabi (`Rabi_sche`).\n
+The quantify path unrolls one Reset/Readout/pulse/Integration block per point, here the point is a Q1ASM loop whose free time or XY gain comes from a register,
+so the program size doesn't grow with the points and nothing is compiled. The drive (QCM-RF) and the readout (QRM-RF) sequencers are programmed directly like `m1_wideCS.wideCS`.\n
+`LoopedQ1ASMGettable` is used like ScheduleGettable and returns the same I, Q (or magnitude, phase), so the datasets from MeasurementControl keep their layout.
+The sweeps it can't loop (time Rabi, DRAG, non-uniform points ...) are measured by the quantify path instead.\n
+With `active_reset` in the schedule kwargs the passive Reset is replaced by thresholded readouts, each one followed by a pi pulse on the drive conditioned by the trigger network.
+"""
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from Modularize.support.UserFriend import *
+from Modularize.support.WaveformCtrl import XY_waveform, s_factor, half_pi_ratio
+from Modularize.support.Pulse_schedule_library import electrical_delay, sequencer_bin_limit, feedback_latency
+
+# a 16-bit DAC full scale, amp 1 = gain 32767
+full_scale_gain:int = 32767
+# fractional bits of the fixed-point sweep registers, the value of a point is (register >> 8)
+fixed_point_bits:int = 8
+# the longest immediate of `wait`
+max_wait_ns:int = 65532
+# buffer after Reset in T1_sche and Ramsey_sche
+buffer_ns:int = 5000
+drive_sequencer:int = 0
+readout_sequencer:int = 0
+# from the end of the thresholded readout to the conditional pi pulse, at least the trigger network delay
+feedback_latency_ns:int = int(round(feedback_latency*1e9))
+# trigger network address of the thresholded readout
+trigger_address:int = 1
+
+
+def _ns(seconds:float)->int:
+    return int(round(seconds*1e9))
+
+def _u32(value:int)->int:
+    """ Registers are unsigned 32-bit, a negative start is given in two's complement. """
+    return int(value) % 2**32
+
+def affine(const:float, per_sweep:float=0)->tuple:
+    """ A quantity of a point = const + per_sweep * sweep value, like a wait in ns or a gain. """
+    return (float(const), float(per_sweep))
+
+
+### the point timeline
+def T1_segments(sched_kwargs:dict, reset_ns:int, aligned:bool=True)->list:
+    """
+    Reset + buffer, X_pi, free time + electrical delay, readout. The pi pulse is aligned to the readout like `T1_sche`, so the idle before it shrinks with the free time.\n
+    aligned=False keeps the idle `reset_ns` without the buffer, it's the relax after an active reset.
+    """
+    q = sched_kwargs["q"]
+    pi_ns = _ns(sched_kwargs["pi_dura"])
+    gap = affine(_ns(electrical_delay), 1e9)
+    return [
+        ("wait", affine(reset_ns+buffer_ns-pi_ns-gap[0], -gap[1]) if aligned else affine(reset_ns)),
+        ("xy", "X", affine(sched_kwargs["pi_amp"][q]*full_scale_gain), pi_ns),
+        ("wait", gap),
+        ("readout",),
+    ]
+
+def Ramsey_segments(sched_kwargs:dict, reset_ns:int, aligned:bool=True)->list:
+    """ Reset + buffer, X_pi/2, (free time split by the echo pi pulses), X or Y pi/2, electrical delay, readout. Same timeline as `Ramsey_sche`, `aligned` like `T1_segments`. """
+    q = sched_kwargs["q"]
+    pi_ns = _ns(sched_kwargs.get("pi_dura",20e-9))
+    echo_pi_num = int(sched_kwargs.get("echo_pi_num",0))
+    half_gain = affine(sched_kwargs["pi_amp"][q]*half_pi_ratio*full_scale_gain)
+    last_phase = "X" if sched_kwargs.get("second_pulse_phase",'x').lower() == 'x' else "Y"
+    body = [("xy", "X", half_gain, pi_ns)]
+    if echo_pi_num == 0:
+        body += [("wait", affine(0, 1e9))]
+    else:
+        body += [("wait", affine(0, 0.5e9/echo_pi_num))]
+        for pi_idx in range(echo_pi_num):
+            body += [("xy", "X", affine(sched_kwargs["pi_amp"][q]*full_scale_gain), pi_ns)]
+            body += [("wait", affine(0, (1e9 if pi_idx != echo_pi_num-1 else 0.5e9)/echo_pi_num))]
+    body += [("xy", last_phase, half_gain, pi_ns), ("wait", affine(_ns(electrical_delay)))]
+    const, per_sweep = block_duration(body)
+    return [("wait", affine(reset_ns+buffer_ns-const, -per_sweep) if aligned else affine(reset_ns))] + body + [("readout",)]
+
+def Rabi_segments(sched_kwargs:dict, reset_ns:int, aligned:bool=True)->list:
+    """ Reset, X or Y theta with the swept amplitude, electrical delay, readout. Only the power Rabi has a fixed waveform, `aligned` like `T1_segments`. """
+    if sched_kwargs["Rabi_type"] != 'PowerRabi':
+        raise ValueError("only the power Rabi can be looped, the time Rabi changes the waveform")
+    if sched_kwargs.get("chevron",False):
+        raise ValueError("the chevron sets the clock in every point")
+    xy_ns = _ns(sched_kwargs["XY_duration"])
+    phase = {"X_theta":"X","Y_theta":"Y"}[sched_kwargs["XY_theta"]]
+    return [
+        ("wait", affine(reset_ns-xy_ns-_ns(electrical_delay)) if aligned else affine(reset_ns)),
+        ("xy", phase, affine(0, full_scale_gain), xy_ns),
+        ("wait", affine(_ns(electrical_delay))),
+        ("readout",),
+    ]
+
+def lift_swept_waits(segments:list, sweep:np.ndarray, min_ns:int=4)->tuple[list, int]:
+    """
+    A wait can't be shorter than 4 ns, so the swept waits going below `min_ns` (like the free time of a Ramsey from 0 ns) are lifted by the same ns, a multiple of 4.\n
+    Return the segments and how much longer (ns) the free time of every point is than asked.
+    """
+    sweep = np.asarray(sweep, dtype=float)
+    short = [idx for idx, seg in enumerate(segments) if seg[0] == "wait" and seg[1][1] != 0 and np.min(seg[1][0]+seg[1][1]*sweep) < min_ns]
+    if len(short) == 0:
+        return segments, 0
+    lift = max([int(np.ceil((min_ns-np.min(segments[idx][1][0]+segments[idx][1][1]*sweep))/4))*4 for idx in short])
+    return [("wait", affine(seg[1][0]+lift, seg[1][1])) if idx in short else seg for idx, seg in enumerate(segments)], lift*len(short)
+
+def active_reset_segment(rounds:int, pi_gain:float, pi_ns:int, check:bool=True)->tuple:
+    """ `rounds` of thresholded readout + conditional pi pulse, then a thresholded readout to check the residual excited population if `check`. """
+    if rounds < 1:
+        raise ValueError("the active reset needs 1 round at least")
+    return ("active_reset", int(rounds), affine(pi_gain), int(pi_ns), bool(check))
+
+def block_duration(segments:list)->tuple:
+    """ Duration (const ns, ns per sweep unit) of the given wait and xy segments. """
+    const, per_sweep = 0.0, 0.0
+    for seg in segments:
+        if seg[0] == "wait":
+            const, per_sweep = const+seg[1][0], per_sweep+seg[1][1]
+        elif seg[0] == "xy":
+            const += seg[3]
+    return const, per_sweep
+
+def point_durations(segments:list, sweep:np.ndarray, readout_ns:int)->np.ndarray:
+    """ Duration (ns) of every point in the programs from `build_loop_programs`, the inverse of its mean is the repetition rate. """
+    const, per_sweep = block_duration(segments)
+    for seg in segments:
+        if seg[0] == "readout":
+            const += readout_ns
+        elif seg[0] == "active_reset":
+            const += seg[1]*(4+readout_ns+feedback_latency_ns+seg[3]) + (readout_ns if seg[4] else 0)
+    return const+per_sweep*np.asarray(sweep, dtype=float)
+
+
+### programs
+class _Q1ASMWriter():
+    """ Collect the lines of a program, the sweep registers are shared by the drive and readout programs so both keep the same timing. """
+    def __init__(self, sweep_regs:dict):
+        self.lines = []
+        self.sweep_regs = sweep_regs
+        self.__label_idx = 0
+
+    def add(self, instruction:str, comment:str=''):
+        self.lines.append(f"        {instruction:<40}" + (f"# {comment}" if comment else ''))
+
+    def label(self, name:str):
+        self.lines.append(f"{name}:")
+
+    def new_label(self, prefix:str)->str:
+        self.__label_idx += 1
+        return f"{prefix}{self.__label_idx}"
+
+    def wait(self, quantity:tuple, comment:str=''):
+        """ Wait const ns, or the value of the sweep register of this quantity (longer than `max_wait_ns` is split in a loop). """
+        if quantity[1] == 0:
+            remain = int(round(quantity[0]))
+            while remain > max_wait_ns:
+                step = max_wait_ns if remain-max_wait_ns >= 4 else max_wait_ns-4
+                self.add(f"wait {step}", comment)
+                remain -= step
+            if remain >= 4:
+                self.add(f"wait {remain}", comment)
+            elif remain != 0:
+                raise ValueError(f"a wait of {remain} ns is shorter than 4 ns")
+        else:
+            self.value_of(quantity, "R8")
+            loop_label = self.new_label("long_wait")
+            self.label(loop_label)
+            self.add(f"jlt R8,{max_wait_ns+4},@{loop_label}_end", comment)
+            self.add(f"wait {max_wait_ns}")
+            self.add(f"sub R8,{max_wait_ns},R8")
+            self.add(f"jmp @{loop_label}")
+            self.label(f"{loop_label}_end")
+            self.add("wait R8")
+
+    def value_of(self, quantity:tuple, target:str):
+        self.add(f"asr {self.sweep_regs[quantity]},{fixed_point_bits},{target}")
+
+    def gain(self, quantity:tuple):
+        if quantity[1] == 0:
+            gain = int(round(quantity[0]))
+            self.add(f"set_awg_gain {gain},{gain}")
+        else:
+            self.value_of(quantity, "R8")
+            self.add("set_awg_gain R8,R8")
+
+    def text(self)->str:
+        return "\n".join(self.lines)+"\n"
+
+
+def readout_block(R_duration_ns:int, acq_delay_ns:int, integration_ns:int, ro_offset:int, acq_index:int=0, bin_reg:str="R1")->tuple[list, int]:
+    """ Q1ASM of the square readout (set_awg_offs like `m1_wideCS`) and the acquisition into the bin in `bin_reg` of acquisition `acq_index`, and its duration in ns. """
+    hold_ns = R_duration_ns-acq_delay_ns
+    if acq_delay_ns < 4 or hold_ns < 4:
+        raise ValueError(f"the readout ({R_duration_ns} ns) should be longer than the acq_delay ({acq_delay_ns} ns) by 4 ns at least")
+    tail_ns = max(4, integration_ns-hold_ns+4)
+    lines = [
+        (f"set_awg_offs {ro_offset},0", "readout pulse on"),
+        (f"upd_param {acq_delay_ns}", "acq_delay"),
+        (f"acquire {acq_index},{bin_reg},{hold_ns}", "integrate into the bin of this point"),
+        ("set_awg_offs 0,0", "readout pulse off"),
+        (f"upd_param {tail_ns}", "let the integration finish"),
+    ]
+    return lines, R_duration_ns+tail_ns
+
+def build_loop_programs(segments:list, sweep:np.ndarray, repetitions:int, readout:dict)->dict:
+    """
+    Write the drive and the readout programs of a looped 1D sweep.\n
+    ### Args:\n
+    * segments: the point timeline from `T1_segments`, `Ramsey_segments` or `Rabi_segments`, it can start with an `active_reset_segment`.\n
+    * sweep: the sweep values, they should be uniform.\n
+    * readout: {"R_duration_ns","acq_delay_ns","integration_ns","ro_offset"}.\n
+    ### Returns:\n
+    {"drive":program, "readout":program, "readout_ns":readout block duration, "waveforms":{XY duration:(gauss index, zero index)}}\n
+    The active reset readouts go to acquisition 1 (bin = point*rounds+round) and the check readouts to acquisition 2 (bin = point).
+    """
+    sweep = np.asarray(sweep, dtype=float).reshape(-1)
+    points = sweep.shape[0]
+    if points > sequencer_bin_limit:
+        raise ValueError(f"{points} points are more than the {sequencer_bin_limit} acquisition bins")
+    step = float(sweep[1]-sweep[0]) if points > 1 else 0.0
+    if points > 2 and not np.allclose(np.diff(sweep), step, rtol=1e-6, atol=1e-15):
+        raise ValueError("the sweep points are not uniform")
+
+    # a register for every swept quantity, it starts at the value of the first point and steps by the value of one sweep step
+    swept = []
+    for seg in segments:
+        for quantity in ([seg[1]] if seg[0] == "wait" else [seg[2]] if seg[0] == "xy" else []):
+            if quantity[1] != 0 and quantity not in swept:
+                swept.append(quantity)
+    sweep_regs = {quantity:f"R{10+idx}" for idx, quantity in enumerate(swept)}
+    for seg in segments:
+        if seg[0] == "wait":
+            values = seg[1][0]+seg[1][1]*sweep
+            if values.min() < 4 and not (seg[1][1] == 0 and values.min() == 0):
+                raise ValueError(f"a wait goes down to {round(values.min())} ns, it should be 4 ns at least")
+        if seg[0] == "xy":
+            values = seg[2][0]+seg[2][1]*sweep
+            if np.abs(values).max() > full_scale_gain:
+                raise ValueError("the XY amplitude is out of the full scale")
+            if seg[3] < 4:
+                raise ValueError(f"a XY pulse of {seg[3]} ns is shorter than 4 ns")
+        if seg[0] == "active_reset" and abs(seg[2][0]) > full_scale_gain:
+            raise ValueError("the pi amplitude of the active reset is out of the full scale")
+    active = [seg for seg in segments if seg[0] == "active_reset"]
+    if len(active) != 0 and points*active[0][1] > sequencer_bin_limit:
+        raise ValueError(f"{points}*{active[0][1]} active reset readouts are more than the {sequencer_bin_limit} acquisition bins")
+    xy_ns = sorted(set([seg[3] for seg in segments if seg[0] in ["xy","active_reset"]]))
+    waveforms = {duration:(2*idx, 2*idx+1) for idx, duration in enumerate(xy_ns)}
+
+    ro_lines, readout_ns = readout_block(**readout)
+    reset_lines, _ = readout_block(**readout, acq_index=1, bin_reg="R5")
+    check_lines, _ = readout_block(**readout, acq_index=2, bin_reg="R1")
+    programs = {}
+    for side in ["drive", "readout"]:
+        w = _Q1ASMWriter(sweep_regs)
+        w.add("wait_sync 4")
+        if len(active) != 0:
+            w.add("set_latch_en 1,4" if side == "drive" else "wait 4", "latch the triggers of the thresholded readouts")
+        w.add(f"move {int(repetitions)},R0", "repetitions")
+        w.label("avg")
+        w.add("move 0,R1", "bin of the point")
+        if len(active) != 0:
+            w.add("move 0,R5", "bin of the active reset readout")
+        w.add(f"move {points},R2", "points")
+        for quantity, reg in sweep_regs.items():
+            first = quantity[0]+quantity[1]*sweep[0]
+            w.add(f"move {_u32(round(first*2**fixed_point_bits)+2**(fixed_point_bits-1))},{reg}", "fixed-point value of the first point")
+        w.label("point")
+        w.add("reset_ph")
+        for seg in segments:
+            if seg[0] == "wait":
+                w.wait(seg[1])
+            elif seg[0] == "xy":
+                gauss, zero = waveforms[seg[3]]
+                if side == "drive":
+                    w.gain(seg[2])
+                    w.add(f"play {gauss if seg[1] == 'X' else zero},{zero if seg[1] == 'X' else gauss},{seg[3]}", f"{seg[1]} pulse")
+                else:
+                    w.wait(affine(seg[3]), "XY pulse")
+            elif seg[0] == "active_reset":
+                gauss, zero = waveforms[seg[3]]
+                for _ in range(seg[1]):
+                    if side == "drive":
+                        w.add("latch_rst 4", "forget the former triggers")
+                        w.wait(affine(readout_ns+feedback_latency_ns), "thresholded readout + trigger latency")
+                        w.gain(seg[2])
+                        w.add(f"set_cond 1,{2**(trigger_address-1)},0,{seg[3]}", "only if the qubit was in |e>")
+                        w.add(f"play {gauss},{zero},{seg[3]}", "conditional X pi pulse")
+                        w.add("set_cond 0,0,0,4")
+                    else:
+                        w.add("wait 4")
+                        for instruction, comment in reset_lines:
+                            w.add(instruction, comment)
+                        w.add("add R5,1,R5")
+                        w.wait(affine(feedback_latency_ns+seg[3]), "trigger latency + conditional pi pulse")
+                if seg[4]:
+                    if side == "drive":
+                        w.wait(affine(readout_ns), "check readout")
+                    else:
+                        for instruction, comment in check_lines:
+                            w.add(instruction, comment)
+            elif seg[0] == "readout":
+                if side == "drive":
+                    w.wait(affine(readout_ns), "readout")
+                else:
+                    for instruction, comment in ro_lines:
+                        w.add(instruction, comment)
+        w.add("add R1,1,R1")
+        for quantity, reg in sweep_regs.items():
+            w.add(f"add {reg},{_u32(round(quantity[1]*step*2**fixed_point_bits))},{reg}", "next point")
+        w.add("loop R2,@point")
+        w.add("loop R0,@avg")
+        w.add("stop")
+        programs[side] = w.text()
+    programs["readout_ns"] = readout_ns
+    programs["waveforms"] = waveforms
+    return programs
+
+def gauss_envelope(duration_ns:int)->np.ndarray:
+    """ The `GaussPulse` of `XY_waveform_controller` with G_amp = 1, sigma = duration/s_factor, sampled every ns. """
+    t = np.arange(duration_ns)
+    sigma = duration_ns/s_factor
+    return np.exp(-0.5*((t-duration_ns/2)/sigma)**2)
+
+
+### the experiment from a schedule function
+def loop_experiment(schedule_function, sched_kwargs:dict, quantum_device)->dict:
+    """
+    Translate the evaluated schedule kwargs of `T1_sche`, `Ramsey_sche` or `Rabi_sche` into the programs and the settings of the two sequencers.\n
+    sched_kwargs["active_reset"] = {"rounds":1,"relax":0,"check":True} replaces the Reset by an active reset (see `Qubit_reset` in Pulse_schedule_library), the pi pulse is `rxy.amp180` in `rxy.duration`.
+    It's the passive reset if the qubit has no calibrated `measure.acq_threshold` and `measure.acq_rotation`.\n
+    The swept waits shorter than 4 ns are lifted by `lift_swept_waits`, "lift_ns" tells how much.\n
+    Raise ValueError if this sweep can't be looped.
+    """
+    from Modularize.support.Pulse_schedule_library import T1_sche, Ramsey_sche, Rabi_sche
+    if XY_waveform.lower() != 'gauss':
+        raise ValueError(f"only the gauss XY waveform is looped, now it's '{XY_waveform}'")
+    q = sched_kwargs["q"]
+    qubit_info = quantum_device.get_element(q)
+    reset_ns = _ns(qubit_info.reset.duration())
+    drive_freq = qubit_info.clock_freqs.f01()
+    builders = {T1_sche:(T1_segments,"freeduration"), Ramsey_sche:(Ramsey_segments,"freeduration"), Rabi_sche:(Rabi_segments,"XY_amp")}
+    if schedule_function not in builders:
+        raise ValueError(f"{getattr(schedule_function,'__name__',schedule_function)} has no looped version")
+    builder, sweep_key = builders[schedule_function]
+    if schedule_function is Ramsey_sche:
+        drive_freq = sched_kwargs["New_fxy"]
+    sweep = np.asarray(sched_kwargs[sweep_key], dtype=float).reshape(-1)
+    # fixed_relax puts the pulses after reset + buffer instead of inside them
+    passive_segments = builder(sched_kwargs, reset_ns+buffer_ns, aligned=False) if sched_kwargs.get("fixed_relax",False) else builder(sched_kwargs, reset_ns)
+
+    active_reset = dict(sched_kwargs.get("active_reset",{}))
+    threshold, rotation = qubit_info.measure.acq_threshold(), qubit_info.measure.acq_rotation()
+    if active_reset != {} and threshold == 0 and rotation == 0:
+        warning_print(f"{q} has no calibrated acq_threshold and acq_rotation, use the passive reset.")
+        active_reset = {}
+    if active_reset != {}:
+        reset_seg = active_reset_segment(active_reset.get("rounds",1), qubit_info.rxy.amp180()*full_scale_gain, _ns(qubit_info.rxy.duration()), active_reset.get("check",True))
+        segments = [reset_seg] + builder(sched_kwargs, _ns(active_reset.get("relax",0)), aligned=False)
+        active_reset = {"rounds":reset_seg[1], "check":reset_seg[4], "threshold":threshold, "rotation":rotation}
+    else:
+        segments, active_reset = passive_segments, None
+    segments, lift_ns = lift_swept_waits(segments, sweep)
+    passive_segments, _ = lift_swept_waits(passive_segments, sweep)
+    if lift_ns > 0:
+        warning_print(f"A Q1ASM wait can't be 0 ns, every free time of this {getattr(schedule_function,'__name__','sweep')} is {lift_ns} ns longer than the setpoints.")
+    readout = dict(
+        R_duration_ns=_ns(sched_kwargs["R_duration"][q]),
+        acq_delay_ns=_ns(sched_kwargs["R_inte_delay"]),
+        integration_ns=_ns(sched_kwargs["R_integration"][q]),
+        ro_offset=int(round(sched_kwargs["R_amp"][q]*full_scale_gain)),
+    )
+    programs = build_loop_programs(segments, sweep, quantum_device.cfg_sched_repetitions(), readout)
+    point_ns = point_durations(segments, sweep, programs["readout_ns"])
+    return {
+        "q":q, "sweep":sweep, "programs":programs, "active_reset":active_reset, "lift_ns":lift_ns,
+        "integration_ns":readout["integration_ns"], "drive_freq":drive_freq, "readout_freq":qubit_info.clock_freqs.readout(),
+        "duration_s":point_ns.sum()*1e-9*quantum_device.cfg_sched_repetitions(),
+        "period_s":float(point_ns.mean())*1e-9, "passive_period_s":float(point_durations(passive_segments, sweep, programs["readout_ns"]).mean())*1e-9,
+    }
+
+def active_reset_report(experiment:dict)->dict:
+    """
+    The repetition rate of a looped experiment from `run_looped` compared with the passive reset, and the excited populations measured by the active reset:\n
+    "excited_before_reset" by the first thresholded readout (mean of the points), "residual_excited" by the check readout after the last round (None without the check).
+    """
+    report = {
+        "period_s":experiment["period_s"], "rep_rate_Hz":1/experiment["period_s"],
+        "passive_period_s":experiment["passive_period_s"], "passive_rep_rate_Hz":1/experiment["passive_period_s"],
+        "excited_before_reset":None, "residual_excited":None,
+    }
+    if experiment.get("active_reset") is not None and "excited_before_reset" in experiment:
+        report["excited_before_reset"] = float(np.nanmean(experiment["excited_before_reset"][:,0]))
+        if experiment["active_reset"]["check"]:
+            report["residual_excited"] = float(np.nanmean(experiment["residual_excited"]))
+        slightly_print(f"{experiment['q']} active reset: {round(report['rep_rate_Hz']*1e-3,2)} kHz repetition rate (passive {round(report['passive_rep_rate_Hz']*1e-3,2)} kHz), "
+                       f"P(e) before reset = {round(report['excited_before_reset']*100,2)} %"
+                       + (f", residual P(e) = {round(report['residual_excited']*100,2)} %" if report["residual_excited"] is not None else ""))
+    return report
+
+
+### instruments
+def _output_of(hw_config:dict, port:str, clock:str)->tuple:
+    """ (cluster name, slot, output index, output settings, portclock settings) of a port-clock in the hardware config. """
+    from quantify_scheduler.helpers.collections import find_port_clock_path
+    cluster_key, module_key, output_key, _, pc_idx = tuple(find_port_clock_path(hw_config, port=port, clock=clock))
+    output = hw_config[cluster_key][module_key][output_key]
+    return cluster_key, int(module_key.split("module")[-1]), int(output_key.split("_")[-1]), output, output["portclock_configs"][pc_idx]
+
+def _lo_and_nco(output:dict, portclock:dict, freq:float)->tuple:
+    """ LO from the hardware config, or freq - interm_freq if only the IF is given. """
+    if output.get("lo_freq") is not None:
+        return output["lo_freq"], freq-output["lo_freq"]
+    if portclock.get("interm_freq") is None:
+        raise ValueError("neither lo_freq nor interm_freq is in the hardware config")
+    return freq-portclock["interm_freq"], portclock["interm_freq"]
+
+def _set_output(module, seq, out_idx:int, output:dict, portclock:dict, lo:float, nco:float, is_readout:bool):
+    path = "out0_in0" if is_readout else f"out{out_idx}"
+    module.parameters[f"{path}_lo_en"](True)
+    module.parameters[f"{path}_lo_freq"](lo)
+    if "output_att" in output:
+        module.parameters[f"out{out_idx}_att"](output["output_att"])
+    if is_readout and "input_att" in output:
+        module.in0_att(output["input_att"])
+    # the hardware config offsets are in V, the module takes mV
+    module.parameters[f"out{out_idx}_offset_path0"](output.get("dc_mixer_offset_I",0.0)*1e3)
+    module.parameters[f"out{out_idx}_offset_path1"](output.get("dc_mixer_offset_Q",0.0)*1e3)
+    seq.mixer_corr_gain_ratio(portclock.get("mixer_amp_ratio",1.0))
+    seq.mixer_corr_phase_offset_degree(portclock.get("mixer_phase_error_deg",0.0))
+    seq.connect_sequencer("io0" if is_readout else f"out{out_idx}")
+    seq.mod_en_awg(True)
+    seq.nco_freq(nco)
+    seq.sync_en(True)
+
+def run_looped(experiment:dict, quantum_device, cluster=None)->tuple[np.ndarray, np.ndarray]:
+    """
+    Upload the programs of `loop_experiment`, run them and return I, Q (V) of every point, averaged over the repetitions.\n
+    The cluster is found by the name in the hardware config if it's not given. Call `cluster.reset()` after, like the executors do, before going back to quantify.
+    """
+    from qcodes.instrument import Instrument
+    q = experiment["q"]
+    hw_config = quantum_device.hardware_config()
+    cluster_key, ro_slot, ro_out, ro_output, ro_pc = _output_of(hw_config, "q:res", f"{q}.ro")
+    _, xy_slot, xy_out, xy_output, xy_pc = _output_of(hw_config, f"{q}:mw", f"{q}.01")
+    cluster = Instrument.find_instrument(cluster_key) if cluster is None else cluster
+    ro_module, xy_module = cluster.modules[ro_slot-1], cluster.modules[xy_slot-1]
+    ro_seq, xy_seq = ro_module.sequencers[readout_sequencer], xy_module.sequencers[drive_sequencer]
+    points = experiment["sweep"].shape[0]
+    reset = experiment.get("active_reset")
+
+    waveforms = {}
+    for duration, (gauss, zero) in experiment["programs"]["waveforms"].items():
+        envelope = gauss_envelope(duration)
+        waveforms[f"gauss_{duration}ns"] = {"data":envelope.tolist(),"index":gauss}
+        waveforms[f"zero_{duration}ns"] = {"data":np.zeros_like(envelope).tolist(),"index":zero}
+    acquisitions = {"acq":{"num_bins":points,"index":0}}
+    if reset is not None:
+        acquisitions["reset"] = {"num_bins":points*reset["rounds"],"index":1}
+        if reset["check"]:
+            acquisitions["check"] = {"num_bins":points,"index":2}
+    xy_sequence = {
+        "waveforms":waveforms, "weights":{}, "acquisitions":{}, "program":experiment["programs"]["drive"],
+    }
+    ro_sequence = {
+        "waveforms":{}, "weights":{}, "acquisitions":acquisitions, "program":experiment["programs"]["readout"],
+    }
+    for module in [ro_module, xy_module]:
+        module.disconnect_outputs()
+    ro_module.disconnect_inputs()
+
+    xy_lo, xy_nco = _lo_and_nco(xy_output, xy_pc, experiment["drive_freq"])
+    _set_output(xy_module, xy_seq, xy_out, xy_output, xy_pc, xy_lo, xy_nco, is_readout=False)
+    ro_lo, ro_nco = _lo_and_nco(ro_output, ro_pc, experiment["readout_freq"])
+    _set_output(ro_module, ro_seq, ro_out, ro_output, ro_pc, ro_lo, ro_nco, is_readout=True)
+    ro_seq.demod_en_acq(True)
+    ro_seq.integration_length_acq(experiment["integration_ns"])
+    ro_seq.nco_prop_delay_comp_en(True)
+    if reset is not None:
+        # the raw integration is compared with the threshold, so it's scaled by the integration length
+        ro_seq.thresholded_acq_rotation(reset["rotation"])
+        ro_seq.thresholded_acq_threshold(reset["threshold"]*experiment["integration_ns"])
+        ro_seq.thresholded_acq_trigger_en(True)
+        ro_seq.thresholded_acq_trigger_address(trigger_address)
+        ro_seq.thresholded_acq_trigger_invert(False)
+        xy_seq.parameters[f"trigger{trigger_address}_count_threshold"](1)
+        xy_seq.parameters[f"trigger{trigger_address}_threshold_invert"](False)
+    xy_seq.sequence(xy_sequence)
+    ro_seq.sequence(ro_sequence)
+
+    xy_module.arm_sequencer(drive_sequencer)
+    ro_module.arm_sequencer(readout_sequencer)
+    cluster.start_sequencer()
+    ro_module.get_acquisition_state(readout_sequencer, timeout=max(1, experiment["duration_s"]/60*1.5))
+    acquired = ro_module.get_acquisitions(readout_sequencer)
+    data = acquired["acq"]["acquisition"]["bins"]["integration"]
+    xy_module.stop_sequencer(drive_sequencer)
+    if reset is not None:
+        # the thresholded bins averaged over the repetitions are the excited populations
+        experiment["excited_before_reset"] = np.asarray(acquired["reset"]["acquisition"]["bins"]["threshold"], dtype=float).reshape(points, reset["rounds"])
+        if reset["check"]:
+            experiment["residual_excited"] = np.asarray(acquired["check"]["acquisition"]["bins"]["threshold"], dtype=float)
+    I = np.asarray(data["path0"])/experiment["integration_ns"]
+    Q = np.asarray(data["path1"])/experiment["integration_ns"]
+    return I, Q
+
+
+class LoopedQ1ASMGettable():
+    """
+    Use it like ScheduleGettable for `T1_sche`, `Ramsey_sche` and `Rabi_sche` (power Rabi). The sweep runs as register-looped Q1ASM if `loop_experiment` can translate it,
+    otherwise by the quantify path (`CachedScheduleGettable`). The returned values are the same as ScheduleGettable.\n
+    ### Args:\n
+    * cluster: the Cluster, None to find it by the name in the hardware config.\n
+    With "active_reset" in `schedule_kwargs` the quantify path keeps the passive reset, `reset_report` is the `active_reset_report` of the last looped `get`.
+    """
+    def __init__(self, quantum_device, schedule_function, schedule_kwargs:dict, real_imag:bool=True, batched:bool=True, cluster=None):
+        from Modularize.support.ScheduleCache import CachedScheduleGettable
+        self.quantum_device = quantum_device
+        self.schedule_function = schedule_function
+        self.schedule_kwargs = schedule_kwargs
+        self.real_imag = real_imag
+        self.batched = batched
+        self.cluster = cluster
+        if real_imag:
+            self.name, self.label, self.unit = ["I","Q"], ["Voltage I","Voltage Q"], ["V","V"]
+        else:
+            self.name, self.label, self.unit = ["magn","phase"], ["Magnitude","Phase"], ["V","deg"]
+        passive_kwargs = {key:value for key, value in schedule_kwargs.items() if key != "active_reset"}
+        self.fallback = CachedScheduleGettable(quantum_device, schedule_function=schedule_function, schedule_kwargs=passive_kwargs, real_imag=real_imag, batched=batched)
+        self.experiment = None
+        self.reset_report = {}
+        self.fallback_reason = ''
+
+    def get(self):
+        from Modularize.support.ScheduleCache import evaluate_sched_kwargs
+        sched_kwargs = evaluate_sched_kwargs(self.schedule_kwargs)
+        try:
+            self.experiment = loop_experiment(self.schedule_function, sched_kwargs, self.quantum_device)
+        except ValueError as reason:
+            warning_print(f"*** The Q1ASM loop of {getattr(self.schedule_function,'__name__','this sweep')} is NOT used: {reason}. It runs by quantify instead!")
+            self.fallback_reason = str(reason)
+            self.experiment = None
+            return self.fallback.get()
+        I, Q = run_looped(self.experiment, self.quantum_device, self.cluster)
+        self.reset_report = active_reset_report(self.experiment)
+        if self.real_imag:
+            return [I, Q]
+        return [np.abs(I+1j*Q), np.angle(I+1j*Q, deg=True)]
+
+    def programs(self)->dict:
+        """ The drive and readout programs of the last `get`, {} if it ran by quantify. """
+        return {} if self.experiment is None else {side:self.experiment["programs"][side] for side in ["drive","readout"]}
+
+
+if __name__ == "__main__":
+    # print the programs of a 100-point T1 without the instruments
+    sched_kwargs = dict(q='q0', pi_amp={'q0':0.2}, pi_dura=40e-9, freeduration=np.arange(0,80e-6,800e-9),
+                        R_amp={'q0':0.1}, R_duration={'q0':2e-6}, R_integration={'q0':1.5e-6}, R_inte_delay=280e-9)
+    readout = dict(R_duration_ns=2000, acq_delay_ns=280, integration_ns=1500, ro_offset=3277)
+    passive = T1_segments(sched_kwargs, 250000)
+    programs = build_loop_programs(passive, sched_kwargs["freeduration"], 300, readout)
+    for side in ["drive","readout"]:
+        slightly_print(f"{side}: {len(programs[side].splitlines())} lines")
+        print(programs[side])
+    # the same T1 with 2 rounds of active reset and 2 µs relax
+    active = [active_reset_segment(2, 0.2*full_scale_gain, 40)] + T1_segments(sched_kwargs, 2000, aligned=False)
+    active_programs = build_loop_programs(active, sched_kwargs["freeduration"], 300, readout)
+    print(active_programs["drive"])
+    for label, segments in {"passive":passive, "active":active}.items():
+        period = point_durations(segments, sched_kwargs["freeduration"], programs["readout_ns"]).mean()*1e-9
+        slightly_print(f"{label} reset: {round(period*1e6,2)} µs per point, {round(1e-3/period,2)} kHz")
@@ -0,0 +1,226 @@
+"""
+Structured on-disk state of a QDmanager, it replaces the pickled `*_SumInfo.pkl`.\n
+A store is a folder `{Identity}_SumInfo.qds` with json files:\n
+    meta.json       : format version, ID, chip_info, Log, the QuantumDevice parameters and its element names.\n
+    Hcfg.json       : hardware config.\n
+    shared.json     : Flux, Note and refIQ which don't belong to an element, like the couplers.\n
+    elements/q0.json: the element class and parameters with its own Flux, Note and refIQ.\n
+So the metadata or a single qubit can be read without unpickling the QCoDeS instruments, the QuantumDevice is only built by `build_quantum_device`.
+"""
+import os, sys, json, time, datetime
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from numpy import ndarray, generic, array
+from Modularize.support.UserFriend import *
+
+state_store_format = "QDStateStore"
+state_store_version = 1
+store_extension = ".qds"
+# QuantumDevice parameters which are kept somewhere else or rebuilt by add_element
+skipped_QD_paras = ["IDN", "elements", "edges", "hardware_config"]
+
+
+def _encode(obj):
+    """ Turn numpy arrays and scalars into what json can dump, arrays are marked to be decoded back. """
+    if isinstance(obj, dict):
+        return {str(key):_encode(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(i) for i in obj]
+    if isinstance(obj, ndarray):
+        return {"__ndarray__":_encode(obj.tolist()),"dtype":str(obj.dtype)}
+    if isinstance(obj, generic):
+        return obj.item()
+    return obj
+
+def _decode(obj):
+    if isinstance(obj, dict):
+        if "__ndarray__" in obj:
+            return array(obj["__ndarray__"],dtype=obj["dtype"])
+        return {key:_decode(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_decode(i) for i in obj]
+    return obj
+
+def _write_json(path:str, content:dict):
+    tmp_path = path+".tmp"
+    with open(tmp_path,'w') as json_file:
+        json.dump(_encode(content),json_file,indent=1)
+    os.replace(tmp_path,path)
+
+def _read_json(path:str)->dict:
+    with open(path) as json_file:
+        return _decode(json.load(json_file))
+
+def is_state_store(path:str)->bool:
+    return path.rstrip("/\\").endswith(store_extension)
+
+
+### QuantumDevice <-> dict
+def instrument_parameters(instrument, skipped:list=["IDN"])->dict:
+    """
+    Return the values of the settable parameters in the instrument and its submodules, like {"measure":{"pulse_amp":0.1,...},"reset":{...}}.\n
+    The instrument's own parameters are under the key "self", the values json can't dump are skipped.
+    """
+    paras = {"self":{}}
+    for name, para in instrument.parameters.items():
+        if name in skipped or not getattr(para,"settable",True) or not getattr(para,"gettable",True):
+            continue
+        value = _encode(para())
+        try:
+            json.dumps(value)
+        except TypeError:
+            warning_print(f"{instrument.name}.{name} can't be stored, skipped!")
+            continue
+        paras["self"][name] = value
+    for sub_name, submodule in instrument.submodules.items():
+        paras[sub_name] = instrument_parameters(submodule,skipped)["self"]
+    return paras
+
+def apply_instrument_parameters(instrument, paras:dict):
+    """ Set the values from `instrument_parameters` back, the parameters the instrument doesn't have are ignored. """
+    for sub_name, sub_paras in paras.items():
+        target = instrument if sub_name == "self" else instrument.submodules.get(sub_name)
+        if target is None:
+            continue
+        for name, value in sub_paras.items():
+            if name in target.parameters:
+                target.parameters[name](value)
+
+def describe_quantum_device(quantum_device)->dict:
+    """ {"name":str, "params":dict, "elements":{name:{"class":"module:Class", "params":dict}}} """
+    elements = {}
+    for name in quantum_device.elements():
+        element = quantum_device.get_element(name)
+        elements[name] = {"class":f"{type(element).__module__}:{type(element).__name__}","params":instrument_parameters(element)}
+    return {"name":quantum_device.name,"params":instrument_parameters(quantum_device,skipped_QD_paras),"elements":elements}
+
+def build_quantum_device(QD_description:dict, Hcfg:dict):
+    """ Recreate the QuantumDevice and its elements from `describe_quantum_device` and the hardware config. """
+    from importlib import import_module
+    from qcodes.instrument import find_or_create_instrument
+    from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
+    quantum_device = find_or_create_instrument(QuantumDevice, recreate=True, name=QD_description["name"])
+    apply_instrument_parameters(quantum_device, QD_description["params"])
+    for name, element_info in QD_description["elements"].items():
+        module_name, class_name = element_info["class"].split(":")
+        element = find_or_create_instrument(getattr(import_module(module_name),class_name), recreate=True, name=name)
+        apply_instrument_parameters(element, element_info["params"])
+        quantum_device.add_element(element)
+    quantum_device.hardware_config(Hcfg)
+    return quantum_device
+
+
+### save and load
+def save_QD_state(store_path:str, state:dict):
+    """
+    Save the state into the store folder, state is like the merged_file in `QDmanager.QD_keeper` but state["QD"] is from `describe_quantum_device`.\n
+    The meta.json is written at last, so its mtime is the time of this snapshot.
+    """
+    os.makedirs(os.path.join(store_path,"elements"),exist_ok=True)
+    element_names = list(state["QD"]["elements"].keys())
+    shared = {"Flux":{},"Note":{},"refIQ":{}}
+    for cata in shared:
+        for key, value in state[cata].items():
+            if key not in element_names:
+                shared[cata][key] = value
+    for name in element_names:
+        own = {cata:state[cata][name] for cata in shared if name in state[cata]}
+        _write_json(os.path.join(store_path,"elements",f"{name}.json"),{**state["QD"]["elements"][name],**own})
+    for old_file in os.listdir(os.path.join(store_path,"elements")):
+        if old_file.split(".")[0] not in element_names:
+            os.remove(os.path.join(store_path,"elements",old_file))
+    _write_json(os.path.join(store_path,"Hcfg.json"),state["Hcfg"])
+    _write_json(os.path.join(store_path,"shared.json"),shared)
+    meta = {"format":state_store_format,"version":state_store_version,"saved_at":datetime.datetime.now().isoformat(timespec='seconds'),
+            "ID":state["ID"],"chip_info":state["chip_info"],"Log":state["Log"],
+            "QD":{"name":state["QD"]["name"],"params":state["QD"]["params"],"elements":element_names}}
+    _write_json(os.path.join(store_path,"meta.json"),meta)
+
+def load_QD_meta(store_path:str)->dict:
+    """ Only read meta.json: format version, ID, chip_info, Log and the QuantumDevice name, parameters and element names. """
+    meta = _read_json(os.path.join(store_path,"meta.json"))
+    if meta.get("format") != state_store_format or meta.get("version",0) > state_store_version:
+        raise ValueError(f"{store_path} is a {meta.get('format')} v{meta.get('version')} store, this version reads {state_store_format} v{state_store_version}.")
+    return meta
+
+def load_element_state(store_path:str, element_name:str)->dict:
+    """ Only read one element, return {"class","params","Flux","Note","refIQ"}, the last 3 are there if the element has them. Ex. load_element_state(path,'q0')["refIQ"] """
+    element_path = os.path.join(store_path,"elements",f"{element_name}.json")
+    if not os.path.isfile(element_path):
+        raise KeyError(f"There is no element named '{element_name}' in {store_path}")
+    return _read_json(element_path)
+
+def update_QD_meta(store_path:str, **items):
+    """ Change some items in meta.json, like update_QD_meta(path, Log="new message"). """
+    meta = load_QD_meta(store_path)
+    meta.update(items)
+    _write_json(os.path.join(store_path,"meta.json"),meta)
+
+def load_QD_state(store_path:str)->dict:
+    """ Read the whole store back into the merged_file form, state["QD"] is a description for `build_quantum_device`. """
+    meta = load_QD_meta(store_path)
+    shared = _read_json(os.path.join(store_path,"shared.json"))
+    state = {"ID":meta["ID"],"chip_info":meta["chip_info"],"Log":meta["Log"],"Hcfg":_read_json(os.path.join(store_path,"Hcfg.json")),
+             "Flux":dict(shared["Flux"]),"Note":dict(shared["Note"]),"refIQ":dict(shared["refIQ"]),
+             "QD":{"name":meta["QD"]["name"],"params":meta["QD"]["params"],"elements":{}}}
+    for name in meta["QD"]["elements"]:
+        element = load_element_state(store_path,name)
+        state["QD"]["elements"][name] = {"class":element["class"],"params":element["params"]}
+        for cata in ["Flux","Note","refIQ"]:
+            if cata in element:
+                state[cata][name] = element[cata]
+    return state
+
+
+### migration
+def migrate_QD_pkl(pkl_path:str, store_path:str='', overwrite:bool=False)->str:
+    """ Convert a `*_SumInfo.pkl` into a store next to it (or at `store_path`), return the store path. """
+    import pickle
+    if store_path == '':
+        store_path = os.path.splitext(pkl_path)[0]+store_extension
+    if os.path.isdir(store_path) and not overwrite:
+        return store_path
+    with open(pkl_path, 'rb') as inp:
+        gift = pickle.load(inp)
+    state = {key:gift[key] for key in ["ID","chip_info","Flux","Hcfg","refIQ","Note","Log"]}
+    state["QD"] = describe_quantum_device(gift["QD"])
+    save_QD_state(store_path, state)
+    return store_path
+
+def migrate_QD_backup(backup_dir:str='', overwrite:bool=False)->dict:
+    """ Migrate all the `*_SumInfo.pkl` in the date folders of QD_backup, then rebuild the QD index. Return {pkl_path: store_path or the error}. """
+    from Modularize.support.Path_Book import qdevice_backup_dir, foldername_2_date, build_QD_index
+    backup_dir = qdevice_backup_dir if backup_dir == '' else backup_dir
+    report = {}
+    for date_folder in sorted(os.listdir(backup_dir)):
+        folder_path = os.path.join(backup_dir,date_folder)
+        if not os.path.isdir(folder_path) or foldername_2_date(date_folder) is None:
+            continue
+        for name in os.listdir(folder_path):
+            if name.endswith("_SumInfo.pkl"):
+                pkl_path = os.path.join(folder_path,name)
+                try:
+                    report[pkl_path] = migrate_QD_pkl(pkl_path,overwrite=overwrite)
+                except Exception as err:
+                    report[pkl_path] = err
+                    warning_print(f"Can't migrate {pkl_path}: {err}")
+    if backup_dir == qdevice_backup_dir:
+        build_QD_index()
+    slightly_print(f"{len([r for r in report.values() if isinstance(r,str)])}/{len(report)} QD pkl files are migrated.")
+    return report
+
+
+if __name__ == "__main__":
+    QD_pkl_path = "" # migrate this one and compare the loading costs, leave it '' to migrate the whole QD_backup
+    if QD_pkl_path == "":
+        migrate_QD_backup()
+    else:
+        store_path = migrate_QD_pkl(QD_pkl_path)
+        from Modularize.support.QDmanager import QDmanager
+        for path in [QD_pkl_path, store_path]:
+            start = time.time()
+            QD_agent = QDmanager(path)
+            QD_agent.QD_loader()
+            slightly_print(f"{os.path.split(path)[-1]} loaded in {round((time.time()-start)*1e3,1)} ms")
+        start = time.time()
+        refIQ = load_element_state(store_path,"q0")["refIQ"]
+        slightly_print(f"q0 refIQ = {refIQ} read in {round((time.time()-start)*1e3,2)} ms")
@@ -2,6 +2,8 @@ import os, datetime, pickle
 from xarray import Dataset
 from Modularize.support.FluxBiasDict import FluxBiasDict
 from Modularize.support.Notebook import Notebook
+from Modularize.support.Path_Book import update_QD_index
+from Modularize.support.QDStateStore import is_state_store, save_QD_state, load_QD_state, describe_quantum_device, build_quantum_device, store_extension
 from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
 from quantify_scheduler.device_under_test.transmon_element import BasicTransmonElement
 import matplotlib.pyplot as plt
@@ -29,6 +31,19 @@ class QDmanager():
         self.Identity=""
         self.chip_name = ""
         self.chip_type = ""
+        self._quantum_device = None
+        self._QD_description = {} # from a state store, the QuantumDevice is built when it's used at the first time
+    
+    @property
+    def quantum_device(self)->QuantumDevice:
+        if self._quantum_device is None and self._QD_description != {}:
+            self._quantum_device = build_quantum_device(self._QD_description,self.Hcfg)
+        return self._quantum_device
+
+    @quantum_device.setter
+    def quantum_device(self, quantum_device:QuantumDevice):
+        self._quantum_device = quantum_device
+        self._QD_description = {}
         
 
     def register(self,cluster_ip_adress:str,which_dr:str,chip_name:str='',chip_type = ''):
@@ -56,10 +71,14 @@ class QDmanager():
 
     def QD_loader(self, new_Hcfg:bool=False):
         """
-        Load the QuantumDevice, Bias config, hardware config and Flux control callable dict from a given json file path contain the serialized QD.
+        Load the QuantumDevice, Bias config, hardware config and Flux control callable dict from a given path, a state store `*.qds` or an old `*.pkl`.\n
+        From a state store the QuantumDevice isn't built until `self.quantum_device` is used.
         """
-        with open(self.path, 'rb') as inp:
-            gift = pickle.load(inp) # refer to `merged_file` in QD_keeper()
+        if is_state_store(self.path):
+            gift = load_QD_state(self.path)
+        else:
+            with open(self.path, 'rb') as inp:
+                gift = pickle.load(inp) # refer to `merged_file` in QD_keeper()
         # string and int
         self.chip_name:str = gift["chip_info"]["name"]
         self.chip_type:str = gift["chip_info"]["type"]
@@ -72,7 +91,6 @@ class QDmanager():
         self.Fluxmanager.activate_from_dict(gift["Flux"])
         self.Notewriter: Notebook = Notebook(q_number=self.q_num)
         self.Notewriter.activate_from_dict(gift["Note"])
-        self.quantum_device :QuantumDevice = gift["QD"]
         # dict
         if new_Hcfg:
             from Modularize.support.Experiment_setup import hcfg_map
@@ -81,25 +99,41 @@ class QDmanager():
             self.Hcfg = gift["Hcfg"]
         self.refIQ:dict = gift["refIQ"]
         
-        self.quantum_device.hardware_config(self.Hcfg)
+        if is_state_store(self.path):
+            self._quantum_device, self._QD_description = None, gift["QD"]
+        else:
+            self.quantum_device :QuantumDevice = gift["QD"]
+            self.quantum_device.hardware_config(self.Hcfg)
         print("Old friends loaded!")
     
     def QD_keeper(self, special_path:str=''):
         """
-        Save the merged dictionary to a json file with the given path. \n
+        Save the merged dictionary into a state store `{Identity}_SumInfo.qds` in today's folder, see `QDStateStore`. \n
+        If the given special_path ends with '.pkl', it's pickled like before.\n
         Ex. merged_file = {"QD":self.quantum_device,"Flux":self.Fluxmanager.get_bias_dict(),"Hcfg":Hcfg,"refIQ":self.refIQ,"Log":self.Log}
         """
         if self.path == '' or self.path.split("/")[-2].split("_")[-1] != datetime.datetime.now().day:
             db = Data_manager()
             db.build_folder_today()
-            self.path = os.path.join(db.raw_folder,f"{self.Identity}_SumInfo.pkl")
-        Hcfg = self.quantum_device.generate_hardware_config()
+            self.path = os.path.join(db.raw_folder,f"{self.Identity}_SumInfo{store_extension}")
+        save_path = self.path if special_path == '' else special_path
+        # a QuantumDevice never built has nothing changed, keep its description
+        QD_built = self._quantum_device is not None
+        Hcfg = self.quantum_device.generate_hardware_config() if QD_built else self.Hcfg
         # TODO: Here is onlu for the hightlighs :)
-        merged_file = {"ID":self.Identity,"chip_info":{"name":self.chip_name,"type":self.chip_type},"QD":self.quantum_device,"Flux":self.Fluxmanager.get_bias_dict(),"Hcfg":Hcfg,"refIQ":self.refIQ,"Note":self.Notewriter.get_notebook(),"Log":self.Log}
+        merged_file = {"ID":self.Identity,"chip_info":{"name":self.chip_name,"type":self.chip_type},"QD":self.quantum_device if QD_built else self._QD_description,"Flux":self.Fluxmanager.get_bias_dict(),"Hcfg":Hcfg,"refIQ":self.refIQ,"Note":self.Notewriter.get_notebook(),"Log":self.Log}
         
-        with open(self.path if special_path == '' else special_path, 'wb') as file:
-            pickle.dump(merged_file, file)
-            print(f'Summarized info had successfully saved to the given path!')
+        if save_path.endswith(".pkl"):
+            if not QD_built:
+                merged_file["QD"] = self.quantum_device
+            with open(save_path, 'wb') as file:
+                pickle.dump(merged_file, file)
+        else:
+            if QD_built:
+                merged_file["QD"] = describe_quantum_device(self.quantum_device)
+            save_QD_state(save_path, merged_file)
+        print(f'Summarized info had successfully saved to the given path!')
+        update_QD_index(save_path)
 
     
 
@@ -185,8 +219,10 @@ class QDmanager():
         6) pi-pulse duration.\n
         7) ref-IQ point.\n
         8) bias of this point.\n
-        9) ro attenuation.
+        9) ro attenuation.\n
+        The discriminator kept for target_q is forgotten, see `DiscriminatorCache`.
         """
+        from Modularize.support.DiscriminatorCache import forget_discriminator
         option_selected = self.Notewriter.get_all_meas_options(target_q)[int(idx_chosen)]
         qubit = self.quantum_device.get_element(target_q)
         qubit.clock_freqs.readout(option_selected["rof"])
@@ -203,6 +239,8 @@ class QDmanager():
         else:
             self.Fluxmanager.save_sweetspotBias_for(target_q,option_selected["bias"])
             self.Fluxmanager.press_offsweetspot_button(target_q,False)
+        if self.path != '':
+            forget_discriminator(self.path,target_q)
 
     ### Convenient short cuts
 # Object to manage data and pictures store.
@@ -9,6 +9,7 @@ from Modularize.support import QDmanager, Data_manager
 from Modularize.support.Pulse_schedule_library import IQ_data_dis
 from numpy import ndarray, cos, sin, deg2rad, real, imag, transpose, abs
 from scipy.optimize import curve_fit
+from Modularize.analysis.FluxPeakAna import filter_2D, sortAndDecora, FitErrorFilter
 
 
 def plot_QbFlux(Qmanager:QDmanager, nc_path:str, target_q:str):
@@ -65,69 +66,6 @@ def plot_HeatScat(mag,x_heat_ary,y_heat_ary,x_scat_ary,y_scat_ary,fit_scat_ary:n
     fig = go.Figure(data=data, layout=layout)
     fig.show()
 
-def filter_2D(raw_mag:ndarray,threshold:float=3.0):
-    filtered_f_idx = []
-    filtered_z_idx = []
-    filtered_mag   = []
-    mu = mean(raw_mag.reshape(-1))
-    sigma = std(raw_mag.reshape(-1))
-    for i_z in range(raw_mag.shape[1]):
-        sofar_max = min(raw_mag.reshape(-1))# the maximum signal in the same bias
-        z_idx_champion = 0
-        f_idx_champion = 0
-        for i_f in range(raw_mag.shape[0]):
-            if raw_mag[i_f][i_z] > mu + threshold*sigma:
-                if raw_mag[i_f][i_z] > sofar_max:
-                    f_idx_champion = i_f
-                    z_idx_champion = i_z 
-                    sofar_max = raw_mag[i_f][i_z]
-        if z_idx_champion != 0 or f_idx_champion != 0:
-            filtered_z_idx.append(z_idx_champion)
-            filtered_f_idx.append(f_idx_champion)
-            filtered_mag.append(sofar_max)
-    
-    return filtered_f_idx, filtered_z_idx, filtered_mag
-
-
-def sortAndDecora(raw_z:ndarray,raw_XYF:ndarray,raw_mag:ndarray,threshold:float=3):
-    def takeLast(elem):
-        return elem[-1]
-
-    # filter peaks idx by a threshold satisfies that peak > mean + threshold*std
-    while True:
-        f_idx, z_idx, XL_mag = filter_2D(raw_mag,threshold)
-        if len(f_idx)==0 and len(z_idx)==0:
-            if threshold != 0:
-                threshold-=0.5
-            else:
-                print(f"This interval can't find the trend : XYF={raw_XYF[0]}~{raw_XYF[-1]}")
-        else:
-            break
-    
-    # extract the values by the filtered idx
-    extracted = [] # [z, xyf, mag]
-    for i in range(len(f_idx)):
-        extracted.append([raw_z[z_idx[i]],raw_XYF[f_idx[i]],XL_mag[i]])
-    # filter out the freq when it's under the same bias
-    filtered = []
-    for point_i in range(len(extracted)):
-        same_bias = []
-        picked_z = extracted[point_i][0]
-        same_bias.append(extracted[point_i])
-        for point_j in range(point_i,len(extracted)):
-            if extracted[point_j][0] == picked_z:
-                same_bias.append(extracted[point_j])
-        same_bias.sort(key=takeLast)
-        if filtered != []:
-            if filtered[-1][0] != same_bias[-1][0]:
-                filtered.append(same_bias[-1])
-        else:
-            filtered.append(same_bias[-1])
-
-    sort(array(filtered),axis=0)
-
-    return array(filtered)
-
 def convert_netCDF_2_arrays(CDF_path:str):
     """
     For Qblox system, give a netCDF file path to return some ndarrays.
@@ -260,29 +198,6 @@ def plot_fq_fit(flux_array:ndarray,f01_array:ndarray,target_q:str,popt:dict,plot
     with open(os.path.join(os.path.split(fig_path)[0],"measANDfit_points.json"), "w") as record_file:
         json.dump(exam_dict,record_file)
 
-def FitErrorFilter(eqn:Callable,eqn_paras:dict,exp_x_ary:ndarray,exp_y_ary:ndarray,threshold:float=1.5):
-    """
-    Statics for the distances along the same x axis between exp_y_data and fitting curve. Throw away the larger deviation. 
-    """
-    fit_y_ary = eqn(exp_x_ary,*eqn_paras)
-    distances  = []
-    # compute distances along a same x axis between fit curve and exp data
-    for idx in range(fit_y_ary.shape[0]):
-        distances.append(abs(fit_y_ary[idx]-exp_y_ary[idx]))
-    away_bound = mean(array(distances)) + threshold*std(array(distances))
-    
-    throwAwayCounts = 0
-    pass_exp_x = []
-    pass_exp_y = []
-    for idx in range(exp_y_ary.shape[0]):
-        if distances[idx] < away_bound:
-            pass_exp_y.append(exp_y_ary[idx])
-            pass_exp_x.append(exp_x_ary[idx])
-        else:
-            throwAwayCounts += 1
-
-    return array(pass_exp_x), array(pass_exp_y), throwAwayCounts
-
 def fq_fit(QD:QDmanager,data2fit_path:str,target_q:str,plot:bool=True,savefig_path:str='',saveParas:bool=False, FitFilter_threshold:float=1.0):
     
     period = QD.Fluxmanager.get_PeriodFor(target_q)
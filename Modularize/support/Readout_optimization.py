@@ -165,8 +165,14 @@ if plot_data:               #y_scale='log' , 'linear'
 
 #%%
 
-def Readout_F_calibration(quantum_device:QuantumDevice,ro_bare_guess:dict,ro_span_Hz:int=5e6,n_avg:int=1000,points:int=200,run:bool=True,q:str='q1'):
-    
+def Readout_F_calibration(quantum_device:QuantumDevice,ro_bare_guess:dict,ro_span_Hz:int=5e6,n_avg:int=1000,points:int=200,run:bool=True,q:str='q1',pi_dura:dict={},interleave:bool=True):
+    """
+    * pi_dura: {q: pi pulse duration} for the interleaved schedule, the rxy.duration of the qubit in the quantum_device if q isn't in it.\n
+    * interleave: prepare |g> and |e> one after another in one schedule and sweep once. False for the former 2 runs.
+    """
+    if q not in pi_dura:
+        pi_dura = {**pi_dura, str(q):quantum_device.get_element(q).rxy.duration()}
+
 
     sche_func = Qubit_state_heterodyne_spec_sched_nco
     LO= f01[q]+IF
@@ -217,8 +223,49 @@ def Readout_F_calibration(quantum_device:QuantumDevice,ro_bare_guess:dict,ro_spa
             show_args(exp_kwargs, title="Readout_F_cal_kwargs: Meas.qubit="+q)
             show_args(Experi_info(q))
             
-    state_dep_sched('g')   
-    state_dep_sched('e')  
+    def interleaved_sched():
+        spec_sched_kwargs = dict(   
+            frequencies=freq,
+            q= q,
+            pi_amp=pi_amp,
+            pi_dura=pi_dura,
+            R_amp=R_amp,
+            R_duration=R_duration,
+            R_integration=R_integration,
+            R_inte_delay=R_inte_delay
+        )
+        
+        if run:
+            gettable = ScheduleGettable(
+                quantum_device,
+                schedule_function=Qubit_state_heterodyne_spec_interleaved_sched_nco, 
+                schedule_kwargs=spec_sched_kwargs,
+                real_imag=False,
+                batched=True,
+            )
+            quantum_device.cfg_sched_repetitions(n_avg)
+            meas_ctrl.gettables(gettable)
+            meas_ctrl.settables(freq)
+            meas_ctrl.setpoints(ro_f_samples)
+            rs_ds = meas_ctrl.run("Readout_F_cal")
+            for ini_state, state_ds in split_multiplexed_dataset(rs_ds,interleaved_states).items():
+                mag,pha= dataset_to_array(dataset=state_ds,dims=1)
+                data[ini_state] = tuple([mag,pha])
+            show_args(exp_kwargs, title="Readout_F_cal_kwargs: Meas.qubit="+q)
+            show_args(Experi_info(q))
+            
+        else:
+            sweep_para= np.array(ro_f_samples[:n_s])
+            spec_sched_kwargs['frequencies']= sweep_para.reshape(sweep_para.shape or (1,))
+            pulse_preview(quantum_device,Qubit_state_heterodyne_spec_interleaved_sched_nco,spec_sched_kwargs)
+            show_args(exp_kwargs, title="Readout_F_cal_kwargs: Meas.qubit="+q)
+            show_args(Experi_info(q))
+
+    if interleave:
+        interleaved_sched()
+    else:
+        state_dep_sched('g')   
+        state_dep_sched('e')  
     analysis_result[q]= Readout_F_opt_analysis(data,ro_f_samples)
     f_g= analysis_result[q]['f_g']
     f_e= analysis_result[q]['f_e']
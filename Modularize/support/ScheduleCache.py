@@ -0,0 +1,242 @@
+"""
+Content-addressed cache for compiled schedules.\n
+A compiled schedule is reused when the schedule function, its kwargs (sweep arrays included), the repetitions,
+the device element parameters and the hardware config are all the same as a previous compilation.
+Then only the upload to the cluster is repeated.
+"""
+import os, sys, time, pickle, hashlib, json
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from collections import OrderedDict
+from numpy import ndarray, generic
+from qcodes.parameters import Parameter
+from quantify_scheduler.gettables import ScheduleGettable
+from quantify_scheduler.backends.graph_compilation import SerialCompiler
+from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
+from Modularize.support.Path_Book import sche_cache_dir
+from Modularize.support.UserFriend import *
+
+
+def _jsonable(obj):
+    """ Turn the schedule kwargs into something json can dump in a stable order. """
+    if isinstance(obj, dict):
+        return {str(k):_jsonable(obj[k]) for k in sorted(obj, key=str)}
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(i) for i in obj]
+    if isinstance(obj, ndarray):
+        return {"shape":list(obj.shape),"data":obj.reshape(-1).tolist()}
+    if isinstance(obj, generic):
+        return obj.item()
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+def evaluate_sched_kwargs(sched_kwargs:dict)->dict:
+    """
+    Replace the qcodes Parameters in the schedule kwargs by their values, the same as what ScheduleGettable does before building a schedule.
+    """
+    evaluated = {}
+    for key in sched_kwargs:
+        if isinstance(sched_kwargs[key], Parameter):
+            evaluated[key] = sched_kwargs[key].get()
+        elif isinstance(sched_kwargs[key], dict):
+            evaluated[key] = evaluate_sched_kwargs(sched_kwargs[key])
+        else:
+            evaluated[key] = sched_kwargs[key]
+    return evaluated
+
+def device_fingerprint(quantum_device:QuantumDevice)->str:
+    """
+    Return a string which changes when any device element parameter changes.
+    """
+    device_cfg = quantum_device.generate_device_config()
+    if hasattr(device_cfg, "model_dump_json"):
+        return device_cfg.model_dump_json()
+    elif hasattr(device_cfg, "json"):
+        return device_cfg.json()
+    return str(device_cfg)
+
+def schedule_key(schedule_function, sched_kwargs:dict, repetitions:int, quantum_device:QuantumDevice)->str:
+    """
+    sha256 of the schedule function name, evaluated kwargs, repetitions, device elements and hardware config.
+    """
+    content = {
+        "function":f"{schedule_function.__module__}.{schedule_function.__qualname__}",
+        "kwargs":_jsonable(sched_kwargs),
+        "repetitions":int(repetitions),
+        "device":device_fingerprint(quantum_device),
+        "hardware":_jsonable(quantum_device.generate_hardware_config()),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class CompiledScheduleCache():
+    """
+    In-memory LRU for compiled schedules with an on-disk store in `Modularize/QD_backup/ScheduleCache`.\n
+    ### Args:\n
+    * max_items: how many compiled schedules are kept in memory.\n
+    * disk: also pickle the compiled schedules into `cache_dir`, they survive between scripts.\n
+    * max_disk_items, max_disk_MB: caps of the disk store, the oldest used files are removed first when it's over any of them.
+    """
+    def __init__(self, max_items:int=32, disk:bool=True, cache_dir:str=sche_cache_dir, max_disk_items:int=256, max_disk_MB:float=2048):
+        self.max_items = max_items
+        self.disk = disk
+        self.max_disk_items = max_disk_items
+        self.max_disk_MB = max_disk_MB
+        self.cache_dir = cache_dir
+        self.__memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __disk_path(self, key:str)->str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key:str):
+        """ Return the compiled schedule with that key, or None. """
+        if key in self.__memory:
+            self.__memory.move_to_end(key)
+            self.hits += 1
+            return self.__memory[key]
+        if self.disk and os.path.exists(self.__disk_path(key)):
+            try:
+                with open(self.__disk_path(key), 'rb') as inp:
+                    compiled = pickle.load(inp)
+            except Exception as err:
+                warning_print(f"Broken schedule cache file is ignored: {err}")
+            else:
+                os.utime(self.__disk_path(key))
+                self.disk_hits += 1
+                self.__keep_in_memory(key, compiled)
+                return compiled
+        self.misses += 1
+        return None
+
+    def put(self, key:str, compiled):
+        self.__keep_in_memory(key, compiled)
+        if self.disk:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            try:
+                with open(self.__disk_path(key), 'wb') as file:
+                    pickle.dump(compiled, file)
+            except Exception as err:
+                warning_print(f"Compiled schedule can't be saved on disk, only kept in memory: {err}")
+                if os.path.exists(self.__disk_path(key)):
+                    os.remove(self.__disk_path(key))
+            self.__evict_disk()
+
+    def __evict_disk(self):
+        """ Remove the least recently used pkl files until the disk store is under `max_disk_items` and `max_disk_MB`. """
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.split(".")[-1] == 'pkl':
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        files.sort()
+        total_size = sum(file[1] for file in files)
+        while files and (len(files) > self.max_disk_items or total_size > self.max_disk_MB*1e6):
+            _, size, name = files.pop(0)
+            os.remove(os.path.join(self.cache_dir, name))
+            total_size -= size
+
+    def __keep_in_memory(self, key:str, compiled):
+        self.__memory[key] = compiled
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_items:
+            self.__memory.popitem(last=False)
+
+    def clear(self, disk:bool=False):
+        """ Empty the memory, and also the disk store if `disk=True`. """
+        self.__memory.clear()
+        if disk and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.split(".")[-1] == 'pkl':
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def get_stats(self)->dict:
+        on_disk = len([name for name in os.listdir(self.cache_dir) if name.split(".")[-1] == 'pkl']) if self.disk and os.path.isdir(self.cache_dir) else 0
+        return {"hits":self.hits,"disk_hits":self.disk_hits,"misses":self.misses,"in_memory":len(self.__memory),"on_disk":on_disk}
+
+
+# The cache shared by all the gettables in a python process
+sche_cache = CompiledScheduleCache()
+
+
+class CachedScheduleGettable(ScheduleGettable):
+    """
+    A ScheduleGettable which looks up the compiled schedule in a `CompiledScheduleCache` before compiling it. Use it the same way as ScheduleGettable.\n
+    It replaces `initialize()` of quantify-scheduler 0.20 (pinned in setup.py), which compiles and uploads the schedule in `get()`.
+    Only the compiled schedule is kept, in `compiled_schedule`, whether it came from the cache or not.
+    """
+    def __init__(self, *args, cache:CompiledScheduleCache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = sche_cache if cache is None else cache
+
+    def compile(self):
+        """ The compiled schedule of the current schedule kwargs, from the cache or compiled and put into it. """
+        sched_kwargs = evaluate_sched_kwargs(self.schedule_kwargs)
+        repetitions = self.quantum_device.cfg_sched_repetitions()
+        key = schedule_key(self.schedule_function, sched_kwargs, repetitions, self.quantum_device)
+        compiled_schedule = self.cache.get(key)
+        if compiled_schedule is None:
+            compiler = SerialCompiler(name="compiler")
+            compiled_schedule = compiler.compile(schedule=self.schedule_function(**sched_kwargs, repetitions=repetitions), config=self.quantum_device.generate_compilation_config())
+            self.cache.put(key, compiled_schedule)
+        # the attribute behind the `compiled_schedule` property of ScheduleGettable 0.20
+        self._compiled_schedule = compiled_schedule
+        return compiled_schedule
+
+    def initialize(self):
+        """ Like `ScheduleGettable.initialize`, the compiled schedule comes from `compile()`. """
+        self.compile()
+        self.quantum_device.instr_instrument_coordinator.get_instr().prepare(self.compiled_schedule)
+        self.is_initialized = True
+
+
+def benchmark_schedule_cache(QD_path:str, target_q:str, points:int=200):
+    """
+    Compile `T1_sche` and `Ramsey_sche` with `points` free durations twice, the second time is served by the cache.\n
+    No cluster is needed, it only compiles.
+    """
+    from numpy import linspace
+    from qcodes.parameters import ManualParameter
+    from Modularize.support.QDmanager import QDmanager
+    from Modularize.support.Pulse_schedule_library import T1_sche, Ramsey_sche
+
+    QD_agent = QDmanager(QD_path)
+    QD_agent.QD_loader()
+    qubit_info = QD_agent.quantum_device.get_element(target_q)
+    QD_agent.quantum_device.cfg_sched_repetitions(300)
+    Para_free_Du = ManualParameter(name="free_Duration", unit="s", label="Time")
+    Para_free_Du.batched = True
+    Para_free_Du(linspace(0,80e-6,points))
+    common = dict(
+        q=target_q,
+        pi_amp={str(target_q):qubit_info.rxy.amp180()},
+        pi_dura=qubit_info.rxy.duration(),
+        freeduration=Para_free_Du,
+        R_amp={str(target_q):qubit_info.measure.pulse_amp()},
+        R_duration={str(target_q):qubit_info.measure.pulse_duration()},
+        R_integration={str(target_q):qubit_info.measure.integration_time()},
+        R_inte_delay=qubit_info.measure.acq_delay(),
+    )
+    cases = {"T1_sche":(T1_sche,common),"Ramsey_sche":(Ramsey_sche,dict(common,New_fxy=qubit_info.clock_freqs.f01()))}
+    cache = CompiledScheduleCache(disk=False)
+    costs = {}
+    for name in cases:
+        gettable = CachedScheduleGettable(QD_agent.quantum_device,schedule_function=cases[name][0],schedule_kwargs=cases[name][1],real_imag=True,batched=True,cache=cache)
+        start = time.time()
+        gettable.compile()
+        miss = time.time()-start
+        start = time.time()
+        gettable.compile()
+        hit = time.time()-start
+        costs[name] = {"miss":miss,"hit":hit}
+        slightly_print(f"{name} with {points} points: compile {round(miss,3)} s, cached {round(hit*1e3,2)} ms")
+    print(cache.get_stats())
+    return costs
+
+
+if __name__ == "__main__":
+    QD_path = 'Modularize/QD_backup/2024_9_23/DR4#81_SumInfo.pkl'
+    benchmark_schedule_cache(QD_path, 'q0', points=200)
@@ -83,7 +83,7 @@ if plot_data:
 
 #%%
 
-def Cavity_powerDep_spec(quantum_device:QuantumDevice,ro_elements:list,ro_bare_guess:dict,ro_span_Hz:int=5e6,ro_p_min:float=0.1,ro_p_max:float=0.7,n_avg:int=1000,f_points:int=200,p_points:int=200,run:bool=True,q:str='q1'):
+def Cavity_powerDep_spec(quantum_device:QuantumDevice,ro_elements:list,ro_bare_guess:dict,ro_span_Hz:int=5e6,ro_p_min:float=0.1,ro_p_max:float=0.7,n_avg:int=1000,f_points:int=200,p_points:int=200,run:bool=True,q:str='q1',batch_power:bool=True):
 
     sche_func = One_tone_sche
         
@@ -95,7 +95,9 @@ def Cavity_powerDep_spec(quantum_device:QuantumDevice,ro_elements:list,ro_bare_g
     freq.batched = True
     
     ro_pulse_amp = ManualParameter(name="ro_amp", unit="", label="Readout pulse amplitude")
-    ro_pulse_amp.batched = False
+    ro_pulse_amp.batched = batch_power
+    if batch_power:
+        freq.batch_size = ro_pulse_amp.batch_size = batched_chunk_size(f_points*p_points,inner_points=f_points)
     
     
     spec_sched_kwargs = dict(   
@@ -135,7 +137,7 @@ def Cavity_powerDep_spec(quantum_device:QuantumDevice,ro_elements:list,ro_bare_g
         sweep_para1= np.array(ro_f_samples[:n_s])
         sweep_para2= np.array(ro_p_samples[:2])
         spec_sched_kwargs['frequencies']= sweep_para1.reshape(sweep_para1.shape or (1,))
-        spec_sched_kwargs['R_amp']= {q:sweep_para2.reshape(sweep_para2.shape or (1,))[0]}
+        spec_sched_kwargs['R_amp']= sweep_para2.reshape(sweep_para2.shape or (1,))[0]
         pulse_preview(quantum_device,sche_func,spec_sched_kwargs)
 
         show_args(exp_kwargs, title="One_tone_powerDep_kwargs: Meas.qubit="+q)
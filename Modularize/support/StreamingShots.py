@@ -0,0 +1,145 @@
+"""
+Streaming single shots for the shot numbers the instrument memory or the RAM can't take at once.\n
+The shots are taken in hardware batches of `batch` repetitions. The first batch is saved as the usual single-shot nc file (`e`, `g` in dims ("I","Q"))
+with the shots dimension "Q" unlimited and chunked by the batch, every later batch is appended to it on disk and dropped.
+The discrimination statistics are merged batch by batch, so only one batch is in the memory whatever the total shots are.\n
+The engine only decides the batches, the acquisition is `acquire(n)` given by the caller, like `m14_SingleShot.Qubit_state_single_shot` with `stream_batch`.
+"""
+import os, sys, time, tracemalloc
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from xarray import Dataset, open_dataset
+from Modularize.support.Pulse_schedule_library import simulated_single_shots
+from Modularize.support.DiscriminatorCache import GaussianDiscriminator
+from Modularize.support.UserFriend import *
+try:
+    from netCDF4 import Dataset as NCfile
+except ImportError:
+    NCfile = None
+
+# the shots of one state are [I, Q] in dims ("I","Q"), "Q" is the shots axis
+shots_dim:str = "Q"
+
+
+def SS_batch_dataset(batch_IQ:dict)->Dataset:
+    """ The single-shot dataset of a batch {"g":[I, Q], "e":[I, Q]}, ready to be appended along the shots. """
+    SS_ds = Dataset.from_dict({state:{"dims":("I",shots_dim),"data":np.asarray(batch_IQ[state])} for state in ["e","g"]})
+    SS_ds.encoding["unlimited_dims"] = {shots_dim}
+    for state in ["e","g"]:
+        SS_ds[state].encoding["chunksizes"] = (2, max(int(SS_ds.sizes[shots_dim]),1))
+    return SS_ds
+
+def append_SS_batch(nc_path:str, batch_IQ:dict)->int:
+    """ Append the batch {"g":[I, Q], "e":[I, Q]} to the nc file along the shots, return the shots in the file. """
+    with NCfile(nc_path, 'a') as nc:
+        start = nc.dimensions[shots_dim].size
+        for state in ["e","g"]:
+            IQ = np.asarray(batch_IQ[state])
+            nc[state][:, start:start+IQ.shape[-1]] = IQ
+        return nc.dimensions[shots_dim].size
+
+
+class RunningDiscrimination():
+    """
+    The single-shot statistics merged batch by batch with the discriminator `model`.\n
+    Per prepared state the |1> counts and the mean and variance of the projection on the g-e axis (Chan's merge), so no shot is kept.
+    """
+    def __init__(self, model:GaussianDiscriminator):
+        self.model = model
+        self.shots = {"g":0,"e":0}
+        self.ones = {"g":0,"e":0}
+        self.__mean = {"g":0.0,"e":0.0}
+        self.__scatter = {"g":0.0,"e":0.0}
+
+    def add(self, state:str, IQ:np.ndarray):
+        projection = self.model.projection(IQ[0], IQ[1])
+        n, total = projection.shape[0], self.shots[state]+projection.shape[0]
+        delta = float(np.mean(projection))-self.__mean[state]
+        self.__scatter[state] += float(np.sum((projection-np.mean(projection))**2)) + delta**2*n*self.shots[state]/total
+        self.__mean[state] += delta*n/total
+        self.ones[state] += int(np.count_nonzero(projection > 0))
+        self.shots[state] = total
+
+    def summary(self)->dict:
+        """ {"shots", "p1":{"g","e"}, "fidelity" (%), "snr"} so far, the snr is the separation of the projections over their pooled std. """
+        p1 = {state:self.ones[state]/max(self.shots[state],1) for state in self.shots}
+        pooled_std = np.sqrt((self.__scatter["g"]+self.__scatter["e"])/max(self.shots["g"]+self.shots["e"]-2,1))
+        return {"shots":int(self.shots["g"]), "p1":p1, "fidelity":(1-p1["g"]+p1["e"])*100/2,
+                "snr":float(abs(self.__mean["e"]-self.__mean["g"])/pooled_std) if pooled_std > 0 else 0.0}
+
+
+def stream_single_shots(acquire, shots:int, batch:int, save, model:GaussianDiscriminator=None, train=None)->tuple[str, dict]:
+    """
+    Take `shots` single shots of |g> and |e> in batches of `batch` repetitions.\n
+    ### Args:\n
+    * acquire: `acquire(n)` returns {"g":[I, Q], "e":[I, Q]} of n shots.\n
+    * save: `save(SS_ds)` saves the dataset of the first batch as the nc file and returns its path, like `Data_manager().save_raw_data(..., get_data_loc=True)`.\n
+    * model: the discriminator for the running statistics, if None it's `train(g_IQ, e_IQ)` on the first batch.\n
+    ----
+    ### Returns:\n
+    (nc_path, the `RunningDiscrimination.summary()` of all the shots)
+    """
+    if NCfile is None:
+        raise ImportError("Streaming the single shots needs netCDF4 to append the batches to the nc file.")
+    batch = max(int(min(batch, shots)), 1)
+    nc_path, stats = None, None
+    done = 0
+    while done < shots:
+        start = time.time()
+        n = min(batch, shots-done)
+        batch_IQ = {state:np.asarray(IQ) for state, IQ in acquire(n).items()}
+        if nc_path is None:
+            nc_path = save(SS_batch_dataset(batch_IQ))
+            stats = RunningDiscrimination(model if model is not None else train(batch_IQ['g'], batch_IQ['e']))
+        else:
+            append_SS_batch(nc_path, batch_IQ)
+        for state in ["g","e"]:
+            stats.add(state, batch_IQ[state])
+        done += n
+        del batch_IQ
+        summary = stats.summary()
+        slightly_print(f"{done}/{shots} shots: P(1|g) = {round(summary['p1']['g'],4)}, P(1|e) = {round(summary['p1']['e'],4)}, fidelity {round(summary['fidelity'],2)} % ({round(time.time()-start,1)} s/batch)")
+    return nc_path, stats.summary()
+
+
+def benchmark_streaming(shots:int=1000000, batch:int=50000, folder:str='')->dict:
+    """
+    Simulated single shots instead of the instruments, the peak memory of streaming them in batches against taking and saving them at once, and their populations.
+    """
+    import tempfile
+    folder = folder if folder != '' else tempfile.mkdtemp()
+    def acquire(n, seed=[0]):
+        seed[0] += 1
+        data = simulated_single_shots(n, seed=seed[0])
+        return {"g":data['g'], "e":data['e']}
+    def save(SS_ds):
+        path = os.path.join(folder, f"stream_{time.time()}.nc")
+        SS_ds.to_netcdf(path)
+        return path
+    model = GaussianDiscriminator.train(acquire(batch)['g'], acquire(batch)['e'], [1,1])
+
+    tracemalloc.start()
+    start = time.time()
+    batches = [acquire(batch) for _ in range(shots//batch)]
+    whole = {state:np.concatenate([batch_IQ[state] for batch_IQ in batches],axis=-1) for state in ["g","e"]}
+    del batches
+    save(Dataset.from_dict({state:{"dims":("I","Q"),"data":whole[state]} for state in ["e","g"]}))
+    whole_p1 = {state:float(np.mean(model.predict(whole[state][0], whole[state][1]))) for state in whole}
+    whole_cost, whole_peak = time.time()-start, tracemalloc.get_traced_memory()[1]
+    del whole
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    start = time.time()
+    nc_path, summary = stream_single_shots(acquire, shots, batch, save, model)
+    stream_cost, stream_peak = time.time()-start, tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    with open_dataset(nc_path) as SS_ds:
+        saved = int(SS_ds.sizes["Q"])
+    slightly_print(f"{shots} shots: at once {round(whole_peak/1e6,1)} MB peak in {round(whole_cost,1)} s, streamed by {batch} {round(stream_peak/1e6,1)} MB peak in {round(stream_cost,1)} s (x{round(whole_peak/stream_peak,1)}), {saved} shots saved")
+    slightly_print(f"P(1|g) {round(whole_p1['g'],4)}/{round(summary['p1']['g'],4)}, P(1|e) {round(whole_p1['e'],4)}/{round(summary['p1']['e'],4)}, snr {round(summary['snr'],2)}")
+    return {"whole_peak":whole_peak, "stream_peak":stream_peak, "whole":whole_cost, "stream":stream_cost, "saved":saved, "summary":summary}
+
+
+if __name__ == "__main__":
+    benchmark_streaming()
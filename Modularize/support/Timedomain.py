@@ -106,11 +106,12 @@ if plot_data:
         
 #%%
 
-def Zgate_Rabi(quantum_device:QuantumDevice,ro_elements:list,XY_amp:float, XY_duration:float, Z_amp_min:float,Z_amp_max:float,n_avg:int=300,Rabi_points:int=200,Z_points:int=201,run:bool=True,XY_theta:str='X_theta',Rabi_type:str='TimeRabi',q:str='q1'):
+def Zgate_Rabi(quantum_device:QuantumDevice,ro_elements:list,XY_amp:float, XY_duration:float, Z_amp_min:float,Z_amp_max:float,n_avg:int=300,Rabi_points:int=200,Z_points:int=201,run:bool=True,XY_theta:str='X_theta',Rabi_type:str='TimeRabi',q:str='q1',sweep_Z:bool=False,batch_Z:bool=True):
+    # sweep_Z: sweep the Z bias over (Z_amp_min, Z_amp_max) with the Rabi as a 2D grid, batch_Z batches it then.
     analysis_result = {}
     sche_func= Zgate_Rabi_sche
     Z_bias = ManualParameter(name="Z", unit="V", label="Z bias")
-    Z_bias.batched = False
+    Z_bias.batched = sweep_Z and batch_Z
     Z_samples = linspace(Z_amp_min,Z_amp_max,Z_points)
     
     if Rabi_type=='TimeRabi':
@@ -161,8 +162,14 @@ def Zgate_Rabi(quantum_device:QuantumDevice,ro_elements:list,XY_amp:float, XY_du
    
         quantum_device.cfg_sched_repetitions(n_avg)
         meas_ctrl.gettables(gettable)
-        meas_ctrl.settables(Sweep_para)
-        meas_ctrl.setpoints(samples)
+        if sweep_Z:
+            if batch_Z:
+                Sweep_para.batch_size = Z_bias.batch_size = batched_chunk_size(Rabi_points*Z_points,inner_points=Rabi_points)
+            meas_ctrl.settables([Sweep_para,Z_bias])
+            meas_ctrl.setpoints_grid((samples,Z_samples))
+        else:
+            meas_ctrl.settables(Sweep_para)
+            meas_ctrl.setpoints(samples)
     
        
         rabi_ds = meas_ctrl.run('Zgate_'+Rabi_type)
@@ -0,0 +1,131 @@
+"""
+Coarse-to-fine spectroscopy.\n
+A sparse sweep with few averages over the whole window finds the candidate peaks, then only narrow windows around them are swept again
+with more averages, stage by stage, until the stages or the shot budget are used up.\n
+The engine only decides the frequencies and the averages, the measurement is the `measure(freqs, n_avg)` given by the caller, like
+`m8_Cnti2Tone.Zoom_two_tone_spec` and `m2_CavitySpec.zoom_cavity_search`. It returns the 1D data where the resonance is a peak.
+"""
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import numpy as np
+from scipy.signal import find_peaks
+from scipy.optimize import curve_fit
+from Modularize.support.UserFriend import *
+
+
+def trace_noise(data:np.ndarray)->float:
+    """ The white noise std of a trace from the MAD of its point-to-point differences, a resonance much wider than a step doesn't count. """
+    diff = np.diff(np.asarray(data, dtype=float))
+    return float(1.4826*np.median(np.abs(diff-np.median(diff)))/np.sqrt(2)) if diff.shape[0] > 0 else 0.0
+
+def peak_location(freqs:np.ndarray, data:np.ndarray)->float:
+    """ The maximum refined by the parabola through it and its neighbors. """
+    idx = int(np.argmax(data))
+    if idx == 0 or idx == data.shape[0]-1:
+        return float(freqs[idx])
+    left, mid, right = data[idx-1], data[idx], data[idx+1]
+    curvature = left-2*mid+right
+    shift = 0.5*(left-right)/curvature if curvature != 0 else 0
+    return float(freqs[idx]+shift*(freqs[idx+1]-freqs[idx-1])/2)
+
+def lorentzian_location(freqs:np.ndarray, data:np.ndarray)->float:
+    """ The center of a Lorentzian fit on the window, `peak_location` if the fit fails or leaves the window. """
+    freqs, data = np.asarray(freqs, dtype=float), np.asarray(data, dtype=float)
+    guess = [peak_location(freqs, data), (freqs[-1]-freqs[0])/4, np.ptp(data), np.min(data)]
+    try:
+        popt, _ = curve_fit(lambda f, f0, width, height, offset: offset+height/(1+((f-f0)/(width/2))**2), freqs, data, p0=guess, maxfev=2000)
+    except (RuntimeError, ValueError):
+        return guess[0]
+    return float(popt[0]) if freqs[0] <= popt[0] <= freqs[-1] else guess[0]
+
+def find_candidates(freqs:np.ndarray, data:np.ndarray, max_candidates:int=3, min_snr:float=4)->list:
+    """
+    The frequencies of the peaks standing out by `min_snr` times the `trace_noise`, the most prominent first.
+    The highest point is returned if nothing stands out.
+    """
+    data = np.asarray(data, dtype=float)
+    noise = max(trace_noise(data), 1e-15)
+    peaks, props = find_peaks(data-np.median(data), prominence=min_snr*noise)
+    if peaks.shape[0] == 0:
+        return [float(freqs[np.argmax(data)])]
+    order = np.argsort(props["prominences"])[::-1][:int(max_candidates)]
+    return [float(freqs[idx]) for idx in peaks[order]]
+
+def peak_snr(data:np.ndarray)->float:
+    data = np.asarray(data, dtype=float)
+    return float((np.max(data)-np.median(data))/max(trace_noise(data), 1e-15))
+
+
+def zoom_spectroscopy(measure, f_start:float, f_end:float, coarse_points:int=100, coarse_avg:int=100, fine_points:int=41, fine_avg:int=500, stages:int=2, window_steps:float=8, max_candidates:int=3, min_snr:float=4, shot_budget:int=0, dense:tuple=(), locate=lorentzian_location)->dict:
+    """
+    Sweep [f_start, f_end] with `coarse_points` and `coarse_avg`, then every stage sweeps `fine_points` in the windows of `window_steps`
+    previous steps around the candidates. The averages go up from `coarse_avg` to `fine_avg` geometrically over the stages.\n
+    ### Args:\n
+    * measure: `measure(freqs, n_avg)` returns the data (resonance as a peak) on the freqs.\n
+    * coarse_points: keep the coarse step below the linewidth, or the peak can fall between the points.\n
+    * min_snr: the peaks standing out by it are the candidates, and a candidate is dropped after a stage if its window doesn't show it anymore.\n
+    * shot_budget: stop before a sweep would make the total shots (points * averages) over it, 0 for no limit.\n
+    * dense: (points, n_avg) of the dense sweep to compare with in the report, like the fixed `fpts` and `avg_times` of the executor.\n
+    * locate: `locate(freqs, data)` gives the peak frequency in a window, like a Lorentzian fit.\n
+    ----
+    ### Returns:\n
+    {"best": frequency of the highest-SNR candidate, "candidates": [{"freq","snr"}], "sweeps": [{"stage","freqs","data","n_avg"}], "report": dict}\n
+    The sweep of the best candidate at the last stage is `result["sweeps"][result["best_sweep"]]`.
+    """
+    sweeps, spent = [], 0
+    def sweep(stage:int, freqs:np.ndarray, n_avg:int):
+        nonlocal spent
+        data = np.asarray(measure(freqs, n_avg), dtype=float).reshape(-1)
+        spent += freqs.shape[0]*n_avg
+        sweeps.append({"stage":stage, "freqs":freqs, "data":data, "n_avg":int(n_avg)})
+        return data
+
+    freqs = np.linspace(f_start, f_end, int(coarse_points))
+    data = sweep(0, freqs, coarse_avg)
+    candidates = [{"freq":freq, "snr":peak_snr(data), "sweep":0} for freq in find_candidates(freqs, data, max_candidates, min_snr)]
+    step = freqs[1]-freqs[0]
+    averages = np.geomspace(coarse_avg, fine_avg, int(stages)+1).round().astype(int)
+    for stage in range(1, int(stages)+1):
+        half_window = window_steps*step/2
+        if shot_budget > 0 and spent+len(candidates)*int(fine_points)*averages[stage] > shot_budget:
+            warning_print(f"Stage {stage} would exceed the shot budget {shot_budget}, stop at {spent} shots.")
+            break
+        refined = []
+        for candidate in candidates:
+            freqs = np.linspace(max(candidate["freq"]-half_window, f_start), min(candidate["freq"]+half_window, f_end), int(fine_points))
+            data = sweep(stage, freqs, averages[stage])
+            snr = peak_snr(data)
+            if snr >= min_snr or len(candidates) == 1:
+                refined.append({"freq":float(locate(freqs, data)), "snr":snr, "sweep":len(sweeps)-1})
+        if refined == []:
+            warning_print(f"No candidate stands out at stage {stage}, keep the ones of stage {stage-1}.")
+            break
+        candidates = sorted(refined, key=lambda c: c["snr"], reverse=True)
+        step = freqs[1]-freqs[0]
+
+    best = max(candidates, key=lambda c: c["snr"])
+    report = {"shots":int(spent), "sweeps":len(sweeps), "resolution_Hz":float(step)}
+    if dense != ():
+        report.update({"dense_shots":int(dense[0]*dense[1]), "dense_resolution_Hz":float((f_end-f_start)/(dense[0]-1)), "saving":float(dense[0]*dense[1]/spent)})
+        slightly_print(f"Zoom spectroscopy: {spent} shots at {round(step*1e-3,1)} kHz resolution, the dense sweep takes {dense[0]*dense[1]} shots at {round(report['dense_resolution_Hz']*1e-3,1)} kHz (x{round(report['saving'],1)})")
+    return {"best":best["freq"], "best_sweep":best["sweep"], "candidates":[{"freq":c["freq"], "snr":c["snr"]} for c in candidates], "sweeps":sweeps, "report":report}
+
+
+def benchmark_zoom(span:float=500e6, linewidth:float=5e6, contrast:float=1.0, shot_noise:float=2, dense:tuple=(200,500), repeat:int=20)->dict:
+    """ A Lorentzian peak at a random frequency with white shot noise instead of the instruments, the error and the shots against the dense sweep. """
+    errors, shots, dense_errors = [], [], []
+    for seed in range(repeat):
+        rng = np.random.default_rng(seed)
+        f0 = rng.uniform(0.2*span, 0.8*span)
+        measure = lambda freqs, n_avg: contrast/(1+((freqs-f0)/(linewidth/2))**2) + shot_noise/np.sqrt(n_avg)*rng.standard_normal(freqs.shape[0])
+        result = zoom_spectroscopy(measure, 0, span, dense=dense)
+        errors.append(abs(result["best"]-f0))
+        shots.append(result["report"]["shots"])
+        freqs = np.linspace(0, span, dense[0])
+        dense_errors.append(abs(peak_location(freqs, measure(freqs, dense[1]))-f0))
+    slightly_print(f"zoom: {round(np.mean(shots))} shots, |error| {round(np.median(errors)*1e-3,1)} kHz; dense: {dense[0]*dense[1]} shots, |error| {round(np.median(dense_errors)*1e-3,1)} kHz")
+    return {"zoom_shots":float(np.mean(shots)), "zoom_error":float(np.median(errors)), "dense_error":float(np.median(dense_errors))}
+
+
+if __name__ == "__main__":
+    benchmark_zoom()
@@ -249,6 +249,11 @@ def leave_LogMSG(MSG:str,sumInfo_path:str):
     """
     Leave the log message in the sumInfo with the given path.
     """
+    from Modularize.support.QDStateStore import is_state_store, update_QD_meta
+    if is_state_store(sumInfo_path):
+        update_QD_meta(sumInfo_path, Log=MSG)
+        print("Log message had been added!")
+        return
     with open(sumInfo_path, 'rb') as inp:
         gift = pickle.load(inp)
     gift["Log"] = MSG